@@ -0,0 +1,416 @@
+"""
+Benchmarks do sistema_.py com dados sintéticos.
+
+Uso:
+    python3 benchmark.py gerar --tamanho 10k --destino /tmp/dados_10k
+    python3 benchmark.py rodar --tamanhos 1k,10k --saida bench_resultados/atual.json
+    python3 benchmark.py comparar bench_resultados/antes.json bench_resultados/atual.json
+    python3 benchmark.py formatos --tamanhos 10k,100k
+
+Tamanhos aceitam sufixos k/m (1k, 10k, 100k, 1m). Os resultados são gravados em JSON
+(um objeto por benchmark/tamanho, com o commit git atual) para comparar entre commits.
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from urllib.parse import parse_qs
+
+AQUI = os.path.dirname(os.path.abspath(__file__))
+
+RESPONSAVEIS = ["Fulano", "Ciclano", "Beltrano"]
+USUARIOS = ["admin", "fulano", "ciclano", "beltrano", "tecnico1", "tecnico2", "estagiario"]
+MOTIVOS = ["formatação", "manutenção", "reparo", "outros", "troca de HD", "upgrade de memória"]
+HARDWARES = ["Desktop", "Desktop", "Desktop", "Notebook", "Notebook", "Monitor", "Teclado/Mouse", "Impressora"]
+MARCAS = {"Desktop": ["Dell", "HP", "Lenovo", "Positivo"], "Notebook": ["Dell", "Lenovo", "Acer"],
+          "Monitor": ["LG", "Samsung", "AOC"], "Teclado/Mouse": ["Logitech", "Multilaser"],
+          "Impressora": ["HP", "Brother", "Epson"]}
+MODELOS = {"Dell": ["OptiPlex 3080", "OptiPlex 7010", "Latitude 5420"], "HP": ["ProDesk 400", "EliteDesk 800", "LaserJet M428"],
+           "Lenovo": ["ThinkCentre M70", "ThinkPad T14"], "Positivo": ["Master D3400"], "Acer": ["Aspire 5"],
+           "LG": ["24MK430"], "Samsung": ["S24R350"], "AOC": ["24B2XH"], "Logitech": ["MK270"],
+           "Multilaser": ["TC239"], "Brother": ["DCP-L2540"], "Epson": ["L3250"]}
+ORIGENS = ["CPCTBA", "PEP", "PCE", "CMP", "PFP", "CDR", "DEPPEN", ""]
+PESSOAS = ["João Silva", "Maria Souza", "Ana Lima", "Carlos Pereira", "Paulo Santos", "Juliana Costa"]
+TEXTOS_OBS = ["Aguardando peça.", "Enviado para o fornecedor.", "Formatado, aguardando retirada.",
+              "Usuário informou lentidão.", "Troca de fonte realizada.", "Sem previsão de retorno."]
+
+TAMANHOS_PADRAO = "1k,10k"
+
+
+def parse_tamanho(txt):
+    txt = str(txt).strip().lower()
+    mult = 1
+    if txt.endswith("k"):
+        mult, txt = 1000, txt[:-1]
+    elif txt.endswith("m"):
+        mult, txt = 1000000, txt[:-1]
+    return int(float(txt) * mult)
+
+
+def _br(dt):
+    return dt.strftime("%d/%m/%Y %H:%M")
+
+
+def gerar_registros(n, seed=42, agora=None, observacoes=None):
+    """
+    Gera `n` registros com uma mistura plausível: ~45% entradas, ~35% saídas (a maioria
+    reaproveitando o workflow/patrimônio de uma entrada anterior), ~20% empréstimos;
+    observações em ~30% dos registros, ~5% ocultos e histórico distribuído em ~3 anos.
+    No registro fica só o resumo da última observação; as entradas do log vão para a lista
+    `observacoes`, se informada.
+    """
+    rnd = random.Random(seed)
+    agora = agora or datetime.datetime.now().replace(second=0, microsecond=0)
+    inicio = agora - datetime.timedelta(days=3 * 365)
+    passo = (agora - inicio) / max(n, 1)
+    registros = []
+    entradas_abertas = []  # índices de entradas que ainda podem receber a saída correspondente
+
+    for i in range(n):
+        id_ = i + 1
+        data = inicio + passo * i + datetime.timedelta(minutes=rnd.randint(0, 59))
+        sorteio = rnd.random()
+        if sorteio < 0.35 and entradas_abertas:
+            tipo = "saida"
+        elif sorteio < 0.55:
+            tipo = "emprestimo"
+        else:
+            tipo = "entrada"
+
+        if tipo == "saida":
+            base = registros[entradas_abertas.pop(rnd.randrange(len(entradas_abertas)))]
+            hardware, marca, modelo = base["hardware"], base["marca"], base["modelo"]
+            patrimonio, workflow, motivo = base["patrimonio"], base["workflow"], base["motivo"]
+            origem = base["origem"]
+            if rnd.random() < 0.8:
+                base["devolvido"] = True
+                base["status_extra"] = f"Devolvido (ID: {id_})"
+        else:
+            hardware = rnd.choice(HARDWARES)
+            marca = rnd.choice(MARCAS[hardware])
+            modelo = rnd.choice(MODELOS[marca])
+            patrimonio = "" if hardware == "Teclado/Mouse" and rnd.random() < 0.7 else str(rnd.randint(1000000, 9999999))
+            workflow = (f"P-{rnd.randint(1000000, 9999999)}" if rnd.random() < 0.8
+                        else f"P-{rnd.randint(10000, 99999)}-{rnd.randint(0, 99):02d}") if rnd.random() < 0.85 else ""
+            motivo = rnd.choice(MOTIVOS)
+            origem = rnd.choice(ORIGENS)
+
+        registrado_por = rnd.choice(USUARIOS)
+        r = {
+            "id": id_,
+            "tipo": tipo,
+            "responsavel": rnd.choice(RESPONSAVEIS),
+            "patrimonio": patrimonio,
+            "workflow": workflow,
+            "origem": origem,
+            "data_inicio": _br(data),
+            "motivo": motivo,
+            "hardware": hardware,
+            "marca": marca,
+            "modelo": modelo,
+            "devolvido": False,
+            "estoque": False,
+            "observacao": "",
+        }
+        if tipo == "emprestimo":
+            r["emprestado_para"] = rnd.choice(PESSOAS)
+            r["data_retorno"] = _br(data + datetime.timedelta(days=rnd.randint(1, 30)))
+            # empréstimos antigos quase sempre já foram devolvidos
+            r["devolvido"] = (agora - data).days > 45 and rnd.random() < 0.97
+        elif tipo == "entrada":
+            entradas_abertas.append(i)
+            r["estoque"] = rnd.random() < 0.1
+
+        if rnd.random() < 0.3:
+            obs = []
+            ultima = data
+            for k in range(rnd.randint(1, 3)):
+                quando = data + datetime.timedelta(days=k * rnd.randint(1, 10))
+                ultima = max(ultima, quando)
+                obs.append({"text": rnd.choice(TEXTOS_OBS), "registrado_em": _br(quando)})
+            r["observacao"] = obs[-1]["text"]
+            r["ultima_observacao_em"] = _br(ultima)
+            if observacoes is not None:
+                observacoes.extend(dict(ob, id=id_) for ob in obs)
+
+        r["oculto"] = rnd.random() < 0.05
+        r["oculto_meta"] = {
+            "client_ip": f"10.0.{rnd.randint(0, 20)}.{rnd.randint(2, 250)}",
+            "registrado_em": _br(data + datetime.timedelta(minutes=rnd.randint(0, 5))),
+            "registrado_por": registrado_por,
+        }
+        registros.append(r)
+    return registros
+
+
+def gerar_usuarios(seed=42):
+    """Usuários com senha já definida (salt/hash fictícios — não servem para login)."""
+    rnd = random.Random(seed)
+    return [{"username": u, "salt": "%032x" % rnd.getrandbits(128), "password_hash": "%064x" % rnd.getrandbits(256)}
+            for u in USUARIOS]
+
+
+def gerar_sessoes(qtd=50, seed=42):
+    rnd = random.Random(seed)
+    agora = int(time.time())
+    return [{"token": "%064x" % rnd.getrandbits(256), "username": rnd.choice(USUARIOS),
+             "created_at": agora - rnd.randint(0, 3 * 3600)} for _ in range(qtd)]
+
+
+def gravar_fixture(destino, n, seed=42):
+    os.makedirs(destino, exist_ok=True)
+    observacoes = []
+    arquivos = {
+        "dados.json": gerar_registros(n, seed, observacoes=observacoes),
+        "users.json": gerar_usuarios(seed),
+        "sessions.json": gerar_sessoes(seed=seed),
+    }
+    for nome, conteudo in arquivos.items():
+        with open(os.path.join(destino, nome), "w", encoding="utf-8") as f:
+            json.dump(conteudo, f, ensure_ascii=False, indent=4)
+    with open(os.path.join(destino, "observacoes.jsonl"), "w", encoding="utf-8") as f:
+        for ob in observacoes:
+            f.write(json.dumps(ob, ensure_ascii=False) + "\n")
+    return destino
+
+
+# ----------------------------- execução -----------------------------
+def _importar_sistema():
+    """Importa sistema_ dentro de um diretório temporário (o módulo cria arquivos no cwd)."""
+    os.chdir(tempfile.mkdtemp(prefix="bench_sistema_"))
+    sys.path.insert(0, AQUI)
+    import sistema_
+    return sistema_
+
+
+def _consumir(resultado):
+    """As funções de página podem devolver str ou um iterável de bytes; força a renderização completa."""
+    if isinstance(resultado, (str, bytes)):
+        return len(resultado)
+    return sum(len(p) for p in resultado)
+
+
+def medir(fn, orcamento=1.0, min_rep=3, max_rep=1000):
+    """Executa fn repetidamente até gastar `orcamento` segundos (respeitando min/max de repetições)."""
+    tempos = []
+    t_total = time.perf_counter()
+    while len(tempos) < max_rep:
+        t0 = time.perf_counter()
+        fn()
+        tempos.append(time.perf_counter() - t0)
+        if len(tempos) >= min_rep and time.perf_counter() - t_total >= orcamento:
+            break
+    tempos.sort()
+    return {
+        "repeticoes": len(tempos),
+        "min_s": tempos[0],
+        "mediana_s": statistics.median(tempos),
+        "media_s": statistics.fmean(tempos),
+        "max_s": tempos[-1],
+    }
+
+
+def microbenchmarks(S, registros):
+    datas = [r["data_inicio"] for r in registros[:5000]]
+    qs_export = parse_qs("f_tipo=on&tipo_value=entrada&f_origem=on&origem_value=cp"
+                         "&f_data=on&date_from=01/01/2024 00:00&date_to=31/12/2024 23:59")
+    return {
+        "parse_br_datetime": (lambda: [S.parse_br_datetime(d) for d in datas], len(datas)),
+        "calcular_status": (lambda: [S.calcular_status(r) for r in registros], len(registros)),
+        "gerar_pendencias_html": (lambda: S.gerar_pendencias_html(registros), 1),
+        "gerar_pagina_lista": (lambda: _consumir(S.gerar_pagina_lista(registros, "admin")), 1),
+        "gerar_pagina_lista_fria": (lambda: (S._cache_linhas.limpar(),
+                                             _consumir(S.gerar_pagina_lista(registros, "admin"))), 1),
+        "export_filtro": (lambda: S.filtrar_registros_export(registros, qs_export), 1),
+        "export_filtro_colunar": (lambda: S.filtrar_tabela_export(qs_export), 1),
+        "export_csv": (lambda: S.gerar_csv_registros(S.filtrar_registros_export(registros, qs_export)), 1),
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "-C", AQUI, "rev-parse", "--short", "HEAD"],
+                              capture_output=True, text=True, timeout=10).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def rodar(tamanhos, saida, filtro=None, orcamento=1.0, seed=42):
+    S = _importar_sistema()
+    resultados = []
+    for n in tamanhos:
+        print(f"== {n} registros", flush=True)
+        registros = gerar_registros(n, seed)
+        for nome, (fn, unidades) in microbenchmarks(S, registros).items():
+            if filtro and not any(f in nome for f in filtro):
+                continue
+            m = medir(fn, orcamento=orcamento)
+            m.update({"benchmark": nome, "tamanho": n, "unidades_por_rep": unidades})
+            resultados.append(m)
+            print(f"  {nome:<24} mediana {m['mediana_s'] * 1000:10.2f} ms  ({m['repeticoes']} rep)", flush=True)
+        del registros
+
+    doc = {
+        "commit": _git_commit(),
+        "quando": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "plataforma": platform.platform(),
+        "seed": seed,
+        "resultados": resultados,
+    }
+    if saida:
+        os.makedirs(os.path.dirname(os.path.abspath(saida)), exist_ok=True)
+        with open(saida, "w", encoding="utf-8") as f:
+            json.dump(doc, f, ensure_ascii=False, indent=2)
+        print(f"resultados gravados em {saida}")
+    return doc
+
+
+def comparar(arq_antes, arq_depois):
+    with open(arq_antes, encoding="utf-8") as f:
+        antes = json.load(f)
+    with open(arq_depois, encoding="utf-8") as f:
+        depois = json.load(f)
+    idx = {(r["benchmark"], r["tamanho"]): r for r in antes["resultados"]}
+    print(f"{'benchmark':<24} {'tamanho':>9} {'antes ms':>11} {'depois ms':>11} {'razão':>7}")
+    for r in depois["resultados"]:
+        a = idx.get((r["benchmark"], r["tamanho"]))
+        if not a:
+            continue
+        razao = r["mediana_s"] / a["mediana_s"] if a["mediana_s"] else float("inf")
+        print(f"{r['benchmark']:<24} {r['tamanho']:>9} {a['mediana_s'] * 1000:11.2f} {r['mediana_s'] * 1000:11.2f} {razao:7.2f}")
+
+
+# ----------------------------- formatos de armazenamento -----------------------------
+FORMATOS = ("json", "compacto", "binario")
+
+
+def carga_particoes(diretorio, modo):
+    """
+    Roda em um subprocesso limpo: mede o tempo e o aumento do pico de RSS para carregar as
+    partições de `diretorio`. modo "lista" = carregar_registros() (decodifica tudo);
+    "mmap" = só abre as partições binárias, sem decodificar nenhum registro.
+    """
+    import resource
+    os.chdir(diretorio)
+    sys.path.insert(0, AQUI)
+    import sistema_ as S
+    base = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    t0 = time.perf_counter()
+    if modo == "lista":
+        n = len(S.carregar_registros())
+    else:
+        seqs = [S.RegistrosMmap(os.path.join(S.DADOS_DIR, nome))
+                for nome in sorted(os.listdir(S.DADOS_DIR)) if nome.endswith(".bin")]
+        n = sum(len(seq) for seq in seqs)
+    segundos = time.perf_counter() - t0
+    rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - base
+    print(json.dumps({"registros": n, "segundos": segundos, "rss_kb": rss_kb}))
+
+
+def _gravar_formato(S, destino, registros, formato):
+    """Grava `registros` como partições em `destino`/dados no formato; devolve os bytes em disco."""
+    cwd = os.getcwd()
+    os.makedirs(destino, exist_ok=True)
+    os.chdir(destino)
+    try:
+        grupos = {}
+        for r in registros:
+            grupos.setdefault(S._mes_particao(r), []).append(r)
+        S._gravar_particoes(grupos, {"formato": 1, "particoes": {}}, list(grupos), formato)
+        return sum(os.path.getsize(os.path.join(S.DADOS_DIR, nome)) for nome in os.listdir(S.DADOS_DIR))
+    finally:
+        os.chdir(cwd)
+
+
+def formatos(tamanhos, saida, seed=42, repeticoes=3):
+    """Compara tamanho em disco, tempo de carga e RSS entre os formatos das partições."""
+    S = _importar_sistema()
+    resultados = []
+    print(f"{'formato':<18} {'tamanho':>9} {'disco MiB':>10} {'carga ms':>10} {'RSS MiB':>9}")
+    for n in tamanhos:
+        registros = gerar_registros(n, seed)
+        base = tempfile.mkdtemp(prefix="bench_formatos_")
+        try:
+            for formato in FORMATOS:
+                destino = os.path.join(base, formato)
+                disco = _gravar_formato(S, destino, registros, formato)
+                for modo in (("lista", "mmap") if formato == "binario" else ("lista",)):
+                    medidas = []
+                    for _ in range(repeticoes):
+                        proc = subprocess.run([sys.executable, os.path.abspath(__file__), "carga-particoes", destino, modo],
+                                              capture_output=True, text=True, check=True)
+                        medidas.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+                    nome = formato if modo == "lista" else formato + " (mmap)"
+                    r = {"formato": nome, "tamanho": n, "disco_bytes": disco,
+                         "carga_s": statistics.median(m["segundos"] for m in medidas),
+                         "rss_kb": statistics.median(m["rss_kb"] for m in medidas)}
+                    resultados.append(r)
+                    print(f"{nome:<18} {n:>9} {disco / 2**20:10.1f} {r['carga_s'] * 1000:10.1f} {r['rss_kb'] / 1024:9.1f}", flush=True)
+        finally:
+            shutil.rmtree(base, ignore_errors=True)
+    if saida:
+        os.makedirs(os.path.dirname(os.path.abspath(saida)), exist_ok=True)
+        with open(saida, "w", encoding="utf-8") as f:
+            json.dump({"commit": _git_commit(), "seed": seed, "resultados": resultados}, f, ensure_ascii=False, indent=2)
+        print(f"resultados gravados em {saida}")
+    return resultados
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Benchmarks do sistema_.py")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+
+    g = sub.add_parser("gerar", help="gera dados.json/users.json/sessions.json sintéticos")
+    g.add_argument("--tamanho", default="10k")
+    g.add_argument("--destino", required=True)
+    g.add_argument("--seed", type=int, default=42)
+
+    r = sub.add_parser("rodar", help="executa os microbenchmarks")
+    r.add_argument("--tamanhos", default=TAMANHOS_PADRAO, help="ex.: 1k,10k,100k,1m")
+    r.add_argument("--saida", default=os.path.join("bench_resultados", "resultados.json"))
+    r.add_argument("--filtro", default="", help="executa só benchmarks cujo nome contém um destes termos (separados por vírgula)")
+    r.add_argument("--orcamento", type=float, default=1.0, help="segundos por benchmark")
+    r.add_argument("--seed", type=int, default=42)
+
+    c = sub.add_parser("comparar", help="compara dois arquivos de resultados")
+    c.add_argument("antes")
+    c.add_argument("depois")
+
+    fm = sub.add_parser("formatos", help="compara disco, tempo de carga e RSS dos formatos de armazenamento")
+    fm.add_argument("--tamanhos", default=TAMANHOS_PADRAO, help="ex.: 10k,100k")
+    fm.add_argument("--saida", default="")
+    fm.add_argument("--seed", type=int, default=42)
+
+    cp = sub.add_parser("carga-particoes", help="(uso interno de formatos) mede a carga de um diretório")
+    cp.add_argument("diretorio")
+    cp.add_argument("modo", choices=("lista", "mmap"))
+
+    args = ap.parse_args(argv)
+    if args.cmd == "gerar":
+        destino = gravar_fixture(os.path.abspath(args.destino), parse_tamanho(args.tamanho), args.seed)
+        print(f"fixture gravada em {destino}")
+    elif args.cmd == "rodar":
+        saida = os.path.abspath(args.saida) if args.saida else None
+        filtro = [f.strip() for f in args.filtro.split(",") if f.strip()]
+        rodar([parse_tamanho(t) for t in args.tamanhos.split(",") if t.strip()], saida, filtro,
+              args.orcamento, args.seed)
+    elif args.cmd == "comparar":
+        comparar(args.antes, args.depois)
+    elif args.cmd == "formatos":
+        formatos([parse_tamanho(t) for t in args.tamanhos.split(",") if t.strip()],
+                 os.path.abspath(args.saida) if args.saida else None, args.seed)
+    elif args.cmd == "carga-particoes":
+        carga_particoes(args.diretorio, args.modo)
+
+
+if __name__ == "__main__":
+    main()
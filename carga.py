@@ -0,0 +1,373 @@
+"""
+Teste de carga ponta a ponta (somente stdlib).
+
+Sobe o Servidor do sistema_.py em uma porta de loopback (processo separado, diretório
+temporário), faz login de N usuários virtuais e reproduz uma mistura realista de uso:
+polling de /atrasos a cada 20 s, visualizações de /lista, POSTs em /registrar e
+/adicionar_observacao e, ocasionalmente, um /export_csv completo.
+
+Ao final mostra latência p50/p95/p99 por rota, vazão, taxa de erro e a contagem de
+"atualizações perdidas" (registros criados com sucesso x registros persistidos).
+
+Uso:
+    python3 carga.py --usuarios 20 --duracao 60
+    python3 carga.py --usuarios 50 --duracao 120 --registros-iniciais 10k --saida carga.json
+"""
+import argparse
+import csv
+import http.client
+import io
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+
+AQUI = os.path.dirname(os.path.abspath(__file__))
+SENHA = "carga123"
+MARCA_CARGA = "CARGA"
+
+# pesos das ações "interativas" (o polling de /atrasos roda em paralelo, no seu próprio ritmo)
+MISTURA = [
+    ("lista", 50),
+    ("registrar", 25),
+    ("observacao", 20),
+    ("export_csv", 5),
+]
+
+SERVIDOR_SCRIPT = r"""
+import sys
+sys.path.insert(0, sys.argv[1])
+import sistema_
+sistema_.LOGIN_TENTATIVAS_POR_IP = None  # todos os usuários virtuais vêm de 127.0.0.1
+from http.server import HTTPServer
+from socketserver import ThreadingMixIn
+
+class ThreadedHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+httpd = ThreadedHTTPServer(("127.0.0.1", int(sys.argv[2])), sistema_.Servidor)
+print("pronto", flush=True)
+httpd.serve_forever()
+"""
+
+
+def porta_livre():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def percentil(valores, p):
+    if not valores:
+        return 0.0
+    valores = sorted(valores)
+    k = (len(valores) - 1) * p / 100.0
+    f = int(k)
+    c = min(f + 1, len(valores) - 1)
+    return valores[f] + (valores[c] - valores[f]) * (k - f)
+
+
+class Cliente:
+    def __init__(self, host, porta, timeout=60):
+        self.host = host
+        self.porta = porta
+        self.timeout = timeout
+        self.cookie = None
+
+    def requisicao(self, metodo, caminho, campos=None):
+        corpo = None
+        headers = {"Accept-Encoding": "identity"}
+        if self.cookie:
+            headers["Cookie"] = self.cookie
+        if campos is not None:
+            corpo = urllib.parse.urlencode(campos)
+            headers["Content-Type"] = "application/x-www-form-urlencoded"
+        conn = http.client.HTTPConnection(self.host, self.porta, timeout=self.timeout)
+        try:
+            conn.request(metodo, caminho, body=corpo, headers=headers)
+            resp = conn.getresponse()
+            dados = resp.read()
+            return resp.status, resp, dados
+        finally:
+            conn.close()
+
+    def login(self, usuario):
+        status, resp, _ = self.requisicao("POST", "/login", {"username": usuario, "password": SENHA})
+        cookie = resp.getheader("Set-Cookie") or ""
+        if status != 303 or "session_token=" not in cookie:
+            raise RuntimeError(f"login falhou para {usuario}: HTTP {status}")
+        self.cookie = cookie.split(";", 1)[0]
+
+
+class Estatisticas:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencias = {}   # rota -> [segundos]
+        self.erros = {}       # rota -> qtd
+        self.criados = 0
+        self.observacoes = 0
+        self.sessoes_perdidas = 0
+
+    def registrar(self, rota, duracao, ok):
+        with self.lock:
+            self.latencias.setdefault(rota, []).append(duracao)
+            if not ok:
+                self.erros[rota] = self.erros.get(rota, 0) + 1
+
+
+class UsuarioVirtual(threading.Thread):
+    def __init__(self, idx, usuario, cliente, stats, fim, intervalo_atrasos, pensar, rnd, ids_conhecidos):
+        super().__init__(daemon=True)
+        self.idx = idx
+        self.usuario = usuario
+        self.cliente = cliente
+        self.stats = stats
+        self.fim = fim
+        self.intervalo_atrasos = intervalo_atrasos
+        self.pensar = pensar
+        self.rnd = rnd
+        self.ids_conhecidos = ids_conhecidos
+        self.seq = 0
+
+    def _medir(self, rota, metodo, caminho, campos=None, esperado=(200,)):
+        t0 = time.perf_counter()
+        sessao_perdida = False
+        try:
+            status, resp, dados = self.cliente.requisicao(metodo, caminho, campos)
+            sessao_perdida = status == 401 or (status == 303 and resp.getheader("Location") == "/login")
+            ok = status in esperado and not sessao_perdida
+        except Exception:
+            status, dados, ok = None, b"", False
+        self.stats.registrar(rota, time.perf_counter() - t0, ok)
+        if sessao_perdida:
+            # o servidor "esqueceu" a sessão: conta como erro e faz login de novo, como o usuário faria
+            with self.stats.lock:
+                self.stats.sessoes_perdidas += 1
+            try:
+                self.cliente.login(self.usuario)
+            except Exception:
+                pass
+        return ok, dados
+
+    def acao(self, nome):
+        if nome == "lista":
+            self._medir("GET /lista", "GET", "/lista")
+        elif nome == "export_csv":
+            self._medir("GET /export_csv", "GET", "/export_csv?f_all=on")
+        elif nome == "registrar":
+            self.seq += 1
+            tipo = self.rnd.choice(["entrada", "entrada", "saida", "emprestimo"])
+            campos = {
+                "tipo": tipo,
+                "responsavel": "Fulano",
+                "patrimonio": str(self.rnd.randint(1000000, 9999999)),
+                "workflow": f"P-{self.rnd.randint(1000000, 9999999)}",
+                "origem": "CARGA",
+                "data_inicio": time.strftime("%d/%m/%Y %H:%M"),
+                "motivo": "manutenção",
+                "hardware": "Desktop",
+                "marca": "Dell",
+                "modelo": f"{MARCA_CARGA}-{self.idx}-{self.seq}",
+            }
+            if tipo == "emprestimo":
+                campos["emprestado_para"] = "Teste de carga"
+                campos["data_retorno"] = time.strftime("%d/%m/%Y %H:%M", time.localtime(time.time() + 86400))
+            ok, _ = self._medir("POST /registrar", "POST", "/registrar", campos, esperado=(303,))
+            if ok:
+                with self.stats.lock:
+                    self.stats.criados += 1
+        elif nome == "observacao":
+            if not self.ids_conhecidos:
+                return self.acao("lista")
+            id_ = self.rnd.choice(self.ids_conhecidos)
+            campos = {"id": str(id_), "texto": f"obs de carga {self.idx}-{self.seq}",
+                      "registrado_em": time.strftime("%d/%m/%Y %H:%M")}
+            ok, _ = self._medir("POST /adicionar_observacao", "POST", "/adicionar_observacao", campos, esperado=(303,))
+            if ok:
+                with self.stats.lock:
+                    self.stats.observacoes += 1
+
+    def run(self):
+        nomes = [n for n, _ in MISTURA]
+        pesos = [p for _, p in MISTURA]
+        # espalha o primeiro poll para não sincronizar todos os usuários
+        proximo_poll = time.monotonic() + self.rnd.uniform(0, self.intervalo_atrasos)
+        while time.monotonic() < self.fim:
+            agora = time.monotonic()
+            if agora >= proximo_poll:
+                self._medir("GET /atrasos", "GET", "/atrasos")
+                proximo_poll += self.intervalo_atrasos
+                continue
+            self.acao(self.rnd.choices(nomes, pesos)[0])
+            espera = min(self.rnd.expovariate(1.0 / self.pensar), max(0.0, proximo_poll - time.monotonic()))
+            time.sleep(max(0.0, min(espera, self.fim - time.monotonic())))
+
+
+def preparar_diretorio(n_usuarios, registros_iniciais):
+    """Cria o diretório de trabalho do servidor com dados (opcionalmente sintéticos) e usuários de carga."""
+    destino = tempfile.mkdtemp(prefix="carga_sistema_")
+    sys.path.insert(0, AQUI)
+    cwd = os.getcwd()
+    os.chdir(destino)
+    try:
+        import sistema_
+        if registros_iniciais:
+            import benchmark
+            benchmark.gravar_fixture(destino, registros_iniciais)
+        usuarios = [{"username": "admin"}]
+        for i in range(n_usuarios):
+            salt_hex, hash_hex = sistema_.hash_password(SENHA)
+            usuarios.append({"username": f"carga{i:03d}", "salt": salt_hex, "password_hash": hash_hex})
+        with open(os.path.join(destino, "users.json"), "w", encoding="utf-8") as f:
+            json.dump(usuarios, f, ensure_ascii=False, indent=4)
+        with open(os.path.join(destino, "sessions.json"), "w", encoding="utf-8") as f:
+            json.dump([], f)
+    finally:
+        os.chdir(cwd)
+    return destino, [u["username"] for u in usuarios[1:]]
+
+
+def contar_persistidos(cliente, usuario):
+    """Conta, via exportação completa, os registros criados por este teste (modelo CARGA-*)."""
+    cliente.login(usuario)  # sessão nova: a contagem não pode depender de sessões perdidas durante a carga
+    status, _, dados = cliente.requisicao("GET", "/export_csv?f_all=on")
+    if status != 200:
+        raise RuntimeError(f"export final falhou: HTTP {status}")
+    leitor = csv.DictReader(io.StringIO(dados.decode("utf-8")))
+    ids = []
+    persistidos = 0
+    for row in leitor:
+        try:
+            ids.append(int(row.get("id") or 0))
+        except ValueError:
+            pass
+        if (row.get("modelo") or "").startswith(MARCA_CARGA + "-"):
+            persistidos += 1
+    return persistidos, ids
+
+
+def executar(args):
+    diretorio, usuarios = preparar_diretorio(args.usuarios, args.registros_iniciais)
+    porta = args.porta or porta_livre()
+    log_servidor = open(os.path.join(diretorio, "servidor.log"), "w", encoding="utf-8")
+    servidor = subprocess.Popen([sys.executable, "-c", SERVIDOR_SCRIPT, AQUI, str(porta)], cwd=diretorio,
+                                stdout=subprocess.PIPE, stderr=log_servidor, text=True)
+    try:
+        while True:  # avisos impressos pelo sistema_ na importação vêm antes do "pronto"
+            linha = servidor.stdout.readline()
+            if not linha:
+                raise RuntimeError("servidor não subiu")
+            if linha.strip() == "pronto":
+                break
+
+        clientes = []
+        t0 = time.perf_counter()
+        for u in usuarios:
+            c = Cliente("127.0.0.1", porta)
+            c.login(u)
+            clientes.append(c)
+        print(f"{len(clientes)} usuários logados em {time.perf_counter() - t0:.1f}s (porta {porta}, dir {diretorio})")
+
+        _, ids_iniciais = contar_persistidos(Cliente("127.0.0.1", porta), usuarios[0])
+        ids_conhecidos = ids_iniciais[-500:]
+
+        stats = Estatisticas()
+        rnd = random.Random(args.seed)
+        inicio = time.monotonic()
+        fim = inicio + args.duracao
+        vus = [UsuarioVirtual(i, u, c, stats, fim, args.intervalo_atrasos, args.pensar,
+                              random.Random(rnd.random()), ids_conhecidos)
+               for i, (u, c) in enumerate(zip(usuarios, clientes))]
+        for v in vus:
+            v.start()
+        for v in vus:
+            v.join()
+        decorrido = time.monotonic() - inicio
+
+        persistidos, _ = contar_persistidos(Cliente("127.0.0.1", porta), usuarios[0])
+    finally:
+        servidor.terminate()
+        try:
+            servidor.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            servidor.kill()
+        log_servidor.close()
+
+    with open(os.path.join(diretorio, "servidor.log"), encoding="utf-8", errors="replace") as f:
+        excecoes = f.read().count("Exception occurred during processing of request")
+
+    total = sum(len(v) for v in stats.latencias.values())
+    erros = sum(stats.erros.values())
+    todas = [x for v in stats.latencias.values() for x in v]
+    relatorio = {
+        "usuarios": args.usuarios,
+        "duracao_s": round(decorrido, 2),
+        "registros_iniciais": args.registros_iniciais,
+        "requisicoes": total,
+        "vazao_rps": round(total / decorrido, 2) if decorrido else 0,
+        "taxa_erro": round(erros / total, 4) if total else 0,
+        "latencia_ms": {"p50": percentil(todas, 50) * 1000, "p95": percentil(todas, 95) * 1000,
+                        "p99": percentil(todas, 99) * 1000},
+        "rotas": {},
+        "registros_criados": stats.criados,
+        "registros_persistidos": persistidos,
+        "atualizacoes_perdidas": stats.criados - persistidos,
+        "observacoes_enviadas": stats.observacoes,
+        "sessoes_perdidas": stats.sessoes_perdidas,
+        "excecoes_servidor": excecoes,
+    }
+    for rota, lat in sorted(stats.latencias.items()):
+        relatorio["rotas"][rota] = {
+            "requisicoes": len(lat),
+            "erros": stats.erros.get(rota, 0),
+            "p50_ms": percentil(lat, 50) * 1000,
+            "p95_ms": percentil(lat, 95) * 1000,
+            "p99_ms": percentil(lat, 99) * 1000,
+        }
+
+    print(f"\n{total} requisições em {decorrido:.1f}s — {relatorio['vazao_rps']} req/s, "
+          f"erro {relatorio['taxa_erro'] * 100:.2f}%")
+    print(f"{'rota':<30} {'req':>7} {'erros':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for rota, r in relatorio["rotas"].items():
+        print(f"{rota:<30} {r['requisicoes']:>7} {r['erros']:>6} {r['p50_ms']:9.1f} {r['p95_ms']:9.1f} {r['p99_ms']:9.1f}")
+    print(f"\nregistros criados (303): {stats.criados}  persistidos: {persistidos}  "
+          f"perdidos: {relatorio['atualizacoes_perdidas']}  sessões perdidas: {stats.sessoes_perdidas}")
+    if excecoes:
+        print(f"exceções no servidor: {excecoes} (veja servidor.log em {diretorio}; use --manter)")
+
+    if args.saida:
+        with open(args.saida, "w", encoding="utf-8") as f:
+            json.dump(relatorio, f, ensure_ascii=False, indent=2)
+        print(f"relatório gravado em {args.saida}")
+    if not args.manter:
+        shutil.rmtree(diretorio, ignore_errors=True)
+    return relatorio
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Teste de carga HTTP do sistema_.py")
+    ap.add_argument("--usuarios", type=int, default=10, help="usuários virtuais")
+    ap.add_argument("--duracao", type=float, default=60, help="segundos de carga")
+    ap.add_argument("--intervalo-atrasos", type=float, default=20.0, help="período do polling de /atrasos (s)")
+    ap.add_argument("--pensar", type=float, default=3.0, help="tempo médio entre ações de um usuário (s)")
+    ap.add_argument("--registros-iniciais", default="0", help="gera dados sintéticos antes (ex.: 10k)")
+    ap.add_argument("--porta", type=int, default=0)
+    ap.add_argument("--seed", type=int, default=42)
+    ap.add_argument("--saida", default="", help="grava o relatório em JSON")
+    ap.add_argument("--manter", action="store_true", help="não apaga o diretório de dados do servidor ao final")
+    args = ap.parse_args(argv)
+    sys.path.insert(0, AQUI)
+    import benchmark
+    args.registros_iniciais = benchmark.parse_tamanho(args.registros_iniciais)
+    executar(args)
+
+
+if __name__ == "__main__":
+    main()
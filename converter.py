@@ -0,0 +1,52 @@
+"""
+Converte as partições de dados/ entre os formatos de armazenamento do sistema_.py.
+
+Uso (no diretório de trabalho do servidor):
+    python3 converter.py binario
+    python3 converter.py compacto
+    python3 converter.py json --diretorio /caminho/do/servidor
+
+"json" é o formato legível (indentado), "compacto" é JSON sem espaços e "binario" grava cada
+registro com prefixo de tamanho (lido via mmap). A leitura detecta o formato de cada arquivo,
+então a conversão pode ser feita com o servidor rodando; para que as próximas gravações usem o
+novo formato, ajuste também FORMATO_DADOS em sistema_.py.
+"""
+import argparse
+import os
+import sys
+
+AQUI = os.path.dirname(os.path.abspath(__file__))
+FORMATOS = ("json", "compacto", "binario")
+
+
+def tamanho_particoes(S):
+    total = 0
+    for nome in os.listdir(S.DADOS_DIR) if os.path.isdir(S.DADOS_DIR) else []:
+        total += os.path.getsize(os.path.join(S.DADOS_DIR, nome))
+    return total
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Converte as partições de dados/ entre formatos")
+    ap.add_argument("formato", choices=FORMATOS)
+    ap.add_argument("--diretorio", default=".", help="diretório de trabalho do servidor (onde fica dados/)")
+    args = ap.parse_args(argv)
+
+    os.chdir(args.diretorio)
+    sys.path.insert(0, AQUI)
+    import sistema_ as S
+
+    registros = len(S.carregar_registros())  # migra um dados.json antigo, se houver
+    antes = tamanho_particoes(S)
+    particoes = S.converter_particoes(args.formato)
+    # relê do disco: confere que nada se perdeu na conversão
+    relidos = len(S.carregar_registros())
+    if relidos != registros:
+        sys.exit(f"erro: {registros} registros antes da conversão, {relidos} depois")
+    depois = tamanho_particoes(S)
+    print(f"{particoes} partições, {registros} registros convertidos para {args.formato}: "
+          f"{antes / 1024:.1f} KiB -> {depois / 1024:.1f} KiB")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,7 +3,7 @@ import csv
 import datetime
 import re
 from http.server import BaseHTTPRequestHandler, HTTPServer
-from urllib.parse import parse_qs, urlparse
+from urllib.parse import parse_qs, urlparse, unquote
 from socketserver import ThreadingMixIn
 from zoneinfo import ZoneInfo
 import os
@@ -11,13 +11,86 @@ import hashlib
 import secrets
 import binascii
 import time
-
-ARQUIVO = "dados.json"
+import threading
+import collections
+import functools
+import itertools
+import cProfile
+import pstats
+import io
+import sys
+import zlib
+import gzip
+import mmap
+import struct
+import concurrent.futures
+import bisect
+import array
+import heapq
+import copy
+
+ARQUIVO = "dados.json"           # formato antigo (arquivo único): migrado para DADOS_DIR na primeira leitura
+DADOS_DIR = "dados"              # partições mensais por data_inicio + manifesto.json
+# Formato em que as partições são gravadas: "json" (indentado, legível), "compacto" (JSON sem
+# espaços) ou "binario" (registros com prefixo de tamanho, lidos via mmap). A leitura detecta
+# o formato de cada arquivo; para converter tudo de uma vez use converter.py.
+FORMATO_DADOS = "json"
 USERS_FILE = "users.json"
 SESSIONS_FILE = "sessions.json"
+OBSERVACOES_FILE = "observacoes.jsonl"  # log append-only das observações (uma linha JSON cada)
+AUDITORIA_FILE = "auditoria.jsonl"      # log append-only das edições de registros
 SESSION_TTL = 4 * 3600 # 4 horas em segundos
 PWD_ITERATIONS = 100_000
 PWD_SALT_BYTES = 16
+# PBKDF2 do login roda fora das threads de requisição: pool pequeno com fila limitada
+SENHA_WORKERS = 2                  # hashes simultâneos (limita a CPU gasta com login)
+SENHA_FILA_MAX = 16                # pedidos esperando; além disso o login é recusado na hora (503)
+# Limites de tentativas de login: (quantidade, janela em segundos); None desativa
+LOGIN_TENTATIVAS_POR_IP = (30, 60)     # tentativas por IP
+LOGIN_FALHAS_POR_USUARIO = (5, 300)    # senhas erradas por usuário
+
+# Profiling sob demanda (somente admin): ?__perfil=cprofile|amostragem ou header X-Perfil
+PERFIL_DIR = "perfis"            # onde o modo "próximas K requisições" grava os .pstats
+PERFIL_TOP_N = 40                # linhas da tabela de tempo cumulativo
+PERFIL_MAX_MEMORIA = 20          # perfis recentes mantidos em memória (/admin_perfis)
+PERFIL_INTERVALO_AMOSTRAGEM = 0.005  # segundos entre amostras do profiler por amostragem
+
+# Slow log: requisições acima do limiar viram uma linha JSON com o tempo de cada fase
+SLOW_LOG_FILE = "lentas.jsonl"
+SLOW_LOG_LIMIAR_MS = 500         # None desativa o slow log
+
+# Compressão das respostas (negociada via Accept-Encoding)
+COMPRESSAO_MIN_BYTES = 1024      # corpos menores vão sem compressão
+COMPRESSAO_NIVEL = 6
+COMPRESSAO_CACHE_MAX_BYTES = 32 * 1024 * 1024  # cache de corpos comprimidos por ETag
+
+# /lista a partir deste número de registros é enviada em streaming (sem ETag/Content-Length)
+LISTA_STREAM_MIN_REGISTROS = 5000
+# Cache de linhas <tr> já renderizadas do /lista (LRU, por versão do registro)
+LINHAS_CACHE_MAX_BYTES = 64 * 1024 * 1024
+# /api/registros/changes: acima disso o cliente recarrega a página inteira
+DELTA_MAX_REGISTROS = 2000
+# /api/lote: máximo de ids por requisição
+LOTE_MAX_IDS = 1000
+# /importar_csv: linhas gravadas por commit e máximo de erros listados no relatório
+IMPORTACAO_LOTE = 5000
+IMPORTACAO_MAX_ERROS = 1000
+
+# Arquivo frio: registros encerrados (devolvidos/ocultos) sem atividade há mais de
+# ARQUIVAMENTO_IDADE_DIAS saem das partições de dados para arquivos gzip por ano em ARQUIVO_DIR
+ARQUIVO_DIR = "arquivo"
+ARQUIVAMENTO_IDADE_DIAS = 365
+ARQUIVAMENTO_NA_INICIALIZACAO = True
+
+# Assets estáticos (CSS/JS) servidos da memória em /static/ com URL versionada pelo conteúdo
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+STATIC_MAX_AGE = 365 * 24 * 3600
+# flatpickr vendorizado (sem CDN: a rede interna não alcança o jsdelivr)
+FLATPICKR_ARQUIVOS = (
+    "vendor/flatpickr/flatpickr.min.css",
+    "vendor/flatpickr/flatpickr.min.js",
+    "vendor/flatpickr/l10n/pt.js",
+)
 
 # Lista de responsáveis (usada para montar o select no frontend)
 RESPONSAVEIS = [
@@ -26,14 +99,6 @@ RESPONSAVEIS = [
     "Beltrano"
 ]
 
-# garante que o json existe
-try:
-    with open(ARQUIVO, "r", encoding="utf-8") as f:
-        pass
-except:
-    with open(ARQUIVO, "w", encoding="utf-8") as f:
-        json.dump([], f, indent=4, ensure_ascii=False)
-
 def ensure_json_file(path, default):
     if not os.path.exists(path):
         with open(path, "w", encoding="utf-8") as f:
@@ -43,24 +108,69 @@ def ensure_json_file(path, default):
 ensure_json_file(USERS_FILE, [{"username": "admin"}])  # cria admin vazio por padrão — defina seus usuários
 ensure_json_file(SESSIONS_FILE, [])
 
+# Diretório de usuários em memória: lista + índice por nome (casefold), relidos só quando
+# users.json muda (mtime/tamanho). Quem altera a lista faz isso com _usuarios_lock e chama
+# save_users() no final, que grava de forma atômica e refaz índice e fragmentos.
+_usuarios_lock = threading.RLock()
+_usuarios_cache = {"chave": None, "lista": None, "indice": {}, "fragmentos": {}}
+
+
+def _nome_usuario(username):
+    return str(username or "").strip().casefold()
+
+
+def _indexar_usuarios(users, chave):
+    indice = {}
+    for u in users:
+        indice.setdefault(_nome_usuario(u.get("username", "")), u)
+    _usuarios_cache.update(chave=chave, lista=users, indice=indice, fragmentos={})
+
+
 def load_users():
-    with open(USERS_FILE, "r", encoding="utf-8") as f:
-        try:
-            return json.load(f)
-        except Exception:
-            return []
+    chave = _chave_ou_none(USERS_FILE)
+    if _usuarios_cache["lista"] is None or chave != _usuarios_cache["chave"]:
+        with _usuarios_lock:
+            chave = _chave_ou_none(USERS_FILE)
+            if _usuarios_cache["lista"] is None or chave != _usuarios_cache["chave"]:
+                try:
+                    with open(USERS_FILE, "r", encoding="utf-8") as f:
+                        users = json.load(f)
+                except Exception:
+                    users = []
+                _indexar_usuarios(users, chave)
+    return _usuarios_cache["lista"]
 
 def save_users(users):
-    with open(USERS_FILE, "w", encoding="utf-8") as f:
-        json.dump(users, f, ensure_ascii=False, indent=4)
+    """Grava users.json de forma atômica (temporário + os.replace) e atualiza o diretório."""
+    with _usuarios_lock:
+        tmp = USERS_FILE + ".tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(users, f, ensure_ascii=False, indent=4)
+            os.replace(tmp, USERS_FILE)
+        except Exception:
+            _usuarios_cache["lista"] = None  # memória pode ter divergido do disco: força reler
+            raise
+        _indexar_usuarios(users, _chave_ou_none(USERS_FILE))
 
 def find_user(users, username):
-    username = (username or "").strip()
+    if users is _usuarios_cache["lista"]:
+        return _usuarios_cache["indice"].get(_nome_usuario(username))
+    nome = _nome_usuario(username)
     for u in users:
-        if str(u.get("username","")).strip().lower() == username.lower():
+        if _nome_usuario(u.get("username","")) == nome:
             return u
     return None
 
+def fragmento_usuarios(nome, gerar):
+    """HTML derivado da lista de usuários (ex.: <option>s), em cache até os usuários mudarem."""
+    users = load_users()
+    fragmentos = _usuarios_cache["fragmentos"]
+    html = fragmentos.get(nome)
+    if html is None:
+        html = fragmentos[nome] = gerar(users)
+    return html
+
 def hash_password(password, salt_bytes=None):
     if salt_bytes is None:
         salt = secrets.token_bytes(PWD_SALT_BYTES)
@@ -78,7 +188,77 @@ def verify_password(password, salt_hex, hash_hex):
     except Exception:
         return False
 
+
+# Pool de hashing: pbkdf2_hmac libera o GIL, então threads dedicadas bastam para tirar a CPU
+# do login do caminho das outras requisições. O semáforo limita fila + execução.
+class FilaSenhasCheia(Exception):
+    """Não há vaga no pool de hashing: o login deve ser recusado na hora."""
+
+
+_senhas_pool = concurrent.futures.ThreadPoolExecutor(max_workers=SENHA_WORKERS, thread_name_prefix="senha")
+_senhas_vagas = threading.BoundedSemaphore(SENHA_WORKERS + SENHA_FILA_MAX)
+
+
+def executar_hash(fn, *args):
+    """Roda hash_password/verify_password no pool e espera o resultado; FilaSenhasCheia se lotado."""
+    if not _senhas_vagas.acquire(blocking=False):
+        raise FilaSenhasCheia()
+    try:
+        futuro = _senhas_pool.submit(fn, *args)
+    except Exception:
+        _senhas_vagas.release()
+        raise
+    futuro.add_done_callback(lambda _f: _senhas_vagas.release())
+    with medir_fase("pbkdf2"):
+        return futuro.result()
+
+
+class LimitadorTentativas:
+    """Janela deslizante de eventos por chave (IP ou usuário)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._eventos = {}
+
+    def espera(self, chave, regra):
+        """Segundos até a chave poder tentar de novo (0 = liberada). regra = (máximo, janela) ou None."""
+        if not regra:
+            return 0
+        maximo, janela = regra
+        agora = time.monotonic()
+        with self._lock:
+            eventos = self._eventos.get(chave)
+            if not eventos:
+                return 0
+            while eventos and eventos[0] <= agora - janela:
+                eventos.popleft()
+            if len(eventos) < maximo:
+                return 0
+            return max(1, int(eventos[0] + janela - agora) + 1)
+
+    def registrar(self, chave, regra):
+        if not regra:
+            return
+        agora = time.monotonic()
+        with self._lock:
+            if len(self._eventos) > 10000:
+                # descarta chaves sem eventos recentes para o dicionário não crescer sem limite
+                self._eventos = {k: v for k, v in self._eventos.items() if v and v[-1] > agora - regra[1]}
+            self._eventos.setdefault(chave, collections.deque()).append(agora)
+
+    def limpar(self, chave):
+        with self._lock:
+            self._eventos.pop(chave, None)
+
+
+_tentativas_ip = LimitadorTentativas()
+_falhas_usuario = LimitadorTentativas()
+
 # SESSIONS
+# Toda gravação passa por _sessoes_lock e é atômica: antes, requisições simultâneas liam um
+# sessions.json pela metade, tratavam como vazio e o regravavam vazio, derrubando todos os logins.
+_sessoes_lock = threading.Lock()
+
 def load_sessions():
     with open(SESSIONS_FILE, "r", encoding="utf-8") as f:
         try:
@@ -87,15 +267,25 @@ def load_sessions():
             return []
 
 def save_sessions(sessions):
-    with open(SESSIONS_FILE, "w", encoding="utf-8") as f:
+    """Grava sessions.json de forma atômica (temporário + os.replace). Chamar com _sessoes_lock."""
+    tmp = SESSIONS_FILE + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
         json.dump(sessions, f, ensure_ascii=False, indent=4)
+    os.replace(tmp, SESSIONS_FILE)
+
+def _sessao_valida(s, now):
+    try:
+        return (s.get("created_at", 0) + SESSION_TTL) > now
+    except Exception:
+        return False
 
 def create_session(username):
     token = secrets.token_urlsafe(32)
     now = int(time.time())
-    sessions = load_sessions()
-    sessions.append({"token": token, "username": username, "created_at": now})
-    save_sessions(sessions)
+    with _sessoes_lock:
+        sessions = load_sessions()
+        sessions.append({"token": token, "username": username, "created_at": now})
+        save_sessions(sessions)
     return token
 
 def validate_session(token):
@@ -104,34 +294,2359 @@ def validate_session(token):
     sessions = load_sessions()
     now = int(time.time())
     valid_user = None
-    new_sessions = []
     for s in sessions:
         try:
-            if s.get("token") == token:
-                if (s.get("created_at", 0) + SESSION_TTL) > now:
-                    valid_user = s.get("username")
-                    new_sessions.append(s)
-                else:
-                    # expired -> skip (removes)
-                    continue
-            else:
-                # keep other sessions
-                if (s.get("created_at", 0) + SESSION_TTL) > now:
-                    new_sessions.append(s)
+            if s.get("token") == token and _sessao_valida(s, now):
+                valid_user = s.get("username")
+                break
         except Exception:
             pass
-    # salvar sessões limpas (remove expiradas)
-    save_sessions(new_sessions)
+    # remove expiradas só quando existe alguma (antes o arquivo era regravado a cada requisição)
+    if not all(_sessao_valida(s, now) for s in sessions):
+        with _sessoes_lock:
+            save_sessions([s for s in load_sessions() if _sessao_valida(s, now)])
     return valid_user
 
 def remove_session(token):
     if not token:
         return
-    sessions = load_sessions()
-    sessions = [s for s in sessions if s.get("token") != token]
-    save_sessions(sessions)
+    with _sessoes_lock:
+        sessions = load_sessions()
+        sessions = [s for s in sessions if s.get("token") != token]
+        save_sessions(sessions)
+
+# ----------------------------- SLOW LOG (fases por requisição) -----------------------------
+_req_local = threading.local()
+_slow_log_lock = threading.Lock()
+
+
+def iniciar_contexto_requisicao(metodo, rota):
+    ctx = {
+        "inicio": time.perf_counter(),
+        "metodo": metodo,
+        "rota": rota,
+        "usuario": None,
+        "registros": None,
+        "status": None,
+        "bytes": 0,
+        "fases": {},
+    }
+    _req_local.ctx = ctx
+    return ctx
+
+
+def contexto_requisicao():
+    """Contexto da requisição em andamento nesta thread (ou None fora de uma requisição)."""
+    return getattr(_req_local, "ctx", None)
+
+
+class medir_fase:
+    """
+    Context manager que soma o tempo gasto no bloco à fase `nome` da requisição atual.
+    Fora de uma requisição (ex.: benchmarks) não faz nada além de executar o bloco.
+    """
+    __slots__ = ("nome", "ctx", "t0")
+
+    def __init__(self, nome):
+        self.nome = nome
+
+    def __enter__(self):
+        self.ctx = contexto_requisicao()
+        self.t0 = time.perf_counter() if self.ctx is not None else 0.0
+        return self
+
+    def __exit__(self, *exc):
+        if self.ctx is not None:
+            fases = self.ctx["fases"]
+            fases[self.nome] = fases.get(self.nome, 0.0) + (time.perf_counter() - self.t0)
+        return False
+
+
+def finalizar_contexto_requisicao(ctx):
+    """Grava uma linha JSON no slow log se a requisição passou do limiar."""
+    _req_local.ctx = None
+    duracao = time.perf_counter() - ctx["inicio"]
+    if SLOW_LOG_LIMIAR_MS is None or duracao * 1000 < SLOW_LOG_LIMIAR_MS:
+        return
+    entrada = {
+        "ts": datetime.datetime.now().isoformat(timespec="milliseconds"),
+        "metodo": ctx["metodo"],
+        "rota": ctx["rota"],
+        "status": ctx["status"],
+        "usuario": ctx["usuario"],
+        "registros": ctx["registros"],
+        "bytes": ctx["bytes"],
+        "duracao_ms": round(duracao * 1000, 2),
+        "fases_ms": {k: round(v * 1000, 2) for k, v in ctx["fases"].items()},
+    }
+    if ctx.get("mensagem"):
+        entrada["mensagem"] = ctx["mensagem"]
+    if ctx.get("particoes_gravadas") is not None:
+        entrada["particoes_gravadas"] = ctx["particoes_gravadas"]
+    escrever_slow_log(entrada)
+
+
+def escrever_slow_log(entrada):
+    try:
+        linha = json.dumps(entrada, ensure_ascii=False) + "\n"
+        with _slow_log_lock:
+            with open(SLOW_LOG_FILE, "a", encoding="utf-8") as f:
+                f.write(linha)
+    except Exception:
+        pass
+
+
+class EscritorMedido:
+    """Envolve o wfile do handler: conta bytes enviados e mede o tempo na fase socket_write."""
+
+    def __init__(self, wfile):
+        self._wfile = wfile
+
+    def write(self, data):
+        with medir_fase("socket_write"):
+            n = self._wfile.write(data)
+        ctx = contexto_requisicao()
+        if ctx is not None:
+            ctx["bytes"] += len(data)
+        return n
+
+    def writelines(self, partes):
+        for p in partes:
+            self.write(p)
+
+    def flush(self):
+        return self._wfile.flush()
+
+    def __getattr__(self, nome):
+        return getattr(self._wfile, nome)
+
+
+# ----------------------------- DADOS (registros) -----------------------------
+# Os registros ficam em partições mensais por data_inicio (DADOS_DIR/AAAA-MM.<sufixo>.json,
+# mais sem_data), descritas por DADOS_DIR/manifesto.json. Em memória continua existindo uma
+# lista única (ordenada por id); cada partição guarda a sua fatia e a chave do seu arquivo.
+# Os dicts publicados nessa lista nunca são alterados (copy-on-write): os GETs os leem sem
+# _dados_lock, e quem altera trabalha numa copia_para_alterar() publicada por registrar_alteracao().
+_dados_lock = threading.RLock()   # serializa ler → alterar → salvar dos registros
+_dados_cache = {"chave": None, "registros": None, "versao": 0, "geracao": "", "manifesto": None}
+_particoes = {}                   # mês -> {"chave": (mtime, tamanho), "registros": [...] em ordem de id}
+_particoes_sujas = set()          # meses com registro alterado, novo ou removido desde a última gravação
+_ao_recarregar_registros = []     # callbacks chamados quando alguma partição é relida do disco
+_ao_alterar_registro = []         # callbacks(registro) chamados por registrar_alteracao (com _dados_lock)
+_MANIFESTO = "manifesto.json"
+_RE_DATA_BR = re.compile(r"\s*(\d{2})/(\d{2})/(\d{4})")
+
+
+def _chave_arquivo(caminho):
+    st = os.stat(caminho)
+    return (st.st_mtime_ns, st.st_size)
+
+
+def _chave_ou_none(caminho):
+    try:
+        return _chave_arquivo(caminho)
+    except OSError:
+        return None
+
+
+def _caminho_particao(nome):
+    return os.path.join(DADOS_DIR, nome)
+
+
+def _mes_particao(r):
+    """Partição do registro: "AAAA-MM" de data_inicio (ou do cadastro); "sem_data" se não houver."""
+    m = _RE_DATA_BR.match(str(r.get("data_inicio") or ""))
+    if m and "01" <= m.group(2) <= "12":
+        return m.group(3) + "-" + m.group(2)
+    dt = parse_br_datetime(r.get("data_inicio")) or parse_br_datetime((r.get("oculto_meta") or {}).get("registrado_em"))
+    return dt.strftime("%Y-%m") if dt else "sem_data"
+
+
+def _versao_registro(r):
+    v = r.get("versao") or 0
+    return v if isinstance(v, int) else 0
+
+
+def _id_ordem(r):
+    try:
+        return int(r.get("id") or 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+def _info_particao(registros):
+    ids = [_id_ordem(r) for r in registros]
+    return {"registros": len(registros),
+            "versao_max": max((_versao_registro(r) for r in registros), default=0),
+            "id_min": min(ids, default=None), "id_max": max(ids, default=None)}
+
+
+def _ler_manifesto():
+    try:
+        with open(_caminho_particao(_MANIFESTO), "r", encoding="utf-8") as f:
+            manifesto = json.load(f)
+    except FileNotFoundError:
+        return None
+    manifesto.setdefault("particoes", {})
+    return manifesto
+
+
+# Formato binário: cabeçalho (mágico + quantidade) e, por registro, tamanho (uint32) e id
+# (int64) seguidos do JSON compacto do registro. O id no cabeçalho permite achar um registro
+# sem decodificar os outros.
+_BINARIO_MAGICO = b"SMHB\x01\x00\x00\x00"
+_BINARIO_CABECALHO = struct.Struct("<8sI")
+_BINARIO_REGISTRO = struct.Struct("<Iq")
+_JSON_COMPACTO = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+_JSON_LEGIVEL = json.JSONEncoder(ensure_ascii=False)
+
+
+def _extensao_formato(formato):
+    return ".bin" if formato == "binario" else ".json"
+
+
+def codificar_registros(registros, formato):
+    """Bytes de uma partição no `formato` ("json", "compacto" ou "binario")."""
+    if formato == "json":
+        # um registro por linha: legível e com o encoder em C (indent=4 cai no encoder em Python).
+        # É o mesmo JSON (uma lista de objetos); partições antigas, indentadas, são lidas igual.
+        if not registros:
+            return b"[]"
+        corpo = ",\n    ".join(_JSON_LEGIVEL.encode(r) for r in registros)
+        return ("[\n    " + corpo + "\n]").encode("utf-8")
+    if formato == "compacto":
+        return _JSON_COMPACTO.encode(registros).encode("utf-8")
+    if formato != "binario":
+        raise ValueError(f"formato desconhecido: {formato}")
+    partes = [_BINARIO_CABECALHO.pack(_BINARIO_MAGICO, len(registros))]
+    for r in registros:
+        corpo = _JSON_COMPACTO.encode(r).encode("utf-8")
+        partes.append(_BINARIO_REGISTRO.pack(len(corpo), _id_ordem(r)))
+        partes.append(corpo)
+    return b"".join(partes)
+
+
+class RegistrosMmap:
+    """
+    Sequência somente leitura sobre uma partição binária mapeada em memória: ao abrir só os
+    cabeçalhos são percorridos; cada registro é decodificado no primeiro acesso.
+    """
+
+    def __init__(self, caminho):
+        with open(caminho, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magico, quantidade = _BINARIO_CABECALHO.unpack_from(self._mm, 0)
+        if magico != _BINARIO_MAGICO:
+            self._mm.close()
+            raise ValueError(f"{caminho}: não é uma partição binária")
+        self._offsets = []
+        self.ids = []
+        pos = _BINARIO_CABECALHO.size
+        tam_reg = _BINARIO_REGISTRO.size
+        for _ in range(quantidade):
+            tamanho, id_reg = _BINARIO_REGISTRO.unpack_from(self._mm, pos)
+            pos += tam_reg
+            self._offsets.append((pos, pos + tamanho))
+            self.ids.append(id_reg)
+            pos += tamanho
+        self._decodificados = {}
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def __getitem__(self, i):
+        r = self._decodificados.get(i)
+        if r is None:
+            ini, fim = self._offsets[i]
+            r = self._decodificados[i] = json.loads(self._mm[ini:fim])
+        return r
+
+    def __iter__(self):
+        for i in range(len(self._offsets)):
+            yield self[i]
+
+    def todos(self):
+        """
+        Todos os registros, decodificados de uma vez: um único json.loads sobre os corpos
+        concatenados reaproveita as strings das chaves entre registros (menos memória).
+        """
+        mm = self._mm
+        lista = json.loads(b"[" + b",".join(mm[ini:fim] for ini, fim in self._offsets) + b"]")
+        for i, r in self._decodificados.items():
+            lista[i] = r
+        return lista
+
+    def buscar(self, id_reg):
+        """Registro com o id (decodificando só ele) ou None."""
+        try:
+            return self[self.ids.index(id_reg)]
+        except ValueError:
+            return None
+
+    def fechar(self):
+        self._mm.close()
+
+
+def ler_registros(caminho):
+    """Lista de registros de uma partição em qualquer formato (detectado pelo conteúdo)."""
+    with open(caminho, "rb") as f:
+        inicio = f.read(len(_BINARIO_MAGICO))
+    if inicio != _BINARIO_MAGICO:
+        with open(caminho, "r", encoding="utf-8") as f:
+            return internar_registros(json.load(f))
+    # a lista em memória precisa de todos os registros; o mmap é fechado logo em seguida
+    seq = RegistrosMmap(caminho)
+    try:
+        return internar_registros(seq.todos())
+    finally:
+        seq.fechar()
+
+
+def _gravar_particoes(grupos, manifesto, meses, formato=None):
+    """
+    Grava as partições `meses` (vazias são removidas) e depois o manifesto, que é retornado
+    (o recebido não é alterado). Cada partição regravada vai para um arquivo novo
+    (AAAA-MM.<sufixo>.ext) e só passa a valer quando o manifesto é trocado: várias partições
+    alteradas entram em disco num único commit, e uma falha no meio não deixa nada pela metade.
+    """
+    formato = formato or FORMATO_DADOS
+    os.makedirs(DADOS_DIR, exist_ok=True)
+    manifesto = {**manifesto, "particoes": dict(manifesto["particoes"])}
+    removidas, novas = [], []
+    try:
+        for mes in meses:
+            registros = grupos.get(mes)
+            anterior = manifesto["particoes"].get(mes)
+            if not registros:
+                if manifesto["particoes"].pop(mes, None) is not None:
+                    removidas.append(anterior["arquivo"])
+                continue
+            nome = "%s.%s%s" % (mes, secrets.token_hex(3), _extensao_formato(formato))
+            novas.append(nome)
+            _gravar_atomico(_caminho_particao(nome), codificar_registros(registros, formato))
+            if anterior is not None:
+                removidas.append(anterior["arquivo"])
+            info = _info_particao(registros)
+            info["arquivo"] = nome
+            info["formato"] = formato
+            manifesto["particoes"][mes] = info
+        manifesto["atualizado_em"] = sp_now_naive().strftime("%d/%m/%Y %H:%M:%S")
+        _gravar_atomico(_caminho_particao(_MANIFESTO),
+                        json.dumps(manifesto, ensure_ascii=False, indent=4, sort_keys=True).encode("utf-8"))
+    except Exception:
+        # o manifesto antigo continua valendo: os arquivos novos são descartados
+        for nome in novas:
+            try:
+                os.remove(_caminho_particao(nome))
+            except OSError:
+                pass
+        raise
+    # o manifesto já não aponta para elas: apagar por último nunca perde registros
+    for nome in removidas:
+        try:
+            os.remove(_caminho_particao(nome))
+        except OSError:
+            pass
+    return manifesto
+
+
+def _migrar_dados_json():
+    """Divide um dados.json legado em partições e o renomeia para dados.json.migrado."""
+    try:
+        with open(ARQUIVO, "r", encoding="utf-8") as f:
+            registros = json.load(f)
+    except FileNotFoundError:
+        return
+    grupos = {}
+    for r in registros:
+        grupos.setdefault(_mes_particao(r), []).append(r)
+    _gravar_particoes(grupos, {"formato": 1, "particoes": {}}, list(grupos))
+    os.replace(ARQUIVO, ARQUIVO + ".migrado")
+
+
+def _particoes_mudaram(manifesto):
+    """True se o manifesto ou alguma partição em memória não bate mais com o disco."""
+    if _dados_cache["registros"] is None:
+        return True
+    if _chave_ou_none(_caminho_particao(_MANIFESTO)) != _dados_cache["chave"]:
+        return True
+    for mes, info in (manifesto or {}).get("particoes", {}).items():
+        p = _particoes.get(mes)
+        if p is None or _chave_ou_none(_caminho_particao(info["arquivo"])) != p["chave"]:
+            return True
+    return False
+
+
+def _recarregar_particoes():
+    """Relê o manifesto e só as partições que mudaram no disco; remonta a lista em memória."""
+    chave = _chave_ou_none(_caminho_particao(_MANIFESTO))
+    if chave is None and os.path.exists(ARQUIVO):
+        _migrar_dados_json()
+        chave = _chave_ou_none(_caminho_particao(_MANIFESTO))
+    manifesto = _ler_manifesto() if chave is not None else None
+    meses = (manifesto or {}).get("particoes", {})
+    for mes in list(_particoes):
+        if mes not in meses:
+            del _particoes[mes]
+    for mes, info in meses.items():
+        caminho = _caminho_particao(info["arquivo"])
+        chave_p = _chave_ou_none(caminho)
+        p = _particoes.get(mes)
+        if p is not None and p["chave"] == chave_p:
+            continue
+        try:
+            lidos = ler_registros(caminho)
+        except FileNotFoundError:
+            lidos = []
+        lidos.sort(key=_id_ordem)
+        _particoes[mes] = {"chave": chave_p, "registros": lidos}
+    registros = [r for mes in sorted(_particoes) for r in _particoes[mes]["registros"]]
+    registros.sort(key=_id_ordem)
+    _particoes_sujas.clear()
+    versao = max((_versao_registro(r) for r in registros), default=0)
+    # geração nova: versões de antes da releitura não valem mais para os deltas
+    _dados_cache.update(chave=chave, registros=registros, manifesto=manifesto,
+                        versao=max(versao, _dados_cache["versao"]), geracao=secrets.token_hex(4))
+
+
+def carregar_registros():
+    """
+    Lista de registros em memória, montada a partir das partições mensais e relida do disco
+    só quando o manifesto ou uma partição muda (mtime/tamanho) — e, nesse caso, só a partição
+    que mudou. A lista é compartilhada entre as requisições e pode ser lida sem lock; para
+    alterar, com _dados_lock: copia_para_alterar(), registrar_alteracao() e salvar_registros().
+    """
+    with medir_fase("json_load"):
+        if _particoes_mudaram(_dados_cache["manifesto"]):
+            with _dados_lock:
+                recarregou = _particoes_mudaram(_dados_cache["manifesto"])
+                if recarregou:
+                    _recarregar_particoes()
+            if recarregou:
+                for callback in _ao_recarregar_registros:
+                    callback()
+        registros = _dados_cache["registros"]
+    ctx = contexto_requisicao()
+    if ctx is not None:
+        ctx["registros"] = len(registros)
+    return registros
+
+
+def carregar_particoes(meses):
+    """Registros só das partições `meses` ("AAAA-MM"), em ordem de id."""
+    carregar_registros()
+    with _dados_lock:
+        registros = [r for mes in meses if mes in _particoes for r in _particoes[mes]["registros"]]
+    registros.sort(key=_id_ordem)
+    ctx = contexto_requisicao()
+    if ctx is not None:
+        ctx["registros"] = len(registros)
+    return registros
+
+
+def meses_particoes():
+    carregar_registros()
+    return sorted(_particoes)
+
+
+def salvar_registros(registros):
+    """
+    Grava as partições marcadas em _particoes_sujas e passa a usar `registros` como a lista em
+    memória. As partições em memória já estão em dia (registrar_alteracao() põe cada registro na
+    do seu mês e _retirar_das_particoes() tira os arquivados), então o custo é o das partições
+    regravadas, não o do total de registros.
+    """
+    with _dados_lock:
+        with medir_fase("json_dump"):
+            manifesto = _dados_cache["manifesto"] or {"formato": 1, "particoes": {}}
+            sujas = set(_particoes_sujas)
+            grupos = {mes: _particoes[mes]["registros"] for mes in sujas if mes in _particoes}
+            try:
+                if sujas or _dados_cache["manifesto"] is None:
+                    manifesto = _gravar_particoes(grupos, manifesto, sujas)
+            except Exception:
+                # memória pode ter divergido do disco: força reler
+                _dados_cache["registros"] = None
+                _particoes.clear()
+                _particoes_sujas.clear()
+                raise
+            _particoes_sujas.clear()
+            for mes in sujas:
+                if grupos.get(mes):
+                    _particoes[mes]["chave"] = _chave_ou_none(_caminho_particao(manifesto["particoes"][mes]["arquivo"]))
+                else:
+                    _particoes.pop(mes, None)
+        ctx = contexto_requisicao()
+        if ctx is not None:
+            ctx["particoes_gravadas"] = len(sujas)
+        _dados_cache.update(chave=_chave_ou_none(_caminho_particao(_MANIFESTO)),
+                            registros=registros, manifesto=manifesto)
+
+
+def converter_particoes(formato):
+    """Regrava todas as partições no `formato`. Retorna a quantidade de partições gravadas."""
+    with _dados_lock:
+        registros = carregar_registros()
+        grupos = {}
+        for r in registros:
+            grupos.setdefault(_mes_particao(r), []).append(r)
+        manifesto = _dados_cache["manifesto"] or {"formato": 1, "particoes": {}}
+        meses = set(grupos) | set(manifesto["particoes"])
+        _gravar_particoes(grupos, manifesto, meses, formato)
+        # força reler do disco na próxima carga (e valida o que foi gravado)
+        _dados_cache["registros"] = None
+        _particoes.clear()
+        _particoes_sujas.clear()
+    return len(grupos)
+
+
+def copia_para_alterar(registro):
+    """
+    Cópia do registro (com oculto_meta e demais campos aninhados) para ser alterada e depois
+    publicada com registrar_alteracao(); o dict original continua intacto para quem o lê.
+    """
+    copia = dict(registro)
+    for campo, valor in copia.items():
+        if isinstance(valor, (dict, list)):
+            copia[campo] = copy.deepcopy(valor)
+    return copia
+
+
+def _posicao_na_particao(lista, registro):
+    """Índice do próprio dict `registro` na lista (em ordem de id) de uma partição, ou None."""
+    id_reg = _id_ordem(registro)
+    i = bisect.bisect_left(lista, id_reg, key=_id_ordem)
+    while i < len(lista) and _id_ordem(lista[i]) == id_reg:
+        if lista[i] is registro:
+            return i
+        i += 1
+    return None
+
+
+def _publicar_registro(registro):
+    """
+    Troca, na lista em memória, o registro de mesmo id por `registro` e o põe na partição do seu
+    mês (tirando o anterior da dele, se o mês mudou). Registro novo ou desarquivado só entra na
+    partição: quem chama o põe na lista.
+    """
+    registros = _dados_cache["registros"]
+    id_reg = _id_ordem(registro)
+    antigo = None
+    if registros:
+        i = bisect.bisect_left(registros, id_reg, key=_id_ordem)
+        if i < len(registros) and _id_ordem(registros[i]) == id_reg:
+            antigo = registros[i]
+            assert antigo is not registro, "registro publicado alterado no lugar: use copia_para_alterar()"
+            registros[i] = registro
+    mes = _mes_particao(registro)
+    if antigo is not None:
+        mes_antigo = _mes_particao(antigo)
+        _particoes_sujas.add(mes_antigo)   # troca de mês: a partição de antes também muda
+        particao = _particoes.get(mes_antigo)
+        j = _posicao_na_particao(particao["registros"], antigo) if particao is not None else None
+        if j is not None:
+            if mes_antigo == mes:
+                particao["registros"][j] = registro
+                return
+            del particao["registros"][j]
+    particao = _particoes.setdefault(mes, {"chave": None, "registros": []})
+    bisect.insort(particao["registros"], registro, key=_id_ordem)
+
+
+def _retirar_das_particoes(removidos):
+    """Tira das partições (e marca para regravar) registros que saem da lista em memória."""
+    por_mes = {}
+    for r in removidos:
+        por_mes.setdefault(_mes_particao(r), set()).add(id(r))
+    for mes, ids in por_mes.items():
+        particao = _particoes.get(mes)
+        if particao is not None:
+            particao["registros"] = [r for r in particao["registros"] if id(r) not in ids]
+        _particoes_sujas.add(mes)
+
+
+def registrar_alteracao(registro):
+    """
+    Dá ao registro (novo ou uma copia_para_alterar()) a próxima versão dos dados e o publica no
+    lugar do anterior de mesmo id. Toda criação/alteração de registro passa por aqui (com
+    _dados_lock), o que invalida os fragmentos de /lista em cache para ele.
+    """
+    with _dados_lock:
+        _dados_cache["versao"] += 1
+        registro["versao"] = _dados_cache["versao"]
+        _particoes_sujas.add(_mes_particao(registro))
+        for callback in _ao_alterar_registro:
+            callback(registro)
+        _publicar_registro(registro)
+    return registro["versao"]
+
+
+def versao_dados():
+    return _dados_cache["versao"]
+
+
+def geracao_dados():
+    """Muda sempre que alguma partição é relida do disco (início do servidor ou edição externa)."""
+    return _dados_cache["geracao"]
+
+
+def registros_alterados_desde(registros, versao):
+    """Registros criados/alterados depois de `versao`, em ordem de versão."""
+    alterados = []
+    for r in registros:
+        v = r.get("versao") or 0
+        if isinstance(v, int) and v > versao:
+            alterados.append(r)
+    alterados.sort(key=lambda r: r["versao"])
+    return alterados
+
+
+# ----------------------------- ARQUIVO FRIO (registros encerrados) -----------------------------
+_arquivo_cache = {}  # ano -> (chave do arquivo, lista de registros)
+_indice_arquivo_cache = {"chave": None, "indice": None}
+_ARQUIVO_INDICE = "indice.json"
+
+
+def _caminho_arquivo(nome):
+    return os.path.join(ARQUIVO_DIR, nome)
+
+
+def _nome_ano(ano):
+    return f"registros-{ano}.json.gz"
+
+
+def _ano_arquivo(r):
+    """Ano da partição do arquivo: ano de data_inicio (ou do cadastro); "sem_data" se não houver."""
+    dt = parse_br_datetime(r.get("data_inicio")) or parse_br_datetime((r.get("oculto_meta") or {}).get("registrado_em"))
+    return str(dt.year) if dt else "sem_data"
+
+
+def _ultima_atividade(r):
+    """Data mais recente do registro: início, retorno, cadastro, observações e edições."""
+    meta = r.get("oculto_meta") or {}
+    datas = [r.get("data_inicio"), r.get("data_retorno"), meta.get("registrado_em")]
+    datas += [ob.get("registrado_em") for ob in (r.get("observacoes") or []) if isinstance(ob, dict)]
+    datas.append(r.get("ultima_observacao_em"))
+    datas += [ed.get("registrado_em_snapshot") for ed in (meta.get("edicoes") or []) if isinstance(ed, dict)]
+    datas.append(meta.get("editado_em"))
+    ultima = None
+    for d in datas:
+        dt = parse_br_datetime(d)
+        if dt and (ultima is None or dt > ultima):
+            ultima = dt
+    return ultima
+
+
+def registro_arquivavel(r, limite):
+    """Encerrado (devolvido ou oculto) e sem nenhuma atividade depois de `limite`."""
+    if not (r.get("devolvido", False) or r.get("oculto", False)):
+        return False
+    ultima = _ultima_atividade(r)
+    return ultima is not None and ultima < limite
+
+
+def carregar_indice_arquivo():
+    """Índice do arquivo frio lido do disco (cópia própria: quem vai alterá-lo usa esta)."""
+    try:
+        with open(_caminho_arquivo(_ARQUIVO_INDICE), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"max_id": 0, "anos": {}}
+
+
+def _indice_arquivo_leitura():
+    """Índice do arquivo frio em cache até o arquivo mudar — só para leitura (proximo_id, buscas)."""
+    chave = _chave_ou_none(_caminho_arquivo(_ARQUIVO_INDICE))
+    if _indice_arquivo_cache["chave"] != chave or _indice_arquivo_cache["indice"] is None:
+        _indice_arquivo_cache.update(chave=chave, indice=carregar_indice_arquivo())
+    return _indice_arquivo_cache["indice"]
+
+
+def _gravar_atomico(caminho, dados_bytes):
+    tmp = caminho + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(dados_bytes)
+    os.replace(tmp, caminho)
+
+
+def _gravar_ano_arquivo(ano, registros, indice):
+    caminho = _caminho_arquivo(_nome_ano(ano))
+    if registros:
+        corpo = json.dumps(registros, ensure_ascii=False).encode("utf-8")
+        _gravar_atomico(caminho, gzip.compress(corpo, compresslevel=6))
+        ids = [int(r["id"]) for r in registros if str(r.get("id", "")).lstrip("-").isdigit()]
+        indice["anos"][ano] = {
+            "arquivo": _nome_ano(ano),
+            "registros": len(registros),
+            "ocultos": sum(1 for r in registros if r.get("oculto")),   # contagem da vista Legado
+            "id_min": min(ids) if ids else None,
+            "id_max": max(ids) if ids else None,
+            # para a linha do tempo: só abre o ano se o patrimônio estiver aqui
+            "patrimonios": sorted({_chave_patrimonio(r.get("patrimonio")) for r in registros} - {""}),
+        }
+        if ids:
+            indice["max_id"] = max(indice.get("max_id", 0), max(ids))
+    else:
+        if os.path.exists(caminho):
+            os.remove(caminho)
+        indice["anos"].pop(ano, None)
+    _arquivo_cache.pop(ano, None)
+
+
+def _gravar_indice_arquivo(indice):
+    indice["atualizado_em"] = sp_now_str()
+    corpo = json.dumps(indice, ensure_ascii=False, indent=2).encode("utf-8")
+    _gravar_atomico(_caminho_arquivo(_ARQUIVO_INDICE), corpo)
+
+
+def anos_arquivados():
+    return sorted(_indice_arquivo_leitura().get("anos", {}).keys())
+
+
+def carregar_ano_arquivo(ano):
+    """Registros arquivados de um ano (lidos sob demanda e mantidos em memória até o arquivo mudar)."""
+    caminho = _caminho_arquivo(_nome_ano(ano))
+    try:
+        chave = _chave_arquivo(caminho)
+    except FileNotFoundError:
+        return []
+    em_cache = _arquivo_cache.get(ano)
+    if em_cache and em_cache[0] == chave:
+        return em_cache[1]
+    with medir_fase("arquivo_load"):
+        with gzip.open(caminho, "rt", encoding="utf-8") as f:
+            registros = internar_registros(json.load(f))
+    _arquivo_cache[ano] = (chave, registros)
+    return registros
+
+
+def carregar_arquivo(anos=None):
+    """Registros arquivados dos `anos` pedidos (todos se None), em ordem de ano."""
+    arquivados = []
+    for ano in anos_arquivados():
+        if anos is None or ano in anos:
+            arquivados.extend(carregar_ano_arquivo(ano))
+    return arquivados
+
+
+def max_id_arquivado():
+    try:
+        return int(_indice_arquivo_leitura().get("max_id") or 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+def proximo_id(registros):
+    """Próximo id livre, considerando também os registros que já foram para o arquivo."""
+    maxid = max_id_arquivado()
+    for r in registros:
+        try:
+            if int(r.get("id", 0)) > maxid:
+                maxid = int(r.get("id", 0))
+        except:
+            pass
+    return maxid + 1
+
+
+def arquivar_registros(idade_dias=None):
+    """
+    Move para o arquivo frio os registros encerrados sem atividade há mais de `idade_dias`
+    (padrão ARQUIVAMENTO_IDADE_DIAS). Grava primeiro os anos do arquivo e o índice, depois as
+    partições sem eles. Retorna {ano: quantidade arquivada}.
+    """
+    if idade_dias is None:
+        idade_dias = ARQUIVAMENTO_IDADE_DIAS
+    limite = sp_now_naive() - datetime.timedelta(days=idade_dias)
+    with _dados_lock:
+        registros = carregar_registros()
+        por_ano = {}
+        restantes = []
+        for r in registros:
+            if registro_arquivavel(r, limite):
+                por_ano.setdefault(_ano_arquivo(r), []).append(r)
+            else:
+                restantes.append(r)
+        if not por_ano:
+            return {}
+        os.makedirs(ARQUIVO_DIR, exist_ok=True)
+        indice = carregar_indice_arquivo()
+        for ano, novos in por_ano.items():
+            ids_novos = {r.get("id") for r in novos}
+            existentes = [r for r in carregar_ano_arquivo(ano) if r.get("id") not in ids_novos]
+            _gravar_ano_arquivo(ano, existentes + novos, indice)
+        _gravar_indice_arquivo(indice)
+        _retirar_das_particoes([r for novos in por_ano.values() for r in novos])
+        salvar_registros(restantes)
+        _invalidar_linha_tempo()
+        _invalidar_prazos()
+        _invalidar_tabela()
+    return {ano: len(v) for ano, v in por_ano.items()}
+
+
+def buscar_arquivado(id_reg):
+    """(índice, ano, registros do ano, registro) do id no arquivo frio, ou None."""
+    indice = _indice_arquivo_leitura()
+    for ano, info in sorted(indice.get("anos", {}).items()):
+        id_min, id_max = info.get("id_min"), info.get("id_max")
+        if id_min is not None and not (id_min <= id_reg <= id_max):
+            continue
+        arquivados = carregar_ano_arquivo(ano)
+        for r in arquivados:
+            try:
+                if int(r.get("id", 0)) == id_reg:
+                    return indice, ano, arquivados, r
+            except:
+                pass
+    return None
+
+
+def desarquivar_registro(id_reg):
+    """
+    Traz de volta para as partições um registro arquivado (antes de uma ação sobre ele, como
+    restaurar ou adicionar observação). Retorna o registro ou None se não estiver no arquivo.
+    """
+    trazidos = desarquivar_registros([id_reg])
+    return trazidos[0] if trazidos else None
+
+
+def desarquivar_registros(ids):
+    """
+    Versão em lote: traz de volta todos os `ids` que estiverem no arquivo frio, com uma única
+    gravação das partições e cada ano do arquivo regravado uma vez. Retorna os registros trazidos.
+    """
+    ids = set(ids)
+    with _dados_lock:
+        indice = carregar_indice_arquivo()
+        por_ano = {}
+        for ano, info in sorted(indice.get("anos", {}).items()):
+            id_min, id_max = info.get("id_min"), info.get("id_max")
+            if id_min is not None and not any(id_min <= i <= id_max for i in ids):
+                continue
+            arquivados = carregar_ano_arquivo(ano)
+            achados = [r for r in arquivados if _id_ordem(r) in ids]
+            if achados:
+                por_ano[ano] = (arquivados, achados)
+        if not por_ano:
+            return []
+        registros = carregar_registros()
+        trazidos = []
+        for arquivados, achados in por_ano.values():
+            for r in achados:
+                r = copia_para_alterar(r)
+                registrar_alteracao(r)
+                trazidos.append(r)
+        # cada um volta na posição do seu id: a lista em memória (e cada partição) segue em ordem
+        # de id; a lista nova substitui a antiga, sem inserir no meio da que está sendo lida
+        trazidos.sort(key=_id_ordem)
+        salvar_registros(list(heapq.merge(registros, trazidos, key=_id_ordem)))
+        for ano, (arquivados, achados) in por_ano.items():
+            _gravar_ano_arquivo(ano, [r for r in arquivados if not any(r is a for a in achados)], indice)
+        _gravar_indice_arquivo(indice)
+    return trazidos
+
+
+def registros_com_arquivo(registros, anos=None):
+    """Arquivados (dos `anos`, ou todos) seguidos dos registros quentes, sem repetir ids."""
+    ids_quentes = {r.get("id") for r in registros}
+    arquivados = [r for r in carregar_arquivo(anos) if r.get("id") not in ids_quentes]
+    return arquivados + list(registros)
+
+
+# ----------------------------- LINHA DO TEMPO POR PATRIMÔNIO -----------------------------
+# Índice patrimônio -> registros quentes (em ordem de id), mantido por registrar_alteracao() e
+# refeito por inteiro só quando as partições são relidas do disco ou há arquivamento. No arquivo
+# frio, cada ano lista seus patrimônios no índice e o ano aberto ganha um mapa em memória.
+_linha_tempo = {"por_patrimonio": None, "patrimonio_de": {}}   # None = montar na próxima consulta
+_arquivo_por_patrimonio = {}   # ano -> (chave do arquivo, {patrimônio: [registros]})
+_RE_DEVOLVIDO_ID = re.compile(r"\(ID:\s*(\d+)\)")
+
+
+def _chave_patrimonio(valor):
+    return str(valor or "").strip()
+
+
+def _invalidar_linha_tempo():
+    with _dados_lock:
+        _linha_tempo["por_patrimonio"] = None
+        _linha_tempo["patrimonio_de"] = {}
+
+
+def _montar_linha_tempo():
+    por_patrimonio, patrimonio_de = {}, {}
+    for r in carregar_registros():
+        chave = _chave_patrimonio(r.get("patrimonio"))
+        patrimonio_de[_id_ordem(r)] = chave
+        if chave:
+            por_patrimonio.setdefault(chave, []).append(r)
+    for lista in por_patrimonio.values():
+        lista.sort(key=_id_ordem)
+    _linha_tempo.update(por_patrimonio=por_patrimonio, patrimonio_de=patrimonio_de)
+
+
+def _atualizar_linha_tempo(registro):
+    """A cada registrar_alteracao() (com _dados_lock): move o registro se o patrimônio mudou."""
+    por_patrimonio = _linha_tempo["por_patrimonio"]
+    if por_patrimonio is None:
+        return
+    id_reg = _id_ordem(registro)
+    chave = _chave_patrimonio(registro.get("patrimonio"))
+    anterior = _linha_tempo["patrimonio_de"].get(id_reg)
+    if anterior == chave:
+        lista = por_patrimonio.get(chave) if chave else None
+        if lista:
+            i = bisect.bisect_left(lista, id_reg, key=_id_ordem)
+            if i < len(lista) and _id_ordem(lista[i]) == id_reg:
+                lista[i] = registro   # mesma posição, dict novo (copy-on-write)
+        return
+    if anterior:
+        lista = [r for r in por_patrimonio.get(anterior, []) if _id_ordem(r) != id_reg]
+        if lista:
+            por_patrimonio[anterior] = lista
+        else:
+            por_patrimonio.pop(anterior, None)
+    if chave:
+        lista = por_patrimonio.setdefault(chave, [])
+        i = len(lista)
+        while i and _id_ordem(lista[i - 1]) > id_reg:   # quase sempre entra no fim
+            i -= 1
+        lista.insert(i, registro)
+    _linha_tempo["patrimonio_de"][id_reg] = chave
+
+
+def _arquivados_do_patrimonio(chave):
+    encontrados = []
+    for ano, info in sorted(_indice_arquivo_leitura().get("anos", {}).items()):
+        lista = info.get("patrimonios")
+        if lista is not None:
+            i = bisect.bisect_left(lista, chave)
+            if i == len(lista) or lista[i] != chave:
+                continue
+        registros = carregar_ano_arquivo(ano)
+        chave_ano = _arquivo_cache.get(ano, (None,))[0]
+        mapa = _arquivo_por_patrimonio.get(ano)
+        if mapa is None or mapa[0] != chave_ano:
+            por_pat = {}
+            for r in registros:
+                por_pat.setdefault(_chave_patrimonio(r.get("patrimonio")), []).append(r)
+            mapa = _arquivo_por_patrimonio[ano] = (chave_ano, por_pat)
+        encontrados += mapa[1].get(chave, [])
+    return encontrados
+
+
+def linha_do_tempo(patrimonio):
+    """Registros do patrimônio (quentes e arquivados), em ordem cronológica de data_inicio e id."""
+    chave = _chave_patrimonio(patrimonio)
+    if not chave:
+        return []
+    with _dados_lock:
+        if _linha_tempo["por_patrimonio"] is None:
+            _montar_linha_tempo()
+        quentes = list(_linha_tempo["por_patrimonio"].get(chave, ()))
+    ids = {_id_ordem(r) for r in quentes}
+    historico = [r for r in _arquivados_do_patrimonio(chave) if _id_ordem(r) not in ids] + quentes
+    historico.sort(key=lambda r: (parse_br_datetime(r.get("data_inicio")) or datetime.datetime.min, _id_ordem(r)))
+    return historico
+
+
+def situacao_patrimonio(historico, agora=None):
+    """Onde o equipamento está, pelo último movimento não excluído da linha do tempo (ou None)."""
+    ativos = [r for r in historico if not r.get("oculto")]
+    if not ativos:
+        return None
+    r = ativos[-1]
+    tipo, devolvido = r.get("tipo", ""), bool(r.get("devolvido"))
+    local = "TI"
+    if tipo == "emprestimo" and not devolvido:
+        dt_ret = parse_br_datetime(r.get("data_retorno"))
+        situacao = "atrasado" if dt_ret and dt_ret < (agora or sp_now_naive()) else "emprestado"
+        local = r.get("emprestado_para", "")
+    elif tipo == "entrada" and not devolvido:
+        situacao = "em_estoque" if r.get("estoque") else "na_ti"
+    elif (tipo == "saida" and not devolvido) or (tipo == "entrada" and devolvido):
+        situacao = "fora"
+        local = r.get("origem", "")
+    else:
+        situacao = "na_ti"   # empréstimo devolvido / saída que voltou
+    return {"situacao": situacao, "local": local, "status": calcular_status(r, agora), "registro": r.get("id"),
+            "desde": r.get("data_inicio", ""), "responsavel": r.get("responsavel", "")}
+
+
+def resumo_linha_tempo(historico):
+    """Itens compactos do histórico, com o vínculo dos retornos (retorno_de ou status_extra legado)."""
+    retorno_de = {}
+    for r in historico:
+        m = _RE_DEVOLVIDO_ID.search(r.get("status_extra") or "")
+        if m:
+            retorno_de[int(m.group(1))] = r.get("id")
+    itens = []
+    for r in historico:
+        item = {k: r.get(k) or "" for k in ("tipo", "data_inicio", "responsavel", "origem", "workflow", "motivo")}
+        item["id"] = r.get("id")
+        if r.get("tipo") == "emprestimo":
+            item["emprestado_para"] = r.get("emprestado_para", "")
+            item["data_retorno"] = r.get("data_retorno", "")
+        item["status"] = calcular_status(r)
+        if r.get("oculto"):
+            item["oculto"] = True
+        origem = r.get("retorno_de", retorno_de.get(_id_ordem(r)))
+        if origem is not None:
+            item["retorno_de"] = origem
+        itens.append(item)
+    return itens
+
+
+_ao_alterar_registro.append(_atualizar_linha_tempo)
+
+
+# ----------------------------- ESTATÍSTICAS (contadores materializados) -----------------------------
+# Cada registro contribui com uma "assinatura" (empréstimo ativo e data de retorno, estoque, dia
+# do movimento, valores das dimensões, duração do empréstimo encerrado). A cada alteração sai a
+# assinatura antiga e entra a nova: os contadores nunca são recalculados varrendo os registros.
+# Séries por dia/semana ficam em buffers circulares de tamanho fixo (o bucket de um dia que saiu
+# da janela é reaproveitado). Arquivar não muda nada: registros arquivados continuam contando.
+ESTATISTICAS_DIAS = 90
+ESTATISTICAS_SEMANAS = 104
+_DIMENSOES = ("tipo", "hardware", "motivo", "responsavel")
+_estatisticas = {"assinaturas": None, "montando": False}   # assinaturas None = montar na próxima consulta
+
+
+def _assinatura(r):
+    """Contribuição do registro para as estatísticas (None para excluídos)."""
+    if r.get("oculto"):
+        return None
+    tipo = r.get("tipo", "") or ""
+    devolvido = bool(r.get("devolvido"))
+    inicio = parse_br_datetime(r.get("data_inicio"))
+    ativo = tipo == "emprestimo" and not devolvido
+    retorno = parse_br_datetime(r.get("data_retorno")) if ativo else None
+    duracao = None
+    if tipo == "emprestimo" and devolvido and inicio:
+        fim = parse_br_datetime(r.get("devolvido_em")) or parse_br_datetime(r.get("data_retorno"))
+        if fim and fim >= inicio:
+            duracao = (fim - inicio).total_seconds()
+    return (ativo, retorno, tipo == "entrada" and bool(r.get("estoque")) and not devolvido,
+            inicio.toordinal() if inicio else None,
+            tuple(str(r.get(d, "") or "") for d in _DIMENSOES), duracao)
+
+
+class SerieCircular:
+    """`tamanho` buckets de contagem por período (dia ou semana), indexados por período % tamanho."""
+
+    def __init__(self, tamanho):
+        self.tamanho = tamanho
+        self.periodos = [None] * tamanho
+        self.buckets = [None] * tamanho
+
+    def somar(self, periodo, valores, sinal, atual):
+        """Soma no bucket do período; False se ele está fora da janela que termina em `atual`."""
+        if periodo > atual or periodo <= atual - self.tamanho:
+            return False
+        i = periodo % self.tamanho
+        if self.periodos[i] != periodo:
+            if sinal < 0:
+                return False   # o bucket já foi reaproveitado por um período mais novo
+            self.periodos[i] = periodo
+            self.buckets[i] = {"total": 0, **{d: collections.Counter() for d in _DIMENSOES}}
+        b = self.buckets[i]
+        b["total"] += sinal
+        for d, v in zip(_DIMENSOES, valores):
+            b[d][v] += sinal
+            if b[d][v] <= 0:
+                del b[d][v]
+        return True
+
+    def janela(self, ate, quantidade):
+        """[(período, bucket ou None)] dos `quantidade` períodos terminando em `ate`."""
+        saida = []
+        for periodo in range(ate - min(quantidade, self.tamanho) + 1, ate + 1):
+            i = periodo % self.tamanho
+            saida.append((periodo, self.buckets[i] if self.periodos[i] == periodo else None))
+        return saida
+
+
+def _aplicar_assinatura(a, sinal, series=None):
+    """
+    Soma (sinal 1) ou subtrai (-1) a assinatura. Retorna em quais séries (dia, semana) ela
+    entrou; na subtração, `series` é esse retorno guardado — só sai de onde entrou.
+    """
+    e = _estatisticas
+    if a is None:
+        return (False, False)
+    ativo, retorno, estoque, dia, valores, duracao = a
+    e["registros"] += sinal
+    if ativo:
+        e["emprestimos_ativos"] += sinal
+        if retorno is not None:
+            if sinal > 0 and e["montando"]:
+                e["retornos"].append(retorno)   # ordenada uma vez no fim da montagem
+            elif sinal > 0:
+                bisect.insort(e["retornos"], retorno)
+            else:
+                i = bisect.bisect_left(e["retornos"], retorno)
+                if i < len(e["retornos"]) and e["retornos"][i] == retorno:
+                    del e["retornos"][i]
+    if estoque:
+        e["em_estoque"] += sinal
+    for d, v in zip(_DIMENSOES, valores):
+        e["totais"][d][v] += sinal
+        if e["totais"][d][v] <= 0:
+            del e["totais"][d][v]
+    if duracao is not None:
+        e["duracao_soma"] += sinal * duracao
+        e["duracao_qtd"] += sinal
+    if dia is None:
+        return (False, False)
+    hoje = sp_now_naive().toordinal()
+    em_dia, em_semana = series if series is not None else (True, True)
+    return (em_dia and e["por_dia"].somar(dia, valores, sinal, hoje),
+            em_semana and e["por_semana"].somar((dia - 1) // 7, valores, sinal, (hoje - 1) // 7))
+
+
+def _montar_estatisticas():
+    # carregar antes: uma releitura do disco aqui dispara _invalidar_estatisticas()
+    quentes, arquivados = carregar_registros(), carregar_arquivo()
+    _estatisticas.update(
+        assinaturas={}, registros=0, emprestimos_ativos=0, em_estoque=0, retornos=[],
+        totais={d: collections.Counter() for d in _DIMENSOES},
+        por_dia=SerieCircular(ESTATISTICAS_DIAS), por_semana=SerieCircular(ESTATISTICAS_SEMANAS),
+        duracao_soma=0.0, duracao_qtd=0, montando=True)
+    vistos = set()
+    for r in itertools.chain(quentes, arquivados):
+        id_reg = _id_ordem(r)
+        if id_reg in vistos:
+            continue   # quente e arquivado ao mesmo tempo (queda no meio de um desarquivamento)
+        vistos.add(id_reg)
+        a = _assinatura(r)
+        _estatisticas["assinaturas"][id_reg] = (a, _aplicar_assinatura(a, 1))
+    _estatisticas["retornos"].sort()
+    _estatisticas["montando"] = False
+
+
+def _atualizar_estatisticas(registro):
+    """A cada registrar_alteracao() (com _dados_lock): troca a assinatura antiga pela nova."""
+    assinaturas = _estatisticas["assinaturas"]
+    if assinaturas is None:
+        return
+    id_reg = _id_ordem(registro)
+    nova = _assinatura(registro)
+    antiga, series = assinaturas.get(id_reg, (None, None))
+    if antiga == nova:
+        return
+    _aplicar_assinatura(antiga, -1, series)
+    assinaturas[id_reg] = (nova, _aplicar_assinatura(nova, 1))
+
+
+def _invalidar_estatisticas():
+    with _dados_lock:
+        _estatisticas["assinaturas"] = None
+
+
+def _serie_json(serie, ate, quantidade, rotulo):
+    itens = []
+    for periodo, b in serie.janela(ate, quantidade):
+        item = {"periodo": rotulo(periodo), "total": b["total"] if b else 0}
+        for d in _DIMENSOES:
+            item[d] = dict(b[d]) if b else {}
+        itens.append(item)
+    return itens
+
+
+def estatisticas(dias=30, semanas=12):
+    """Painel: contadores atuais, totais por dimensão e séries dos últimos `dias`/`semanas`."""
+    agora = sp_now_naive()
+    hoje = agora.toordinal()
+    with _dados_lock:
+        if _estatisticas["assinaturas"] is None:
+            _montar_estatisticas()
+        e = _estatisticas
+        qtd = e["duracao_qtd"]
+        return {
+            "versao": versao_dados(),
+            "registros": e["registros"],
+            "emprestimos_ativos": e["emprestimos_ativos"],
+            "emprestimos_atrasados": bisect.bisect_right(e["retornos"], agora),
+            "em_estoque": e["em_estoque"],
+            "duracao_media_emprestimo_dias": round(e["duracao_soma"] / qtd / 86400, 1) if qtd else None,
+            "emprestimos_encerrados": qtd,
+            "totais": {d: dict(e["totais"][d].most_common()) for d in _DIMENSOES},
+            "por_dia": _serie_json(e["por_dia"], hoje, dias,
+                                   lambda p: datetime.date.fromordinal(p).strftime("%d/%m/%Y")),
+            "por_semana": _serie_json(e["por_semana"], (hoje - 1) // 7, semanas,
+                                      lambda p: datetime.date.fromordinal(p * 7 + 1).strftime("%d/%m/%Y")),
+        }
+
+
+_ao_alterar_registro.append(_atualizar_estatisticas)
+
+
+# ----------------------------- TABELA COLUNAR (campos categóricos) -----------------------------
+# Campos escolhidos de listas (tipo/hardware/motivo/responsável) têm poucos valores distintos. Ao
+# carregar, cada valor repetido passa a ser o mesmo objeto str em todos os registros
+# (internar_registros). Para varreduras, a TabelaRegistros guarda os registros quentes em colunas:
+# categóricos como códigos de dicionário (array "I"), datas como segundos desde a época (array "q")
+# e os booleanos como bytes; o dict de uma linha só é montado quando pedido. É uma estrutura a
+# mais, ao lado dos dicts: os registros continuam sendo a fonte e a memória que eles ocupam; a
+# tabela é mantida por registrar_alteracao() e refeita quando alguma partição é relida do disco.
+CAMPOS_CATEGORICOS = ("tipo", "hardware", "motivo", "responsavel", "marca", "origem")
+CAMPOS_INTERNADOS = ("tipo", "hardware", "motivo", "responsavel")   # texto livre (marca, origem...) fica de fora
+INTERNAR_MAX_VALORES = 1024   # valores distintos guardados por campo; além disso os novos não são internados
+CAMPOS_DATA_COLUNA = ("data_inicio", "data_retorno")
+CAMPOS_BOOL_COLUNA = ("devolvido", "estoque", "oculto")
+SEM_DATA = -(1 << 62)      # data ausente/inválida numa coluna de datas
+_ORDINAL_EPOCA = datetime.date(1970, 1, 1).toordinal()
+_strings_internadas = {campo: {} for campo in CAMPOS_INTERNADOS}   # campo -> {valor: str compartilhado}
+
+
+def internar_registros(registros):
+    """Troca os valores categóricos de cada registro pelo objeto str compartilhado. Retorna a lista."""
+    for campo in CAMPOS_INTERNADOS:
+        valores = _strings_internadas[campo]
+        for r in registros:
+            v = r.get(campo)
+            if v.__class__ is not str:
+                continue
+            c = valores.get(v)
+            if c is not None:
+                r[campo] = c
+            elif len(valores) < INTERNAR_MAX_VALORES:
+                valores[v] = v
+    return registros
+
+
+@functools.lru_cache(maxsize=65536)
+def _dia_epoca(dia):
+    """"DD/MM/AAAA" -> dias desde 01/01/1970 (muitos registros caem no mesmo dia)."""
+    return datetime.date(int(dia[6:10]), int(dia[3:5]), int(dia[0:2])).toordinal() - _ORDINAL_EPOCA
+
+
+def segundos_epoca(valor):
+    """Data BR (str ou datetime) em segundos desde 01/01/1970 (SEM_DATA se vazia/inválida)."""
+    if isinstance(valor, datetime.datetime):
+        dt = valor
+    elif not isinstance(valor, str) or not valor:
+        return SEM_DATA
+    else:
+        valor = valor.strip()
+        m = _RE_DATA_HORA_BR.fullmatch(valor)
+        if m:
+            hora, minuto, segundo = int(m.group(4)), int(m.group(5)), int(m.group(6) or 0)
+            if hora < 24 and minuto < 60 and segundo < 60:
+                try:
+                    return _dia_epoca(valor[:10]) * 86400 + hora * 3600 + minuto * 60 + segundo
+                except ValueError:
+                    return SEM_DATA
+        dt = parse_br_datetime(valor)
+        if dt is None:
+            return SEM_DATA
+    return (dt.toordinal() - _ORDINAL_EPOCA) * 86400 + dt.hour * 3600 + dt.minute * 60 + dt.second
+
+
+def data_de_segundos(segundos):
+    if segundos == SEM_DATA:
+        return None
+    return datetime.datetime(1970, 1, 1) + datetime.timedelta(seconds=segundos)
+
+
+def _texto_categorico(valor):
+    return valor if isinstance(valor, str) else str(valor)
+
+
+class ColunaCategorica:
+    """
+    Coluna codificada por dicionário: valores[codigo] -> str (código 0 = vazio). O valor é o
+    str() do campo, como os filtros por registro sempre viram: None vira "None" e campo
+    ausente, "".
+    """
+
+    def __init__(self):
+        self.valores = [""]
+        self.codigos = {"": 0}
+        self.coluna = array.array("I")
+
+    def codigo(self, valor):
+        if valor == "":
+            return 0
+        valor = str(valor)
+        c = self.codigos.get(valor)
+        if c is None:
+            c = self.codigos[valor] = len(self.valores)
+            self.valores.append(valor)
+        return c
+
+    def codigos_onde(self, predicado):
+        """Códigos cujos valores satisfazem `predicado` (avaliado uma vez por valor distinto)."""
+        return {c for c, v in enumerate(self.valores) if predicado(v)}
+
+
+class TabelaRegistros:
+    """Registros quentes em colunas; `registros[i]` é o dict (fonte) da linha i."""
+
+    def __init__(self, registros=()):
+        # montagem coluna a coluna: bem mais rápida que gravar() registro a registro
+        self.registros = list(registros)
+        self.ids = array.array("q", map(_id_ordem, self.registros))
+        self.em_ordem = all(a < b for a, b in zip(self.ids, self.ids[1:]))   # linhas em ordem de id
+        self.linha_do_id = {id_reg: i for i, id_reg in enumerate(self.ids)}
+        self.categoricos = {}
+        for campo in CAMPOS_CATEGORICOS:
+            col = self.categoricos[campo] = ColunaCategorica()
+            valores = [r.get(campo, "") for r in self.registros]
+            try:
+                codigos = {v: col.codigo(v) for v in set(valores)}
+                col.coluna = array.array("I", map(codigos.__getitem__, valores))
+            except TypeError:   # valor não hashable vindo do JSON
+                col.coluna = array.array("I", map(col.codigo, map(_texto_categorico, valores)))
+        self.datas = {campo: array.array("q", [segundos_epoca(r.get(campo)) for r in self.registros])
+                      for campo in CAMPOS_DATA_COLUNA}
+        self.booleanos = {campo: bytearray([1 if r.get(campo) else 0 for r in self.registros])
+                          for campo in CAMPOS_BOOL_COLUNA}
+        # bitmaps de ids por estado (vistas do /lista), mantidos junto com as colunas
+        self.bitmaps = {campo: BitmapRoaring(itertools.compress(self.ids, col))
+                        for campo, col in self.booleanos.items()}
+        self.bitmaps["todos"] = BitmapRoaring(self.ids)
+
+    def __len__(self):
+        return len(self.registros)
+
+    def gravar(self, r):
+        """Acrescenta o registro ou, se o id já tem linha, reescreve a linha. Retorna o índice."""
+        id_reg = _id_ordem(r)
+        i = self.linha_do_id.get(id_reg)
+        if i is None:
+            i = len(self.registros)
+            if i and id_reg < self.ids[-1]:
+                self.em_ordem = False   # desarquivado: volta com um id antigo
+            self.linha_do_id[id_reg] = i
+            self.registros.append(r)
+            self.ids.append(id_reg)
+            for campo, col in self.categoricos.items():
+                col.coluna.append(col.codigo(r.get(campo, "")))
+            for campo, col in self.datas.items():
+                col.append(segundos_epoca(r.get(campo)))
+            for campo, col in self.booleanos.items():
+                col.append(1 if r.get(campo) else 0)
+                self.bitmaps[campo].definir(id_reg, col[i])
+            self.bitmaps["todos"].add(id_reg)
+            return i
+        self.registros[i] = r
+        for campo, col in self.categoricos.items():
+            col.coluna[i] = col.codigo(r.get(campo, ""))
+        for campo, col in self.datas.items():
+            col[i] = segundos_epoca(r.get(campo))
+        for campo, col in self.booleanos.items():
+            col[i] = 1 if r.get(campo) else 0
+            self.bitmaps[campo].definir(id_reg, col[i])
+        return i
+
+    def linha(self, i):
+        """Dict só com os campos colunares da linha i, montado na hora."""
+        d = {"id": self.ids[i]}
+        for campo, col in self.categoricos.items():
+            d[campo] = col.valores[col.coluna[i]]
+        for campo, col in self.datas.items():
+            d[campo] = data_de_segundos(col[i])
+        for campo, col in self.booleanos.items():
+            d[campo] = bool(col[i])
+        return d
+
+    def bytes_colunas(self):
+        """Memória das colunas (sem os dicts de origem), para diagnóstico."""
+        total = self.ids.itemsize * len(self.ids)
+        for col in self.categoricos.values():
+            total += col.coluna.itemsize * len(col.coluna)
+        for col in self.datas.values():
+            total += col.itemsize * len(col)
+        return total + sum(len(col) for col in self.booleanos.values())
+
+
+_tabela = {"tabela": None}
+
+
+def tabela_registros():
+    """Tabela colunar dos registros quentes (montada na primeira vez e mantida a cada alteração)."""
+    registros = carregar_registros()   # antes: uma releitura aqui dispara _invalidar_tabela()
+    with _dados_lock:
+        if _tabela["tabela"] is None:
+            _tabela["tabela"] = TabelaRegistros(registros)
+        return _tabela["tabela"]
+
+
+def _atualizar_tabela(registro):
+    """A cada registrar_alteracao() (com _dados_lock): reescreve/acrescenta a linha do registro."""
+    internar_registros((registro,))
+    tabela = _tabela["tabela"]
+    if tabela is not None:
+        tabela.gravar(registro)
+
+
+def _invalidar_tabela():
+    with _dados_lock:
+        _tabela["tabela"] = None
+        for valores in _strings_internadas.values():
+            valores.clear()   # recomeça com os valores das partições relidas
+
+
+_ao_alterar_registro.append(_atualizar_tabela)
+
+
+# ----------------------------- MÁSCARAS (filtros vetorizados sobre a tabela colunar) -----------------------------
+# Um filtro vira uma máscara de linhas da TabelaRegistros, e as máscaras se combinam com & e |.
+# Com NumPy instalado, a máscara é um vetor bool e as comparações rodam sobre as colunas inteiras;
+# sem ele, é um int em que o byte i (little-endian) vale 1 se a linha i entra — as colunas de bytes
+# viram máscara direto e os códigos categóricos passam por bytes.translate, tudo em C.
+try:
+    import numpy
+except ImportError:   # opcional
+    numpy = None
+
+_TIPO_NUMPY_CODIGO = {1: "uint8", 2: "uint16", 4: "uint32", 8: "uint64"}
+
+
+class Mascaras:
+    """Construtor de máscaras para uma TabelaRegistros (usar com _dados_lock: as colunas não podem mudar)."""
+
+    def __init__(self, tabela):
+        self.tabela = tabela
+        self.n = len(tabela)
+        self._uns = None
+
+    def todas(self):
+        if numpy is not None:
+            return numpy.ones(self.n, dtype=bool)
+        if self._uns is None:
+            self._uns = int.from_bytes(b"\x01" * self.n, "little")
+        return self._uns
+
+    def nenhuma(self):
+        return numpy.zeros(self.n, dtype=bool) if numpy is not None else 0
+
+    def categorico(self, campo, predicado):
+        """Linhas cujo valor categórico satisfaz `predicado` (avaliado uma vez por valor distinto)."""
+        col = self.tabela.categoricos[campo]
+        codigos = col.codigos_onde(predicado)
+        if not codigos:
+            return self.nenhuma()
+        if numpy is not None:
+            arr = numpy.frombuffer(col.coluna, dtype=_TIPO_NUMPY_CODIGO[col.coluna.itemsize])
+            return numpy.isin(arr, numpy.fromiter(codigos, dtype=arr.dtype))
+        tamanho = col.coluna.itemsize
+        bruto = col.coluna.tobytes()
+        if sys.byteorder != "little":
+            col_le = array.array(col.coluna.typecode, col.coluna)
+            col_le.byteswap()
+            bruto = col_le.tobytes()
+        planos = [bruto[k::tamanho] for k in range(tamanho)]
+        # byte k de cada código: as linhas cujo byte k está em `bytes_k` entram (planos 1+ quase
+        # sempre são zero, então costuma bastar um translate por plano)
+        alvos = {}
+        for c in codigos:
+            alvos.setdefault(c >> 8, set()).add(c & 0xFF)
+        m = 0
+        for alto, baixos in alvos.items():
+            parcial = self._plano(planos[0], baixos)
+            for k in range(1, tamanho):
+                parcial &= self._plano(planos[k], {(alto >> (8 * (k - 1))) & 0xFF})
+            m |= parcial
+        return m
+
+    @staticmethod
+    def _plano(plano, valores):
+        tabela = bytearray(256)
+        for v in valores:
+            tabela[v] = 1
+        return int.from_bytes(plano.translate(tabela), "little")
+
+    def faixa(self, campo, de=None, ate=None):
+        """Linhas com a data (segundos desde 1970) do campo em [de, ate]; sem data nunca entra."""
+        col = self.tabela.datas[campo]
+        de = SEM_DATA + 1 if de is None else de
+        ate = (1 << 62) if ate is None else ate
+        if numpy is not None:
+            arr = numpy.frombuffer(col, dtype=numpy.int64)
+            return (arr >= de) & (arr <= ate)
+        return int.from_bytes(bytes([de <= v <= ate for v in col]), "little")
+
+    def linhas(self, indices):
+        """Máscara com exatamente as linhas `indices`."""
+        if numpy is not None:
+            m = numpy.zeros(self.n, dtype=bool)
+            m[list(indices)] = True
+            return m
+        b = bytearray(self.n)
+        for i in indices:
+            b[i] = 1
+        return int.from_bytes(b, "little")
+
+    def indices(self, m):
+        """Linhas selecionadas, em ordem."""
+        if numpy is not None:
+            return numpy.flatnonzero(m).tolist()
+        return list(itertools.compress(range(self.n), m.to_bytes(self.n, "little")))
+
+    def contar(self, m):
+        if numpy is not None:
+            return int(numpy.count_nonzero(m))
+        return m.to_bytes(self.n, "little").count(1)
+
+
+# ----------------------------- BITMAPS (índices das vistas do /lista) -----------------------------
+# Cada estado booleano dos registros quentes (devolvido, estoque, oculto, e "todos") tem um bitmap
+# de ids comprimido no estilo Roaring, mantido pela TabelaRegistros a cada alteração. As vistas
+# do seletor são interseções/diferenças desses bitmaps e as contagens, somas de cardinalidades.
+_LIMITE_ARRAY = 4096          # acima disso o bloco vira bitmap (8 KiB ocupam menos que o array)
+_BYTES_BLOCO = 8192           # 2^16 bits
+_popcount = getattr(int, "bit_count", None) or (lambda x: bin(x).count("1"))
+# _BIT_DO_BYTE[k]: tabela de translate que leva cada byte ao seu bit k (0/1)
+_BIT_DO_BYTE = [bytes((v >> k) & 1 for v in range(256)) for k in range(8)]
+
+
+def _bloco_bitmap(baixos):
+    b = bytearray(_BYTES_BLOCO)
+    for x in baixos:
+        b[x >> 3] |= 1 << (x & 7)
+    return b
+
+
+def _bytes_por_bit(b):
+    """Bitmap de 8 KiB -> 65536 bytes 0/1 (um por bit), com translate e fatias (em C)."""
+    expandido = bytearray(8 * len(b))
+    for k in range(8):
+        expandido[k::8] = b.translate(_BIT_DO_BYTE[k])
+    return expandido
+
+
+def _baixos(bloco):
+    """Valores (16 bits de baixo) de um bloco, em ordem."""
+    if isinstance(bloco, array.array):
+        return bloco
+    return array.array("H", itertools.compress(range(65536), _bytes_por_bit(bloco)))
+
+
+def _normalizar_bloco(bloco, card):
+    """Escolhe a representação pela cardinalidade (None = bloco vazio)."""
+    if card == 0:
+        return None
+    if isinstance(bloco, array.array):
+        return bloco if card <= _LIMITE_ARRAY else _bloco_bitmap(bloco)
+    return bloco if card > _LIMITE_ARRAY else _baixos(bloco)
+
+
+class BitmapRoaring:
+    """
+    Conjunto de inteiros não negativos em blocos de 2^16 (chave = valor >> 16). Cada bloco é
+    um array("H") ordenado enquanto tem até 4096 valores e um bitmap (bytearray de 8 KiB)
+    acima disso. &, | e - trabalham bloco a bloco; len() soma as cardinalidades guardadas.
+    """
+
+    def __init__(self, valores=()):
+        self.blocos = {}
+        self.cards = {}
+        grupos = {}
+        for v in valores:
+            grupos.setdefault(v >> 16, []).append(v & 0xFFFF)
+        for chave, baixos in grupos.items():
+            baixos = sorted(set(baixos))
+            self._guardar(chave, array.array("H", baixos), len(baixos))
+
+    def _guardar(self, chave, bloco, card):
+        bloco = _normalizar_bloco(bloco, card)
+        if bloco is None:
+            self.blocos.pop(chave, None)
+            self.cards.pop(chave, None)
+        else:
+            self.blocos[chave] = bloco
+            self.cards[chave] = card
+
+    def __len__(self):
+        return sum(self.cards.values())
+
+    def __contains__(self, v):
+        bloco = self.blocos.get(v >> 16)
+        if bloco is None:
+            return False
+        x = v & 0xFFFF
+        if isinstance(bloco, array.array):
+            i = bisect.bisect_left(bloco, x)
+            return i < len(bloco) and bloco[i] == x
+        return bool(bloco[x >> 3] >> (x & 7) & 1)
+
+    def __iter__(self):
+        for chave in sorted(self.blocos):
+            base = chave << 16
+            for x in _baixos(self.blocos[chave]):
+                yield base | x
+
+    def add(self, v):
+        chave, x = v >> 16, v & 0xFFFF
+        bloco = self.blocos.get(chave)
+        if bloco is None:
+            self._guardar(chave, array.array("H", (x,)), 1)
+        elif isinstance(bloco, array.array):
+            i = bisect.bisect_left(bloco, x)
+            if i == len(bloco) or bloco[i] != x:
+                bloco.insert(i, x)
+                self._guardar(chave, bloco, self.cards[chave] + 1)
+        elif not bloco[x >> 3] >> (x & 7) & 1:
+            bloco[x >> 3] |= 1 << (x & 7)
+            self.cards[chave] += 1
+
+    def discard(self, v):
+        chave, x = v >> 16, v & 0xFFFF
+        bloco = self.blocos.get(chave)
+        if bloco is None:
+            return
+        if isinstance(bloco, array.array):
+            i = bisect.bisect_left(bloco, x)
+            if i < len(bloco) and bloco[i] == x:
+                del bloco[i]
+                self._guardar(chave, bloco, self.cards[chave] - 1)
+        elif bloco[x >> 3] >> (x & 7) & 1:
+            bloco[x >> 3] &= ~(1 << (x & 7)) & 0xFF
+            self._guardar(chave, bloco, self.cards[chave] - 1)
+
+    def definir(self, v, presente):
+        (self.add if presente else self.discard)(v)
+
+    @staticmethod
+    def _combinar(a, b, operacao):
+        """Combina dois blocos: operacao em "e", "ou", "menos". Retorna (bloco, cardinalidade)."""
+        if isinstance(a, array.array) and isinstance(b, array.array):
+            if operacao == "e":
+                r = sorted(set(a).intersection(b))
+            elif operacao == "ou":
+                r = sorted(set(a).union(b))
+            else:
+                r = sorted(set(a).difference(b))
+            return array.array("H", r), len(r)
+        if operacao != "ou" and isinstance(a, array.array):
+            # array contra bitmap: testa bit a bit só os valores do array
+            dentro = [x for x in a if b[x >> 3] >> (x & 7) & 1]
+            r = dentro if operacao == "e" else sorted(set(a).difference(dentro))
+            return array.array("H", r), len(r)
+        if operacao == "e" and isinstance(b, array.array):
+            return BitmapRoaring._combinar(b, a, "e")
+        ia = int.from_bytes(a if not isinstance(a, array.array) else _bloco_bitmap(a), "little")
+        ib = int.from_bytes(b if not isinstance(b, array.array) else _bloco_bitmap(b), "little")
+        r = ia & ib if operacao == "e" else (ia | ib if operacao == "ou" else ia & ~ib)
+        return bytearray(r.to_bytes(_BYTES_BLOCO, "little")), _popcount(r)
+
+    def _operar(self, outro, operacao):
+        resultado = BitmapRoaring()
+        if operacao == "e":
+            chaves = self.blocos.keys() & outro.blocos.keys()
+        elif operacao == "ou":
+            chaves = self.blocos.keys() | outro.blocos.keys()
+        else:
+            chaves = self.blocos.keys()
+        for chave in chaves:
+            a, b = self.blocos.get(chave), outro.blocos.get(chave)
+            if b is None:
+                bloco, card = a[:], self.cards[chave]   # cópias: o resultado não compartilha blocos
+            elif a is None:
+                bloco, card = b[:], outro.cards[chave]
+            else:
+                bloco, card = self._combinar(a, b, operacao)
+            resultado._guardar(chave, bloco, card)
+        return resultado
+
+    def __and__(self, outro):
+        return self._operar(outro, "e")
+
+    def __or__(self, outro):
+        return self._operar(outro, "ou")
+
+    def __sub__(self, outro):
+        return self._operar(outro, "menos")
+
+
+def bitmap_pendencias(registros):
+    """Ids com atraso/pendência (data-pendencia de /lista), a partir do índice de prazos."""
+    atrasos_ids, pendencias_ids = calcular_ids_atraso_pendencia(registros)
+    return BitmapRoaring(int(x) for x in atrasos_ids | pendencias_ids if x.isdigit())
+
+
+def bitmap_vista(tabela, vista, pendencias=None):
+    """Ids quentes de uma vista do seletor (mesmas regras do lista.js), pelos bitmaps da tabela."""
+    b = tabela.bitmaps
+    if vista == "ativos":
+        return b["todos"] - b["devolvido"] - b["oculto"]
+    if vista == "inativos":
+        return b["devolvido"] | b["estoque"]
+    if vista == "estoque":
+        return b["estoque"]
+    if vista == "pendentes":
+        return pendencias if pendencias is not None else bitmap_pendencias(tabela.registros)
+    if vista == "legado":
+        return b["todos"] - b["oculto"]
+    return b["todos"]
+
+
+def registros_da_vista(vista):
+    """Registros quentes da vista, em ordem de id."""
+    tabela = tabela_registros()
+    with _dados_lock:
+        linha_do_id = tabela.linha_do_id
+        return [tabela.registros[linha_do_id[i]] for i in bitmap_vista(tabela, vista) if i in linha_do_id]
+
+
+_contagens_vistas = {"chave": None, "contagens": None}
+
+
+def contagens_vistas():
+    """
+    Quantos registros cada vista mostra. Quentes: cardinalidade dos bitmaps; tudo/legado somam
+    o arquivo frio pelas contagens do índice (sem abrir os arquivos). Fica em cache até a
+    geração/versão dos dados (que também sobe quando um prazo vira) ou o índice do arquivo mudar.
+    """
+    tabela = tabela_registros()
+    # chave do índice lida antes dele: se mudar no meio, a chave fica velha e a próxima chamada refaz
+    chave_arquivo = _chave_ou_none(_caminho_arquivo(_ARQUIVO_INDICE))
+    anos = (_indice_arquivo_leitura() or {}).get("anos", {})
+    with _dados_lock:
+        chave = (geracao_dados(), versao_dados(), chave_arquivo)
+        if _contagens_vistas["chave"] == chave:
+            return dict(_contagens_vistas["contagens"])
+        contagens = {vista: len(bitmap_vista(tabela, vista)) for vista in VISTAS_LISTA}
+        arquivados = sum(info.get("registros", 0) for info in anos.values())
+        ocultos = sum(info.get("ocultos", 0) for info in anos.values())
+        contagens["tudo"] += arquivados
+        contagens["legado"] += arquivados - ocultos
+        if _tabela["tabela"] is tabela:   # releitura no meio: não guarda contagens da tabela velha
+            _contagens_vistas.update(chave=chave, contagens=contagens)
+        return dict(contagens)
+
+
+# ----------------------------- LOGS APPEND-ONLY (observações, auditoria) -----------------------------
+class LogAppend:
+    """
+    Arquivo JSONL só de acréscimo, com índice em memória: offset e data de cada linha e, para
+    cada campo de `campos_indice`, valor -> posições. As linhas nunca são reescritas; o índice
+    é refeito só quando o arquivo muda por fora do processo.
+    """
+
+    def __init__(self, caminho, campos_indice=("id",), campo_data=None):
+        self.caminho = caminho
+        self.campos_indice = campos_indice
+        self.campo_data = campo_data
+        self._lock = threading.Lock()
+        self._chave = False           # False = ainda não indexado
+        self._offsets = []
+        self._datas = []
+        self._indices = {}
+
+    @staticmethod
+    def _valor_indice(valor):
+        return str(valor).strip().lower()
+
+    def _indexar_linha(self, entrada, offset):
+        pos = len(self._offsets)
+        self._offsets.append(offset)
+        self._datas.append(parse_br_datetime(entrada.get(self.campo_data)) if self.campo_data else None)
+        for campo in self.campos_indice:
+            valor = entrada.get(campo)
+            if valor is not None and valor != "":
+                self._indices[campo].setdefault(self._valor_indice(valor), []).append(pos)
+
+    def _atualizar_indice(self):
+        chave = _chave_ou_none(self.caminho)
+        if chave == self._chave:
+            return
+        self._offsets, self._datas = [], []
+        self._indices = {campo: {} for campo in self.campos_indice}
+        try:
+            with open(self.caminho, "rb") as f:
+                offset = 0
+                for linha in f:
+                    try:
+                        self._indexar_linha(json.loads(linha), offset)
+                    except Exception:
+                        pass  # linha truncada (queda no meio de um append) ou inválida
+                    offset += len(linha)
+        except FileNotFoundError:
+            pass
+        self._chave = chave
+
+    def anexar(self, entrada):
+        return self.anexar_varios([entrada])[0]
+
+    def anexar_varios(self, entradas):
+        """Acrescenta várias entradas com uma única escrita (importações em lote)."""
+        linhas = [(json.dumps(e, ensure_ascii=False) + "\n").encode("utf-8") for e in entradas]
+        if not linhas:
+            return entradas
+        with self._lock:
+            self._atualizar_indice()
+            with open(self.caminho, "a+b") as f:
+                f.seek(0, os.SEEK_END)
+                offset = f.tell()
+                if offset:
+                    f.seek(offset - 1)
+                    if f.read(1) != b"\n":
+                        # última linha ficou sem \n (append interrompido): não emenda nela
+                        f.write(b"\n")
+                        offset += 1
+                f.write(b"".join(linhas))
+            for entrada, linha in zip(entradas, linhas):
+                self._indexar_linha(entrada, offset)
+                offset += len(linha)
+            self._chave = _chave_ou_none(self.caminho)
+        return entradas
+
+    def consultar(self, filtros=None, desde=None, ate=None, limite=None):
+        """
+        Entradas (em ordem de acréscimo) cujos campos indexados batem com `filtros` e cuja
+        data está em [desde, ate]. Com `limite`, só as `limite` mais recentes.
+        """
+        with self._lock:
+            self._atualizar_indice()
+            posicoes = None
+            for campo, valor in (filtros or {}).items():
+                achadas = self._indices[campo].get(self._valor_indice(valor), [])
+                posicoes = achadas if posicoes is None else sorted(set(posicoes) & set(achadas))
+            if posicoes is None:
+                posicoes = range(len(self._offsets))
+            if desde or ate:
+                posicoes = [p for p in posicoes if self._datas[p]
+                            and (not desde or self._datas[p] >= desde) and (not ate or self._datas[p] <= ate)]
+            posicoes = list(posicoes)
+            if limite is not None:
+                posicoes = posicoes[-limite:] if limite > 0 else []
+            if not posicoes:
+                return []
+            entradas = []
+            with open(self.caminho, "rb") as f:
+                for p in posicoes:
+                    f.seek(self._offsets[p])
+                    try:
+                        entradas.append(json.loads(f.readline()))
+                    except Exception:
+                        pass
+        return entradas
+
+
+# ----------------------------- OBSERVAÇÕES -----------------------------
+# Cada observação é uma linha {"id", "registrado_em", "text", "registrado_por"} em
+# OBSERVACOES_FILE; o registro guarda só o resumo (observacao = último texto e
+# ultima_observacao_em). Registros antigos ainda podem trazer a lista "observacoes" embutida.
+_log_observacoes = LogAppend(OBSERVACOES_FILE)
+
+
+def anexar_observacao(id_reg, texto, registrado_em, usuario=None):
+    """Acrescenta uma observação ao log (nunca reescreve as anteriores) e devolve a entrada."""
+    entrada = {"id": id_reg, "registrado_em": registrado_em, "text": texto}
+    if usuario:
+        entrada["registrado_por"] = usuario
+    return _log_observacoes.anexar(entrada)
+
+
+def anexar_observacoes(itens, usuario=None):
+    """Versão em lote de anexar_observacao: itens (id, texto, registrado_em), uma única escrita."""
+    entradas = []
+    for id_reg, texto, registrado_em in itens:
+        entrada = {"id": id_reg, "registrado_em": registrado_em, "text": texto}
+        if usuario:
+            entrada["registrado_por"] = usuario
+        entradas.append(entrada)
+    return _log_observacoes.anexar_varios(entradas)
+
+
+def listar_observacoes(id_reg):
+    """Observações de um registro no log, na ordem em que foram anexadas."""
+    return [{"text": e.get("text", ""), "registrado_em": e.get("registrado_em", "")}
+            for e in _log_observacoes.consultar({"id": id_reg})]
+
+
+def observacoes_do_registro(r):
+    """Histórico completo: lista embutida (registros antigos) seguida das entradas do log."""
+    embutidas = [ob for ob in (r.get("observacoes") or []) if isinstance(ob, dict)]
+    try:
+        id_reg = int(r.get("id"))
+    except (TypeError, ValueError):
+        return embutidas
+    return embutidas + listar_observacoes(id_reg)
+
+
+def ultima_observacao_dt(r):
+    """Data da observação mais recente, pelo resumo do registro (ou pela lista embutida antiga)."""
+    ultima = parse_br_datetime(r.get("ultima_observacao_em"))
+    for ob in r.get("observacoes") or []:
+        try:
+            dt_obs = parse_br_datetime(ob.get("registrado_em") or ob.get("registered_at") or "")
+        except Exception:
+            dt_obs = None
+        if dt_obs and (ultima is None or dt_obs > ultima):
+            ultima = dt_obs
+    return ultima
+
+
+def tem_observacoes(r):
+    return bool(r.get("ultima_observacao_em") or r.get("observacoes"))
+
+
+def resumir_observacao(r, texto, registrado_em):
+    """Atualiza o resumo do registro com uma observação nova (a data só avança)."""
+    r["observacao"] = texto
+    atual = ultima_observacao_dt(r)
+    nova = parse_br_datetime(registrado_em)
+    if atual is None or (nova is not None and nova >= atual):
+        r["ultima_observacao_em"] = registrado_em
+
+
+def migrar_observacoes():
+    """
+    Move as listas "observacoes" embutidas nos registros para o log. Retorna quantos registros.
+    Pode ser repetida: se a gravação das partições falhar (ou o processo cair) depois do log,
+    as observações que já estão no log para o id (mesma data e texto) não são anexadas de novo.
+    """
+    migrados = 0
+    with _dados_lock:
+        registros = carregar_registros()
+        novas, alterados = [], []
+        for r in list(registros):
+            obs = r.get("observacoes")
+            if "observacoes" not in r:
+                continue
+            r = copia_para_alterar(r)
+            try:
+                id_reg = int(r.get("id"))
+            except (TypeError, ValueError):
+                continue
+            no_log = collections.Counter((e.get("registrado_em", ""), e.get("text", ""))
+                                         for e in _log_observacoes.consultar({"id": id_reg}))
+            for ob in obs if isinstance(obs, list) else []:
+                if not isinstance(ob, dict):
+                    continue
+                texto, em = ob.get("text", ""), ob.get("registrado_em") or ob.get("registered_at") or ""
+                if no_log[(em, texto)]:
+                    no_log[(em, texto)] -= 1   # já anexada por uma migração interrompida
+                else:
+                    novas.append((id_reg, texto, em))
+            ultima = ultima_observacao_dt(r)
+            del r["observacoes"]
+            if ultima is not None:
+                r["ultima_observacao_em"] = ultima.strftime("%d/%m/%Y %H:%M")
+            alterados.append(r)
+        # primeiro o log (uma escrita só), depois as partições sem as listas embutidas
+        anexar_observacoes(novas)
+        for r in alterados:
+            registrar_alteracao(r)
+            migrados += 1
+        if migrados:
+            salvar_registros(registros)
+    return migrados
+
+
+# ----------------------------- AUDITORIA (edições) -----------------------------
+# Cada edição é uma linha {"id", "registrado_em", "usuario", "anterior": {...}, "novo": {...}}
+# em AUDITORIA_FILE, indexada por id e por usuário. No registro fica só oculto_meta.editado_em.
+_log_auditoria = LogAppend(AUDITORIA_FILE, ("id", "usuario"), campo_data="registrado_em")
+
+
+def registrar_edicao(registro, anterior, novo, usuario):
+    """Grava no log de auditoria os valores anteriores/novos dos campos editados."""
+    agora = sp_now_str()
+    entrada = _log_auditoria.anexar({"id": registro.get("id"), "registrado_em": agora,
+                                     "usuario": str(usuario), "anterior": anterior, "novo": novo})
+    if not isinstance(registro.get("oculto_meta"), dict):
+        registro["oculto_meta"] = {}
+    registro["oculto_meta"]["editado_em"] = agora
+    return entrada
+
+
+def consultar_auditoria(id_reg=None, usuario=None, desde=None, ate=None, limite=None):
+    """Edições filtradas por registro, usuário e período (datetimes), em ordem cronológica."""
+    filtros = {}
+    if id_reg is not None:
+        filtros["id"] = id_reg
+    if usuario:
+        filtros["usuario"] = usuario
+    return _log_auditoria.consultar(filtros, desde=desde, ate=ate, limite=limite)
+
+
+def _chave_auditoria(entrada):
+    return json.dumps(entrada, ensure_ascii=False, sort_keys=True)
+
+
+def migrar_edicoes():
+    """
+    Move oculto_meta.edicoes (formato antigo) para o log de auditoria. Retorna quantos registros.
+    Como migrar_observacoes(), pode ser repetida depois de uma gravação interrompida: edições
+    que já estão no log para o registro não são anexadas de novo.
+    """
+    migrados = 0
+    with _dados_lock:
+        registros = carregar_registros()
+        novas, alterados = [], []
+        for r in list(registros):
+            if not isinstance(r.get("oculto_meta"), dict) or "edicoes" not in r["oculto_meta"]:
+                continue
+            r = copia_para_alterar(r)
+            meta = r["oculto_meta"]
+            no_log = collections.Counter(_chave_auditoria(e) for e in _log_auditoria.consultar({"id": r.get("id")}))
+            ultima = None
+            for ed in meta["edicoes"] if isinstance(meta["edicoes"], list) else []:
+                if not isinstance(ed, dict):
+                    continue
+                anterior = {k: v for k, v in ed.items() if k not in ("registrado_em_snapshot", "edited_by")}
+                em = ed.get("registrado_em_snapshot", "")
+                entrada = {"id": r.get("id"), "registrado_em": em,
+                           "usuario": ed.get("edited_by", ""), "anterior": anterior}
+                chave = _chave_auditoria(entrada)
+                if no_log[chave]:
+                    no_log[chave] -= 1   # já anexada por uma migração interrompida
+                else:
+                    novas.append(entrada)
+                dt = parse_br_datetime(em)
+                if dt and (ultima is None or dt > ultima):
+                    ultima = dt
+            del meta["edicoes"]
+            if ultima is not None:
+                meta["editado_em"] = ultima.strftime("%d/%m/%Y %H:%M")
+            alterados.append(r)
+        # primeiro o log (uma escrita só), depois as partições sem o histórico embutido
+        _log_auditoria.anexar_varios(novas)
+        for r in alterados:
+            registrar_alteracao(r)
+            migrados += 1
+        if migrados:
+            salvar_registros(registros)
+    return migrados
+
+
+# ----------------------------- AÇÕES SOBRE REGISTROS (individuais e em lote) -----------------------------
+# Alteram uma cópia do registro e a publicam com registrar_alteracao(); quem chama segura
+# _dados_lock e grava com salvar_registros() no final — uma vez por requisição, mesmo em lote.
+# Retornam (registro alterado, movimento novo ou None).
+_RE_PATRIMONIO = re.compile(r'^\d{7,}$')
+
+
+def montar_movimento(valor, usuario, client_ip=""):
+    """
+    Valida e monta um movimento novo (id ainda None) a partir dos campos de /registrar;
+    `valor(nome)` devolve o texto do campo. Retorna (registro, observacao, data da observação).
+    Campo inválido levanta ValueError com a mensagem mostrada ao usuário.
+    """
+    tipo = valor("tipo").strip()
+    responsavel = valor("responsavel").strip()
+    patrimonio = valor("patrimonio").strip()
+    data_inicio = normalize_br_datetime_str(valor("data_inicio"))
+
+    if not tipo:
+        raise ValueError("Campo 'Tipo' é obrigatório.")
+    if not responsavel:
+        raise ValueError("Campo 'Responsável' é obrigatório.")
+
+    motivo = valor("motivo").strip()
+    if not motivo:
+        raise ValueError("Campo 'Motivo' é obrigatório.")
+    if motivo == "outros":
+        motivo = valor("motivo_outros").strip()
+        if not motivo:
+            raise ValueError("Descreva o motivo (campo obrigatório quando selecionar 'Outros').")
+
+    hardware = valor("hardware").strip()
+    if not hardware:
+        raise ValueError("Campo 'Hardware' é obrigatório.")
+    if hardware == "outros":
+        hardware = valor("hardware_outros").strip()
+        if not hardware:
+            raise ValueError("Descreva o hardware (campo obrigatório quando selecionar 'Outros').")
+
+    if hardware != "Teclado/Mouse" and not patrimonio:
+        raise ValueError("Campo 'Patrimônio' é obrigatório para este hardware.")
+
+    if patrimonio and not _RE_PATRIMONIO.match(patrimonio):
+        raise ValueError("Patrimônio inválido. Digite apenas números e no mínimo 7 dígitos.")
+
+    observacao = valor("observacao").strip()
+    if observacao and len(observacao) > 200:
+        raise ValueError("Observação deve ter no máximo 200 caracteres.")
+
+    novo = {
+        "id": None,
+        "tipo": tipo,
+        "responsavel": responsavel,
+        "patrimonio": patrimonio,
+        "workflow": valor("workflow"),
+        "origem": valor("origem").strip(),
+        "data_inicio": data_inicio,
+        "motivo": motivo,
+        "hardware": hardware,
+        "marca": valor("marca"),
+        "modelo": valor("modelo"),
+        "devolvido": False,
+        "estoque": False,
+        "observacao": observacao,
+    }
+    if tipo == "emprestimo":
+        novo["emprestado_para"] = valor("emprestado_para")
+        novo["data_retorno"] = normalize_br_datetime_str(valor("data_retorno"))
+
+    novo["oculto_meta"] = {
+        "client_ip": client_ip,
+        "registrado_em": sp_now_str(),
+        "registrado_por": usuario
+    }
+    obs_em = (normalize_br_datetime_str(valor("registrado_em")) or sp_now_str()) if observacao else None
+    return novo, observacao, obs_em
+
+
+def retornar_registro(registros, original, usuario, novo_id=None):
+    """
+    Retorno de um movimento: empréstimo só vira devolvido; entrada/saída gera o movimento
+    inverso (com `novo_id` ou o próximo id livre) e marca o original.
+    """
+    original = copia_para_alterar(original)
+    tipo_orig = original.get("tipo", "")
+    if tipo_orig == "emprestimo":
+        original["devolvido"] = True
+        original["devolvido_em"] = sp_now_str()
+        registrar_alteracao(original)
+        return original, None
+
+    if novo_id is None:
+        novo_id = proximo_id(registros)
+    novo = {
+        "id": novo_id,
+        "retorno_de": original.get("id"),
+        "tipo": "saida" if tipo_orig == "entrada" else "entrada",
+        "responsavel": original.get("responsavel", ""),
+        "patrimonio": original.get("patrimonio", ""),
+        "workflow": original.get("workflow", ""),
+        "origem": original.get("origem", ""),
+        "data_inicio": sp_now_str(),
+        "motivo": original.get("motivo", ""),
+        "hardware": original.get("hardware", ""),
+        "marca": original.get("marca", ""),
+        "modelo": original.get("modelo", ""),
+        "devolvido": False,
+        "estoque": False
+    }
+    novo["oculto_meta"] = {
+        "client_ip": original.get("oculto_meta", {}).get("client_ip", ""),
+        "registrado_em": sp_now_str(),
+        "registrado_por": usuario
+    }
+    if original.get("emprestado_para"):
+        novo["emprestado_para"] = original.get("emprestado_para", "")
+    if novo["tipo"] == "emprestimo":
+        novo["data_retorno"] = original.get("data_retorno", "")
+
+    original["devolvido"] = True
+    original["estoque"] = False
+    original["status_extra"] = f"Devolvido (ID: {novo_id})"
+    registrar_alteracao(original)
+    registrar_alteracao(novo)
+    registros.append(novo)
+    return original, novo
+
+
+def alternar_estoque_registro(registros, r, usuario, novo_id=None):
+    r = copia_para_alterar(r)
+    r["estoque"] = not r.get("estoque", False)
+    registrar_alteracao(r)
+    return r, None
+
+
+def devolver_registro(registros, r, usuario, novo_id=None):
+    r = copia_para_alterar(r)
+    r["devolvido"] = True
+    if r.get("tipo") == "emprestimo":
+        r["devolvido_em"] = sp_now_str()
+    registrar_alteracao(r)
+    return r, None
+
+
+def ocultar_registro(registros, r, usuario, novo_id=None):
+    r = copia_para_alterar(r)
+    r["oculto"] = True
+    registrar_alteracao(r)
+    return r, None
+
+
+def restaurar_registro(registros, r, usuario, novo_id=None):
+    r = copia_para_alterar(r)
+    r["oculto"] = False
+    registrar_alteracao(r)
+    return r, None
+
+
+# ação -> (função(registros, r, usuario, novo_id), só admin)
+ACOES_LOTE = {
+    "retornar": (retornar_registro, False),
+    "alternar_estoque": (alternar_estoque_registro, False),
+    "devolver": (devolver_registro, False),
+    "ocultar": (ocultar_registro, False),
+    "restaurar": (restaurar_registro, True),
+}
+
+
+def _recusa_lote(acao, r):
+    """Código do motivo para não aplicar `acao` ao registro no lote, ou None."""
+    if acao == "restaurar":
+        return None if r.get("oculto") else "nao_excluido"
+    if r.get("oculto"):
+        return "excluido"
+    if acao in ("retornar", "devolver") and r.get("devolvido"):
+        return "ja_devolvido"
+    return None
+
+
+def aplicar_lote(acao, ids, usuario):
+    """
+    Aplica `acao` (chave de ACOES_LOTE) a cada id e grava tudo com um único salvar_registros():
+    como o manifesto é o ponto de commit das partições, ou todas as alterações valem ou nenhuma.
+    Ids que estão no arquivo frio são trazidos de volta antes. Retorna um resultado por id, na
+    ordem recebida: {"id", "ok": True, "versao"} (retornos de entrada/saída trazem "novo_id")
+    ou {"id", "ok": False, "erro": código}.
+    """
+    funcao, _ = ACOES_LOTE[acao]
+    with _dados_lock:
+        registros = carregar_registros()
+        por_id = {_id_ordem(r): r for r in registros}
+        limite_arquivo = max_id_arquivado()
+        faltando = [i for i in ids if i not in por_id and 0 < i <= limite_arquivo]
+        if faltando:
+            for r in desarquivar_registros(faltando):
+                por_id[_id_ordem(r)] = r
+            registros = carregar_registros()
+
+        resultados, vistos, proximo, alterou = [], set(), None, False
+        for id_reg in ids:
+            r = por_id.get(id_reg)
+            erro = "repetido" if id_reg in vistos else ("nao_encontrado" if r is None else _recusa_lote(acao, r))
+            vistos.add(id_reg)
+            if erro:
+                resultados.append({"id": id_reg, "ok": False, "erro": erro})
+                continue
+            if proximo is None:
+                proximo = proximo_id(registros)   # uma varredura só, não uma por retorno
+            r, novo = funcao(registros, r, usuario, proximo)
+            por_id[id_reg] = r
+            resultado = {"id": id_reg, "ok": True, "versao": r.get("versao")}
+            if novo is not None:
+                resultado["novo_id"] = novo["id"]
+                proximo += 1
+            resultados.append(resultado)
+            alterou = True
+        if alterou:
+            salvar_registros(registros)
+    return resultados
+
+
+# ----------------------------- IMPORTAÇÃO CSV -----------------------------
+# Migração de planilhas: cada linha do CSV é um /registrar. O corpo é lido aos pedaços (nunca
+# inteiro em memória) e as linhas válidas são gravadas a cada IMPORTACAO_LOTE, com os ids do
+# lote reservados de uma vez.
+class CorpoLimitado(io.RawIOBase):
+    """Stream de leitura dos `tamanho` bytes do corpo da requisição (não lê além do Content-Length)."""
+
+    def __init__(self, fonte, tamanho):
+        self.fonte = fonte
+        self.restante = tamanho
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        if self.restante <= 0:
+            return 0
+        dados = self.fonte.read(min(len(b), self.restante))
+        if not dados:
+            raise ConnectionError("corpo da requisição terminou antes do Content-Length")
+        self.restante -= len(dados)
+        b[:len(dados)] = dados
+        return len(dados)
+
+
+_VERDADEIRO_CSV = {"sim", "s", "true", "1", "x", "yes"}
+
+
+def _abrir_csv(binario):
+    """TextIO + delimitador (vírgula ou ponto e vírgula, como o Excel em pt-BR) de um CSV em bytes."""
+    inicio = binario.peek(64 * 1024)[:64 * 1024].split(b"\n", 1)[0]
+    delimitador = ";" if inicio.count(b";") > inicio.count(b",") else ","
+    return io.TextIOWrapper(binario, encoding="utf-8-sig", newline=""), delimitador
+
+
+def _gravar_lote_importacao(pendentes, usuario):
+    """Dá ids consecutivos às linhas válidas e grava todas com um salvar_registros(). Retorna os ids."""
+    with _dados_lock:
+        registros = carregar_registros()
+        primeiro = proximo_id(registros)   # uma varredura por lote, não por linha
+        observacoes = []
+        for i, (_, novo, texto, em) in enumerate(pendentes):
+            novo["id"] = primeiro + i
+            if texto:
+                novo["ultima_observacao_em"] = em
+                observacoes.append((novo["id"], texto, em))
+            registrar_alteracao(novo)
+            registros.append(novo)
+        salvar_registros(registros)
+    # depois dos registros: uma falha aqui não deixa observações apontando para ids inexistentes
+    anexar_observacoes(observacoes, usuario)
+    return primeiro, primeiro + len(pendentes) - 1
+
+
+def importar_csv(binario, usuario, client_ip=""):
+    """
+    Importa movimentos de um CSV em `binario` (BufferedReader), lido linha a linha. O cabeçalho
+    usa os nomes dos campos de /registrar (tipo, responsavel, patrimonio, motivo, hardware,
+    data_inicio, observacao, ...); as colunas devolvido/estoque ("Sim"/"Não") são opcionais e
+    as demais (id, status... de uma exportação) são ignoradas. Retorna o relatório
+    {"importados", "lotes", "ids": [[primeiro, último], ...], "erros": [{"linha", "erro"}, ...]},
+    com "erro" se a leitura parou antes do fim (arquivo que não é UTF-8, aspas sem fechar...).
+    """
+    texto, delimitador = _abrir_csv(binario)
+    leitor = csv.DictReader(texto, delimiter=delimitador)
+    if not leitor.fieldnames or "tipo" not in [c.strip().lower() for c in leitor.fieldnames]:
+        raise ValueError("CSV sem cabeçalho com a coluna 'tipo'.")
+    leitor.fieldnames = [c.strip().lower() for c in leitor.fieldnames]
+
+    relatorio = {"importados": 0, "lotes": 0, "ids": [], "erros": []}
+    omitidos = 0
+    pendentes = []
+
+    def gravar():
+        relatorio["ids"].append(list(_gravar_lote_importacao(pendentes, usuario)))
+        relatorio["importados"] += len(pendentes)
+        relatorio["lotes"] += 1
+        pendentes.clear()
+
+    try:
+        for linha in leitor:
+            numero = leitor.line_num
+            if not any((v or "").strip() for k, v in linha.items() if k is not None and isinstance(v, str)):
+                continue  # linha em branco
+            try:
+                novo, observacao, obs_em = montar_movimento(lambda k: linha.get(k) or "", usuario, client_ip)
+            except ValueError as e:
+                if len(relatorio["erros"]) < IMPORTACAO_MAX_ERROS:
+                    relatorio["erros"].append({"linha": numero, "erro": str(e)})
+                else:
+                    omitidos += 1
+                continue
+            for campo in ("devolvido", "estoque"):
+                if (linha.get(campo) or "").strip().lower() in _VERDADEIRO_CSV:
+                    novo[campo] = True
+            pendentes.append((numero, novo, observacao, obs_em))
+            if len(pendentes) >= IMPORTACAO_LOTE:
+                gravar()
+    except (UnicodeDecodeError, csv.Error) as e:
+        # arquivo quebrado no meio: o que veio antes é gravado e o relatório diz onde parou
+        relatorio["erro"] = f"linha {leitor.line_num}: {e}"
+    if pendentes:
+        gravar()
+    if omitidos:
+        relatorio["erros_omitidos"] = omitidos
+    return relatorio
+
 
 # ----------------------------- HELPERS (BR date) -----------------------------
+# só dígitos ASCII: o resto (dígitos unicode, partes com 1 dígito, ISO...) fica com o strptime
+_RE_DATA_HORA_BR = re.compile(r"([0-9]{2})/([0-9]{2})/([0-9]{4}) ([0-9]{2}):([0-9]{2})(?::([0-9]{2}))?")
+
+
 def parse_br_datetime(dt_str):
     """
     Recebe uma string no formato BR "DD/MM/YYYY HH:MM" (ou com segundos) ou "DD/MM/YYYY"
@@ -142,10 +2657,27 @@ def parse_br_datetime(dt_str):
         return None
     if isinstance(dt_str, datetime.datetime):
         return dt_str
+    s = _normalizar_data_br(dt_str)
+    # caminho rápido para o formato que o próprio sistema grava (strptime é ~10x mais lento).
+    # Aceita exatamente o que o strptime aceitaria; inválidas (31/02, 24:00, :60) dão None igual.
+    m = _RE_DATA_HORA_BR.fullmatch(s)
+    if m:
+        try:
+            return datetime.datetime(*map(int, m.group(3, 2, 1, 4, 5)), int(m.group(6) or 0))
+        except ValueError:
+            return None
+    return _parse_br_datetime_formatos(s)
+
+
+def _normalizar_data_br(dt_str):
     s = str(dt_str).strip()
     # normalizações comuns
     s = s.replace('\xa0', ' ').replace('\u200e', '').replace('\u200f', '')
-    s = s.replace('T', ' ')
+    return s.replace('T', ' ')
+
+
+def _parse_br_datetime_formatos(s):
+    """Caminho lento de parse_br_datetime (strptime + ISO), sobre a string já normalizada."""
     # tenta formatos com segundos, minutos e só data
     for fmt in ("%d/%m/%Y %H:%M:%S", "%d/%m/%Y %H:%M", "%d/%m/%Y"):
         try:
@@ -190,10 +2722,10 @@ def sp_now_str():
     return sp_now_naive().strftime("%d/%m/%Y %H:%M")
 
 
-def calcular_status(registro):
+def calcular_status(registro, agora=None):
     """
     Calcula o status do registro para exportação CSV.
-    Retorna uma string com o status.
+    Retorna uma string com o status. Depende só do registro e de `agora` (padrão: sp_now_naive()).
     """
     tipo = registro.get("tipo", "")
     devolvido = registro.get("devolvido", False)
@@ -206,11 +2738,11 @@ def calcular_status(registro):
         else:
             return "Devolvido"
     
-    # Verificar se é empréstimo atrasado
-    if tipo == "emprestimo" and not devolvido:
-        dt_raw = registro.get("data_retorno", "")
-        dt = parse_br_datetime(dt_raw)
-        if dt and dt <= sp_now_naive():
+    # Verificar se é empréstimo atrasado (mesma regra do índice de prazos, sem depender dele)
+    if tipo == "emprestimo" and not devolvido \
+            and avaliar_prazos(registro, agora or sp_now_naive())[0] & ATRASADO:
+        dt = parse_br_datetime(registro.get("data_retorno", ""))
+        if dt:
             return f"Atrasado ({dt.strftime('%d/%m/%Y')})"
     
     if estoque and tipo == "entrada":
@@ -259,84 +2791,32 @@ def gerar_pendencias_html(registros):
     Gera mini painel com:
     - atrasos (emprestimos vencidos) no topo
     - entradas com motivo != 'outros' sem atualização a mais de 7 dias (sem saida com mesmo workflow OU sem observação atualizada)
+    Quem está atrasado/vencido vem do índice de prazos (prazos_atuais); `registros` é a lista
+    quente de onde ele é montado, mantido na assinatura pelos chamadores.
     """
     now = sp_now_naive()
+    prazos = prazos_atuais()
+    por_id = prazos["registros"]
     atrasos = []
     pendencias = []
 
-    # map workflow -> list of registros (para busca rápida)
-    workflow_map = {}
-    for r in registros:
-        if r.get("oculto", False) or r.get("estoque", False) or r.get("devolvido", False):
-            continue
-        wf = (r.get("workflow") or "").strip()
-        if wf:
-            workflow_map.setdefault(wf, []).append(r)
-
     # achar atrasos (emprestimo com data_retorno passada)
-    for r in registros:
-        if r.get("oculto", False) or r.get("estoque", False) or r.get("devolvido", False):
+    for id_reg in tuple(prazos["atrasados"]):
+        r = por_id.get(id_reg)
+        if r is None or not eh_atraso(r):
             continue
-        if r.get("tipo") == "emprestimo" and not r.get("devolvido", False):
-            dt_raw = r.get("data_retorno", "")
-            dt = parse_br_datetime(dt_raw)
-            if dt and dt <= now:
-                atrasos.append((r, dt))
-
-    # pendências de entrada (motivo != outros)
-    for r in registros:
-        if r.get("oculto", False) or r.get("estoque", False) or r.get("devolvido", False):
-            continue
-        if r.get("tipo") != "entrada":
-            continue
-        motivo = (r.get("motivo") or "").strip().lower()
-        if motivo == "outros" or motivo == "outro" or motivo == "other":
-            continue
-        data_inicio_raw = r.get("data_inicio", "")
-        dt_inicio = parse_br_datetime(data_inicio_raw)
-        if not dt_inicio:
+        dt = parse_br_datetime(r.get("data_retorno", ""))
+        if dt:
+            atrasos.append((r, dt))
+
+    # pendências de entrada (motivo != outros): aqui só contam saídas ainda em aberto
+    for id_reg in tuple(prazos["pendentes"]):
+        r = por_id.get(id_reg)
+        if r is None or not eh_pendencia_entrada(r, prazos["saidas_abertas"]):
             continue
-        delta_days = (now - dt_inicio).days
-        if delta_days < 7:
-            continue
-
-        wf = (r.get("workflow") or "").strip()
-        tem_saida_com_wf = False
-        if wf:
-            others = workflow_map.get(wf, [])
-            for o in others:
-                if o is r:
-                    continue
-                if o.get("tipo") == "saida" and not o.get("oculto", False):
-                    tem_saida_com_wf = True
-                    break
-
-        # última observação registrada no próprio registro (se houver)
-        last_obs_date = None
-        try:
-            obs_list = r.get("observacoes", []) or []
-            # pegar o mais recente
-            for ob in obs_list:
-                reg_em = ob.get("registrado_em") or ob.get("registered_at") or ""
-                dt_obs = parse_br_datetime(reg_em)
-                if dt_obs:
-                    if (last_obs_date is None) or dt_obs > last_obs_date:
-                        last_obs_date = dt_obs
-        except Exception:
-            last_obs_date = None
-
-        obs_antiga = True
-        if last_obs_date:
-            # se última observação foi dentro dos últimos 7 dias, considera atualizada
-            obs_antiga = (now - last_obs_date).days >= 7
-        else:
-            obs_antiga = True
-
-        # mostrará se não existe saida com mesmo workflow OU se a última observação é antiga/ausente
-        # CORREÇÃO: deve mostrar somente se NÃO existe saída com o mesmo workflow E a observação for antiga/ausente.
-        # Ou seja: quando houver observação recente ou já existir saída com o workflow, não deve aparecer.
-        if (not tem_saida_com_wf) and obs_antiga:
-            pendencias.append((r, delta_days))
+        dt_inicio = parse_br_datetime(r.get("data_inicio", ""))
+        if dt_inicio:
+            pendencias.append((r, (now - dt_inicio).days))
 
     # gerar HTML do painel
     html = '<div style="padding:10px;border-radius:8px;background:#111;border:1px solid rgba(255,255,255,0.03);max-width:320px;">'
@@ -346,7 +2826,7 @@ def gerar_pendencias_html(registros):
         html += '<div style="padding:8px;border-radius:6px;background:#33111166;margin-bottom:8px;">'
         html += '<strong style="color:#ffcccb;">Atrasos</strong>'
         html += '<ul style="margin:6px 0 0 16px;padding:0;">'
-        atrasos.sort(key=lambda x: x[1])
+        atrasos.sort(key=lambda x: (x[1], _id_ordem(x[0])))
         for r, dt in atrasos:
             data_retorno_display = dt.strftime("%d/%m/%Y %H:%M")
             html += (f"<li style='color:#ff9999;margin-bottom:6px;'>"
@@ -362,7 +2842,7 @@ def gerar_pendencias_html(registros):
         html += '<strong style="color:#ffd966;">Entradas sem atualização (>=7 dias)</strong>'
         html += '<ul style="margin:6px 0 0 16px;padding:0;">'
         # ordenar por dias (mais antigo primeiro)
-        pendencias.sort(key=lambda x: -x[1])
+        pendencias.sort(key=lambda x: (-x[1], _id_ordem(x[0])))
         for r, dias in pendencias:
             patrimonio = r.get('patrimonio','')
             wf = r.get('workflow','')
@@ -377,80 +2857,497 @@ def gerar_pendencias_html(registros):
     html += '</div>'
     return html
 
-# ---------------------------- HTML LOGIN ----------------------------------------
-def gerar_login_page(users, message=""):
-    # users: lista de dicts de users (para popular select)
-    options = ""
-    for u in users:
-        username = u.get("username","")
-        has_password = "1" if u.get("password_hash") else "0"
-        options += f'<option value="{username}" data-has-pass="{has_password}">{username}</option>'
+# ----------------------------- PRAZOS (estado que depende do relógio) -----------------------------
+# Atraso de empréstimo, pendência de entrada (7 dias sem saída/observação) e a janela de 24h em
+# que o criador pode editar mudam só com o passar do tempo. Em vez de reavaliar as datas de todos
+# os registros a cada requisição, cada registro quente guarda os bits já calculados e o instante
+# da próxima virada; um heap desses instantes é consumido pelo AgendadorPrazos, que dá versão
+# nova (registrar_alteracao) a quem virou — o cache de linhas e o delta de /lista acompanham.
+PRAZO_PENDENCIA_DIAS = 7
+PRAZO_EDICAO_HORAS = 24
+PRAZOS_ESPERA_MAX = 300   # segundos; o agendador acorda ao menos assim (releituras do disco etc.)
+
+ATRASADO = 1          # empréstimo não devolvido com data_retorno já passada
+ENTRADA_VENCIDA = 2   # entrada (motivo != outros) em aberto há 7 dias ou mais
+OBS_ANTIGA = 4        # ... e sem observação nos últimos 7 dias
+EDICAO_ABERTA = 8     # criador ainda dentro das 24h para editar (sem observações)
+_PENDENCIA = ENTRADA_VENCIDA | OBS_ANTIGA
+_MOTIVOS_SEM_PENDENCIA = ("outros", "outro", "other")
+
+# flags: id -> (versão, bits, próximo prazo, saída com workflow) | None enquanto não montado
+# viradas: id -> versão dos dados em que o relógio mudou os bits do registro (só em memória)
+_prazos = {"flags": None}
+_prazos_cond = threading.Condition(_dados_lock)
+
+
+def _teto_minuto(dt):
+    """Primeiro minuto cheio >= dt (sp_now_naive() só anda de minuto em minuto)."""
+    if dt.second or dt.microsecond:
+        return dt.replace(second=0, microsecond=0) + datetime.timedelta(minutes=1)
+    return dt
+
+
+def avaliar_prazos(r, agora):
+    """(bits, próxima virada ou None) do registro no instante `agora`."""
+    bits = 0
+    proximos = []
+    tipo = r.get("tipo")
+    devolvido = r.get("devolvido", False)
+    if tipo == "emprestimo" and not devolvido:
+        dt = _parse_data_memo(r.get("data_retorno", "") or "")
+        if dt:
+            if dt <= agora:
+                bits |= ATRASADO
+            else:
+                proximos.append(dt)
+    if tipo == "entrada" and not (devolvido or r.get("oculto", False) or r.get("estoque", False)) \
+            and (r.get("motivo") or "").strip().lower() not in _MOTIVOS_SEM_PENDENCIA:
+        dt = _parse_data_memo(r.get("data_inicio", "") or "")
+        if dt:
+            prazo = datetime.timedelta(days=PRAZO_PENDENCIA_DIAS)
+            if dt + prazo <= agora:
+                bits |= ENTRADA_VENCIDA
+            else:
+                proximos.append(dt + prazo)
+            try:
+                ultima = ultima_observacao_dt(r)
+            except Exception:
+                ultima = None
+            if ultima is None or ultima + prazo <= agora:
+                bits |= OBS_ANTIGA
+            else:
+                proximos.append(ultima + prazo)
+    meta = r.get("oculto_meta") or {}
+    if meta.get("registrado_por") and not tem_observacoes(r):
+        dt = _parse_data_memo(meta.get("registrado_em"))
+        if dt and agora < dt + datetime.timedelta(hours=PRAZO_EDICAO_HORAS):
+            bits |= EDICAO_ABERTA
+            proximos.append(dt + datetime.timedelta(hours=PRAZO_EDICAO_HORAS))
+    return bits, (_teto_minuto(min(proximos)) if proximos else None)
+
+
+def _saida_workflow(r):
+    """(workflow, em aberto) de uma saída não excluída com workflow — conta para as pendências."""
+    if r.get("tipo") != "saida" or r.get("oculto", False):
+        return None
+    wf = (r.get("workflow") or "").strip()
+    if not wf:
+        return None
+    return wf, not (r.get("estoque", False) or r.get("devolvido", False))
+
+
+def _indexar_prazos(r, agora, antigo=None):
+    """Guarda bits/prazo/saída de `r` (trocando a contribuição `antigo`). Chamar com _dados_lock."""
+    p = _prazos
+    id_reg = _id_ordem(r)
+    bits, proximo = avaliar_prazos(r, agora)
+    saida = _saida_workflow(r)
+    if antigo is not None:
+        if antigo[3] is not None:
+            wf, aberta = antigo[3]
+            p["saidas"][wf] -= 1
+            if aberta:
+                p["saidas_abertas"][wf] -= 1
+    if saida is not None:
+        wf, aberta = saida
+        p["saidas"][wf] += 1
+        if aberta:
+            p["saidas_abertas"][wf] += 1
+    (p["atrasados"].add if bits & ATRASADO else p["atrasados"].discard)(id_reg)
+    (p["pendentes"].add if bits & _PENDENCIA == _PENDENCIA else p["pendentes"].discard)(id_reg)
+    versao = _versao_registro(r)
+    p["flags"][id_reg] = (versao, bits, proximo, saida)
+    p["registros"][id_reg] = r
+    if proximo is not None:
+        heapq.heappush(p["heap"], (proximo, id_reg, versao))
+    return bits
+
+
+def _montar_prazos():
+    registros = carregar_registros()   # antes: uma releitura aqui dispara _invalidar_prazos()
+    agora = sp_now_naive()
+    _prazos.update(flags={}, registros={}, heap=[], atrasados=set(), pendentes=set(), viradas={},
+                   saidas=collections.Counter(), saidas_abertas=collections.Counter())
+    for r in registros:
+        _indexar_prazos(r, agora)
+
+
+def _atualizar_prazos(registro):
+    """A cada registrar_alteracao() (com _dados_lock): recalcula bits e reagenda o registro."""
+    if _prazos["flags"] is None:
+        return
+    heap = _prazos["heap"]
+    topo = heap[0][0] if heap else None
+    _prazos["viradas"].pop(_id_ordem(registro), None)   # a versão nova do registro já leva ao delta
+    _indexar_prazos(registro, sp_now_naive(), _prazos["flags"].get(_id_ordem(registro)))
+    if len(heap) > 2 * len(_prazos["flags"]) + 1024:
+        # entradas de versões antigas acumuladas: refaz o heap só com os prazos atuais
+        heap[:] = [(f[2], id_reg, f[0]) for id_reg, f in _prazos["flags"].items() if f[2] is not None]
+        heapq.heapify(heap)
+    if heap and (topo is None or heap[0][0] < topo):
+        _prazos_cond.notify_all()   # prazo mais cedo que o que o agendador está esperando
+
+
+def _invalidar_prazos():
+    with _prazos_cond:
+        _prazos["flags"] = None
+        _prazos_cond.notify_all()
+
+
+def vencer_prazos():
+    """
+    Monta o índice se preciso e aplica os prazos já vencidos. Retorna quantos segundos faltam
+    para o próximo prazo.
+
+    Virar um prazo muda só estado em memória: o registro não é alterado nem gravado (a versão
+    dele continua a do disco, o status vem do relógio). Sobe apenas a versão dos dados, para
+    os caches que dependem dela, e o id fica em _prazos["viradas"] para o delta do /lista
+    mandar a linha de novo.
+    """
+    with _dados_lock:
+        if _prazos["flags"] is None:
+            _montar_prazos()
+        agora = sp_now_naive()
+        heap = _prazos["heap"]
+        while heap and heap[0][0] <= agora:
+            _, id_reg, versao = heapq.heappop(heap)
+            atual = _prazos["flags"].get(id_reg)
+            if atual is None or atual[0] != versao:
+                continue   # prazo de uma versão que já foi substituída
+            r = _prazos["registros"][id_reg]
+            if avaliar_prazos(r, agora)[0] != atual[1]:
+                # NÃO passa por registrar_alteracao: nada a gravar e a versão do registro não muda
+                _dados_cache["versao"] += 1
+                _prazos["viradas"][id_reg] = _dados_cache["versao"]
+            _indexar_prazos(r, agora, atual)
+        if not heap:
+            return PRAZOS_ESPERA_MAX
+        try:
+            exato = datetime.datetime.now(ZoneInfo("America/Sao_Paulo")).replace(tzinfo=None)
+        except Exception:
+            exato = datetime.datetime.now()
+        return min(max((heap[0][0] - exato).total_seconds(), 0.05), PRAZOS_ESPERA_MAX)
+
+
+def prazos_atuais():
+    """
+    Índice de prazos em dia, para quem vai ler os bits de muitos registros. Normalmente o
+    agendador já aplicou tudo e isto não trava nada; sem ele (uso como biblioteca), aplica aqui.
+    """
+    heap = _prazos.get("heap")
+    if _prazos["flags"] is None or (heap and heap[0][0] <= sp_now_naive()):
+        carregar_registros()
+        vencer_prazos()
+    return _prazos
+
+
+def prazos_virados_desde(versao):
+    """Registros cujos bits de prazo o relógio mudou depois da versão dos dados `versao`."""
+    with _dados_lock:
+        prazos = prazos_atuais()
+        por_id = prazos["registros"]
+        return [por_id[i] for i, v in prazos["viradas"].items() if v > versao and i in por_id]
+
+
+def bits_prazos(r):
+    """Bits de prazo do registro: os do índice se estiverem na versão dele, senão calculados agora."""
+    flags = _prazos["flags"]
+    if flags is not None:
+        atual = flags.get(_id_ordem(r))
+        if atual is not None and atual[0] == _versao_registro(r):
+            return atual[1]
+    return avaliar_prazos(r, sp_now_naive())[0]
+
+
+def eh_atraso(r):
+    """Empréstimo atrasado que conta como pendência (fora do estoque e não excluído)."""
+    return bool(bits_prazos(r) & ATRASADO) and not (r.get("oculto", False) or r.get("estoque", False))
+
+
+def eh_pendencia_entrada(r, saidas):
+    """Entrada vencida sem observação recente e sem saída do mesmo workflow em `saidas`."""
+    if bits_prazos(r) & _PENDENCIA != _PENDENCIA:
+        return False
+    wf = (r.get("workflow") or "").strip()
+    return not (wf and saidas.get(wf))
+
+
+def pode_editar_como_criador(r, usuario):
+    """O criador do registro, dentro das 24h e antes de qualquer observação."""
+    criador = (r.get("oculto_meta") or {}).get("registrado_por")
+    return bool(criador) and str(criador).lower() == str(usuario).lower() \
+        and bool(bits_prazos(r) & EDICAO_ABERTA)
+
+
+class AgendadorPrazos(threading.Thread):
+    """Thread que dorme até o próximo prazo do heap (ou até um prazo mais cedo ser agendado)."""
+
+    def __init__(self):
+        super().__init__(daemon=True, name="agendador-prazos")
+        self._parar = threading.Event()
+
+    def run(self):
+        while not self._parar.is_set():
+            try:
+                with _prazos_cond:
+                    carregar_registros()
+                    espera = vencer_prazos()
+                    if not self._parar.is_set():
+                        _prazos_cond.wait(espera)
+            except Exception as e:
+                print("Erro no agendador de prazos:", e)
+                self._parar.wait(PRAZOS_ESPERA_MAX)
+
+    def parar(self):
+        self._parar.set()
+        with _prazos_cond:
+            _prazos_cond.notify_all()
+        self.join()
+
+
+_ao_alterar_registro.append(_atualizar_prazos)
+_ao_recarregar_registros.append(_invalidar_prazos)
+
+# ----------------------------- COMPRESSÃO (Accept-Encoding) -----------------------------
+_compressao_lock = threading.Lock()
+_compressao_cache = collections.OrderedDict()  # (etag, codificacao) -> bytes comprimidos
+_compressao_cache_bytes = 0
+
+
+def escolher_codificacao(accept_encoding):
+    """
+    Escolhe gzip ou deflate a partir do header Accept-Encoding (respeitando q=0).
+    Retorna "gzip", "deflate" ou None (identidade).
+    """
+    if not accept_encoding:
+        return None
+    aceitas = {}
+    for parte in accept_encoding.split(","):
+        item = parte.strip().split(";")
+        nome = item[0].strip().lower()
+        q = 1.0
+        for param in item[1:]:
+            param = param.strip()
+            if param.startswith("q="):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    q = 0.0
+        if nome:
+            aceitas[nome] = q
+    for cod in ("gzip", "deflate"):
+        q = aceitas.get(cod, aceitas.get("*", 0.0) if cod not in aceitas else 0.0)
+        if q > 0:
+            return cod
+    return None
+
+
+def novo_compressor(codificacao):
+    """compressobj para streaming: gzip (wbits 16+) ou deflate no formato zlib (o que o HTTP chama de deflate)."""
+    wbits = 16 + zlib.MAX_WBITS if codificacao == "gzip" else zlib.MAX_WBITS
+    return zlib.compressobj(COMPRESSAO_NIVEL, zlib.DEFLATED, wbits)
+
+
+def comprimir(corpo, codificacao):
+    """Comprime bytes ou uma lista de pedaços em bytes (sem juntá-los antes)."""
+    comp = novo_compressor(codificacao)
+    if isinstance(corpo, (bytes, bytearray)):
+        return comp.compress(corpo) + comp.flush()
+    saida = [comp.compress(parte) for parte in corpo]
+    saida.append(comp.flush())
+    return b"".join(saida)
+
+
+def calcular_etag(corpo):
+    h = hashlib.sha1()
+    if isinstance(corpo, (bytes, bytearray)):
+        h.update(corpo)
+    else:
+        for parte in corpo:
+            h.update(parte)
+    return '"' + h.hexdigest()[:24] + '"'
+
+
+def comprimir_com_cache(corpo, etag, codificacao):
+    """Comprime `corpo` reaproveitando o resultado já calculado para o mesmo ETag."""
+    global _compressao_cache_bytes
+    chave = (etag, codificacao)
+    with _compressao_lock:
+        pronto = _compressao_cache.get(chave)
+        if pronto is not None:
+            _compressao_cache.move_to_end(chave)
+            return pronto
+    comprimido = comprimir(corpo, codificacao)
+    if len(comprimido) > COMPRESSAO_CACHE_MAX_BYTES // 4:
+        return comprimido  # grande demais para valer a pena guardar
+    with _compressao_lock:
+        if chave not in _compressao_cache:
+            _compressao_cache[chave] = comprimido
+            _compressao_cache_bytes += len(comprimido)
+            while _compressao_cache and _compressao_cache_bytes > COMPRESSAO_CACHE_MAX_BYTES:
+                _, antigo = _compressao_cache.popitem(last=False)
+                _compressao_cache_bytes -= len(antigo)
+    return comprimido
+
+
+# ----------------------------- ASSETS ESTÁTICOS (/static/) -----------------------------
+_TIPOS_ASSET = {
+    ".css": "text/css; charset=utf-8",
+    ".js": "application/javascript; charset=utf-8",
+    ".svg": "image/svg+xml",
+    ".png": "image/png",
+    ".woff2": "font/woff2",
+}
+_assets = {}          # nome relativo (ex.: "lista.css") -> asset
+_assets_por_url = {}  # "/static/lista.3f9a0c1b2d4e.css" -> asset
+
+
+def registrar_asset(nome, conteudo):
+    """
+    Registra um asset em memória. A URL leva os 12 primeiros dígitos do sha1 do conteúdo,
+    então pode ser servida com Cache-Control immutable: mudou o arquivo, mudou a URL.
+    Textos a partir de COMPRESSAO_MIN_BYTES já ficam com as variantes gzip/deflate prontas.
+    """
+    base, ext = os.path.splitext(nome)
+    tipo = _TIPOS_ASSET.get(ext.lower(), "application/octet-stream")
+    digest = hashlib.sha1(conteudo).hexdigest()
+    asset = {
+        "nome": nome,
+        "url": f"/static/{base}.{digest[:12]}{ext}",
+        "content_type": tipo,
+        "etag": '"' + digest[:24] + '"',
+        "corpo": conteudo,
+        "variantes": {},
+    }
+    if len(conteudo) >= COMPRESSAO_MIN_BYTES and not tipo.startswith(("image/png", "font/")):
+        for cod in ("gzip", "deflate"):
+            comprimido = comprimir(conteudo, cod)
+            if len(comprimido) < len(conteudo):
+                asset["variantes"][cod] = comprimido
+    _assets[nome] = asset
+    _assets_por_url[asset["url"]] = asset
+    return asset
+
+
+def carregar_assets(diretorio=STATIC_DIR):
+    """Lê todos os arquivos de static/ (inclusive vendor/) para a memória. Chamado na importação."""
+    if not os.path.isdir(diretorio):
+        print(f"Aviso: diretório de assets não encontrado: {diretorio}")
+        return
+    for raiz, _dirs, arquivos in os.walk(diretorio):
+        for arq in sorted(arquivos):
+            if os.path.splitext(arq)[1].lower() not in _TIPOS_ASSET:
+                continue
+            caminho = os.path.join(raiz, arq)
+            nome = os.path.relpath(caminho, diretorio).replace(os.sep, "/")
+            try:
+                with open(caminho, "rb") as f:
+                    registrar_asset(nome, f.read())
+            except Exception as e:
+                print("Erro ao carregar asset", nome, e)
+    faltando = [n for n in FLATPICKR_ARQUIVOS if n not in _assets]
+    if faltando:
+        print("Aviso: arquivos do flatpickr faltando em static/; os campos de data ficam como texto simples:",
+              ", ".join(faltando))
+
+
+def asset_url(nome):
+    asset = _assets.get(nome)
+    if asset:
+        return asset["url"]
+    return "/static/" + nome
+
+
+def obter_asset(url_path):
+    return _assets_por_url.get(url_path)
+
+
+def tag_css(nome):
+    return f'<link rel="stylesheet" href="{asset_url(nome)}">'
+
+
+def tag_js(nome):
+    return f'<script src="{asset_url(nome)}"></script>'
+
+
+def tags_flatpickr_css():
+    return tag_css("vendor/flatpickr/flatpickr.min.css")
+
+
+def tags_flatpickr_js():
+    return tag_js("vendor/flatpickr/flatpickr.min.js") + "\n" + tag_js("vendor/flatpickr/l10n/pt.js")
+
+
+carregar_assets()
+
+
+# ----------------------------- TEMPLATES (segmentos + slots) -----------------------------
+class Template:
+    """
+    Página compilada na importação: o texto é quebrado em segmentos de bytes fixos e slots
+    `{{nome}}`. Renderizar só intercala os valores entre os segmentos já codificados, sem
+    .replace() nem concatenação do documento inteiro; o resultado vai para o socket com writelines.
+    """
+    _SLOT = re.compile(r"\{\{([a-z_][a-z0-9_]*)\}\}")
+
+    def __init__(self, texto):
+        self.partes = []  # bytes (fixo) ou str (nome do slot)
+        pos = 0
+        for m in self._SLOT.finditer(texto):
+            if m.start() > pos:
+                self.partes.append(texto[pos:m.start()].encode("utf-8"))
+            self.partes.append(m.group(1))
+            pos = m.end()
+        if pos < len(texto):
+            self.partes.append(texto[pos:].encode("utf-8"))
+        self.slots = {p for p in self.partes if isinstance(p, str)}
+
+    def iterar(self, **valores):
+        """
+        Gera os pedaços em bytes. Um valor pode ser str, bytes ou um iterável de str/bytes
+        (outra página já renderizada, um gerador de linhas...), consumido só na hora da escrita.
+        """
+        faltando = self.slots - valores.keys()
+        if faltando:
+            raise KeyError("slots sem valor: " + ", ".join(sorted(faltando)))
+        for parte in self.partes:
+            if isinstance(parte, bytes):
+                yield parte
+                continue
+            valor = valores[parte]
+            if isinstance(valor, str):
+                yield valor.encode("utf-8")
+            elif isinstance(valor, bytes):
+                yield valor
+            else:
+                for item in valor:
+                    yield item.encode("utf-8") if isinstance(item, str) else item
 
-    html = f"""
+    def render(self, **valores):
+        """Lista de pedaços em bytes pronta para writelines."""
+        return list(self.iterar(**valores))
+
+
+# ---------------------------- HTML LOGIN ----------------------------------------
+_TPL_LOGIN = Template("""
 <!doctype html>
 <html lang="pt-BR">
 <head>
 <meta charset="utf-8">
 <meta name="viewport" content="width=device-width,initial-scale=1">
 <title>Login — Controle de Hardware</title>
-<style>
-:root {{ --bg: #0b0b0c; --muted:#9aa0a6; --card:#0f0f10; --border:#262626; --accent:#22a148; --accent-contrast:#071005; }}
-* {{ box-sizing: border-box; }}
-html,body{{height:100%; margin:0; font-family: Inter, Roboto, Arial, sans-serif; -webkit-font-smoothing:antialiased; -moz-osx-font-smoothing:grayscale;}}
-body{{
-  background: linear-gradient(180deg, #070707 0%, #0c0c0d 100%);
-  color: #e8e8e8;
-  display:flex;
-  align-items:center;
-  justify-content:center;
-  padding:24px;
-}}
-
-.card{{
-  width:420px;
-  max-width:calc(100% - 48px);
-  background: linear-gradient(180deg, rgba(255,255,255,0.02), rgba(255,255,255,0.01));
-  border:1px solid var(--border);
-  padding:20px;
-  border-radius:12px;
-  box-shadow: 0 6px 18px rgba(0,0,0,0.6);
-}}
-
-h1{{margin:0 0 8px 0;font-size:20px;}}
-.message{{padding:10px;border-radius:8px;background:#0f0f10;border:1px solid rgba(255,255,255,0.02);margin-bottom:12px;color:var(--muted);font-size:13px;}}
-
-.form-row{{margin-top:12px;}}
-label{{display:block;font-size:13px;color:var(--muted); margin-bottom:6px;}}
-.select, input[type="text"], input[type="password"], select {{
-  width:100%; padding:12px 14px; margin:0; background:#101010; border:1px solid var(--border); color:#eaeaea; border-radius:10px; font-size:14px; height:44px;
-}}
-select.select{{-webkit-appearance:none; -moz-appearance:none; appearance:none; background-image: linear-gradient(45deg, transparent 50%, var(--muted) 50%), linear-gradient(135deg, var(--muted) 50%, transparent 50%); background-position: calc(100% - 18px) calc(1em + 2px), calc(100% - 13px) calc(1em + 2px); background-size: 6px 6px, 6px 6px; background-repeat: no-repeat; padding-right:40px;}}
-
-.checkbox-row{{display:flex; align-items:center; gap:8px; margin-top:12px; color:var(--muted); font-size:13px;}}
-.checkbox-row input{{width:16px; height:16px; margin:0;}}
-
-.actions{{display:flex; justify-content:flex-end; margin-top:16px;}}
-button.primary{{background:var(--accent); color:var(--accent-contrast); border:none; padding:10px 18px; border-radius:10px; cursor:pointer; font-weight:600; font-size:14px; height:44px;}}
-.note{{font-size:13px;color:var(--muted);margin-top:12px; line-height:1.35;}}
-
-/* responsivo: reduzir padding dos inputs em telas pequenas */
-@media (max-width:420px) {{
-  .card{{padding:16px;}}
-  .select, input[type="password"]{{height:42px; padding:10px 12px;}}
-  button.primary{{height:42px; padding:8px 14px;}}
-}}
-</style>
+""" + tag_css("login.css") + """
 </head>
 <body>
   <div class="card" role="main" aria-label="Tela de Login">
     <h1>Entrar — Controle de Hardware</h1>
-    {f'<div class="message">{message}</div>' if message else ''}
+    {{mensagem}}
     <form method="POST" action="/login" id="loginForm" autocomplete="off">
       <div class="form-row">
         <label for="login_username">Usuário</label>
         <select name="username" id="login_username" class="select" required>
           <option value="" disabled selected>Selecione o usuário...</option>
-          {options}
+          {{opcoes}}
         </select>
       </div>
 
@@ -471,73 +3368,44 @@ button.primary{{background:var(--accent); color:var(--accent-contrast); border:n
     <div class="note">Se for o primeiro acesso do usuário (senha não definida) o campo de senha será salvo como nova senha.</div>
   </div>
 
-<script>
-(function(){{
-  const sel = document.getElementById('login_username');
-  const pwd = document.getElementById('login_password');
-  const label = document.getElementById('senha_label');
-
-  function updateLabel() {{
-    const opt = sel.selectedOptions && sel.selectedOptions[0];
-    if (!opt) return;
-    const has = opt.dataset.hasPass;
-    if (has === '0') {{
-      label.innerText = 'Defina uma senha (primeiro login)';
-      pwd.placeholder = 'Defina uma senha (mínimo 6 caracteres)';
-      pwd.value = "";
-      pwd.autocomplete = "new-password";
-    }} else {{
-      label.innerText = 'Senha';
-      pwd.placeholder = 'Digite sua senha';
-      pwd.autocomplete = "current-password";
-    }}
-  }}
-  sel.addEventListener('change', updateLabel);
-
-  // tenta selecionar o primeiro usuário real automaticamente (se houver)
-  (function autoSelectFirst() {{
-    if (!sel) return;
-    // procurar primeira opção que não é placeholder
-    for (let i = 0; i < sel.options.length; i++) {{
-      const o = sel.options[i];
-      if (o.value && o.disabled === false && o.value !== "") {{
-        sel.selectedIndex = i;
-        break;
-      }}
-    }}
-    updateLabel();
-  }})();
-}})();
-</script>
+""" + tag_js("login.js") + """
 
 </body>
 </html>
-"""
-    return html
+""")
 
-# ----------------------------- HTML TEMPLATE (INDEX) -----------------------------
-def gerar_html_form(registros, current_user=None):
-    # não preencher aqui com a hora do servidor — o cliente (navegador) preencherá com sua hora local
 
-    # monta options do select responsável a partir da array RESPONSAVEIS
-    responsaveis_html = ""
-    for r in RESPONSAVEIS:
-        responsaveis_html += '<option value="{}">{}</option>'.format(r, r)
+def _opcoes_login(users):
+    options = []
+    for u in users:
+        username = u.get("username","")
+        has_password = "1" if u.get("password_hash") else "0"
+        options.append(f'<option value="{username}" data-has-pass="{has_password}">{username}</option>')
+    return "".join(options)
+
 
-    # pendencias (inclui atrasos no topo)
-    pendencias_html = gerar_pendencias_html(registros)
+def _opcoes_admin(users):
+    user_options = []
+    for u in users:
+        uname = u.get("username", "")
+        user_options.append(f'<option value="{uname}">{uname}</option>')
+    return "".join(user_options)
 
-        # ----------------- Painel de Manutenção (somente para admin) -----------------
-    admin_panel_html = ""
-    if current_user and str(current_user).lower() == "admin":
-        # build options list of users for selects
-        users_list = load_users()
-        user_options = ""
-        for u in users_list:
-            uname = u.get("username", "")
-            user_options += f'<option value="{uname}">{uname}</option>'
-
-        admin_panel_html = f'''
+
+def gerar_login_page(users=None, message=""):
+    # users: lista de dicts de users (para popular select); None = diretório em cache
+    opcoes = fragmento_usuarios("login", _opcoes_login) if users is None else _opcoes_login(users)
+    return _TPL_LOGIN.render(
+        mensagem=f'<div class="message">{message}</div>' if message else "",
+        opcoes=opcoes,
+    )
+
+# ----------------------------- HTML TEMPLATE (INDEX) -----------------------------
+# options do select responsável (RESPONSAVEIS é fixo, entra direto no template)
+_OPCOES_RESPONSAVEIS = "".join('<option value="{}">{}</option>'.format(r, r) for r in RESPONSAVEIS)
+
+# ----------------- Painel de Manutenção (somente para admin) -----------------
+_TPL_PAINEL_ADMIN = Template("""
     <div class="right-card card">
       <h3 style="margin-top:0;margin-bottom:10px;">Painel de Manutenção</h3>
 
@@ -561,7 +3429,7 @@ def gerar_html_form(registros, current_user=None):
           </div>
           <select name="target_user" style="width:100%;padding:8px;border-radius:8px;margin-top:6px;border:1px solid var(--border);background:#101010;color:#eaeaea;" required>
             <option value="" disabled selected>Selecione usuário...</option>
-            {user_options}
+            {{opcoes_usuarios}}
           </select>
           <div style="display:flex;justify-content:flex-end;margin-top:8px;">
             <button type="submit" style="background:#1565c0;color:#fff;border:none;padding:8px 10px;border-radius:8px;cursor:pointer;">Forçar redefinição</button>
@@ -576,7 +3444,7 @@ def gerar_html_form(registros, current_user=None):
           <label style="font-size:13px;color:var(--muted);">Excluir usuário</label>
           <select name="target_user" id="delete_user_select" style="width:100%;padding:8px;border-radius:8px;margin-top:6px;border:1px solid var(--border);background:#101010;color:#eaeaea;" required>
             <option value="" disabled selected>Selecione usuário...</option>
-            {user_options}
+            {{opcoes_usuarios}}
           </select>
           <div style="display:flex;justify-content:flex-end;margin-top:8px;">
             <button type="submit" style="background:#b71c1c;color:#fff;border:none;padding:8px 10px;border-radius:8px;cursor:pointer;">Excluir</button>
@@ -584,310 +3452,50 @@ def gerar_html_form(registros, current_user=None):
         </form>
       </div>
 
-    </div>
-
-    <script>
-    function adminAddUserValidate(form) {{
-      const u = form.username.value.trim();
-      if(!u) {{ alert('Digite um nome de usuário.'); return false; }}
-      return true;
-    }}
-    function adminResetValidate(form) {{
-      const u = form.target_user.value;
-      if (!u) {{
-          alert('Selecione um usuário.');
-          return false;
-      }}
-      // confirmação extra se for o admin
-      if (u.toLowerCase() === 'admin') {{
-         if (!confirm('Você está forçando redefinição para o usuário "admin". Confirma?')) {{
-          return false;
-          }}
-    }}
-    return confirm('Ao confirmar, a senha atual será removida e o usuário ' + u + ' deverá definir uma nova senha no próximo login. Continuar?');
-    }}
-    function adminDeleteConfirm(form) {{
-      const u = form.target_user.value;
-      if(!u) {{ alert('Selecione um usuário.'); return false; }}
-      if(u.toLowerCase() === 'admin') {{
-        alert('Não é permitido excluir o usuário admin.');
-        return false;
-      }}
-      return confirm('Confirma exclusão do usuário: ' + u + ' ?');
-    }}
-    </script>
-'''
-
-    html = """
-<!doctype html>
-<html lang="pt-BR">
-<head>
-<meta charset="utf-8">
-<meta name="viewport" content="width=device-width,initial-scale=1">
-<title>Controle de Hardware DEPPEN</title>
-
-<link rel="stylesheet" href="https://cdn.jsdelivr.net/npm/flatpickr/dist/flatpickr.min.css">
-
-<style>
-    :root {
-        --bg: #0f0f10;
-        --card: #161617;
-        --muted: #9aa0a6;
-        --accent: #4caf50;
-        --accent-2: #3aa0ff;
-        --danger: #ff6b6b;
-        --input-bg: #1f1f20;
-        --border: #2a2a2a;
-        font-family: Inter, Roboto, Arial, sans-serif;
-    }
-
-    html,body {
-        height:100%;
-        margin:0;
-        background: radial-gradient(circle at 10% 10%, #0b0b0c, var(--bg));
-        color:#e6e6e6;
-    }
-
-    .card {
-        background: linear-gradient(180deg, rgba(255,255,255,0.02), rgba(255,255,255,0.01));
-        border: 1px solid var(--border);
-        padding:24px;
-        border-radius:12px;
-        box-shadow: 0 6px 18px rgba(0,0,0,0.6);
-        width:960px;
-        max-width:calc(100vw - 40px);
-        margin:20px auto;
-    }
-
-    /* layout que coloca o painel de pendências como card separado à esquerda
-       e o formulário principal como card centralizado ao lado direito (desktop).
-       Em mobile empilha com o painel de pendências acima do formulário. */
-    .dashboard {
-        display:flex;
-        gap:16px;
-        justify-content:center;
-        align-items:flex-start;
-        max-width:calc(100vw - 40px);
-        margin:20px auto;
-        padding:0 10px;
-        box-sizing:border-box;
-    }
-    .left-card {
-        flex:0 0 320px;
-        width:320px;
-        max-width:320px;
-        margin:0;
-        padding:18px;
-    }
-    .dashboard .card {
-        /* form card menor quando dentro do dashboard */
-        width:720px;
-        max-width: calc(100vw - 360px);
-        margin:0;
-    }
-    .right-card {
-    flex: 0 0 320px;
-    width: 320px;
-    max-width: 320px;
-    margin: 0;
-    padding: 18px;
-    }
-    @media (max-width: 920px) {
-    .dashboard { flex-direction: column; align-items: stretch; }
-    .left-card, .card, .right-card { width: 100%; max-width:none; }
-    }
-
-    h1 { margin:0 0 12px 0; font-size:20px; }
-
-    label { display:block; margin-top:12px; color:var(--muted); font-size:13px; }
-    input[type="text"], input[type="number"], select, textarea {
-        width:100%;
-        box-sizing:border-box;
-        padding:10px 12px;
-        margin-top:6px;
-        background:var(--input-bg);
-        border:1px solid var(--border);
-        color: #eaeaea;
-        border-radius:8px;
-        outline:none;
-        font-size:14px;
-    }
-    textarea { min-height:80px; resize:vertical; }
-
-    .layout { display:flex; gap:16px; align-items:flex-start; }
-    .left-panel { width:320px; flex:0 0 320px; }
-    .form-panel { flex:1; }
-
-    .two-columns { display:flex; gap:12px; }
-    .two-columns > * { flex:1; }
-
-    .four-columns { display:flex; gap:10px; align-items:flex-start; }
-    .four-columns > * { flex:1; }
-    .four-columns > .col-data { flex:1; }
-
-    .row-right { display:flex; justify-content:flex-end; gap:10px; margin-top:14px; }
-
-    button.primary {
-        background:var(--accent);
-        color:#061006;
-        border:none;
-        padding:10px 16px;
-        border-radius:8px;
-        cursor:pointer;
-        font-weight:600;
-    }
-    button.ghost {
-        background:transparent;
-        border:1px solid var(--border);
-        color:var(--muted);
-        padding:10px 12px;
-        border-radius:8px;
-        cursor:pointer;
-    }
-
-    /* botões de ação */
-    .btn-action {
-        display:inline-flex;
-        align-items:center;
-        justify-content:center;
-        width:28px;
-        height:28px;
-        padding:0;
-        box-sizing:border-box;
-        border-radius:6px;
-        font-weight:700;
-        cursor:pointer;
-        border: none;
-        font-size:16px;
-        line-height:0;
-        background:transparent;
-        color:var(--muted);
-        vertical-align: middle;
-    }
-    .btn-action svg {
-        width:18px;
-        height:18px;
-        display:block;
-        margin:0;
-        vertical-align:middle;
-    }
-    .btn-action:hover { filter:brightness(1.05); transform: translateY(-1px); }
-    .btn-devolver {
-        background: linear-gradient(180deg, #66dd88, #4caf50);
-        color:#062009;
-        border: none;
-    }
-    .btn-estender {
-        background: linear-gradient(180deg, #8fd6ff, #3aa0ff);
-        color:#022938;
-        border: none;
-    }
-    .btn-excluir {
-        background: linear-gradient(180deg, #ff8b8b, #ff6b6b);
-        color:#160000;
-        border: none;
-    }
-    .btn-excluir svg { width:18px; height:18px; display:block; margin:0; vertical-align:middle; }
-    .btn-action svg { width:16px; height:16px; display:block; margin:0; vertical-align:middle; }
-    .btn-observacao { background: linear-gradient(180deg,#ffd97a,#ffcc33); color:#082010; border:none; }
-    .btn-observacao svg { width:16px; height:16px; display:block; margin:0; vertical-align:middle; }
-
-    .topbar {
-        display:flex;
-        justify-content:space-between;
-        align-items:center;
-        margin-bottom:8px;
-    }
-    .link-lista {
-        color:var(--muted);
-        text-decoration:none;
-        border:1px solid var(--border);
-        padding:8px 12px;
-        border-radius:8px;
-        background:transparent;
-    }
-
-    .note { font-size:13px; color:var(--muted); }
-
-    .footer-small { margin-top:16px; font-size:13px; color:var(--muted); text-align:center; }
+      <hr style="border:0;border-top:1px solid rgba(255,255,255,0.03);margin:8px 0;">
 
-    /* Modal extender */
-    #modal_extender {
-        display:none;
-        position:fixed;
-        top:0; left:0; width:100%; height:100%;
-        background:rgba(0,0,0,0.6);
-        align-items:center; justify-content:center;
-        z-index:9999;
-    }
-    #modal_box {
-        background:#1b1b1b;
-        padding:20px;
-        border-radius:10px;
-        width:320px;
-        box-shadow:0 6px 18px rgba(0,0,0,0.7);
-    }
-    #modal_box .btn-action {
-        width: auto !important;
-        height: auto !important;
-        padding:8px 12px !important;
-        border-radius:8px !important;
-        font-size:14px !important;
-        line-height:1 !important;
-        display:inline-flex !important;
-        align-items:center !important;
-        justify-content:center !important;
-        background:transparent !important;
-        color:var(--muted) !important;
-        box-sizing:border-box;
-    }
-    .btn-small-ghost {
-        background:transparent;
-        border:1px solid var(--border);
-        color:var(--muted);
-        padding:8px 12px;
-        border-radius:8px;
-        cursor:pointer;
-    }
+      <div>
+        <form method="POST" action="/admin_arquivar" onsubmit="return confirm('Mover para o arquivo os registros devolvidos/ocultos sem atividade há mais dias que o informado?');">
+          <label style="font-size:13px;color:var(--muted);">Arquivar encerrados com mais de (dias)</label>
+          <input name="idade_dias" type="number" min="0" value="{{idade_arquivamento}}" style="width:100%;padding:8px;border-radius:8px;margin-top:6px;border:1px solid var(--border);background:#101010;color:#eaeaea;" required />
+          <div style="display:flex;justify-content:flex-end;margin-top:8px;">
+            <button type="submit" style="background:#455a64;color:#fff;border:none;padding:8px 10px;border-radius:8px;cursor:pointer;">Arquivar</button>
+          </div>
+        </form>
+      </div>
 
-    /* Força layout da tabela de observações para respeitar colgroup */
-    #modal_obs table#obs_table,
-    #modal_extender table#obs_table {
-      table-layout: fixed !important;
-      width: 100% !important;
-      border-collapse: collapse;
-    }
+      <hr style="border:0;border-top:1px solid rgba(255,255,255,0.03);margin:8px 0;">
 
-    #modal_obs table#obs_table col:first-child,
-    #modal_extender table#obs_table col:first-child {
-      width: 130px !important;
-    }
+      <div>
+        <form id="form_importar" onsubmit="return adminImportarCsv(this);">
+          <label style="font-size:13px;color:var(--muted);">Importar movimentações (CSV)</label>
+          <div style="font-size:12px;color:var(--muted);margin-top:6px;margin-bottom:6px;">
+            Cabeçalho com os campos do formulário (tipo, responsavel, patrimonio, motivo, hardware, data_inicio, observacao...). Cada linha passa pelas mesmas validações do registro.
+          </div>
+          <input name="arquivo" type="file" accept=".csv,text/csv" style="width:100%;margin-top:6px;color:#eaeaea;" required />
+          <div style="display:flex;justify-content:flex-end;margin-top:8px;">
+            <button type="submit" style="background:#6a1b9a;color:#fff;border:none;padding:8px 10px;border-radius:8px;cursor:pointer;">Importar</button>
+          </div>
+          <pre id="importar_relatorio" style="display:none;white-space:pre-wrap;font-size:12px;max-height:200px;overflow:auto;background:#101010;border:1px solid var(--border);border-radius:8px;padding:8px;"></pre>
+        </form>
+      </div>
 
-    #modal_obs table#obs_table col:last-child,
-    #modal_extender table#obs_table col:last-child {
-      width: auto !important;
-    }
+    </div>
 
-    #modal_obs table#obs_table td:first-child,
-    #modal_extender table#obs_table td:first-child {
-      white-space: nowrap;
-      overflow: hidden;
-      text-overflow: ellipsis;
-    }
+    """ + tag_js("admin.js") + """
+""")
 
-    /* responsividade: empilha em telas pequenas */
-    @media (max-width: 920px) {
-        .layout { flex-direction:column; }
-        .left-panel { width:100%; flex-basis:auto; }
+_TPL_FORM = Template("""
+<!doctype html>
+<html lang="pt-BR">
+<head>
+<meta charset="utf-8">
+<meta name="viewport" content="width=device-width,initial-scale=1">
+<title>Controle de Hardware DEPPEN</title>
 
-        /* empilhar dashboard em mobile: painel de pendências acima do formulário */
-        .dashboard { flex-direction:column; align-items:stretch; padding:0 12px; }
-        .left-card { order: -1; width:100%; max-width:100%; margin-bottom:12px; }
-        .dashboard .card { width:100%; max-width:100%; }
-        .four-columns { flex-direction:column; }
-    }
+""" + tags_flatpickr_css() + """
 
-</style>
+""" + tag_css("form.css") + """
 </head>
 <body>
 
@@ -898,7 +3506,7 @@ def gerar_html_form(registros, current_user=None):
       <h1>Painel de Pendências</h1>
     </div>
     <div id="mini_pendencias">
-""" + pendencias_html + """
+{{pendencias}}
     </div>
   </div>
 
@@ -908,7 +3516,8 @@ def gerar_html_form(registros, current_user=None):
       <h1>Registrar Movimentação</h1>
       <div style="display:flex;gap:10px;align-items:center;">
         <a class="link-lista" href="/lista">Ver Registros</a>
-        <span style="color:var(--muted);font-size:13px;">{user_display}</span>
+        <a class="link-lista" href="/estatisticas">Estatísticas</a>
+        <span style="color:var(--muted);font-size:13px;">{{usuario}}</span>
         <a class="link-lista" href="/logout" style="margin-left:6px;">Sair</a>
       </div>
     </div>
@@ -931,7 +3540,7 @@ def gerar_html_form(registros, current_user=None):
         <label>Responsável</label>
         <select name="responsavel" id="responsavel" required>
             <option value="" disabled selected>Selecione o responsável...</option>
-""" + responsaveis_html + """
+""" + _OPCOES_RESPONSAVEIS + """
         </select>
 
         <div class="four-columns">
@@ -1013,7 +3622,7 @@ def gerar_html_form(registros, current_user=None):
   </div>
 
   <!-- Painel de Manutenção (aparecerá apenas para admin) -->
-""" + (admin_panel_html if current_user and str(current_user).lower() == "admin" else "") + """
+{{painel_admin}}
 </div>
 
 <!-- Modal Extender / Observação ficam inalterados -->
@@ -1123,833 +3732,119 @@ def gerar_html_form(registros, current_user=None):
   </div>
 </div>
 
-<script src="https://cdn.jsdelivr.net/npm/flatpickr"></script>
-<script src="https://cdn.jsdelivr.net/npm/flatpickr/dist/l10n/pt.js"></script>
-<script>
-    // Atualização automática do painel de pendências (a cada 20s)
-    const ATUALIZA_INTERVAL_MS = 20000;
-    async function atualizarAtrasos() {
-        try {
-            const res = await fetch('/atrasos');
-            if (res.status === 401) {
-                window.location.href = '/login';
-                return;
-            }
-            if (!res.ok) return;
-            const html = await res.text();
-            const el = document.getElementById('mini_pendencias');
-            if (el) el.innerHTML = html;
-        } catch (e) {
-            console.error('Erro atualizando pendências:', e);
-        }
-    }
-    setInterval(atualizarAtrasos, ATUALIZA_INTERVAL_MS);
-
-    function initFlatpickrBR(selector) {
-        flatpickr(selector, {
-            enableTime: true,
-            time_24hr: true,
-            dateFormat: "d/m/Y H:i",
-            locale: "pt",
-            theme: "light",  // Força tema claro
-            // Desabilita a detecção automática de tema escuro
-            onReady: function(selectedDates, dateStr, instance) {
-                // Remove qualquer classe de tema escuro que possa ter sido adicionada
-                instance.calendarContainer.classList.remove("flatpickr-dark");
-                instance.calendarContainer.classList.add("flatpickr-light");
-            }
-        });
-    }
-
-    document.addEventListener('DOMContentLoaded', function() {
-        try {
-            function pad(n){ return n.toString().padStart(2, '0'); }
-            function formatBRDate(d){
-                return pad(d.getDate()) + '/' + pad(d.getMonth()+1) + '/' + d.getFullYear()
-                    + ' ' + pad(d.getHours()) + ':' + pad(d.getMinutes());
-            }
-            document.getElementById("data_inicio").value = formatBRDate(new Date());
-        } catch (e) {
-            console.error('Erro ao setar data_inicio:', e);
-        }
-        // preencher registrado_em com data do cliente antes de enviar formulários
-        try {
-            var mainForm = document.getElementById('mainForm');
-            if (mainForm) {
-                mainForm.addEventListener('submit', function(){
-                    try { document.getElementById('registrado_em_main').value = formatBRDate(new Date()); } catch(e){}
-                });
-            }
-        } catch(e){}
-
-        try {
-            var formObs = document.getElementById('form_add_obs');
-            if (formObs) {
-                formObs.addEventListener('submit', function(){
-                    try { document.getElementById('registrado_em_obs').value = formatBRDate(new Date()); } catch(e){}
-                });
-            }
-        } catch(e){}
-
-        try {
-            function detectClientUser() {
-                try {
-                    if (window.ActiveXObject || "ActiveXObject" in window) {
-                        var net = new ActiveXObject("WScript.Network");
-                        return net.UserName || "";
-                    }
-                } catch(e) {}
-                return "";
-            }
-            var cu = detectClientUser();
-            var el = document.getElementById("client_user");
-            if (el) el.value = cu;
-        } catch(e) { console.warn("detecção usuário cliente falhou:", e); }
-
-        initFlatpickrBR("#data_inicio");
-        initFlatpickrBR("#data_retorno");
-        initFlatpickrBR("#extender_data");
-
-        atualizarAtrasos();
-
-        try {
-            toggleOutroMotivo();
-            toggleOutroHardware();
-            toggleEmprestimoCampos();
-        } catch (e) {}
-    });
-
-    function toggleOutroMotivo() {
-        const show = document.getElementById("motivo_select").value === "outros";
-        document.getElementById("motivo_outros_div").style.display = show ? "block" : "none";
-        if (show) document.getElementById("motivo_outros").required = true;
-        else document.getElementById("motivo_outros").required = false;
-    }
-
-    function toggleOutroHardware() {
-        const show = document.getElementById("hardware_select").value === "outros";
-        document.getElementById("hardware_outros_div").style.display = show ? "block" : "none";
-        if (show) document.getElementById("hardware_outros").required = true;
-        else document.getElementById("hardware_outros").required = false;
-    }
-
-    function toggleEmprestimoCampos() {
-        const tipo = document.getElementById("tipo").value;
-        const area = document.getElementById("area_emprestimo");
-        if (tipo === "emprestimo") {
-            area.style.display = "block";
-            document.getElementById("emprestado_para").required = true;
-            document.getElementById("data_retorno").required = true;
-        } else {
-            area.style.display = "none";
-            document.getElementById("emprestado_para").required = false;
-            document.getElementById("data_retorno").required = false;
-        }
-    }
-
-    function validarFormulario() {
-        const patr = document.getElementById("patrimonio").value.trim();
-        const hardware = document.getElementById("hardware_select").value;
-        
-        // Se não for Teclado/Mouse e o patrimônio foi preenchido, valida
-        if (hardware !== "Teclado/Mouse" && patr !== "") {
-            if (!/^[0-9]{7,}$/.test(patr)) {
-                alert("Patrimônio inválido. Digite apenas números e no mínimo 7 dígitos.");
-                return false;
-            }
-        }
-        // Se for Teclado/Mouse, o patrimônio é opcional, mas se preenchido deve ser válido
-        else if (hardware === "Teclado/Mouse" && patr !== "") {
-            if (!/^[0-9]{7,}$/.test(patr)) {
-                alert("Patrimônio inválido. Digite apenas números e no mínimo 7 dígitos, ou deixe em branco para Teclado/Mouse.");
-                return false;
-            }
-        }
-
-        const workflow = document.getElementById("workflow").value.trim();
-        if (workflow) {
-            if (!/^(?:P-\\d{7}|P-\\d{5}-\\d{2})$/i.test(workflow)) {
-                alert("Workflow inválido. Formatos aceitos: P-1234567 ou P-12345-00.");
-                return false;
-            }
-        }
+""" + tags_flatpickr_js() + """
+""" + tag_js("comum.js") + """
+""" + tag_js("form.js") + """
 
-        const origem = document.getElementById("origem").value.trim();
-        if (origem && origem.length > 10) {
-            alert("Origem deve ter no máximo 10 caracteres.");
-            return false;
-        }
+</body>
+</html>
+""")
 
-        return true;
-    }
 
-    function limparFormulario() {
-        document.getElementById("mainForm").reset();
-        try {
-            document.querySelectorAll('.flatpickr-input').forEach(i => i.value = "");
-        } catch (e) {}
-    }
+def gerar_html_form(registros, current_user=None):
+    # não preencher aqui com a hora do servidor — o cliente (navegador) preencherá com sua hora local
 
-    function abrirExtensao(id, current_date_br = "") {
-        document.getElementById("extender_id").value = id;
-        document.getElementById("extender_data").value = current_date_br || "";
-        document.getElementById("modal_extender").style.display = "flex";
-    }
-    function fecharExtensao() {
-        document.getElementById("modal_extender").style.display = "none";
-    }
+    # pendencias (inclui atrasos no topo)
+    with medir_fase("gerar_pendencias_html"):
+        pendencias_html = gerar_pendencias_html(registros)
 
-    function abrirObs(id, obs_json){
-        try{
-            var list = [];
-            if (typeof obs_json === 'string') {
-                try { list = JSON.parse(obs_json); } catch (e) { list = []; }
-            } else if (Array.isArray(obs_json)) {
-                list = obs_json;
-            } else if (obs_json && typeof obs_json === 'object') {
-                if (Array.isArray(obs_json)) list = obs_json;
-                else list = [];
-            }
-            var tbody = document.querySelector('#obs_table tbody');
-            tbody.innerHTML = '';
-            if (!list || list.length === 0){
-                var tr = document.createElement('tr');
-                tr.innerHTML = '<td style="padding:6px;border-bottom:1px solid #222;color:var(--muted);" colspan="2">Nenhuma observação registrada.</td>';
-                tbody.appendChild(tr);
-            } else {
-                list.forEach(function(o){
-                    var date = o.registrado_em || '';
-                    var text = o.text || '';
-                    var tr = document.createElement('tr');
-                    tr.innerHTML = "<td style='padding:6px;border-bottom:1px solid #222;vertical-align:top;white-space:nowrap;color:var(--muted);'>"+ date +"</td>" +
-                                   "<td style='padding:6px;border-bottom:1px solid #222;white-space:pre-wrap;'>"+ (text || '') +"</td>";
-                    tbody.appendChild(tr);
-                });
-            }
-            try{ document.getElementById('obs_record_id').value = id; }catch(e){}
-            try{ document.getElementById('obs_text').value = ''; }catch(e){}
-            document.getElementById('modal_obs').style.display = 'flex';
-        }catch(e){ console.error('abrirObs erro', e); }
-    }
-    function fecharObs(){ try{ document.getElementById('modal_obs').style.display = 'none'; }catch(e){} }
-
-    // abrir modal de edição (os dados chegam serializados como objeto)
-    function abrirEditar(id, record) {
-        try {
-            const modal = document.getElementById("modal_edit");
-            if (!modal) return;
-            document.getElementById("edit_id").value = id;
-            document.getElementById("edit_id_display").innerText = "#" + id;
-
-            // preencher campos (verifica existência)
-            const setVal = (el, v) => { if (el) el.value = v || ""; }
-            setVal(document.getElementById("edit_tipo"), record.tipo || "");
-            setVal(document.getElementById("edit_responsavel"), record.responsavel || "");
-            setVal(document.getElementById("edit_patrimonio"), record.patrimonio || "");
-            setVal(document.getElementById("edit_workflow"), record.workflow || "");
-            setVal(document.getElementById("edit_origem"), record.origem || "");
-            setVal(document.getElementById("edit_motivo"), record.motivo || "");
-            setVal(document.getElementById("edit_hardware"), record.hardware || "");
-            setVal(document.getElementById("edit_marca"), record.marca || "");
-            setVal(document.getElementById("edit_modelo"), record.modelo || "");
-            setVal(document.getElementById("edit_emprestado_para"), record.emprestado_para || "");
-            // datas: setar valor compatível com flatpickr (d/m/Y H:i)
-            setVal(document.getElementById("edit_data_inicio"), record.data_inicio || "");
-            setVal(document.getElementById("edit_data_retorno"), record.data_retorno || "");
-
-            // inicializar flatpickr nos campos caso ainda não tenha
-            try {
-                if (window.flatpickr) {
-                    if (!document.querySelector("#edit_data_inicio")._flatpickr) {
-                        flatpickr("#edit_data_inicio", { enableTime:true, time_24hr:true, dateFormat:"d/m/Y H:i", locale:"pt", theme:"light" });
-                    }
-                    if (!document.querySelector("#edit_data_retorno")._flatpickr) {
-                        flatpickr("#edit_data_retorno", { enableTime:true, time_24hr:true, dateFormat:"d/m/Y H:i", locale:"pt", theme:"light" });
-                    }
-                    // setar datas se vierem
-                    try { document.querySelector("#edit_data_inicio")._flatpickr.setDate(record.data_inicio || null, true); } catch(e){}
-                    try { document.querySelector("#edit_data_retorno")._flatpickr.setDate(record.data_retorno || null, true); } catch(e){}
-                }
-            } catch(e){ console.warn("flatpickr:", e); }
-
-            modal.style.display = "flex";
-        } catch(e) {
-            console.error("abrirEditar erro:", e);
-        }
-    }
+    painel_admin = ""
+    if current_user and str(current_user).lower() == "admin":
+        # options dos selects de usuários (fragmento em cache até users.json mudar)
+        painel_admin = _TPL_PAINEL_ADMIN.iterar(opcoes_usuarios=fragmento_usuarios("admin", _opcoes_admin),
+                                                idade_arquivamento=str(ARQUIVAMENTO_IDADE_DIAS))
 
-    function fecharEditar() {
-        const modal = document.getElementById("modal_edit");
-        if (!modal) return;
-        modal.style.display = "none";
-    }
+    return _TPL_FORM.render(
+        pendencias=pendencias_html,
+        usuario=f"Olá, {current_user}" if current_user else "",
+        painel_admin=painel_admin,
+    )
 
-    document.addEventListener("DOMContentLoaded", function() {
-    });
-
-    // Funções para o modal de edição
-    window.abrirEditar = function(id, record) {
-        try {
-            const modal = document.getElementById("modal_edit");
-            if (!modal) return;
-            document.getElementById("edit_id").value = id;
-            document.getElementById("edit_id_display").innerText = "#" + id;
-
-            // Preenche campos
-            const setVal = (el, v) => { if (el) el.value = v || ""; };
-            setVal(document.getElementById("edit_tipo"), record.tipo || "");
-            setVal(document.getElementById("edit_responsavel"), record.responsavel || "");
-            setVal(document.getElementById("edit_patrimonio"), record.patrimonio || "");
-            setVal(document.getElementById("edit_workflow"), record.workflow || "");
-            setVal(document.getElementById("edit_origem"), record.origem || "");
-            setVal(document.getElementById("edit_motivo"), record.motivo || "");
-            setVal(document.getElementById("edit_hardware"), record.hardware || "");
-            setVal(document.getElementById("edit_marca"), record.marca || "");
-            setVal(document.getElementById("edit_modelo"), record.modelo || "");
-            setVal(document.getElementById("edit_emprestado_para"), record.emprestado_para || "");
-            setVal(document.getElementById("edit_data_inicio"), record.data_inicio || "");
-            setVal(document.getElementById("edit_data_retorno"), record.data_retorno || "");
-
-            // Inicializa flatpickr nos campos de data se ainda não tiver
-            try {
-                if (window.flatpickr) {
-                    if (!document.querySelector("#edit_data_inicio")._flatpickr) {
-                        flatpickr("#edit_data_inicio", { enableTime:true, time_24hr:true, dateFormat:"d/m/Y H:i", locale:"pt", theme:"light" });
-                    }
-                    if (!document.querySelector("#edit_data_retorno")._flatpickr) {
-                        flatpickr("#edit_data_retorno", { enableTime:true, time_24hr:true, dateFormat:"d/m/Y H:i", locale:"pt", theme:"light" });
-                    }
-                    // Força a data no flatpickr
-                    document.querySelector("#edit_data_inicio")._flatpickr.setDate(record.data_inicio || null, true);
-                    document.querySelector("#edit_data_retorno")._flatpickr.setDate(record.data_retorno || null, true);
-                }
-            } catch(e) { console.warn("flatpickr edit:", e); }
-
-            modal.style.display = "flex";
-        } catch(e) {
-            console.error("Erro ao abrir editar:", e);
-        }
-    };
 
-    window.fecharEditar = function() {
-        const modal = document.getElementById("modal_edit");
-        if (modal) modal.style.display = "none";
-    };
+# ----------------------------- ESTATÍSTICAS (dashboard) -----------------------------
+# Página estática: os números vêm de /api/estatisticas (contadores já materializados).
+_TPL_ESTATISTICAS = Template("""
+<!doctype html>
+<html lang="pt-BR">
+<head>
+<meta charset="utf-8">
+<meta name="viewport" content="width=device-width,initial-scale=1">
+<title>Estatísticas</title>
+""" + tag_css("estatisticas.css") + """
+</head>
+<body>
+<div class="container">
+    <div class="top">
+        <div>
+            <h1>Estatísticas</h1>
+            <div class="small">{{usuario}} · atualizado <span id="atualizado_em">—</span></div>
+        </div>
+        <div style="display:flex; gap:8px; align-items:center;">
+            <select id="periodo" title="Série">
+                <option value="dia" selected>Por dia (30 dias)</option>
+                <option value="semana">Por semana (12 semanas)</option>
+            </select>
+            <select id="dimensao" title="Agrupar por">
+                <option value="tipo" selected>Tipo</option>
+                <option value="hardware">Hardware</option>
+                <option value="motivo">Motivo</option>
+                <option value="responsavel">Responsável</option>
+            </select>
+            <a class="btn ghost" href="/lista">Registros</a>
+            <a class="btn ghost" href="/">Voltar</a>
+        </div>
+    </div>
 
-</script>
+    <div class="cards">
+        <div class="card-num"><div class="rotulo">Empréstimos ativos</div><div class="valor" id="n_ativos">—</div></div>
+        <div class="card-num alerta"><div class="rotulo">Empréstimos atrasados</div><div class="valor" id="n_atrasados">—</div></div>
+        <div class="card-num"><div class="rotulo">Em estoque</div><div class="valor" id="n_estoque">—</div></div>
+        <div class="card-num"><div class="rotulo">Duração média do empréstimo</div><div class="valor" id="n_duracao">—</div></div>
+        <div class="card-num"><div class="rotulo">Registros</div><div class="valor" id="n_registros">—</div></div>
+    </div>
 
+    <div class="painel">
+        <h3>Movimentações <span class="small" id="legenda_serie"></span></h3>
+        <div id="serie" class="serie"></div>
+    </div>
+    <div class="painel">
+        <h3>Total por <span id="titulo_totais">tipo</span></h3>
+        <div id="totais" class="totais"></div>
+    </div>
+</div>
+""" + tag_js("estatisticas.js") + """
 </body>
 </html>
-"""
-    user_display = f"Olá, {current_user}" if current_user else ""
-    html = html.replace("{user_display}", user_display)
-    return html
+""")
 
 
 # ----------------------------- LISTA / REGISTROS PAGE -----------------------------
-def gerar_pagina_lista(registros, current_user=None):
-    """
-    Gera a página /lista com a tabela de registros e modal de edição.
-    current_user: nome do usuário atual (string) — usado para liberar ações de admin.
-    """
-    # montar options de responsáveis (usado no modal de edição e no modal de exportação)
-    responsaveis_options = ""
-    for r in RESPONSAVEIS:
-        responsaveis_options += '<option value="{}">{}</option>'.format(r, r)
-
-    # calcular pendências/atrasos similar a gerar_pendencias_html
-    now = sp_now_naive()
-    workflow_map = {}
-    for rec in registros:
-        wf = (rec.get("workflow") or "").strip()
-        if wf:
-            workflow_map.setdefault(wf, []).append(rec)
-
-    atrasos_ids = set()
-    for rec in registros:
-        if rec.get("oculto", False) or rec.get("estoque", False) or rec.get("devolvido", False):
-            continue
-        if rec.get("tipo") == "emprestimo" and not rec.get("devolvido", False):
-            dt_raw = rec.get("data_retorno", "")
-            dt = parse_br_datetime(dt_raw)
-            if dt and dt <= now:
-                atrasos_ids.add(str(rec.get("id", "")))
-
-    pendencias_ids = set()
-    for rec in registros:
-        if rec.get("oculto", False) or rec.get("estoque", False) or rec.get("devolvido", False):
-            continue
-        if rec.get("tipo") != "entrada":
-            continue
-        motivo = (rec.get("motivo") or "").strip().lower()
-        if motivo in ("outros", "outro", "other"):
-            continue
-        data_inicio_raw = rec.get("data_inicio", "")
-        dt_inicio = parse_br_datetime(data_inicio_raw)
-        if not dt_inicio:
-            continue
-        delta_days = (now - dt_inicio).days
-        if delta_days < 7:
-            continue
-
-        wf = (rec.get("workflow") or "").strip()
-        tem_saida_com_wf = False
-        if wf:
-            others = workflow_map.get(wf, [])
-            for o in others:
-                if o is rec:
-                    continue
-                if o.get("tipo") == "saida" and not o.get("oculto", False):
-                    tem_saida_com_wf = True
-                    break
-
-        last_obs_date = None
-        try:
-            obs_list = rec.get("observacoes", []) or []
-            for ob in obs_list:
-                reg_em = ob.get("registrado_em") or ob.get("registered_at") or ""
-                dt_obs = parse_br_datetime(reg_em)
-                if dt_obs:
-                    if (last_obs_date is None) or dt_obs > last_obs_date:
-                        last_obs_date = dt_obs
-        except Exception:
-            last_obs_date = None
-
-        obs_antiga = True
-        if last_obs_date:
-            obs_antiga = (now - last_obs_date).days >= 7
-        else:
-            obs_antiga = True
-
-        if (not tem_saida_com_wf) and obs_antiga:
-            pendencias_ids.add(str(rec.get("id", "")))
-
-    # gera linhas da tabela
-    linhas = ""
-    for r in registros:
-        id_ = r.get("id", "")
-        tipo = r.get("tipo", "") or ""
-        responsavel = r.get("responsavel", "") or ""
-        patrimonio = r.get("patrimonio", "") or ""
-        workflow = r.get("workflow", "") or ""
-        origem = r.get("origem", "") or ""
-        motivo = r.get("motivo", "") or ""
-        hardware = r.get("hardware", "") or ""
-        marca = r.get("marca", r.get("marca_modelo", "")) or ""
-        modelo = r.get("modelo", "") or ""
-        data_inicio = r.get("data_inicio", "") or ""
-        emprestado_para = r.get("emprestado_para", "") or ""
-        data_retorno = r.get("data_retorno", "") or ""
-        devolvido = bool(r.get("devolvido", False))
-        estoque = bool(r.get("estoque", False))
-        oculto = bool(r.get("oculto", False))
-
-        id_str = str(id_)
-
-        # cálculo de atraso
-        atrasado = False
-        atraso_html = ""
-        try:
-            now_min = sp_now_naive()
-            if tipo == "emprestimo" and not devolvido:
-                dt_ret = parse_br_datetime(data_retorno)
-                if dt_ret and dt_ret <= now_min:
-                    atrasado = True
-                    atraso_html = f"<span style='color:#ff6b6b;font-weight:700;'>Atrasado ({dt_ret.strftime('%d/%m/%Y')})</span>"
-        except Exception:
-            atrasado = False
-            atraso_html = ""
-
-        # serializar observações (para modal)
-        try:
-            obs_list = r.get("observacoes", []) or []
-            safe_obs_json = json.dumps(obs_list, ensure_ascii=False).replace("</", "<\\/").replace("'", "\\'")
-        except Exception:
-            safe_obs_json = "[]"
-
-        # ---------- Lógica para exibir botão de edição ----------
-        pode_editar = False
-        if current_user and str(current_user).lower() == "admin":
-            pode_editar = True
-        else:
-            # verifica se o usuário atual é o criador do registro
-            criador = r.get("oculto_meta", {}).get("registrado_por")
-            if criador and str(criador).lower() == str(current_user).lower():
-                # verifica se ainda está dentro do prazo de 24h
-                registrado_em_str = r.get("oculto_meta", {}).get("registrado_em")
-                if registrado_em_str:
-                    dt_registro = parse_br_datetime(registrado_em_str)
-                    if dt_registro:
-                        agora = sp_now_naive()
-                        diferenca = agora - dt_registro
-                        if diferenca.total_seconds() < 24 * 3600:
-                            # verifica se não há observações
-                            if not r.get("observacoes"):
-                                pode_editar = True
-
-        # botões
-        botao_observacao = (
-            f'<span style="display:inline-flex;align-items:center;">'
-            f'<button class="btn-action btn-observacao" title="Ver observações" onclick=\'abrirObs({id_}, {safe_obs_json})\' type="button">'
-            '<svg viewBox="0 0 24 24" xmlns="http://www.w3.org/2000/svg" aria-hidden="true" focusable="false">'
-            '<path fill="currentColor" d="M12 4.5C7 4.5 2.73 7.61 1 12c1.73 4.39 6 7.5 11 7.5s9.27-3.11 11-7.5c-1.73-4.39-6-7.5-11-7.5zm0 12.5c-2.76 0-5-2.24-5-5s2.24-5 5-5 5 2.24 5 5-2.24 5-5 5z"/>'
-            '</svg>'
-            '</button>'
-            '</span>'
-        )
-
-        botao_devolver = ""
-        botao_extender = ""
-        botao_estoque = ""
-        if not devolvido:
-            botao_devolver = (
-                '<form method="POST" action="/retornar" style="display:inline-flex;align-items:center;margin:0;">'
-                f'<input type="hidden" name="id" value="{id_}">'
-                '<button type="submit" class="btn-action btn-devolver" title="Retornar máquina">'
-                '<svg viewBox="0 0 24 24" xmlns="http://www.w3.org/2000/svg" aria-hidden="true" focusable="false">'
-                '<path fill="currentColor" d="M9 16.2 4.8 12l-1.4 1.4L9 19l12-12-1.4-1.4z"/>'
-                '</svg>'
-                '</button>'
-                '</form>'
-            )
-            if tipo == "emprestimo":
-                data_retorno_br = normalize_br_datetime_str(data_retorno) if data_retorno else ""
-                safe_data = data_retorno_br.replace("'", "\\'")
-                botao_extender = (
-                    f'<span style="display:inline-flex;align-items:center;">'
-                    f'<button class="btn-action btn-estender" title="Estender empréstimo" onclick="abrirExtensao({id_}, \'{safe_data}\')" type="button">'
-                    '<svg viewBox="0 0 24 24" xmlns="http://www.w3.org/2000/svg" aria-hidden="true" focusable="false">'
-                    '<path fill="currentColor" d="M12 6V3L8 7l4 4V8c2.76 0 5 2.24 5 5 0 .34-.03.67-.09.99L19 14.5c.06-.33.09-.67.09-1.01 0-4.42-3.58-8-8-8zM6.09 9.01C6.03 9.33 6 9.66 6 10c0 4.42 3.58 8 8 8v3l4-4-4-4v3c-3.31 0-6-2.69-6-6 0-.34.03-.67.09-.99L6.09 9.01z"/>'
-                    '</svg>'
-                    '</button>'
-                    '</span>'
-                )
-        if tipo == "entrada" and not devolvido:
-            estoque_status = "Remover do estoque" if estoque else "Colocar em estoque"
-            botao_estoque = (
-                f'<form method="POST" action="/alternar_estoque" style="display:inline-flex;align-items:center;margin:0;">'
-                f'<input type="hidden" name="id" value="{id_}">'
-                f'<button type="submit" class="btn-action btn-estoque" title="{estoque_status}">'
-                '<svg viewBox="0 0 24 24" xmlns="http://www.w3.org/2000/svg" aria-hidden="true" focusable="false">'
-                '<path fill="currentColor" d="M21 16.5c0 .38-.21.71-.53.88l-7.9 4.44c-.16.12-.36.18-.57.18-.21 0-.41-.06-.57-.18l-7.9-4.44A.991.991 0 0 1 3 16.5v-9c0-.38.21-.71.53-.88l7.9-4.44c.16-.12.36-.18.57-.18.21 0 .41.06.57.18l7.9 4.44c.32.17.53.5.53.88v9zM12 4.15L6.04 7.5 12 10.85l5.96-3.35L12 4.15zM5 15.91l6 3.38v-6.71L5 9.21v6.7zm14 0v-6.7l-6 3.37v6.71l6-3.38z"/>'
-                '</svg>'
-                '</button>'
-                '</form>'
-            )
-
-        botao_excluir = (
-            '<form method="POST" action="/ocultar" style="display:inline-flex;align-items:center;" '
-            'onsubmit="return confirm(\'Tem certeza que deseja apagar este registro?\');">'
-            f'<input type="hidden" name="id" value="{id_}">'
-            '<button type="submit" class="btn-action btn-excluir" title="Apagar registro">'
-            '<svg viewBox="0 0 24 24" xmlns="http://www.w3.org/2000/svg" aria-hidden="true" focusable="false">'
-            '<path fill="#000" d="M9 3v1H4v2h16V4h-5V3H9zm1 6v8h2V9H10zm4 0v8h2V9h-2zM7 9v8h2V9H7z"/>'
-            '</svg>'
-            '</button>'
-            '</form>'
-        )
-
-        # botão Editar
-        botao_editar = ""
-        if pode_editar:
-            try:
-                record_for_js = {
-                    "id": id_,
-                    "tipo": tipo,
-                    "responsavel": responsavel,
-                    "patrimonio": patrimonio,
-                    "workflow": workflow,
-                    "origem": origem,
-                    "motivo": motivo,
-                    "hardware": hardware,
-                    "marca": marca,
-                    "modelo": modelo,
-                    "data_inicio": data_inicio,
-                    "emprestado_para": emprestado_para,
-                    "data_retorno": data_retorno,
-                    "devolvido": devolvido,
-                    "estoque": estoque
-                }
-                safe_record_json = json.dumps(record_for_js, ensure_ascii=False).replace("</", "<\\/").replace('"', "&quot;")
-            except Exception:
-                safe_record_json = "{}"
-
-            botao_editar = (
-                f'<span style="display:inline-flex;align-items:center;">'
-                f'<button class="btn-action btn-edit" title="Editar registro" type="button" data-record="{safe_record_json}">'
-                '<svg viewBox="0 0 24 24" xmlns="http://www.w3.org/2000/svg" aria-hidden="true" focusable="false">'
-                '<path fill="currentColor" d="M3 17.25V21h3.75L17.81 9.94l-3.75-3.75L3 17.25zM20.71 7.04a1.003 1.003 0 0 0 0-1.42l-2.34-2.34a1.003 1.003 0 0 0-1.42 0l-1.83 1.83 3.75 3.75 1.84-1.82z"/>'
-                '</svg>'
-                '</button>'
-                '</span>'
-            )
-
-        # botão Restaurar (admin, apenas se oculto)
-        botao_restaurar = ""
-        if oculto and current_user and str(current_user).lower() == "admin":
-            botao_restaurar = (
-                '<form method="POST" action="/restaurar" style="display:inline-flex;align-items:center;">'
-                f'<input type="hidden" name="id" value="{id_}">'
-                '<button type="submit" class="btn-action btn-restore" title="Restaurar registro">'
-                '<svg viewBox="0 0 24 24" xmlns="http://www.w3.org/2000/svg" aria-hidden="true" focusable="false">'
-                '<path fill="currentColor" d="M10 9V5l-7 7 7 7v-4.1c5 0 8.5 1.6 11 5.1-1-5-4-10-11-11z"/>'
-                '</svg>'
-                '</button>'
-                '</form>'
-            )
-
-        # prioridade do status
-        if oculto:
-            status = "<span style='color:#ff5050;font-weight:700;'>Excluído</span>"
-        else:
-            if devolvido:
-                if r.get("status_extra"):
-                    status = r.get("status_extra")
-                else:
-                    status = "Devolvido"
-            elif atrasado:
-                status = atraso_html
-            elif estoque and tipo == "entrada":
-                status = "Em estoque"
-            else:
-                status = "Ativo" if tipo == "emprestimo" else ""
-
-        is_pendencia = id_str in pendencias_ids or id_str in atrasos_ids
-        is_atraso = id_str in atrasos_ids
-
-        tr_class = "oculto-row" if oculto else ""
-        linhas += (
-            f'<tr class="{tr_class}" data-id="{id_}" data-devolvido="{str(devolvido).lower()}" '
-            f'data-estoque="{str(estoque).lower()}" data-oculto="{str(oculto).lower()}" '
-            f'data-pendencia="{str(is_pendencia).lower()}" data-atraso="{str(is_atraso).lower()}">'
-            f'<td>{id_}</td>'
-            f'<td>{tipo}</td>'
-            f'<td>{responsavel}</td>'
-            f'<td>{emprestado_para}</td>'
-            f'<td>{origem}</td>'
-            f'<td>{patrimonio}</td>'
-            f'<td>{workflow}</td>'
-            f'<td>{motivo}</td>'
-            f'<td>{hardware}</td>'
-            f'<td>{marca}</td>'
-            f'<td>{modelo}</td>'
-            f'<td>{data_inicio or ""}</td>'
-            f'<td>{data_retorno or ""}</td>'
-            f'<td>{status}</td>'
-            f'<td><div style="display:flex;gap:8px;align-items:center;">{botao_devolver}{botao_extender}{botao_observacao}{botao_estoque}{botao_editar}{botao_restaurar}{botao_excluir}</div></td>'
-            '</tr>'
-        )
-
-    page = """
+_TPL_LISTA = Template("""
 <!doctype html>
 <html lang="pt-BR">
 <head>
 <meta charset="utf-8">
 <meta name="viewport" content="width=device-width,initial-scale=1">
 <title>Registros Cadastrados</title>
-<link rel="stylesheet" href="https://cdn.jsdelivr.net/npm/flatpickr/dist/flatpickr.min.css">
-<style>
-    :root {
-        --bg:#0f0f10; --card:#111; --muted:#9aa0a6; --border:#222; --accent:#4caf50;
-        --accent-2:#3aa0ff; --input-bg: #1f1f20;
-    }
-    body { background:var(--bg); color:#eaeaea; font-family:Inter, Arial; margin:0; padding:20px; }
-    .container { max-width:calc(100vw - 40px); margin:0 auto; }
-    h1 { margin:0 0 10px 0; }
-    .top { display:flex; justify-content:space-between; align-items:center; gap:10px; margin-bottom:14px; flex-wrap:wrap; }
-    .search { padding:8px 10px; border-radius:8px; border:1px solid var(--border); background:#121212; color:#eee; min-width:220px; }
-    .btn { padding:8px 10px; border-radius:8px; cursor:pointer; border:none; background:var(--accent); color:#071007; font-weight:700; }
-    .btn.ghost { background:transparent; border:1px solid var(--border); color:var(--muted); }
-    .table-wrap { overflow-x: visible; }
-    table { width:100%; max-width:100%; border-collapse:collapse; margin-top:12px; background:#0e0e0e; border-radius:8px; overflow:visible; table-layout:fixed; }
-    colgroup col { vertical-align:top; }
-    th, td { padding:8px 9px; border-bottom:1px solid #1b1b1b; font-size:13px; white-space:normal; word-break:break-word; overflow-wrap:break-word; hyphens:auto; }
-    th { text-align:left; background:#0d0d0d; color:var(--muted); position:sticky; top:0; z-index:2; }
-    th, td { border-right:1px solid rgba(255,255,255,0.04); }
-    th:last-child, td:last-child { border-right: none; }
-    tr:nth-child(even) td { background:#0b0b0b; }
-    .small { font-size:12px; color:var(--muted); }
-    form.inline { display:inline; }
-
-    #view_selector {
-        padding:8px 10px;
-        border-radius:8px;
-        border:1px solid var(--border);
-        background:#121212;
-        color:#eee;
-        font-size:14px;
-        -webkit-appearance: none;
-        appearance: none;
-    }
-
-    tr.oculto-row td { color: #ff6b6b; }
-
-    /* BOTÕES DE AÇÃO */
-    .btn-action {
-        display: inline-flex;
-        align-items: center;
-        justify-content: center;
-        width: 22px;
-        height: 22px;
-        padding: 0;
-        box-sizing: border-box;
-        border-radius: 6px;
-        font-weight: 700;
-        cursor: pointer;
-        border: none;
-        font-size: 16px;
-        line-height: 0;
-        background: transparent;
-        color: var(--muted);
-        vertical-align: middle;
-    }
-    .btn-action svg {
-        width: 16px;
-        height: 16px;
-        display: block;
-        margin: 0;
-        vertical-align: middle;
-    }
-    .btn-action:hover {
-        filter: brightness(1.05);
-        transform: translateY(-1px);
-    }
-
-    .btn-devolver {
-        background: linear-gradient(180deg, #66dd88, #4caf50);
-        color:#062009;
-    }
-    .btn-estender {
-        background: linear-gradient(180deg, #8fd6ff, #3aa0ff);
-        color:#022938;
-    }
-    .btn-excluir {
-        background: linear-gradient(180deg, #ff8b8b, #ff6b6b);
-        color:#160000;
-    }
-    .btn-estoque {
-        background: linear-gradient(180deg, #3a6ea5, #1e3a5f);
-        color:#ffffff;
-    }
-    .btn-observacao {
-        background: linear-gradient(180deg,#ffd97a,#ffcc33);
-        color:#082010;
-    }
-    .btn-edit {
-        background: linear-gradient(180deg, #ffb347, #ff8c00) !important;
-        color: #2b1b00 !important;
-        border: 1px solid rgba(255,140,0,0.18) !important;
-        box-shadow: 0 6px 14px rgba(255,140,0,0.12) !important;
-    }
-    .btn-restore {
-        background: linear-gradient(180deg, #2e7d32, #1b5e20) !important;
-        color:#e8f5e9 !important;
-        border: 1px solid rgba(20,90,30,0.18) !important;
-        box-shadow: 0 6px 14px rgba(10,60,20,0.12) !important;
-    }
-
-    /* Modais - estilo igual ao de observações */
-    #modal_edit, #modal_extender, #modal_obs, #modal_export {
-        display:none;
-        position:fixed;
-        top:0; left:0; width:100%; height:100%;
-        background:rgba(0,0,0,0.6);
-        align-items:center;
-        justify-content:center;
-        z-index:10000;
-    }
-    .modal-inner, #modal_edit .modal-inner, #modal_obs > div, #modal_extender > div {
-        background:#1b1b1b;
-        padding:22px;
-        border-radius:10px;
-        width:720px;
-        max-width:94vw;
-        box-shadow:0 6px 18px rgba(0,0,0,0.7);
-    }
-    #modal_edit .modal-inner { width:720px; }
-    #modal_edit h3 { margin:0 0 12px 0; }
-    #modal_edit .form-grid {
-        display:grid;
-        grid-template-columns: 1fr 1fr;
-        gap:12px 20px;
-    }
-    #modal_edit .form-grid label {
-        display:block;
-        font-size:13px;
-        color:var(--muted);
-        margin-bottom:4px;
-    }
-    #modal_edit .form-grid input,
-    #modal_edit .form-grid select,
-    #modal_edit .form-grid textarea {
-        width:100%;
-        box-sizing:border-box;
-        padding:8px 10px;
-        background:var(--input-bg);
-        border:1px solid var(--border);
-        color:#eaeaea;
-        border-radius:6px;
-        outline:none;
-        font-size:14px;
-    }
-    #modal_edit .full-width {
-        grid-column: span 2;
-    }
-    #modal_edit .actions {
-        display:flex;
-        justify-content:flex-end;
-        gap:10px;
-        margin-top:20px;
-    }
-
-    /* Export Modal */
-    #modal_export .export-grid {
-        display:grid;
-        grid-template-columns: 220px 1fr;
-        gap:10px 12px;
-        align-items:center;
-    }
-    #modal_export .export-left { display:flex; align-items:center; gap:8px; color:var(--muted); font-size:14px; }
-    #modal_export .export-left input[type="checkbox"] { width:16px; height:16px; }
-    #modal_export .export-right input[type="text"],
-    #modal_export .export-right select {
-        width:100%;
-        box-sizing:border-box;
-        padding:8px 10px;
-        background:var(--input-bg);
-        border:1px solid var(--border);
-        color:#eaeaea;
-        border-radius:8px;
-        outline:none;
-        font-size:14px;
-    }
-    #modal_export .export-right select option {
-        color:#eaeaea;
-        background:#1b1b1b;
-    }
-    #modal_export .export-right .two-inline { display:flex; gap:8px; }
-    @media (max-width:640px) {
-        #modal_export .export-grid { grid-template-columns: 1fr; }
-        #modal_export .export-left { padding:8px 0; }
-    }
-</style>
+""" + tags_flatpickr_css() + """
+""" + tag_css("lista.css") + """
 </head>
 <body>
 <div class="container">
     <div class="top">
         <div>
             <h1>Registros Cadastrados</h1>
-            <div class="small">Total: {total}</div>
+            <div class="small">Total: <span id="total_registros">{{total}}</span></div>
         </div>
         <div style="display:flex; gap:8px; align-items:center; flex-wrap:wrap;">
             <input id="search" class="search" placeholder="Pesquisar (responsável, patrimônio, hardware, modelo...)">
             <select id="view_selector" title="Selecionar vista">
-                <option value="ativos" selected>Listar: Ativos</option>
-                <option value="inativos">Listar: Inativos</option>
-                <option value="estoque">Listar: Estoque</option>
-                <option value="pendentes">Listar: Pendentes</option>
-                <option value="legado">Lista: Legado</option>
-                <option value="tudo">Listar: Tudo</option>
+                <option value="ativos" data-rotulo="Listar: Ativos" selected>Listar: Ativos ({{n_ativos}})</option>
+                <option value="inativos" data-rotulo="Listar: Inativos">Listar: Inativos ({{n_inativos}})</option>
+                <option value="estoque" data-rotulo="Listar: Estoque">Listar: Estoque ({{n_estoque}})</option>
+                <option value="pendentes" data-rotulo="Listar: Pendentes">Listar: Pendentes ({{n_pendentes}})</option>
+                <option value="legado" data-rotulo="Lista: Legado">Lista: Legado ({{n_legado}})</option>
+                <option value="tudo" data-rotulo="Listar: Tudo">Listar: Tudo ({{n_tudo}})</option>
             </select>
             <button id="btnToggleOrder" class="btn ghost" type="button" title="Alternar ordem por ID">Ordem: Mais novo → antigo</button>
             <button id="btnExportCsv" class="btn" type="button">Exportar CSV</button>
@@ -1957,12 +3852,23 @@ def gerar_pagina_lista(registros, current_user=None):
         </div>
     </div>
 
+    <!-- ações em lote: aparece ao marcar linhas (POST /api/lote) -->
+    <div id="barra_lote" class="barra-lote" hidden>
+        <span><span id="lote_qtd">0</span> selecionado(s)</span>
+        <button class="btn" type="button" data-acao="retornar">Retornar</button>
+        <button class="btn ghost" type="button" data-acao="alternar_estoque">Alternar estoque</button>
+        <button class="btn ghost" type="button" data-acao="ocultar">Excluir</button>
+        {{botoes_lote_admin}}
+        <button class="btn ghost" type="button" id="lote_limpar">Limpar seleção</button>
+    </div>
+    <div id="lote_msg" class="small"></div>
+
     <div class="table-wrap">
-    <table id="tabela" role="table" aria-label="Registros">
+    <table id="tabela" role="table" aria-label="Registros" data-versao="{{versao}}" data-geracao="{{geracao}}" data-arquivo="{{arquivo}}" data-vista="{{vista}}">
         <colgroup>
-            <col style="width:2%;">   <!-- ID -->
+            <col style="width:3.5%;"> <!-- ID + seleção -->
             <col style="width:5%;">   <!-- Tipo -->
-            <col style="width:15%;">  <!-- Responsável -->
+            <col style="width:13.5%;"> <!-- Responsável -->
             <col style="width:12%;">  <!-- Emprestado para -->
             <col style="width:5%;">   <!-- Origem -->
             <col style="width:5%;">   <!-- Patrimônio -->
@@ -1978,7 +3884,7 @@ def gerar_pagina_lista(registros, current_user=None):
         </colgroup>
         <thead>
             <tr>
-                <th>ID</th>
+                <th><input type="checkbox" id="sel_todos" title="Selecionar as linhas visíveis"> ID</th>
                 <th>Tipo</th>
                 <th>Responsável</th>
                 <th>Emprestado para</th>
@@ -1996,7 +3902,7 @@ def gerar_pagina_lista(registros, current_user=None):
             </tr>
         </thead>
         <tbody>
-""" + linhas + """
+{{linhas}}
         </tbody>
     </table>
     </div>
@@ -2023,7 +3929,7 @@ def gerar_pagina_lista(registros, current_user=None):
           <label>Responsável</label>
           <select name="responsavel" id="edit_responsavel" required>
             <option value="" disabled selected>Selecione o responsável...</option>
-            """ + responsaveis_options + """
+            """ + _OPCOES_RESPONSAVEIS + """
           </select>
         </div>
         <!-- Patrimônio -->
@@ -2127,7 +4033,7 @@ def gerar_pagina_lista(registros, current_user=None):
         <div class="export-right">
           <select name="responsavel_value" id="responsavel_value">
             <option value="">-- selecione --</option>
-""" + responsaveis_options + """
+""" + _OPCOES_RESPONSAVEIS + """
           </select>
         </div>
         <div class="export-left"><label><input type="checkbox" name="f_emprestado_para" id="f_emprestado_para"> <span>Emprestado para</span></label></div>
@@ -2221,340 +4127,928 @@ def gerar_pagina_lista(registros, current_user=None):
   </div>
 </div>
 
-<script src="https://cdn.jsdelivr.net/npm/flatpickr"></script>
-<script src="https://cdn.jsdelivr.net/npm/flatpickr/dist/l10n/pt.js"></script>
-<script>
-    // ------------------- FLATPICKR ---------------------
-    function initFlatpickrBR(selector) {
-        flatpickr(selector, {
-            enableTime: true,
-            time_24hr: true,
-            dateFormat: "d/m/Y H:i",
-            locale: "pt",
-            theme: "light"
-        });
-    }
+""" + tags_flatpickr_js() + """
+""" + tag_js("comum.js") + """
+""" + tag_js("lista.js") + """
+</body>
+</html>
+""")
+
+
+# ----- botões da tabela: HTML fixo pré-montado, só os valores da linha entram nos `{}` -----
+def _fragmento(html):
+    """Quebra o HTML de um botão nos pontos `{}` onde entram os valores de cada linha."""
+    return tuple(html.split("{}"))
+
+
+def _intercalar(partes, fragmento, *valores):
+    partes.append(fragmento[0])
+    for valor, fixo in zip(valores, fragmento[1:]):
+        partes.append(valor)
+        partes.append(fixo)
+
+
+_BOTAO_OBSERVACAO = _fragmento(
+    '<span style="display:inline-flex;align-items:center;">'
+    '<button class="btn-action btn-observacao" title="Ver observações" onclick="abrirObs({})" type="button">'
+    '<svg viewBox="0 0 24 24" xmlns="http://www.w3.org/2000/svg" aria-hidden="true" focusable="false">'
+    '<path fill="currentColor" d="M12 4.5C7 4.5 2.73 7.61 1 12c1.73 4.39 6 7.5 11 7.5s9.27-3.11 11-7.5c-1.73-4.39-6-7.5-11-7.5zm0 12.5c-2.76 0-5-2.24-5-5s2.24-5 5-5 5 2.24 5 5-2.24 5-5 5z"/>'
+    '</svg>'
+    '</button>'
+    '</span>'
+)
+_BOTAO_DEVOLVER = _fragmento(
+    '<form method="POST" action="/retornar" style="display:inline-flex;align-items:center;margin:0;">'
+    '<input type="hidden" name="id" value="{}">'
+    '<button type="submit" class="btn-action btn-devolver" title="Retornar máquina">'
+    '<svg viewBox="0 0 24 24" xmlns="http://www.w3.org/2000/svg" aria-hidden="true" focusable="false">'
+    '<path fill="currentColor" d="M9 16.2 4.8 12l-1.4 1.4L9 19l12-12-1.4-1.4z"/>'
+    '</svg>'
+    '</button>'
+    '</form>'
+)
+_BOTAO_EXTENDER = _fragmento(
+    '<span style="display:inline-flex;align-items:center;">'
+    '<button class="btn-action btn-estender" title="Estender empréstimo" onclick="abrirExtensao({}, \'{}\')" type="button">'
+    '<svg viewBox="0 0 24 24" xmlns="http://www.w3.org/2000/svg" aria-hidden="true" focusable="false">'
+    '<path fill="currentColor" d="M12 6V3L8 7l4 4V8c2.76 0 5 2.24 5 5 0 .34-.03.67-.09.99L19 14.5c.06-.33.09-.67.09-1.01 0-4.42-3.58-8-8-8zM6.09 9.01C6.03 9.33 6 9.66 6 10c0 4.42 3.58 8 8 8v3l4-4-4-4v3c-3.31 0-6-2.69-6-6 0-.34.03-.67.09-.99L6.09 9.01z"/>'
+    '</svg>'
+    '</button>'
+    '</span>'
+)
+_BOTAO_ESTOQUE = _fragmento(
+    '<form method="POST" action="/alternar_estoque" style="display:inline-flex;align-items:center;margin:0;">'
+    '<input type="hidden" name="id" value="{}">'
+    '<button type="submit" class="btn-action btn-estoque" title="{}">'
+    '<svg viewBox="0 0 24 24" xmlns="http://www.w3.org/2000/svg" aria-hidden="true" focusable="false">'
+    '<path fill="currentColor" d="M21 16.5c0 .38-.21.71-.53.88l-7.9 4.44c-.16.12-.36.18-.57.18-.21 0-.41-.06-.57-.18l-7.9-4.44A.991.991 0 0 1 3 16.5v-9c0-.38.21-.71.53-.88l7.9-4.44c.16-.12.36-.18.57-.18.21 0 .41.06.57.18l7.9 4.44c.32.17.53.5.53.88v9zM12 4.15L6.04 7.5 12 10.85l5.96-3.35L12 4.15zM5 15.91l6 3.38v-6.71L5 9.21v6.7zm14 0v-6.7l-6 3.37v6.71l6-3.38z"/>'
+    '</svg>'
+    '</button>'
+    '</form>'
+)
+_BOTAO_EXCLUIR = _fragmento(
+    '<form method="POST" action="/ocultar" style="display:inline-flex;align-items:center;" '
+    'onsubmit="return confirm(\'Tem certeza que deseja apagar este registro?\');">'
+    '<input type="hidden" name="id" value="{}">'
+    '<button type="submit" class="btn-action btn-excluir" title="Apagar registro">'
+    '<svg viewBox="0 0 24 24" xmlns="http://www.w3.org/2000/svg" aria-hidden="true" focusable="false">'
+    '<path fill="#000" d="M9 3v1H4v2h16V4h-5V3H9zm1 6v8h2V9H10zm4 0v8h2V9h-2zM7 9v8h2V9H7z"/>'
+    '</svg>'
+    '</button>'
+    '</form>'
+)
+_BOTAO_EDITAR = _fragmento(
+    '<span style="display:inline-flex;align-items:center;">'
+    '<button class="btn-action btn-edit" title="Editar registro" type="button" data-record="{}">'
+    '<svg viewBox="0 0 24 24" xmlns="http://www.w3.org/2000/svg" aria-hidden="true" focusable="false">'
+    '<path fill="currentColor" d="M3 17.25V21h3.75L17.81 9.94l-3.75-3.75L3 17.25zM20.71 7.04a1.003 1.003 0 0 0 0-1.42l-2.34-2.34a1.003 1.003 0 0 0-1.42 0l-1.83 1.83 3.75 3.75 1.84-1.82z"/>'
+    '</svg>'
+    '</button>'
+    '</span>'
+)
+_BOTAO_RESTAURAR = _fragmento(
+    '<form method="POST" action="/restaurar" style="display:inline-flex;align-items:center;">'
+    '<input type="hidden" name="id" value="{}">'
+    '<button type="submit" class="btn-action btn-restore" title="Restaurar registro">'
+    '<svg viewBox="0 0 24 24" xmlns="http://www.w3.org/2000/svg" aria-hidden="true" focusable="false">'
+    '<path fill="currentColor" d="M10 9V5l-7 7 7 7v-4.1c5 0 8.5 1.6 11 5.1-1-5-4-10-11-11z"/>'
+    '</svg>'
+    '</button>'
+    '</form>'
+)
+_STATUS_EXCLUIDO = "<span style='color:#ff5050;font-weight:700;'>Excluído</span>"
+_ABRE_ACOES = '<td><div style="display:flex;gap:8px;align-items:center;">'
+_FECHA_LINHA = '</div></td></tr>'
+_JSON_ENCODER = json.JSONEncoder(ensure_ascii=False)
+_ESCAPE_OBS_JS = str.maketrans({"'": "\\'"})
+_ESCAPE_ATRIBUTO = str.maketrans({'"': "&quot;"})
+
+
+# ----- cache de linhas renderizadas (chave: id, versão, estado de _estado_linha) -----
+class CacheLinhas:
+    """LRU de fragmentos <tr> com teto de memória (soma aproximada dos tamanhos em bytes)."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._itens = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.acertos = 0
+        self.faltas = 0
+
+    def obter(self, chave):
+        with self._lock:
+            linha = self._itens.get(chave)
+            if linha is None:
+                self.faltas += 1
+                return None
+            self._itens.move_to_end(chave)
+            self.acertos += 1
+            return linha
+
+    def guardar(self, chave, linha):
+        tamanho = len(linha) + 100  # + overhead aproximado da chave/entrada
+        if tamanho > self.max_bytes:
+            return
+        with self._lock:
+            antiga = self._itens.pop(chave, None)
+            if antiga is not None:
+                self.bytes -= len(antiga) + 100
+            self._itens[chave] = linha
+            self.bytes += tamanho
+            while self.bytes > self.max_bytes and self._itens:
+                _, removida = self._itens.popitem(last=False)
+                self.bytes -= len(removida) + 100
+
+    def limpar(self):
+        with self._lock:
+            self._itens.clear()
+            self.bytes = 0
+
+
+_cache_linhas = CacheLinhas(LINHAS_CACHE_MAX_BYTES)
+# partição alterada por fora do servidor: versões podem não ter mudado, descarta tudo
+_ao_recarregar_registros.append(_cache_linhas.limpar)
+_ao_recarregar_registros.append(_invalidar_linha_tempo)
+_ao_recarregar_registros.append(_invalidar_estatisticas)
+_ao_recarregar_registros.append(_invalidar_tabela)
+
+
+def _estado_linha(r, eh_admin, usuario_lower, atrasos_ids, pendencias_ids):
+    """
+    Parte de uma linha que depende do relógio e de quem está vendo, e não só da versão do
+    registro: (permissão, atrasado, pendência, atraso). Entra na chave do cache de linhas.
+    permissão: "admin" (editar + restaurar), "editor" (criador em até 24h, sem observações) ou "leitor".
+    O relógio entra pelos bits do índice de prazos (bits_prazos).
+    """
+    bits = bits_prazos(r)
+    if eh_admin:
+        permissao = "admin"
+    elif bits & EDICAO_ABERTA and pode_editar_como_criador(r, usuario_lower):
+        permissao = "editor"
+    else:
+        permissao = "leitor"
+
+    atrasado = bool(bits & ATRASADO)
+
+    id_str = str(r.get("id", ""))
+    is_atraso = id_str in atrasos_ids
+    return (permissao, atrasado, is_atraso or id_str in pendencias_ids, is_atraso)
+
+
+def _parse_data_memo(dt_str):
+    try:
+        return _parse_br_datetime_cache(dt_str)
+    except TypeError:  # valor não hashable vindo do JSON
+        return parse_br_datetime(dt_str)
+
+
+_parse_br_datetime_cache = functools.lru_cache(maxsize=65536)(parse_br_datetime)
+
+
+def _render_linha(r, partes, estado):
+    """Acrescenta em `partes` os pedaços de uma <tr> da tabela de /lista (estado = _estado_linha)."""
+    permissao, atrasado, is_pendencia, is_atraso = estado
+    id_ = r.get("id", "")
+    tipo = r.get("tipo", "") or ""
+    devolvido = bool(r.get("devolvido", False))
+    estoque = bool(r.get("estoque", False))
+    oculto = bool(r.get("oculto", False))
+    data_retorno = r.get("data_retorno", "") or ""
+    id_str = str(id_)
+
+    # prioridade do status
+    if oculto:
+        status = _STATUS_EXCLUIDO
+    elif devolvido:
+        status = r.get("status_extra") or "Devolvido"
+    elif atrasado:
+        dt_ret = _parse_data_memo(data_retorno)
+        status = f"<span style='color:#ff6b6b;font-weight:700;'>Atrasado ({dt_ret.strftime('%d/%m/%Y')})</span>"
+    elif estoque and tipo == "entrada":
+        status = "Em estoque"
+    else:
+        status = "Ativo" if tipo == "emprestimo" else ""
+
+    marca = r.get("marca", r.get("marca_modelo", "")) or ""
+    campos = (
+        tipo,
+        r.get("responsavel", "") or "",
+        r.get("emprestado_para", "") or "",
+        r.get("origem", "") or "",
+        r.get("patrimonio", "") or "",
+        r.get("workflow", "") or "",
+        r.get("motivo", "") or "",
+        r.get("hardware", "") or "",
+        marca,
+        r.get("modelo", "") or "",
+        r.get("data_inicio", "") or "",
+        data_retorno,
+        status,
+    )
+    partes.append(
+        f'<tr class="{"oculto-row" if oculto else ""}" data-id="{id_}" data-devolvido="{"true" if devolvido else "false"}" '
+        f'data-estoque="{"true" if estoque else "false"}" data-oculto="{"true" if oculto else "false"}" '
+        f'data-pendencia="{"true" if is_pendencia else "false"}" data-atraso="{"true" if is_atraso else "false"}">'
+        f'<td><input type="checkbox" class="sel-linha" value="{id_}"> {id_}</td><td>'
+    )
+    partes.append("</td><td>".join(map(str, campos)))
+    partes.append("</td>")
+    partes.append(_ABRE_ACOES)
+
+    # botões (mesma ordem de sempre: devolver, estender, observação, estoque, editar, restaurar, excluir)
+    if not devolvido:
+        _intercalar(partes, _BOTAO_DEVOLVER, id_str)
+        if tipo == "emprestimo":
+            data_retorno_br = normalize_br_datetime_str(data_retorno) if data_retorno else ""
+            _intercalar(partes, _BOTAO_EXTENDER, id_str, data_retorno_br.translate(_ESCAPE_OBS_JS))
+
+    # o histórico não vai na página: o modal busca em /api/observacoes?id= ao abrir
+    _intercalar(partes, _BOTAO_OBSERVACAO, id_str)
+
+    if tipo == "entrada" and not devolvido:
+        _intercalar(partes, _BOTAO_ESTOQUE, id_str, "Remover do estoque" if estoque else "Colocar em estoque")
+
+    # botão Editar: admin, ou o criador em até 24h e sem observações
+    if permissao != "leitor":
+        try:
+            record_for_js = {
+                "id": id_,
+                "tipo": tipo,
+                "responsavel": campos[1],
+                "patrimonio": campos[4],
+                "workflow": campos[5],
+                "origem": campos[3],
+                "motivo": campos[6],
+                "hardware": campos[7],
+                "marca": marca,
+                "modelo": campos[9],
+                "data_inicio": campos[10],
+                "emprestado_para": campos[2],
+                "data_retorno": data_retorno,
+                "devolvido": devolvido,
+                "estoque": estoque
+            }
+            safe_record_json = _JSON_ENCODER.encode(record_for_js).replace("</", "<\\/").translate(_ESCAPE_ATRIBUTO)
+        except Exception:
+            safe_record_json = "{}"
+        _intercalar(partes, _BOTAO_EDITAR, safe_record_json)
+
+    if oculto and permissao == "admin":
+        _intercalar(partes, _BOTAO_RESTAURAR, id_str)
+    _intercalar(partes, _BOTAO_EXCLUIR, id_str)
+    partes.append(_FECHA_LINHA)
+
+
+def _linha_html(r, estado):
+    """<tr> do registro, vindo do _cache_linhas quando id/versão/estado não mudaram."""
+    chave = (r.get("id"), r.get("versao", 0)) + estado
+    linha = _cache_linhas.obter(chave)
+    if linha is None:
+        partes = []
+        _render_linha(r, partes, estado)
+        linha = "".join(partes)
+        _cache_linhas.guardar(chave, linha)
+    return linha
+
+
+def gerar_linhas_lista(registros, current_user, atrasos_ids, pendencias_ids, caracteres_por_bloco=64 * 1024):
+    """
+    Gera o <tbody> de /lista em blocos de ~`caracteres_por_bloco` caracteres. Cada linha é uma
+    lista de pedaços juntada uma única vez; os blocos seguem para o socket conforme ficam prontos.
+    Linhas já renderizadas vêm do _cache_linhas: só é refeita a linha cujo registro mudou de
+    versão ou cujo estado dependente do tempo/usuário (atraso, janela de edição) mudou.
+    """
+    eh_admin = bool(current_user) and str(current_user).lower() == "admin"
+    usuario_lower = str(current_user).lower()
+    bloco = []
+    tamanho = 0
+    it = iter(registros)
+    while True:
+        with medir_fase("render_linhas"):
+            for r in it:
+                linha = _linha_html(r, _estado_linha(r, eh_admin, usuario_lower, atrasos_ids, pendencias_ids))
+                bloco.append(linha)
+                tamanho += len(linha)
+                if tamanho >= caracteres_por_bloco:
+                    break
+            pronto = "".join(bloco)
+            bloco = []
+            tamanho = 0
+        if not pronto:
+            return
+        yield pronto
+
+
+def calcular_ids_atraso_pendencia(registros, candidatos=None):
+    """
+    Ids (str) com atraso e com pendência de entrada, mesma regra de gerar_pendencias_html, lidos
+    do índice de prazos. `candidatos` restringe quais registros são avaliados (padrão: os que o
+    índice marca como atrasados/vencidos). Aqui qualquer saída não excluída do workflow conta.
+    """
+    prazos = prazos_atuais()
+    if candidatos is None:
+        por_id = prazos["registros"]
+        candidatos = [por_id[i] for i in tuple(prazos["atrasados"]) + tuple(prazos["pendentes"]) if i in por_id]
+    atrasos_ids = set()
+    pendencias_ids = set()
+    for rec in candidatos:
+        if eh_atraso(rec):
+            atrasos_ids.add(str(rec.get("id", "")))
+        elif eh_pendencia_entrada(rec, prazos["saidas"]):
+            pendencias_ids.add(str(rec.get("id", "")))
+    return atrasos_ids, pendencias_ids
+
+
+_BOTAO_LOTE_RESTAURAR = '<button class="btn ghost" type="button" data-acao="restaurar">Restaurar</button>'
+
+
+def selecao_lista(qs, registros):
+    """
+    (vista, quentes, arquivados) de /lista?view=<vista>[&arquivo=1]: as linhas quentes da vista
+    saem dos bitmaps (padrão: ativos); arquivo=1 (vistas tudo/legado) inclui o arquivo frio.
+    """
+    vista = qs.get("view", ["ativos"])[0]
+    if vista not in VISTAS_LISTA:
+        vista = "ativos"
+    arquivados = None
+    if qs.get("arquivo", [""])[0] == "1":
+        ids_quentes = {r.get("id") for r in registros}
+        arquivados = [r for r in carregar_arquivo()
+                      if r.get("id") not in ids_quentes and registro_na_vista(r, vista)]
+    return vista, registros_da_vista(vista), arquivados
+
+
+def _linhas_pagina_lista(registros, current_user, arquivados):
+    """(total, versão dos dados, gerador das <tr>) das linhas de /lista: arquivados e depois quentes."""
+    # arquivados estão encerrados: nunca entram em atraso/pendência
+    atrasos_ids, pendencias_ids = calcular_ids_atraso_pendencia(registros)
+    versao = versao_dados()
+    if arquivados:
+        todos = itertools.chain(arquivados, registros)
+        total = len(arquivados) + len(registros)
+    else:
+        todos = registros
+        total = len(registros)
+    return total, versao, gerar_linhas_lista(todos, current_user, atrasos_ids, pendencias_ids)
+
+
+def gerar_pagina_lista(registros, current_user=None, arquivados=None, vista=None):
+    """
+    Gera a página /lista com a tabela de registros e modal de edição, como um gerador de
+    pedaços em bytes (as linhas são renderizadas à medida que o corpo é consumido).
+    current_user: nome do usuário atual (string) — usado para liberar ações de admin.
+    arquivados: registros do arquivo frio a incluir (vistas tudo/legado); None = só os quentes.
+    vista: vista do seletor já aplicada no servidor a `registros` (None = todas as linhas vêm
+    e o navegador filtra). As contagens do seletor vêm dos bitmaps (contagens_vistas).
+    """
+    total, versao, linhas = _linhas_pagina_lista(registros, current_user, arquivados)
+    botoes_admin = _BOTAO_LOTE_RESTAURAR if current_user and str(current_user).lower() == "admin" else ""
+    contagens = {"n_" + v: str(n) for v, n in contagens_vistas().items()}
+    return _TPL_LISTA.iterar(total=str(total), versao=str(versao), geracao=geracao_dados(),
+                             arquivo="1" if arquivados is not None else "0", vista=vista or "",
+                             botoes_lote_admin=botoes_admin, linhas=linhas, **contagens)
+
+
+def gerar_delta_lista(registros, desde, geracao, current_user=None):
+    """
+    Alterações para uma página /lista já aberta (GET /api/registros/changes): as linhas <tr>
+    dos registros criados/alterados depois da versão `desde` e tombstones ({id, versao}) dos
+    que foram ocultados. Registros do mesmo workflow entram junto porque a pendência de uma
+    entrada depende da saída correspondente. Retorna {"recarregar": true} quando o delta não
+    serve (outra geração dos dados, versão do futuro ou alterações demais).
+    """
+    versao = versao_dados()
+    if geracao != geracao_dados() or desde < 0 or desde > versao:
+        return {"recarregar": True, "versao": versao, "geracao": geracao_dados()}
+    alterados = registros_alterados_desde(registros, desde)
+    alterados += prazos_virados_desde(desde)   # atraso/pendência/edição viraram pelo relógio
+    if len(alterados) > DELTA_MAX_REGISTROS:
+        return {"recarregar": True, "versao": versao, "geracao": geracao_dados()}
+
+    workflows = {(r.get("workflow") or "").strip() for r in alterados} - {""}
+    afetados = {id(r): r for r in alterados}
+    if workflows:
+        for r in registros:
+            if (r.get("workflow") or "").strip() in workflows:
+                afetados.setdefault(id(r), r)
+    afetados = list(afetados.values())
+
+    atrasos_ids, pendencias_ids = calcular_ids_atraso_pendencia(registros, candidatos=afetados)
+    eh_admin = bool(current_user) and str(current_user).lower() == "admin"
+    usuario_lower = str(current_user).lower()
+    linhas = []
+    ocultos = []
+    for r in afetados:
+        if r.get("oculto", False):
+            ocultos.append({"id": r.get("id"), "versao": r.get("versao", 0)})
+            continue
+        estado = _estado_linha(r, eh_admin, usuario_lower, atrasos_ids, pendencias_ids)
+        linhas.append({"id": r.get("id"), "versao": r.get("versao", 0), "html": _linha_html(r, estado)})
+    return {
+        "versao": versao,
+        "geracao": geracao_dados(),
+        "total": len(registros),
+        "contagens": contagens_vistas(),
+        "registros": linhas,
+        "ocultos": ocultos,
+    }
+
+
+# ----------------------------- EXPORTAÇÃO CSV -----------------------------
+# (checkbox, campo do valor, campo do registro, comparação) — "igual" compara o texto como veio;
+# "igual_ci" ignora caixa/espaços; "contem" procura o valor (sem caixa) dentro do campo
+_FILTROS_EXPORT = (
+    ("f_tipo", "tipo_value", "tipo", "igual"),
+    ("f_responsavel", "responsavel_value", "responsavel", "igual_ci"),
+    ("f_emprestado_para", "emprestado_para_value", "emprestado_para", "contem"),
+    ("f_origem", "origem_value", "origem", "contem"),
+    ("f_patrimonio", "patrimonio_value", "patrimonio", "contem"),
+    ("f_workflow", "workflow_value", "workflow", "contem"),
+    ("f_motivo", "motivo_value", "motivo", "igual_ci"),
+    ("f_hardware", "hardware_value", "hardware", "igual_ci"),
+    ("f_marca", "marca_value", "marca", "contem"),
+    ("f_modelo", "modelo_value", "modelo", "contem"),
+)
+VISTAS_LISTA = ("ativos", "inativos", "estoque", "pendentes", "legado", "tudo")
+
+
+def _filtros_export_ativos(qs):
+    """[(campo do registro, predicado sobre str(valor))] dos filtros de texto marcados no modal."""
+    ativos = []
+    for marcador, campo_valor, campo, comparacao in _FILTROS_EXPORT:
+        if not (qs.get(marcador) and qs.get(campo_valor)):
+            continue
+        valor = qs.get(campo_valor, [''])[0].strip()
+        if not valor:
+            continue
+        if comparacao == "igual":
+            ativos.append((campo, valor.__eq__))
+        elif comparacao == "igual_ci":
+            ativos.append((campo, lambda v, alvo=valor.lower(): v.strip().lower() == alvo))
+        else:
+            ativos.append((campo, lambda v, alvo=valor.lower(): alvo in v.lower()))
+    return ativos
+
+
+def _ids_manuais(qs):
+    """Ids do filtro manual (lista vazia se algum não for número), ou None se o filtro não veio."""
+    if not (qs.get('f_manual') and qs.get('manual_ids')):
+        return None
+    try:
+        return {int(x) for x in qs.get('manual_ids', [''])[0].split(',') if x.strip() != ''}
+    except ValueError:
+        return set()
+
+
+def _faixa_datas_export(qs):
+    """(de, até) do filtro de data (datetimes ou None), ou None se o filtro não se aplica."""
+    if not qs.get('f_data'):
+        return None
+    from_s = qs.get('date_from', [''])[0].strip()
+    to_s = qs.get('date_to', [''])[0].strip()
+    dt_from = parse_br_datetime(from_s) if from_s else None
+    dt_to = parse_br_datetime(to_s) if to_s else None
+    if not (dt_from or dt_to):
+        return None
+    return dt_from, dt_to
+
+
+def registro_na_vista(r, vista, pendencia=False):
+    """Regra do seletor de vistas de /lista (lista.js) para um registro."""
+    devolvido, estoque, oculto = bool(r.get("devolvido")), bool(r.get("estoque")), bool(r.get("oculto"))
+    if vista == "ativos":
+        return not devolvido and not oculto
+    if vista == "inativos":
+        return devolvido or estoque
+    if vista == "estoque":
+        return estoque
+    if vista == "pendentes":
+        return pendencia
+    if vista == "legado":
+        return not oculto
+    return True
+
+
+def filtrar_registros_export(registros, qs):
+    """
+    Aplica os filtros do modal de exportação (querystring já parseada com parse_qs)
+    e retorna a lista de registros selecionados, avaliando registro a registro
+    (usado no arquivo frio; os quentes passam por filtrar_tabela_export).
+    """
+    filtered = list(registros)
+    if qs.get('f_all'):
+        return filtered
+
+    ids = _ids_manuais(qs)
+    if ids is not None:
+        filtered = [r for r in filtered if (r.get('id') is not None and int(r.get('id')) in ids)]
+
+    for campo, predicado in _filtros_export_ativos(qs):
+        filtered = [r for r in filtered if predicado(str(r.get(campo, '')))]
+
+    faixa = _faixa_datas_export(qs)
+    if faixa:
+        dt_from, dt_to = faixa
+
+        def in_range(r):
+            di = parse_br_datetime(r.get('data_inicio',''))
+            if not di:
+                return False
+            if dt_from and di < dt_from:
+                return False
+            if dt_to and di > dt_to:
+                return False
+            return True
+        filtered = [r for r in filtered if in_range(r)]
+
+    return filtered
+
+
+def filtrar_tabela_export(qs):
+    """
+    Mesmos filtros de filtrar_registros_export sobre os registros quentes, como máscaras da
+    tabela colunar: cada filtro categórico/data é avaliado sobre a coluna inteira e
+    as máscaras são combinadas com AND. Os filtros de texto livre (patrimônio, workflow,
+    emprestado para, modelo) não têm coluna e rodam só nas linhas que sobraram.
+    Retorna (tabela, registros selecionados em ordem de id).
+    """
+    tabela = tabela_registros()
+    por_registro = []
+    with _dados_lock:
+        m = Mascaras(tabela)
+        sel = m.todas()
+        if not qs.get('f_all'):
+            ids = _ids_manuais(qs)
+            if ids is not None:
+                sel &= m.linhas(i for i in map(tabela.linha_do_id.get, ids) if i is not None)
+            for campo, predicado in _filtros_export_ativos(qs):
+                if campo in tabela.categoricos:
+                    sel &= m.categorico(campo, predicado)
+                else:
+                    por_registro.append((campo, predicado))
+            faixa = _faixa_datas_export(qs)
+            if faixa:
+                dt_from, dt_to = faixa
+                sel &= m.faixa("data_inicio", segundos_epoca(dt_from) if dt_from else None,
+                               segundos_epoca(dt_to) if dt_to else None)
+        linhas = m.indices(sel)
+        if not tabela.em_ordem:
+            linhas.sort(key=tabela.ids.__getitem__)
+        selecionados = [tabela.registros[i] for i in linhas]
+    for campo, predicado in por_registro:
+        selecionados = [r for r in selecionados if predicado(str(r.get(campo, '')))]
+    return tabela, selecionados
+
+
+def filtrar_export(qs):
+    """Registros da exportação: os arquivados (dos anos e meses do filtro) seguidos dos quentes."""
+    tabela, quentes = filtrar_tabela_export(qs)
+    arquivados = carregar_arquivo(anos_export(qs))
+    meses = meses_export(qs)
+    if meses is not None:
+        # mês pelo começo da data (como a partição): fora da faixa, a data nem é interpretada
+        de, ate = meses
+        arquivados = [r for r in arquivados if de <= _mes_particao(r) <= ate]
+    arquivados = [r for r in arquivados if _id_ordem(r) not in tabela.linha_do_id]
+    return filtrar_registros_export(arquivados, qs) + quentes
+
+
+def anos_export(qs):
+    """
+    Anos do arquivo frio que a exportação precisa abrir: com o filtro de data, só os anos
+    entre date_from e date_to; sem ele (ou com "todos"), None = todos os anos.
+    """
+    if 'f_all' in qs or 'f_data' not in qs:
+        return None
+    dt_from = parse_br_datetime(qs.get('date_from', [''])[0].strip())
+    dt_to = parse_br_datetime(qs.get('date_to', [''])[0].strip())
+    if not dt_from and not dt_to:
+        return None
+    anos = [a for a in anos_arquivados() if a.isdigit()]
+    return {a for a in anos
+            if (not dt_from or int(a) >= dt_from.year) and (not dt_to or int(a) <= dt_to.year)}
+
+
+def meses_export(qs):
+    """
+    Faixa de meses ("AAAA-MM", "AAAA-MM") que a exportação precisa olhar: com o filtro de data,
+    só os meses entre date_from e date_to; sem ele (ou com "todos"), None = todos.
+    """
+    if 'f_all' in qs or 'f_data' not in qs:
+        return None
+    dt_from = parse_br_datetime(qs.get('date_from', [''])[0].strip())
+    dt_to = parse_br_datetime(qs.get('date_to', [''])[0].strip())
+    if not dt_from and not dt_to:
+        return None
+    de = dt_from.strftime("%Y-%m") if dt_from else ""
+    ate = dt_to.strftime("%Y-%m") if dt_to else "9999-99"
+    return de, ate
+
+
+def gerar_csv_partes(registros, linhas_por_parte=500):
+    """
+    Gera a exportação CSV aos pedaços (bytes UTF-8, `linhas_por_parte` linhas por vez),
+    para ser enviada/comprimida em streaming sem montar o arquivo inteiro em memória.
+    """
+    campos_csv = ["id", "tipo", "responsavel", "emprestado_para", "origem", "patrimonio", "workflow", "motivo",
+                  "hardware", "marca", "modelo", "data_inicio", "data_retorno", "devolvido", "estoque",
+                  "status", "client_ip", "registrado_em"]
+
+    csv_buffer = io.StringIO()
+    writer = csv.DictWriter(csv_buffer, fieldnames=campos_csv)
+    writer.writeheader()
+    pendentes = 0
+    agora = sp_now_naive()   # um instante só para o arquivo inteiro
+    for r in registros:
+        row = {k: (r.get(k, "") if r.get(k, "") is not None else "") for k in campos_csv
+               if k not in ("client_ip", "registrado_em", "status")}
+        oculto = r.get("oculto_meta", {}) or {}
+        row["client_ip"] = oculto.get("client_ip", "")
+        row["registrado_em"] = oculto.get("registrado_em", "")
+        row["estoque"] = "Sim" if r.get("estoque") else "Não"
+        row["devolvido"] = "Sim" if r.get("devolvido") else "Não"
+        row["status"] = calcular_status(r, agora)
+        writer.writerow(row)
+        pendentes += 1
+        if pendentes >= linhas_por_parte:
+            yield csv_buffer.getvalue().encode("utf-8")
+            csv_buffer.seek(0)
+            csv_buffer.truncate()
+            pendentes = 0
+
+    resto = csv_buffer.getvalue()
+    csv_buffer.close()
+    if resto:
+        yield resto.encode("utf-8")
+
+
+def gerar_csv_registros(registros):
+    """Gera o conteúdo CSV (str) da exportação para os registros informados."""
+    return b"".join(gerar_csv_partes(registros)).decode("utf-8")
+
+
+# ----------------------------- PROFILING (sob demanda) -----------------------------
+_perfis_lock = threading.Lock()
+_perfis_recentes = collections.OrderedDict()  # id -> {"id", "rota", "modo", "usuario", "criado_em", "duracao", "tabela", "arquivo"}
+_perfis_agendados = {}  # rota -> quantidade restante de requisições a perfilar
+_perfil_execucao_lock = threading.Lock()  # um perfil por vez (cProfile não convive bem com perfis simultâneos)
+
+
+def agendar_perfil(rota, quantidade):
+    """Agenda o profiling das próximas `quantidade` requisições para `rota` (0 cancela)."""
+    with _perfis_lock:
+        if quantidade > 0:
+            _perfis_agendados[rota] = quantidade
+        else:
+            _perfis_agendados.pop(rota, None)
+
 
-    // --------------- FUNÇÕES DE TOGGLE "OUTROS" ---------------
-    function toggleEditMotivoOutros() {
-        const select = document.getElementById('edit_motivo_select');
-        const div = document.getElementById('edit_motivo_outros_div');
-        const textarea = document.getElementById('edit_motivo_outros');
-        if (select && select.value === 'outros') {
-            div.style.display = 'block';
-            textarea.required = true;
-        } else if (select) {
-            div.style.display = 'none';
-            textarea.required = false;
-        }
-    }
+def tem_perfil_agendado(rota):
+    """Há profiling agendado para `rota`? (consulta sem consumir)"""
+    with _perfis_lock:
+        return _perfis_agendados.get(rota, 0) > 0
 
-    function toggleEditHardwareOutros() {
-        const select = document.getElementById('edit_hardware_select');
-        const div = document.getElementById('edit_hardware_outros_div');
-        const textarea = document.getElementById('edit_hardware_outros');
-        if (select && select.value === 'outros') {
-            div.style.display = 'block';
-            textarea.required = true;
-        } else if (select) {
-            div.style.display = 'none';
-            textarea.required = false;
-        }
-    }
 
-    // --------------- FUNÇÃO AUXILIAR PARA SELECT ---------------
-    function setSelectValue(select, value) {
-        if (!select) return;
-        for (let i = 0; i < select.options.length; i++) {
-            if (select.options[i].value.toLowerCase() === value.toLowerCase()) {
-                select.selectedIndex = i;
-                break;
-            }
-        }
-    }
+def consumir_perfil_agendado(rota):
+    """Retorna True (e decrementa o contador) se a requisição para `rota` deve ser perfilada."""
+    with _perfis_lock:
+        restante = _perfis_agendados.get(rota, 0)
+        if restante <= 0:
+            return False
+        if restante == 1:
+            _perfis_agendados.pop(rota, None)
+        else:
+            _perfis_agendados[rota] = restante - 1
+        return True
 
-    // ------------------- MODAL EDIÇÃO -------------------
-    window.abrirEditar = function(id, record) {
-        try {
-            const modal = document.getElementById("modal_edit");
-            if (!modal) return;
-            document.getElementById("edit_id").value = id;
-            document.getElementById("edit_id_display").innerText = "#" + id;
-
-            // Preencher campos
-            // Tipo
-            setSelectValue(document.getElementById("edit_tipo"), record.tipo || "");
-            // Responsável
-            setSelectValue(document.getElementById("edit_responsavel"), record.responsavel || "");
-            // Campos de texto
-            document.getElementById("edit_patrimonio").value = record.patrimonio || "";
-            document.getElementById("edit_workflow").value = record.workflow || "";
-            document.getElementById("edit_origem").value = record.origem || "";
-            document.getElementById("edit_marca").value = record.marca || "";
-            document.getElementById("edit_modelo").value = record.modelo || "";
-            document.getElementById("edit_emprestado_para").value = record.emprestado_para || "";
-            document.getElementById("edit_data_inicio").value = record.data_inicio || "";
-            document.getElementById("edit_data_retorno").value = record.data_retorno || "";
-
-            // ----- Motivo -----
-            const motivoSelect = document.getElementById("edit_motivo_select");
-            const motivoOutrosDiv = document.getElementById("edit_motivo_outros_div");
-            const motivoOutros = document.getElementById("edit_motivo_outros");
-            const motivoAtual = record.motivo || "";
-            const opcoesMotivo = ["formatação", "manutenção", "reparo"];
-            if (opcoesMotivo.includes(motivoAtual.toLowerCase())) {
-                setSelectValue(motivoSelect, motivoAtual);
-                motivoOutrosDiv.style.display = "none";
-                motivoOutros.required = false;
-                motivoOutros.value = "";
-            } else {
-                setSelectValue(motivoSelect, "outros");
-                motivoOutros.value = motivoAtual;
-                motivoOutrosDiv.style.display = "block";
-                motivoOutros.required = true;
-            }
 
-            // ----- Hardware -----
-            const hardwareSelect = document.getElementById("edit_hardware_select");
-            const hardwareOutrosDiv = document.getElementById("edit_hardware_outros_div");
-            const hardwareOutros = document.getElementById("edit_hardware_outros");
-            const hardwareAtual = record.hardware || "";
-            const opcoesHardware = ["Desktop", "Notebook", "Teclado/Mouse", "Monitor"];
-            if (opcoesHardware.includes(hardwareAtual)) {
-                setSelectValue(hardwareSelect, hardwareAtual);
-                hardwareOutrosDiv.style.display = "none";
-                hardwareOutros.required = false;
-                hardwareOutros.value = "";
-            } else {
-                setSelectValue(hardwareSelect, "outros");
-                hardwareOutros.value = hardwareAtual;
-                hardwareOutrosDiv.style.display = "block";
-                hardwareOutros.required = true;
-            }
+def perfis_agendados():
+    with _perfis_lock:
+        return dict(_perfis_agendados)
 
-            // ----- Datas (flatpickr) -----
-            try {
-                if (window.flatpickr) {
-                    if (!document.querySelector("#edit_data_inicio")._flatpickr) {
-                        flatpickr("#edit_data_inicio", { enableTime:true, time_24hr:true, dateFormat:"d/m/Y H:i", locale:"pt", theme:"light" });
-                    }
-                    if (!document.querySelector("#edit_data_retorno")._flatpickr) {
-                        flatpickr("#edit_data_retorno", { enableTime:true, time_24hr:true, dateFormat:"d/m/Y H:i", locale:"pt", theme:"light" });
-                    }
-                    document.querySelector("#edit_data_inicio")._flatpickr.setDate(record.data_inicio || null, true);
-                    document.querySelector("#edit_data_retorno")._flatpickr.setDate(record.data_retorno || null, true);
-                }
-            } catch(e) { console.warn("flatpickr edit:", e); }
-
-            modal.style.display = "flex";
-        } catch(e) {
-            console.error("Erro ao abrir editar:", e);
-        }
-    };
-
-    window.fecharEditar = function() {
-        const modal = document.getElementById("modal_edit");
-        if (modal) modal.style.display = "none";
-    };
-
-    // ------------------- OUTRAS FUNÇÕES -----------------
-    function fecharExtensao() { document.getElementById("modal_extender").style.display = "none"; }
-    function fecharObs() { document.getElementById("modal_obs").style.display = "none"; }
-
-    function abrirObs(id, obs_json){
-        try{
-            var list = [];
-            if (typeof obs_json === 'string') {
-                try { list = JSON.parse(obs_json); } catch (e) { list = []; }
-            } else if (Array.isArray(obs_json)) {
-                list = obs_json;
-            }
-            var tbody = document.querySelector('#obs_table tbody');
-            tbody.innerHTML = '';
-            if (!list || list.length === 0){
-                tbody.innerHTML = '<tr><td colspan="2" style="padding:6px;color:var(--muted);">Nenhuma observação registrada.</td></tr>';
-            } else {
-                list.forEach(function(o){
-                    var date = o.registrado_em || '';
-                    var text = o.text || '';
-                    var tr = document.createElement('tr');
-                    tr.innerHTML = "<td style='padding:6px;vertical-align:top;white-space:nowrap;color:var(--muted);'>"+ date +"</td>" +
-                                   "<td style='padding:6px;white-space:pre-wrap;'>"+ text +"</td>";
-                    tbody.appendChild(tr);
-                });
-            }
-            document.getElementById('obs_record_id').value = id;
-            document.getElementById('obs_text').value = '';
-            document.getElementById('modal_obs').style.display = 'flex';
-        }catch(e){ console.error('abrirObs erro', e); }
-    }
 
-    function abrirExtensao(id, current_date_br = "") {
-        document.getElementById("extender_id").value = id;
-        document.getElementById("extender_data").value = current_date_br || "";
-        document.getElementById("modal_extender").style.display = "flex";
-    }
+def guardar_perfil(info):
+    with _perfis_lock:
+        _perfis_recentes[info["id"]] = info
+        while len(_perfis_recentes) > PERFIL_MAX_MEMORIA:
+            _perfis_recentes.popitem(last=False)
 
-    // --------------- Event delegation: abrir modal editar ---------------
-    document.addEventListener('click', function(e) {
-        try {
-            const btn = e.target.closest && e.target.closest('.btn-edit');
-            if (!btn) return;
-            let recJson = btn.getAttribute('data-record');
-            if (!recJson) return;
-            recJson = recJson.replace(/&quot;/g, '"');
-            const rec = JSON.parse(recJson);
-            if (window.abrirEditar) {
-                abrirEditar(rec.id, rec);
-            }
-        } catch (err) {
-            console.error('erro ao abrir modal editar:', err);
-        }
-    });
-
-    // Adicionar listeners para os selects de "outros" quando o modal é aberto
-    document.addEventListener('click', function(e) {
-        const btn = e.target.closest && e.target.closest('.btn-edit');
-        if (btn) {
-            // Pequeno timeout para garantir que o modal já foi preenchido
-            setTimeout(function() {
-                const motivoSelect = document.getElementById('edit_motivo_select');
-                const hardwareSelect = document.getElementById('edit_hardware_select');
-                if (motivoSelect) {
-                    motivoSelect.removeEventListener('change', toggleEditMotivoOutros);
-                    motivoSelect.addEventListener('change', toggleEditMotivoOutros);
-                }
-                if (hardwareSelect) {
-                    hardwareSelect.removeEventListener('change', toggleEditHardwareOutros);
-                    hardwareSelect.addEventListener('change', toggleEditHardwareOutros);
-                }
-            }, 100);
-        }
-    });
-
-    // --------------- Confirmação restaurar ---------------
-    document.addEventListener('submit', function(e) {
-        try {
-            const form = e.target;
-            const action = form.getAttribute && form.getAttribute('action');
-            if (action === '/restaurar') {
-                if (!confirm('Confirma restaurar este registro?')) e.preventDefault();
-            }
-        } catch(err) { console.error(err); }
-    });
-
-    // --------------- FILTRO E ORDENAÇÃO ---------------
-    function updateVisibility() {
-        const q = document.getElementById("search").value.toLowerCase();
-        const view = document.getElementById("view_selector").value;
-        const rows = document.querySelectorAll("#tabela tbody tr");
-        rows.forEach(r => {
-            const devolvido = r.getAttribute('data-devolvido') === 'true';
-            const estoque = r.getAttribute('data-estoque') === 'true';
-            const oculto = r.getAttribute('data-oculto') === 'true';
-            const pendencia = r.getAttribute('data-pendencia') === 'true';
-
-            let view_ok = false;
-            if (view === 'ativos') view_ok = !devolvido && !oculto;
-            else if (view === 'inativos') view_ok = devolvido || estoque;
-            else if (view === 'estoque') view_ok = estoque;
-            else if (view === 'pendentes') view_ok = pendencia;
-            else if (view === 'legado') view_ok = !oculto;
-            else if (view === 'tudo') view_ok = true;
-
-            const text = r.innerText.toLowerCase();
-            const search_ok = q === "" || text.includes(q);
-            r.style.display = (view_ok && search_ok) ? "" : "none";
-        });
-    }
 
-    document.getElementById("search").addEventListener("input", updateVisibility);
-    document.getElementById("view_selector").addEventListener("change", updateVisibility);
-    document.addEventListener("DOMContentLoaded", function () {
-        document.getElementById("view_selector").dispatchEvent(new Event("change"));
-    });
-
-    // Ordenação por ID
-    (function(){
-        const btn = document.getElementById("btnToggleOrder");
-        let desc = true;
-        function sortTableById(descending) {
-            const tbody = document.querySelector("#tabela tbody");
-            const rows = Array.from(tbody.querySelectorAll("tr"));
-            rows.sort((a,b) => {
-                const ida = parseInt(a.dataset.id||0,10);
-                const idb = parseInt(b.dataset.id||0,10);
-                return descending ? idb - ida : ida - idb;
-            });
-            rows.forEach(r => tbody.appendChild(r));
-        }
-        btn.addEventListener("click", function(){
-            desc = !desc;
-            btn.textContent = desc ? "Ordem: Mais novo → antigo" : "Ordem: Mais antigo → novo";
-            sortTableById(desc);
-        });
-        try { sortTableById(true); } catch(e){}
-    })();
-
-    // Export CSV
-    (function(){
-        const btnOpen = document.getElementById("btnExportCsv");
-        const modal = document.getElementById("modal_export");
-        const btnCancel = document.getElementById("btnCancelExport");
-        const form = document.getElementById("form_export");
-
-        try {
-            flatpickr("#date_from", { enableTime:true, time_24hr:true, dateFormat:"d/m/Y H:i", locale:"pt", theme:"light" });
-            flatpickr("#date_to", { enableTime:true, time_24hr:true, dateFormat:"d/m/Y H:i", locale:"pt", theme:"light" });
-            flatpickr("#extender_data", { enableTime:true, time_24hr:true, dateFormat:"d/m/Y H:i", locale:"pt", theme:"light" });
-        } catch(e) { console.warn("Erro flatpickr:", e); }
-
-        btnOpen.addEventListener("click", function(){
-            modal.style.display = "flex";
-            document.getElementById("manual_ids").value = "";
-            try {
-                const fp = document.querySelector("#date_to")._flatpickr;
-                if (fp) fp.setDate(new Date(), true);
-            } catch(e) {}
-        });
-        btnCancel.addEventListener("click", function(){ modal.style.display = "none"; });
-
-        form.addEventListener("submit", function(ev){
-            if (document.getElementById("f_manual").checked) {
-                const rows = document.querySelectorAll("#tabela tbody tr");
-                const ids = [];
-                rows.forEach(r => {
-                    if (r.style.display !== "none") {
-                        const id = r.dataset.id || r.getAttribute("data-id");
-                        if (id) ids.push(id);
-                    }
-                });
-                document.getElementById("manual_ids").value = ids.join(",");
-            }
-        });
-    })();
-</script>
-</body>
-</html>
-"""
-    page = page.replace("{total}", str(len(registros)))
-    return page
+def listar_perfis():
+    with _perfis_lock:
+        return list(reversed(_perfis_recentes.values()))
+
+
+def obter_perfil(perfil_id):
+    with _perfis_lock:
+        return _perfis_recentes.get(perfil_id)
+
+
+def tabela_cprofile(prof, top_n=PERFIL_TOP_N):
+    """Tabela texto (pstats) ordenada por tempo cumulativo."""
+    buf = io.StringIO()
+    stats = pstats.Stats(prof, stream=buf)
+    stats.strip_dirs().sort_stats("cumulative").print_stats(top_n)
+    return buf.getvalue()
+
+
+class AmostradorPilha(threading.Thread):
+    """
+    Profiler por amostragem: a cada `intervalo` segundos captura a pilha da thread
+    alvo (sys._current_frames) e conta, por função, quantas amostras a tinham na pilha
+    (cumulativo) e no topo (próprio). Overhead bem menor que o cProfile.
+    """
+
+    def __init__(self, thread_id, intervalo=PERFIL_INTERVALO_AMOSTRAGEM):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.intervalo = intervalo
+        self.amostras = 0
+        self.cumulativo = collections.Counter()
+        self.proprio = collections.Counter()
+        self._parar = threading.Event()
+
+    def run(self):
+        while not self._parar.wait(self.intervalo):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            self.amostras += 1
+            vistos = set()
+            topo = True
+            while frame is not None:
+                code = frame.f_code
+                chave = (os.path.basename(code.co_filename), code.co_firstlineno, code.co_name)
+                if topo:
+                    self.proprio[chave] += 1
+                    topo = False
+                if chave not in vistos:
+                    vistos.add(chave)
+                    self.cumulativo[chave] += 1
+                frame = frame.f_back
+
+    def parar(self):
+        self._parar.set()
+        self.join()
+
+    def tabela(self, top_n=PERFIL_TOP_N):
+        total = self.amostras or 1
+        linhas = [f"{self.amostras} amostras (intervalo {self.intervalo * 1000:.1f} ms)", "",
+                  f"{'cumul%':>7} {'proprio%':>9}  função"]
+        for chave, qtd in self.cumulativo.most_common(top_n):
+            arquivo, linha, nome = chave
+            linhas.append(f"{100.0 * qtd / total:7.1f} {100.0 * self.proprio.get(chave, 0) / total:9.1f}  "
+                          f"{nome} ({arquivo}:{linha})")
+        return "\n".join(linhas) + "\n"
+
+
+def gerar_pagina_perfis(perfis, agendados, detalhe=None):
+    """Página simples (admin) com os perfis recentes e o formulário de agendamento."""
+    def esc(s):
+        return str(s).replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+    html = ("<!doctype html><html lang='pt-BR'><head><meta charset='utf-8'><title>Perfis</title></head>"
+            "<body style='background:#0f0f10;color:#eaeaea;font-family:Inter,Arial;padding:20px;'>"
+            "<h2>Profiling de requisições</h2>"
+            "<form method='POST' action='/admin_perfil_agendar' style='margin-bottom:16px;'>"
+            "Perfilar as próximas <input name='quantidade' value='5' size='3'> requisições para a rota "
+            "<input name='rota' value='/lista' size='20'> <button type='submit'>Agendar</button></form>")
+    if agendados:
+        html += "<p>Agendados: " + ", ".join(f"{esc(r)} ({k})" for r, k in agendados.items()) + "</p>"
+    if detalhe:
+        html += (f"<h3>{esc(detalhe['rota'])} — {esc(detalhe['modo'])} — {detalhe['duracao'] * 1000:.1f} ms</h3>"
+                 f"<pre style='background:#111;padding:10px;overflow:auto;'>{esc(detalhe['tabela'])}</pre>")
+    html += "<table style='border-collapse:collapse;font-size:13px;'>"
+    html += "<tr><th align='left'>ID</th><th align='left'>Rota</th><th align='left'>Modo</th><th align='left'>Usuário</th><th align='left'>Quando</th><th align='right'>ms</th><th align='left'>Arquivo</th></tr>"
+    for p in perfis:
+        html += (f"<tr><td><a style='color:#3aa0ff' href='/admin_perfis?id={esc(p['id'])}'>{esc(p['id'])}</a></td>"
+                 f"<td>{esc(p['rota'])}</td><td>{esc(p['modo'])}</td><td>{esc(p.get('usuario') or '')}</td>"
+                 f"<td>{esc(p['criado_em'])}</td><td align='right'>{p['duracao'] * 1000:.1f}</td>"
+                 f"<td>{esc(p.get('arquivo') or '')}</td></tr>")
+    html += "</table><p><a href='/' style='color:#3aa0ff'>Voltar</a></p></body></html>"
+    return html
 
 # ----------------------------- SERVIDOR (HANDLERS) -----------------------------
 class Servidor(BaseHTTPRequestHandler):
 
     def do_GET(self):
+        self._despachar(self._tratar_get)
+
+    def do_POST(self):
+        self._despachar(self._tratar_post)
+
+    # ---------------- profiling sob demanda ----------------
+    def _modo_perfil_solicitado(self):
+        """
+        Lê ?__perfil=... ou o header X-Perfil. Retorna "cprofile", "amostragem" ou None.
+        Só vale para o admin — para os demais o parâmetro é ignorado.
+        """
+        valor = self.headers.get("X-Perfil", "")
+        if not valor and "__perfil=" in self.path:
+            try:
+                valor = parse_qs(urlparse(self.path).query).get("__perfil", [""])[0]
+            except Exception:
+                valor = ""
+        valor = (valor or "").strip().lower()
+        if not valor or valor in ("0", "false", "nao", "não"):
+            return None
+        modo = "amostragem" if valor in ("amostragem", "sample", "sampling") else "cprofile"
+        usuario = self.get_current_user()
+        if not usuario or str(usuario).lower() != "admin":
+            return None
+        return modo
+
+    def setup(self):
+        super().setup()
+        self.wfile = EscritorMedido(self.wfile)
+
+    def _despachar(self, tratador):
+        path = self.path.split("?", 1)[0]
+        ctx = iniciar_contexto_requisicao(self.command, path)
+        try:
+            self._executar(tratador, path)
+        finally:
+            finalizar_contexto_requisicao(ctx)
+
+    def _executar(self, tratador, path):
+        self._perfil_id = None
+        modo = self._modo_perfil_solicitado()
+        # a cota agendada só é gasta por requisição autenticada (anônimos não a consomem)
+        agendado = (tem_perfil_agendado(path) and bool(self.get_current_user())
+                    and consumir_perfil_agendado(path))
+        if not modo and not agendado:
+            tratador()
+            return
+
+        # perfil agendado é sempre cProfile: o objetivo é o .pstats para análise offline
+        modo = "cprofile" if agendado else modo
+        self._perfil_id = f"{int(time.time() * 1000):x}-{secrets.token_hex(3)}"
+        with _perfil_execucao_lock:
+            inicio = time.perf_counter()
+            if modo == "amostragem":
+                amostrador = AmostradorPilha(threading.get_ident())
+                amostrador.start()
+                try:
+                    tratador()
+                finally:
+                    amostrador.parar()
+                duracao = time.perf_counter() - inicio
+                tabela = amostrador.tabela()
+                prof = None
+            else:
+                prof = cProfile.Profile()
+                prof.enable()
+                try:
+                    tratador()
+                finally:
+                    prof.disable()
+                duracao = time.perf_counter() - inicio
+                tabela = tabela_cprofile(prof)
+
+        arquivo = None
+        if agendado:
+            nome_rota = re.sub(r"[^A-Za-z0-9_-]+", "_", path.strip("/")) or "raiz"
+            arquivo = os.path.join(PERFIL_DIR, f"{nome_rota}_{self._perfil_id}.pstats")
+            try:
+                os.makedirs(PERFIL_DIR, exist_ok=True)
+                prof.dump_stats(arquivo)
+            except OSError as e:
+                self.log_message("falha ao gravar o perfil agendado %s: %s", arquivo, e)
+                arquivo = None
+
+        guardar_perfil({
+            "id": self._perfil_id,
+            "rota": path,
+            "modo": modo + (" (agendado)" if agendado else ""),
+            "usuario": self.get_current_user(),
+            "criado_em": sp_now_str(),
+            "duracao": duracao,
+            "tabela": tabela,
+            "arquivo": arquivo,
+        })
+
+    def end_headers(self):
+        # resposta perfilada: informa onde buscar a tabela (/admin_perfis?id=...)
+        if getattr(self, "_perfil_id", None):
+            self.send_header("X-Perfil-Id", self._perfil_id)
+        super().end_headers()
+
+    def _tratar_get(self):
         raw_path = self.path
         path = raw_path.split("?", 1)[0]
 
         # ---------- Rotas públicas ----------
+        if path.startswith("/static/"):
+            self._servir_asset(path)
+            return
+
         if path == "/login":
-            users = load_users()
             cur = self.get_current_user()
             if cur:
                 self.redirect("/")
                 return
-            self.responder(gerar_login_page(users))
+            self.responder(gerar_login_page())
             return
 
         if path == "/logout":
@@ -2572,22 +5066,118 @@ class Servidor(BaseHTTPRequestHandler):
             usuario, ok = self._requer_autenticacao_api()
             if not ok:
                 return
-            with open(ARQUIVO, "r", encoding="utf-8") as f:
-                registros = json.load(f)
-            html = gerar_pendencias_html(registros)
-            self.send_response(200)
-            self.send_header("Content-Type", "text/html; charset=utf-8")
-            self.end_headers()
-            self.wfile.write(html.encode("utf-8"))
+            registros = carregar_registros()
+            with medir_fase("gerar_pendencias_html"):
+                html = gerar_pendencias_html(registros)
+            self.responder(html, cacheavel=True)
             return
 
-        if path == "/export_csv":
+        if path == "/lista/linhas":
+            # troca de vista sem recarregar a página: só o <tbody> da vista, com a versão/geração
+            # e as contagens nos cabeçalhos (a página continua a sincronizar a partir dessa versão)
+            usuario, ok = self._requer_autenticacao_api()
+            if not ok:
+                return
+            vista, quentes, arquivados = selecao_lista(parse_qs(urlparse(raw_path).query), carregar_registros())
+            total, versao, linhas = _linhas_pagina_lista(quentes, usuario, arquivados)
+            cabecalhos = {
+                "Cache-Control": "no-cache",
+                "X-Vista": vista,
+                "X-Arquivo": "1" if arquivados is not None else "0",
+                "X-Total": str(total),
+                "X-Versao": str(versao),
+                "X-Geracao": geracao_dados(),
+                "X-Contagens": json.dumps(contagens_vistas(), separators=(",", ":")),
+            }
+            partes = (p.encode("utf-8") for p in linhas)
+            if total >= LISTA_STREAM_MIN_REGISTROS:
+                self._enviar_stream(200, "text/html; charset=utf-8", partes, headers=cabecalhos)
+            else:
+                self._enviar(200, "text/html; charset=utf-8", list(partes), headers=cabecalhos)
+            return
+
+        if path == "/api/registros/changes":
+            usuario, ok = self._requer_autenticacao_api()
+            if not ok:
+                return
+            qs = parse_qs(urlparse(raw_path).query)
+            try:
+                desde = int(qs.get("since", ["0"])[0])
+            except ValueError:
+                return self.responder_json({"erro": "since inválido"}, status=400)
+            geracao = qs.get("geracao", [""])[0]
+            registros = carregar_registros()
+            self.responder_json(gerar_delta_lista(registros, desde, geracao, usuario))
+            return
+
+        if path == "/api/auditoria":
+            usuario, ok = self._requer_autenticacao_api()
+            if not ok:
+                return
+            if str(usuario).lower() != "admin":
+                return self.responder_json({"erro": "Permissão negada."}, status=403)
+            qs = parse_qs(urlparse(raw_path).query)
+            try:
+                id_txt = qs.get("id", [""])[0].strip()
+                id_reg = int(id_txt) if id_txt else None
+                limite = int(qs.get("limite", ["500"])[0])
+            except ValueError:
+                return self.responder_json({"erro": "id/limite inválido"}, status=400)
+            desde = parse_br_datetime(qs.get("date_from", [""])[0].strip())
+            ate = parse_br_datetime(qs.get("date_to", [""])[0].strip())
+            edicoes = consultar_auditoria(id_reg, qs.get("usuario", [""])[0].strip() or None,
+                                          desde, ate, limite)
+            self.responder_json({"edicoes": edicoes})
+            return
+
+        if path == "/api/observacoes":
+            usuario, ok = self._requer_autenticacao_api()
+            if not ok:
+                return
+            try:
+                id_reg = int(parse_qs(urlparse(raw_path).query).get("id", [""])[0])
+            except (TypeError, ValueError):
+                return self.responder_json({"erro": "id inválido"}, status=400)
+            registros = carregar_registros()   # em ordem de id
+            i = bisect.bisect_left(registros, id_reg, key=_id_ordem)
+            registro = registros[i] if i < len(registros) and _id_ordem(registros[i]) == id_reg else None
+            if registro is None:
+                encontrado = buscar_arquivado(id_reg)
+                registro = encontrado[3] if encontrado else {"id": id_reg}
+            self.responder_json({"id": id_reg, "observacoes": observacoes_do_registro(registro)})
+            return
+
+        if path == "/api/estatisticas":
+            usuario, ok = self._requer_autenticacao_api()
+            if not ok:
+                return
+            qs = parse_qs(urlparse(raw_path).query)
+            try:
+                dias = min(max(int(qs.get("dias", ["30"])[0]), 1), ESTATISTICAS_DIAS)
+                semanas = min(max(int(qs.get("semanas", ["12"])[0]), 1), ESTATISTICAS_SEMANAS)
+            except ValueError:
+                return self.responder_json({"erro": "dias/semanas inválidos"}, status=400)
+            self.responder_json(estatisticas(dias, semanas))
+            return
+
+        if path.startswith("/api/patrimonio/"):
             usuario, ok = self._requer_autenticacao_api()
             if not ok:
                 return
+            patrimonio = unquote(path[len("/api/patrimonio/"):]).strip()
+            if not patrimonio:
+                return self.responder_json({"erro": "patrimônio não informado"}, status=400)
+            historico = linha_do_tempo(patrimonio)
+            if not historico:
+                return self.responder_json({"patrimonio": patrimonio, "erro": "nenhum registro"}, status=404)
+            self.responder_json({"patrimonio": patrimonio, "atual": situacao_patrimonio(historico),
+                                 "historico": resumo_linha_tempo(historico)})
+            return
 
-            with open(ARQUIVO, "r", encoding="utf-8") as f:
-                registros = json.load(f)
+        if path == "/export_csv":
+            usuario, ok = self._requer_autenticacao_api()
+            if not ok:
+                return
 
             # parse query string
             qs = {}
@@ -2596,116 +5186,30 @@ class Servidor(BaseHTTPRequestHandler):
             except Exception:
                 qs = {}
 
-            def has(key):
-                return key in qs and qs.get(key)
-
-            filtered = list(registros)
+            # quentes pela tabela colunar; do arquivo frio, só os anos do período filtrado
+            filtered = filtrar_export(qs)
+            self._enviar_stream(200, "text/csv; charset=utf-8", gerar_csv_partes(filtered),
+                                headers={"Content-Disposition": "attachment; filename=registros_hardware.csv"})
+            return
 
-            if has('f_all'):
-                filtered = list(registros)
-            else:
-                if has('f_manual') and qs.get('manual_ids'):
-                    ids = []
-                    try:
-                        ids = [int(x) for x in qs.get('manual_ids', [''])[0].split(',') if x.strip()!='']
-                    except:
-                        ids = []
-                    filtered = [r for r in filtered if (r.get('id') is not None and int(r.get('id')) in ids)]
-
-                if has('f_tipo') and qs.get('tipo_value'):
-                    tipo_v = qs.get('tipo_value', [''])[0].strip()
-                    if tipo_v:
-                        filtered = [r for r in filtered if (str(r.get('tipo','')) == tipo_v)]
-
-                if has('f_responsavel') and qs.get('responsavel_value'):
-                    rv = qs.get('responsavel_value', [''])[0].strip().lower()
-                    if rv:
-                        filtered = [r for r in filtered if (str(r.get('responsavel','')).strip().lower() == rv)]
-
-                if has('f_emprestado_para') and qs.get('emprestado_para_value'):
-                    qv = qs.get('emprestado_para_value', [''])[0].strip().lower()
-                    if qv:
-                        filtered = [r for r in filtered if qv in str(r.get('emprestado_para','')).lower()]
-
-                if has('f_origem') and qs.get('origem_value'):
-                    ov = qs.get('origem_value', [''])[0].strip().lower()
-                    if ov:
-                        filtered = [r for r in filtered if ov in str(r.get('origem','')).lower()]
-
-                if has('f_patrimonio') and qs.get('patrimonio_value'):
-                    pv = qs.get('patrimonio_value', [''])[0].strip().lower()
-                    if pv:
-                        filtered = [r for r in filtered if pv in str(r.get('patrimonio','')).lower()]
-
-                if has('f_workflow') and qs.get('workflow_value'):
-                    wv = qs.get('workflow_value', [''])[0].strip().lower()
-                    if wv:
-                        filtered = [r for r in filtered if wv in str(r.get('workflow','')).lower()]
-
-                if has('f_motivo') and qs.get('motivo_value'):
-                    mv = qs.get('motivo_value', [''])[0].strip().lower()
-                    if mv:
-                        filtered = [r for r in filtered if str(r.get('motivo','')).strip().lower() == mv]
-
-                if has('f_hardware') and qs.get('hardware_value'):
-                    hv = qs.get('hardware_value', [''])[0].strip().lower()
-                    if hv:
-                        filtered = [r for r in filtered if str(r.get('hardware','')).strip().lower() == hv]
-
-                if has('f_marca') and qs.get('marca_value'):
-                    mvv = qs.get('marca_value', [''])[0].strip().lower()
-                    if mvv:
-                        filtered = [r for r in filtered if mvv in str(r.get('marca','')).lower()]
-
-                if has('f_modelo') and qs.get('modelo_value'):
-                    modv = qs.get('modelo_value', [''])[0].strip().lower()
-                    if modv:
-                        filtered = [r for r in filtered if modv in str(r.get('modelo','')).lower()]
-
-                if has('f_data'):
-                    from_s = qs.get('date_from', [''])[0].strip()
-                    to_s = qs.get('date_to', [''])[0].strip()
-                    dt_from = parse_br_datetime(from_s) if from_s else None
-                    dt_to = parse_br_datetime(to_s) if to_s else None
-                    if dt_from or dt_to:
-                        def in_range(r):
-                            di = parse_br_datetime(r.get('data_inicio',''))
-                            if not di:
-                                return False
-                            if dt_from and di < dt_from:
-                                return False
-                            if dt_to and di > dt_to:
-                                return False
-                            return True
-                        filtered = [r for r in filtered if in_range(r)]
-
-            campos_csv = ["id", "tipo", "responsavel", "emprestado_para", "origem", "patrimonio", "workflow", "motivo",
-                          "hardware", "marca", "modelo", "data_inicio", "data_retorno", "devolvido", "estoque",
-                          "status", "client_ip", "registrado_em"]
-
-            from io import StringIO
-            csv_buffer = StringIO()
-            writer = csv.DictWriter(csv_buffer, fieldnames=campos_csv)
-            writer.writeheader()
-            for r in filtered:
-                row = {k: (r.get(k, "") if r.get(k, "") is not None else "") for k in campos_csv
-                       if k not in ("client_ip", "registrado_em", "status")}
-                oculto = r.get("oculto_meta", {}) or {}
-                row["client_ip"] = oculto.get("client_ip", "")
-                row["registrado_em"] = oculto.get("registrado_em", "")
-                row["estoque"] = "Sim" if r.get("estoque") else "Não"
-                row["devolvido"] = "Sim" if r.get("devolvido") else "Não"
-                row["status"] = calcular_status(r)
-                writer.writerow(row)
-
-            csv_data = csv_buffer.getvalue()
-            csv_buffer.close()
-
-            self.send_response(200)
-            self.send_header("Content-Type", "text/csv; charset=utf-8")
-            self.send_header("Content-Disposition", "attachment; filename=registros_hardware.csv")
-            self.end_headers()
-            self.wfile.write(csv_data.encode("utf-8"))
+        # ---------- Profiling (admin) ----------
+        if path == "/admin_perfis":
+            cur_user = self.get_current_user()
+            if not cur_user:
+                self.redirect("/login")
+                return
+            if str(cur_user).lower() != "admin":
+                return self.responder_error("Permissão negada.")
+            perfil_id = ""
+            try:
+                perfil_id = parse_qs(urlparse(self.path).query).get("id", [""])[0]
+            except Exception:
+                perfil_id = ""
+            detalhe = obter_perfil(perfil_id) if perfil_id else None
+            if detalhe and "text/plain" in self.headers.get("Accept", ""):
+                self._enviar(200, "text/plain; charset=utf-8", detalhe["tabela"].encode("utf-8"))
+                return
+            self.responder(gerar_pagina_perfis(listar_perfis(), perfis_agendados(), detalhe))
             return
 
         # ---------- Rotas de página (redirecionam para login se não autenticado) ----------
@@ -2715,23 +5219,46 @@ class Servidor(BaseHTTPRequestHandler):
                 self.redirect("/login")
                 return
 
-            with open(ARQUIVO, "r", encoding="utf-8") as f:
-                registros = json.load(f)
+            registros = carregar_registros()
 
             if path == "/":
-                self.responder(gerar_html_form(registros, cur_user))
-            else:  # /lista
-                self.responder(gerar_pagina_lista(registros, cur_user))
+                self.responder(gerar_html_form(registros, cur_user), cacheavel=True)
+                return
+
+            # /lista?view=<vista>: só as linhas da vista (padrão: ativos); ?arquivo=1 inclui o arquivo frio
+            vista, quentes, arquivados = selecao_lista(parse_qs(urlparse(raw_path).query), registros)
+            pagina = gerar_pagina_lista(quentes, cur_user, arquivados=arquivados, vista=vista)
+            if len(quentes) + len(arquivados or ()) >= LISTA_STREAM_MIN_REGISTROS:
+                # listas grandes: linhas vão para o socket conforme são geradas (sem ETag)
+                self._enviar_stream(200, "text/html; charset=utf-8", pagina, headers={"Cache-Control": "no-cache"})
+            else:
+                self.responder(pagina, cacheavel=True)
+            return
+
+        if path == "/estatisticas":
+            cur_user = self.get_current_user()
+            if not cur_user:
+                self.redirect("/login")
+                return
+            self.responder(_TPL_ESTATISTICAS.render(usuario=f"Olá, {cur_user}"), cacheavel=True)
             return
 
         # ---------- Qualquer outra rota -> 404 ----------
         self.send_error(404, "Página não encontrada")
 
-    def do_POST(self):
+    def _tratar_post(self):
+        path = self.path.split("?", 1)[0]
+        # importação: o corpo (CSV) é lido aos pedaços pelo importador, não aqui
+        if path == "/importar_csv":
+            return self._tratar_importacao()
+
         tamanho = int(self.headers.get("Content-Length", 0))
         dados = self.rfile.read(tamanho).decode("utf-8")
         campos = parse_qs(dados)
-        path = self.path.split("?", 1)[0]
+
+        # ---------- API JSON: ação em lote (401 em vez de redirecionar para o login) ----------
+        if path == "/api/lote":
+            return self._tratar_lote(dados, campos)
 
         # ---------- Rota pública: /login ----------
         if path == "/login":
@@ -2739,18 +5266,45 @@ class Servidor(BaseHTTPRequestHandler):
             password = campos.get("password", [""])[0]
             remember = bool(campos.get("remember", [""])[0])
 
+            # limites antes de qualquer PBKDF2: por IP (todas as tentativas) e por usuário (falhas)
+            ip = self.client_address[0] if self.client_address else ""
+            nome = _nome_usuario(username)
+            espera = max(_tentativas_ip.espera(ip, LOGIN_TENTATIVAS_POR_IP),
+                         _falhas_usuario.espera(nome, LOGIN_FALHAS_POR_USUARIO))
+            if espera:
+                return self.responder_error(f"Muitas tentativas de login. Tente novamente em {espera} s.",
+                                            status=429, headers={"Retry-After": str(espera)})
+            _tentativas_ip.registrar(ip, LOGIN_TENTATIVAS_POR_IP)
+
             users = load_users()
             user = find_user(users, username)
             if not user:
                 return self.responder_error("Usuário inexistente.")
 
-            if not user.get("password_hash"):
-                if not password or len(password) < 6:
-                    return self.responder_error("Defina uma senha com pelo menos 6 caracteres.")
-                salt_hex, hash_hex = hash_password(password)
-                user["salt"] = salt_hex
-                user["password_hash"] = hash_hex
-                save_users(users)
+            try:
+                if not user.get("password_hash"):
+                    if not password or len(password) < 6:
+                        return self.responder_error("Defina uma senha com pelo menos 6 caracteres.")
+                    salt_hex, hash_hex = executar_hash(hash_password, password)
+                    senha_ok = None
+                else:
+                    senha_ok = executar_hash(verify_password, password, user.get("salt",""), user.get("password_hash",""))
+            except FilaSenhasCheia:
+                return self.responder_error("Servidor ocupado com outros logins. Tente novamente em instantes.",
+                                            status=503, headers={"Retry-After": "1"})
+
+            if senha_ok is None:
+                with _usuarios_lock:
+                    users = load_users()
+                    user = find_user(users, username)
+                    if not user:
+                        return self.responder_error("Usuário inexistente.")
+                    if user.get("password_hash"):
+                        # outro primeiro login terminou antes (o hash foi calculado fora do lock)
+                        return self.responder_error("A senha deste usuário acabou de ser definida. Entre com ela.")
+                    user["salt"] = salt_hex
+                    user["password_hash"] = hash_hex
+                    save_users(users)
                 token = create_session(username)
                 self.send_response(303)
                 self.set_session_cookie(token, remember=remember)
@@ -2758,7 +5312,8 @@ class Servidor(BaseHTTPRequestHandler):
                 self.end_headers()
                 return
 
-            if verify_password(password, user.get("salt",""), user.get("password_hash","")):
+            if senha_ok:
+                _falhas_usuario.limpar(nome)
                 token = create_session(username)
                 self.send_response(303)
                 self.set_session_cookie(token, remember=remember)
@@ -2766,6 +5321,7 @@ class Servidor(BaseHTTPRequestHandler):
                 self.end_headers()
                 return
             else:
+                _falhas_usuario.registrar(nome, LOGIN_FALHAS_POR_USUARIO)
                 return self.responder_error("Senha incorreta.")
 
         # ---------- Todas as outras rotas POST exigem autenticação ----------
@@ -2781,11 +5337,11 @@ class Servidor(BaseHTTPRequestHandler):
             username = campos.get("username", [""])[0].strip()
             if not username:
                 return self.responder_error("Nome de usuário inválido.")
-            users = load_users()
-            if find_user(users, username):
-                return self.responder_error("Usuário já existe.")
-            users.append({"username": username})
-            save_users(users)
+            with _usuarios_lock:
+                users = load_users()
+                if find_user(users, username):
+                    return self.responder_error("Usuário já existe.")
+                save_users(users + [{"username": username}])
             self.redirect("/")
             return
 
@@ -2795,16 +5351,44 @@ class Servidor(BaseHTTPRequestHandler):
             target = campos.get("target_user", [""])[0].strip()
             if not target:
                 return self.responder_error("Selecione um usuário.")
-            users = load_users()
-            u = find_user(users, target)
-            if not u:
-                return self.responder_error("Usuário inexistente.")
-            u.pop("password_hash", None)
-            u.pop("salt", None)
-            save_users(users)
+            with _usuarios_lock:
+                users = load_users()
+                u = find_user(users, target)
+                if not u:
+                    return self.responder_error("Usuário inexistente.")
+                u.pop("password_hash", None)
+                u.pop("salt", None)
+                save_users(users)
             self.redirect("/")
             return
 
+        if path == "/admin_perfil_agendar":
+            if str(usuario).lower() != "admin":
+                return self.responder_error("Permissão negada.")
+            rota = campos.get("rota", [""])[0].strip()
+            try:
+                quantidade = int(campos.get("quantidade", ["0"])[0])
+            except:
+                return self.responder_error("Quantidade inválida.")
+            if not rota.startswith("/"):
+                return self.responder_error("Rota inválida.")
+            agendar_perfil(rota, quantidade)
+            self.redirect("/admin_perfis")
+            return
+
+        if path == "/admin_arquivar":
+            if str(usuario).lower() != "admin":
+                return self.responder_error("Permissão negada.")
+            try:
+                idade = int(campos.get("idade_dias", [str(ARQUIVAMENTO_IDADE_DIAS)])[0])
+            except ValueError:
+                return self.responder_error("Idade inválida.")
+            if idade < 0:
+                return self.responder_error("Idade inválida.")
+            arquivar_registros(idade)
+            self.redirect("/lista")
+            return
+
         if path == "/admin_delete_user":
             if str(usuario).lower() != "admin":
                 return self.responder_error("Permissão negada.")
@@ -2813,271 +5397,68 @@ class Servidor(BaseHTTPRequestHandler):
                 return self.responder_error("Selecione um usuário.")
             if target.lower() == "admin":
                 return self.responder_error("Não é permitido excluir o usuário admin.")
-            users = load_users()
-            users = [x for x in users if x.get("username","").strip().lower() != target.lower()]
-            save_users(users)
+            with _usuarios_lock:
+                users = [x for x in load_users() if _nome_usuario(x.get("username","")) != _nome_usuario(target)]
+                save_users(users)
             self.redirect("/")
             return
 
-        # ---------- Ações de movimentação ----------
-        elif path == "/registrar":
-            with open(ARQUIVO, "r", encoding="utf-8") as f:
-                registros = json.load(f)
-
-            maxid = 0
-            for r in registros:
-                try:
-                    if int(r.get("id", 0)) > maxid:
-                        maxid = int(r.get("id", 0))
-                except:
-                    pass
-            novo_id = maxid + 1
-
-            tipo = campos.get("tipo", [""])[0].strip()
-            responsavel = campos.get("responsavel", [""])[0].strip()
-            patrimonio = campos.get("patrimonio", [""])[0].strip()
-            data_inicio_raw = campos.get("data_inicio", [""])[0]
-            data_inicio = normalize_br_datetime_str(data_inicio_raw)
-
-            if not tipo:
-                return self.responder_error("Campo 'Tipo' é obrigatório.")
-            if not responsavel:
-                return self.responder_error("Campo 'Responsável' é obrigatório.")
-
-            motivo = campos.get("motivo", [""])[0].strip()
-            if not motivo:
-                return self.responder_error("Campo 'Motivo' é obrigatório.")
-            if motivo == "outros":
-                motivo_outros = campos.get("motivo_outros", [""])[0].strip()
-                if not motivo_outros:
-                    return self.responder_error("Descreva o motivo (campo obrigatório quando selecionar 'Outros').")
-                motivo = motivo_outros
-
-            hardware = campos.get("hardware", [""])[0].strip()
-            if not hardware:
-                return self.responder_error("Campo 'Hardware' é obrigatório.")
-            if hardware == "outros":
-                hardware_outros = campos.get("hardware_outros", [""])[0].strip()
-                if not hardware_outros:
-                    return self.responder_error("Descreva o hardware (campo obrigatório quando selecionar 'Outros').")
-                hardware = hardware_outros
-
-            if hardware != "Teclado/Mouse" and not patrimonio:
-                return self.responder_error("Campo 'Patrimônio' é obrigatório para este hardware.")
-
-            if patrimonio and not re.match(r'^\d{7,}$', patrimonio):
-                return self.responder_error("Patrimônio inválido. Digite apenas números e no mínimo 7 dígitos.")
-
-            workflow = campos.get("workflow", [""])[0]
-            origem = campos.get("origem", [""])[0].strip()
-            marca = campos.get("marca", [""])[0]
-            modelo = campos.get("modelo", [""])[0]
-            observacao = campos.get("observacao", [""])[0].strip()
-
-            if observacao and len(observacao) > 200:
-                return self.responder_error("Observação deve ter no máximo 200 caracteres.")
-
-            novo = {
-                "id": novo_id,
-                "tipo": tipo,
-                "responsavel": responsavel,
-                "patrimonio": patrimonio,
-                "workflow": workflow,
-                "origem": origem,
-                "data_inicio": data_inicio,
-                "motivo": motivo,
-                "hardware": hardware,
-                "marca": marca,
-                "modelo": modelo,
-                "devolvido": False,
-                "estoque": False,
-                "observacao": observacao,
-                "observacoes": ([{
-                    "text": observacao,
-                    "registrado_em": (normalize_br_datetime_str(campos.get("registrado_em", [""])[0])
-                                    or sp_now_str())
-                }] if observacao else [])
-            }
+        # ---------- Ações de movimentação (ler → alterar → salvar sob _dados_lock) ----------
+        with _dados_lock:
+            self._desarquivar_se_preciso(campos)
+            self._tratar_post_registros(path, campos, usuario)
 
-            if tipo == "emprestimo":
-                novo["emprestado_para"] = campos.get("emprestado_para", [""])[0]
-                novo["data_retorno"] = normalize_br_datetime_str(campos.get("data_retorno", [""])[0])
+    def _desarquivar_se_preciso(self, campos):
+        """Ação sobre um id que está só no arquivo frio: traz o registro de volta antes de tratá-la."""
+        try:
+            id_reg = int(campos.get("id", ["0"])[0])
+        except (TypeError, ValueError):
+            return
+        if id_reg <= 0 or id_reg > max_id_arquivado():
+            return
+        registros = carregar_registros()   # em ordem de id
+        i = bisect.bisect_left(registros, id_reg, key=_id_ordem)
+        if i < len(registros) and _id_ordem(registros[i]) == id_reg:
+            return
+        desarquivar_registro(id_reg)
 
+    def _tratar_post_registros(self, path, campos, usuario):
+        if path == "/registrar":
             try:
                 client_ip = self.client_address[0] if hasattr(self, "client_address") else ""
             except:
                 client_ip = ""
+            try:
+                novo, observacao, obs_em = montar_movimento(lambda k: campos.get(k, [""])[0], usuario, client_ip)
+            except ValueError as e:
+                return self.responder_error(str(e))
 
-            novo["oculto_meta"] = {
-                "client_ip": client_ip,
-                "registrado_em": sp_now_str(),
-                "registrado_por": usuario
-            }
+            registros = carregar_registros()
+            novo["id"] = novo_id = proximo_id(registros)
+            if observacao:
+                anexar_observacao(novo_id, observacao, obs_em, usuario)
+                novo["ultima_observacao_em"] = obs_em
 
+            registrar_alteracao(novo)
             registros.append(novo)
 
-            with open(ARQUIVO, "w", encoding="utf-8") as f:
-                json.dump(registros, f, ensure_ascii=False, indent=4)
+            salvar_registros(registros)
 
             self.redirect("/lista")
 
         elif path == "/retornar":
-            try:
-                id_reg = int(campos.get("id", ["0"])[0])
-            except:
-                id_reg = 0
-            with open(ARQUIVO, "r", encoding="utf-8") as f:
-                registros = json.load(f)
-
-            original = None
-            for r in registros:
-                try:
-                    if int(r.get("id", 0)) == id_reg:
-                        original = r
-                        break
-                except:
-                    pass
-
-            if not original:
-                return self.responder_error("Registro não encontrado.")
-
-            tipo_orig = original.get("tipo", "")
-            if tipo_orig == "emprestimo":
-                updated = False
-                for r in registros:
-                    try:
-                        if int(r.get("id", 0)) == id_reg:
-                            r["devolvido"] = True
-                            updated = True
-                    except:
-                        pass
-                if updated:
-                    with open(ARQUIVO, "w", encoding="utf-8") as f:
-                        json.dump(registros, f, ensure_ascii=False, indent=4)
-                self.redirect("/lista")
-                return
-
-            now_str = sp_now_str()
-            maxid = 0
-            for r in registros:
-                try:
-                    if int(r.get("id", 0)) > maxid:
-                        maxid = int(r.get("id", 0))
-                except:
-                    pass
-            novo_id = maxid + 1
-
-            novo = {
-                "id": novo_id,
-                "tipo": "saida" if tipo_orig == "entrada" else "entrada",
-                "responsavel": original.get("responsavel", ""),
-                "patrimonio": original.get("patrimonio", ""),
-                "workflow": original.get("workflow", ""),
-                "origem": original.get("origem", ""),
-                "data_inicio": now_str,
-                "motivo": original.get("motivo", ""),
-                "hardware": original.get("hardware", ""),
-                "marca": original.get("marca", ""),
-                "modelo": original.get("modelo", ""),
-                "devolvido": False,
-                "estoque": False
-            }
-
-            novo["oculto_meta"] = {
-                "client_ip": original.get("oculto_meta", {}).get("client_ip", ""),
-                "registrado_em": sp_now_str(),
-                "registrado_por": usuario
-            }
-
-            if original.get("emprestado_para"):
-                novo["emprestado_para"] = original.get("emprestado_para", "")
-
-            if novo["tipo"] == "emprestimo":
-                novo["data_retorno"] = original.get("data_retorno", "")
-
-            updated = False
-            for r in registros:
-                try:
-                    if int(r.get("id", 0)) == id_reg:
-                        r["devolvido"] = True
-                        r["estoque"] = False
-                        r["status_extra"] = f"Devolvido (ID: {novo_id})"
-                        updated = True
-                        break
-                except:
-                    pass
-            registros.append(novo)
-
-            with open(ARQUIVO, "w", encoding="utf-8") as f:
-                json.dump(registros, f, ensure_ascii=False, indent=4)
-
-            self.redirect("/lista")
+            self._acao_individual(campos, retornar_registro, usuario, exige_registro=True)
 
         elif path == "/alternar_estoque":
-            try:
-                id_reg = int(campos.get("id", ["0"])[0])
-            except:
-                id_reg = 0
-            with open(ARQUIVO, "r", encoding="utf-8") as f:
-                registros = json.load(f)
-
-            updated = False
-            for r in registros:
-                try:
-                    if int(r.get("id", 0)) == id_reg:
-                        r["estoque"] = not r.get("estoque", False)
-                        updated = True
-                except:
-                    pass
-            if updated:
-                with open(ARQUIVO, "w", encoding="utf-8") as f:
-                    json.dump(registros, f, ensure_ascii=False, indent=4)
-
-            self.redirect("/lista")
+            self._acao_individual(campos, alternar_estoque_registro, usuario)
 
         elif path == "/devolver":
-            try:
-                id_reg = int(campos.get("id", ["0"])[0])
-            except:
-                id_reg = 0
-            with open(ARQUIVO, "r", encoding="utf-8") as f:
-                registros = json.load(f)
-
-            updated = False
-            for r in registros:
-                try:
-                    if int(r.get("id", 0)) == id_reg:
-                        r["devolvido"] = True
-                        updated = True
-                except:
-                    pass
-            if updated:
-                with open(ARQUIVO, "w", encoding="utf-8") as f:
-                    json.dump(registros, f, ensure_ascii=False, indent=4)
-
-            self.redirect("/lista")
+            self._acao_individual(campos, devolver_registro, usuario)
 
         elif path == "/restaurar":
             if str(usuario).lower() != "admin":
                 return self.responder_error("Permissão negada.")
-            try:
-                id_reg = int(campos.get("id", ["0"])[0])
-            except:
-                id_reg = 0
-            with open(ARQUIVO, "r", encoding="utf-8") as f:
-                registros = json.load(f)
-            updated = False
-            for r in registros:
-                try:
-                    if int(r.get("id", 0)) == id_reg:
-                        r["oculto"] = False
-                        updated = True
-                except:
-                    pass
-            if updated:
-                with open(ARQUIVO, "w", encoding="utf-8") as f:
-                    json.dump(registros, f, ensure_ascii=False, indent=4)
-            self.redirect("/lista")
+            self._acao_individual(campos, restaurar_registro, usuario)
 
         elif path == "/editar_registro":
             try:
@@ -3085,32 +5466,19 @@ class Servidor(BaseHTTPRequestHandler):
             except:
                 return self.responder_error("ID inválido.")
 
-            with open(ARQUIVO, "r", encoding="utf-8") as f:
-                registros = json.load(f)
+            registros = carregar_registros()
 
             registro = None
             for r in registros:
-                if int(r.get("id", 0)) == id_reg:
-                    registro = r
+                if _id_ordem(r) == id_reg:
+                    registro = copia_para_alterar(r)
                     break
 
             if not registro:
                 return self.responder_error("Registro não encontrado.")
 
             is_admin = (usuario and str(usuario).lower() == "admin")
-            is_owner = False
-            if not is_admin:
-                criador = registro.get("oculto_meta", {}).get("registrado_por")
-                if criador and str(criador).lower() == str(usuario).lower():
-                    registrado_em_str = registro.get("oculto_meta", {}).get("registrado_em")
-                    if registrado_em_str:
-                        dt_registro = parse_br_datetime(registrado_em_str)
-                        if dt_registro:
-                            agora = sp_now_naive()
-                            diferenca = agora - dt_registro
-                            if diferenca.total_seconds() < 24 * 3600:
-                                if not registro.get("observacoes"):
-                                    is_owner = True
+            is_owner = not is_admin and pode_editar_como_criador(registro, usuario)
 
             if not (is_admin or is_owner):
                 return self.responder_error("Permissão negada.")
@@ -3202,41 +5570,16 @@ class Servidor(BaseHTTPRequestHandler):
                 registro["estoque"] = new_estoque
 
             if alteracoes:
-                alteracoes["registrado_em_snapshot"] = sp_now_str()
-                alteracoes["edited_by"] = str(usuario)
-
-                if "oculto_meta" not in registro or not isinstance(registro.get("oculto_meta"), dict):
-                    registro["oculto_meta"] = {}
-                if "edicoes" not in registro["oculto_meta"]:
-                    registro["oculto_meta"]["edicoes"] = []
-                registro["oculto_meta"]["edicoes"].append(alteracoes)
+                # histórico vai para o log de auditoria; o registro não cresce a cada edição
+                registrar_edicao(registro, alteracoes, {k: registro.get(k) for k in alteracoes}, usuario)
+                registrar_alteracao(registro)
 
-                with open(ARQUIVO, "w", encoding="utf-8") as f:
-                    json.dump(registros, f, ensure_ascii=False, indent=4)
+                salvar_registros(registros)
 
             self.redirect("/lista")
 
         elif path == "/ocultar":
-            try:
-                id_reg = int(campos.get("id", ["0"])[0])
-            except:
-                id_reg = 0
-            with open(ARQUIVO, "r", encoding="utf-8") as f:
-                registros = json.load(f)
-
-            updated = False
-            for r in registros:
-                try:
-                    if int(r.get("id", 0)) == id_reg:
-                        r["oculto"] = True
-                        updated = True
-                except:
-                    pass
-            if updated:
-                with open(ARQUIVO, "w", encoding="utf-8") as f:
-                    json.dump(registros, f, ensure_ascii=False, indent=4)
-
-            self.redirect("/lista")
+            self._acao_individual(campos, ocultar_registro, usuario)
 
         elif path == "/estender":
             try:
@@ -3246,20 +5589,15 @@ class Servidor(BaseHTTPRequestHandler):
             nova_data_raw = campos.get("data_retorno", [""])[0]
             nova_data_br = normalize_br_datetime_str(nova_data_raw)
 
-            with open(ARQUIVO, "r", encoding="utf-8") as f:
-                registros = json.load(f)
+            registros = carregar_registros()
 
-            updated = False
             for r in registros:
-                try:
-                    if int(r.get("id", 0)) == id_reg:
-                        r["data_retorno"] = nova_data_br
-                        updated = True
-                except:
-                    pass
-            if updated:
-                with open(ARQUIVO, "w", encoding="utf-8") as f:
-                    json.dump(registros, f, ensure_ascii=False, indent=4)
+                if _id_ordem(r) == id_reg:
+                    r = copia_para_alterar(r)
+                    r["data_retorno"] = nova_data_br
+                    registrar_alteracao(r)
+                    salvar_registros(registros)
+                    break
 
             self.redirect("/lista")
 
@@ -3275,33 +5613,102 @@ class Servidor(BaseHTTPRequestHandler):
             if not texto:
                 return self.responder_error("Observação vazia.")
 
-            with open(ARQUIVO, "r", encoding="utf-8") as f:
-                registros = json.load(f)
+            registros = carregar_registros()
 
-            updated = False
             for r in registros:
-                try:
-                    if int(r.get("id", 0)) == id_reg:
-                        if "observacoes" not in r or not isinstance(r["observacoes"], list):
-                            r["observacoes"] = []
-                        novo = {
-                            "text": texto,
-                            "registrado_em": reg_norm
-                        }
-                        r["observacoes"].append(novo)
-                        r["observacao"] = texto
-                        updated = True
-                except:
-                    pass
-            if updated:
-                with open(ARQUIVO, "w", encoding="utf-8") as f:
-                    json.dump(registros, f, ensure_ascii=False, indent=4)
+                if _id_ordem(r) == id_reg:
+                    # o texto vai para o log; no registro fica só o resumo
+                    anexar_observacao(id_reg, texto, reg_norm, usuario)
+                    r = copia_para_alterar(r)
+                    resumir_observacao(r, texto, reg_norm)
+                    registrar_alteracao(r)
+                    salvar_registros(registros)
+                    break
 
             referer = self.headers.get("Referer", "/lista")
             self.redirect(referer)
 
         else:
             self.send_error(404, "Ação desconhecida")
+    def _tratar_lote(self, dados, campos):
+        """
+        POST /api/lote: {"acao": "...", "ids": [..]} em JSON, ou formulário acao=...&ids=1,2,3.
+        Resposta: {"acao", "versao", "resultados": [{"id", "ok", ...}]}, um por id (ver aplicar_lote).
+        """
+        usuario, ok = self._requer_autenticacao_api()
+        if not ok:
+            return
+        if self.headers.get("Content-Type", "").startswith("application/json"):
+            try:
+                corpo = json.loads(dados or "{}")
+                acao = str(corpo.get("acao", ""))
+                ids_brutos = corpo.get("ids", [])
+            except (ValueError, AttributeError):
+                return self.responder_json({"erro": "JSON inválido"}, status=400)
+        else:
+            acao = campos.get("acao", [""])[0]
+            ids_brutos = [p for valor in campos.get("ids", []) for p in valor.split(",")]
+        try:
+            ids = [int(i) for i in ids_brutos if str(i).strip()]
+        except (TypeError, ValueError):
+            return self.responder_json({"erro": "ids inválidos"}, status=400)
+        if acao not in ACOES_LOTE:
+            return self.responder_json({"erro": "ação desconhecida", "acoes": sorted(ACOES_LOTE)}, status=400)
+        if not ids:
+            return self.responder_json({"erro": "nenhum id"}, status=400)
+        if len(ids) > LOTE_MAX_IDS:
+            return self.responder_json({"erro": f"no máximo {LOTE_MAX_IDS} ids por lote"}, status=413)
+        if ACOES_LOTE[acao][1] and str(usuario).lower() != "admin":
+            return self.responder_json({"erro": "Permissão negada"}, status=403)
+        try:
+            resultados = aplicar_lote(acao, ids, usuario)
+        except Exception as e:
+            # nada foi gravado: o manifesto antigo continua valendo e a memória é relida
+            return self.responder_json({"erro": f"falha ao gravar: {e}"}, status=500)
+        self.responder_json({"acao": acao, "versao": versao_dados(), "resultados": resultados})
+
+    def _tratar_importacao(self):
+        """POST /importar_csv (admin): corpo = arquivo CSV; resposta = relatório JSON de importar_csv()."""
+        usuario, ok = self._requer_autenticacao_api()
+        if not ok:
+            return
+        if str(usuario).lower() != "admin":
+            return self.responder_json({"erro": "Permissão negada"}, status=403)
+        try:
+            tamanho = int(self.headers.get("Content-Length", ""))
+        except ValueError:
+            return self.responder_json({"erro": "Content-Length obrigatório"}, status=411)
+        corpo = io.BufferedReader(CorpoLimitado(self.rfile, tamanho), 64 * 1024)
+        client_ip = self.client_address[0] if self.client_address else ""
+        inicio = time.perf_counter()
+        try:
+            relatorio = importar_csv(corpo, usuario, client_ip)
+        except (ValueError, csv.Error) as e:
+            # UnicodeDecodeError também é ValueError; lotes já gravados continuam gravados
+            return self.responder_json({"erro": str(e)}, status=400)
+        relatorio["segundos"] = round(time.perf_counter() - inicio, 3)
+        ctx = contexto_requisicao()
+        if ctx is not None:
+            ctx["importados"] = relatorio["importados"]
+        self.responder_json(relatorio)
+
+    def _acao_individual(self, campos, funcao, usuario, exige_registro=False):
+        """Ação de um id vinda dos botões do /lista: aplica, grava e volta para a lista."""
+        try:
+            id_reg = int(campos.get("id", ["0"])[0])
+        except:
+            id_reg = 0
+        registros = carregar_registros()
+        for r in registros:
+            if _id_ordem(r) == id_reg:
+                funcao(registros, r, usuario)
+                salvar_registros(registros)
+                break
+        else:
+            if exige_registro:
+                return self.responder_error("Registro não encontrado.")
+        self.redirect("/lista")
+
     # ---------------- authentication helpers (dentro de Servidor) ----------------
     def _get_cookie(self, name):
         cookie = self.headers.get("Cookie", "")
@@ -3319,7 +5726,33 @@ class Servidor(BaseHTTPRequestHandler):
         token = self._get_cookie("session_token")
         if not token:
             return None
-        return validate_session(token)
+        with medir_fase("validate_session"):
+            usuario = validate_session(token)
+        ctx = contexto_requisicao()
+        if ctx is not None and usuario:
+            ctx["usuario"] = usuario
+        return usuario
+
+    # logging: em vez das linhas do BaseHTTPRequestHandler no stderr, o status e as
+    # mensagens vão para o contexto da requisição e acabam no slow log (SLOW_LOG_FILE)
+    def log_request(self, code="-", size="-"):
+        ctx = contexto_requisicao()
+        if ctx is not None:
+            try:
+                ctx["status"] = int(code)
+            except (TypeError, ValueError):
+                ctx["status"] = str(code)
+
+    def log_message(self, format, *args):
+        ctx = contexto_requisicao()
+        if ctx is not None:
+            ctx["mensagem"] = format % args
+        else:
+            escrever_slow_log({
+                "ts": datetime.datetime.now().isoformat(timespec="milliseconds"),
+                "cliente": self.client_address[0] if self.client_address else "",
+                "mensagem": format % args,
+            })
 
     def set_session_cookie(self, token, remember=False):
         # set cookie: HttpOnly, Path=/
@@ -3336,23 +5769,135 @@ class Servidor(BaseHTTPRequestHandler):
 
 
     # utilitários
-    def responder(self, conteudo):
+    def responder(self, conteudo, cacheavel=False):
+        """Responde HTML 200; `conteudo` é str ou a lista de pedaços em bytes de um Template."""
+        if isinstance(conteudo, str):
+            conteudo = conteudo.encode("utf-8")
+        self._enviar(200, "text/html; charset=utf-8", conteudo, cacheavel=cacheavel)
+
+    def responder_json(self, dados, status=200):
+        corpo = json.dumps(dados, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        self._enviar(status, "application/json; charset=utf-8", corpo, headers={"Cache-Control": "no-store"})
+
+    def _enviar(self, status, content_type, corpo, headers=None, cacheavel=False):
+        """
+        Envia um corpo pronto (bytes ou lista de pedaços em bytes), comprimindo com gzip/deflate
+        quando o cliente aceita e o corpo passa de COMPRESSAO_MIN_BYTES. Respostas `cacheavel`
+        levam ETag: um If-None-Match igual vira 304 e o corpo comprimido fica em cache junto do ETag.
+        Uma lista de pedaços sem compressão vai para o socket com writelines, sem ser juntada.
+        """
+        if isinstance(corpo, (bytes, bytearray)):
+            tamanho = len(corpo)
+        else:
+            corpo = list(corpo)
+            tamanho = sum(len(p) for p in corpo)
+        etag = calcular_etag(corpo) if cacheavel else None
+        if etag and status == 200 and etag in self.headers.get("If-None-Match", ""):
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Cache-Control", "no-cache")
+            self.end_headers()
+            return
+
+        codificacao = None
+        if tamanho >= COMPRESSAO_MIN_BYTES:
+            codificacao = escolher_codificacao(self.headers.get("Accept-Encoding", ""))
+        if codificacao:
+            corpo = comprimir_com_cache(corpo, etag, codificacao) if etag else comprimir(corpo, codificacao)
+            tamanho = len(corpo)
+
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        if codificacao:
+            self.send_header("Content-Encoding", codificacao)
+        if tamanho >= COMPRESSAO_MIN_BYTES or codificacao:
+            self.send_header("Vary", "Accept-Encoding")
+        if etag:
+            self.send_header("ETag", etag)
+            self.send_header("Cache-Control", "no-cache")
+        self.send_header("Content-Length", str(tamanho))
+        self.end_headers()
+        if isinstance(corpo, (bytes, bytearray)):
+            self.wfile.write(corpo)
+        else:
+            self.wfile.writelines(corpo)
+
+    def _servir_asset(self, path):
+        """
+        Serve um asset de /static/ direto da memória. A URL muda junto com o conteúdo, então a
+        resposta é immutable por um ano; a variante gzip/deflate já vem comprimida do registro.
+        """
+        asset = obter_asset(path)
+        if not asset:
+            self._enviar(404, "text/plain; charset=utf-8", b"Asset nao encontrado")
+            return
+        cache = f"public, max-age={STATIC_MAX_AGE}, immutable"
+        if asset["etag"] in self.headers.get("If-None-Match", ""):
+            self.send_response(304)
+            self.send_header("ETag", asset["etag"])
+            self.send_header("Cache-Control", cache)
+            self.end_headers()
+            return
+        corpo = asset["corpo"]
+        codificacao = None
+        if asset["variantes"]:
+            codificacao = escolher_codificacao(self.headers.get("Accept-Encoding", ""))
+            if codificacao in asset["variantes"]:
+                corpo = asset["variantes"][codificacao]
+            else:
+                codificacao = None
         self.send_response(200)
-        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Type", asset["content_type"])
+        self.send_header("Cache-Control", cache)
+        self.send_header("ETag", asset["etag"])
+        if asset["variantes"]:
+            self.send_header("Vary", "Accept-Encoding")
+        if codificacao:
+            self.send_header("Content-Encoding", codificacao)
+        self.send_header("Content-Length", str(len(corpo)))
         self.end_headers()
-        self.wfile.write(conteudo.encode("utf-8"))
-
-    def responder_error(self, mensagem):
+        self.wfile.write(corpo)
+
+    def _enviar_stream(self, status, content_type, partes, headers=None):
+        """
+        Envia um corpo produzido aos pedaços (iterável de bytes) sem montá-lo inteiro em memória.
+        Com gzip/deflate cada pedaço passa por um compressobj e segue para o socket assim que
+        o compressor devolve bytes; sem Content-Length, o fim da conexão delimita o corpo.
+        """
+        codificacao = escolher_codificacao(self.headers.get("Accept-Encoding", ""))
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.send_header("Vary", "Accept-Encoding")
+        if codificacao:
+            self.send_header("Content-Encoding", codificacao)
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        if not codificacao:
+            for parte in partes:
+                if parte:
+                    self.wfile.write(parte)
+            return
+        comp = novo_compressor(codificacao)
+        for parte in partes:
+            if parte:
+                saida = comp.compress(parte)
+                if saida:
+                    self.wfile.write(saida)
+        self.wfile.write(comp.flush())
+
+    def responder_error(self, mensagem, status=400, headers=None):
         conteudo = (
             "<!doctype html><html><head><meta charset='utf-8'><title>Erro</title></head>"
             "<body style='background:#0f0f10;color:#eaeaea;font-family:Inter,Arial;padding:20px;'>"
             "<h2>Erro</h2><p>{}</p>"
             "<p><a href='/' style='color:#3aa0ff'>Voltar</a></p></body></html>".format(mensagem)
         )
-        self.send_response(400)
-        self.send_header("Content-Type", "text/html; charset=utf-8")
-        self.end_headers()
-        self.wfile.write(conteudo.encode("utf-8"))
+        self._enviar(status, "text/html; charset=utf-8", conteudo.encode("utf-8"), headers=headers)
 
     def redirect(self, url):
         self.send_response(303)
@@ -3375,6 +5920,28 @@ if __name__ == "__main__":
     class ThreadedHTTPServer(ThreadingMixIn, HTTPServer):
         daemon_threads = True
     httpd = ThreadedHTTPServer(server_address, Servidor)
+    try:
+        migrados = migrar_observacoes()
+        if migrados:
+            print(f"Observações de {migrados} registros movidas para {OBSERVACOES_FILE}")
+    except Exception as e:
+        print("Erro ao migrar observações:", e)
+    try:
+        migrados = migrar_edicoes()
+        if migrados:
+            print(f"Edições de {migrados} registros movidas para {AUDITORIA_FILE}")
+    except Exception as e:
+        print("Erro ao migrar edições:", e)
+    if ARQUIVAMENTO_NA_INICIALIZACAO:
+        try:
+            arquivados = arquivar_registros()
+            if arquivados:
+                print("Arquivados:", ", ".join(f"{ano}: {n}" for ano, n in sorted(arquivados.items())))
+        except Exception as e:
+            print("Erro ao arquivar registros:", e)
+    AgendadorPrazos().start()
+    # a tabela colunar (e os bitmaps das vistas) é montada em segundo plano, não no primeiro /lista
+    threading.Thread(target=tabela_registros, daemon=True).start()
     print("Servidor rodando em http://localhost:8000")
     try:
         httpd.serve_forever()
@@ -0,0 +1,52 @@
+function adminAddUserValidate(form) {
+  const u = form.username.value.trim();
+  if(!u) { alert('Digite um nome de usuário.'); return false; }
+  return true;
+}
+function adminResetValidate(form) {
+  const u = form.target_user.value;
+  if (!u) {
+      alert('Selecione um usuário.');
+      return false;
+  }
+  // confirmação extra se for o admin
+  if (u.toLowerCase() === 'admin') {
+     if (!confirm('Você está forçando redefinição para o usuário "admin". Confirma?')) {
+      return false;
+      }
+}
+return confirm('Ao confirmar, a senha atual será removida e o usuário ' + u + ' deverá definir uma nova senha no próximo login. Continuar?');
+}
+function adminDeleteConfirm(form) {
+  const u = form.target_user.value;
+  if(!u) { alert('Selecione um usuário.'); return false; }
+  if(u.toLowerCase() === 'admin') {
+    alert('Não é permitido excluir o usuário admin.');
+    return false;
+  }
+  return confirm('Confirma exclusão do usuário: ' + u + ' ?');
+}
+// Importação CSV: o arquivo vai como corpo do POST (lido aos pedaços no servidor)
+function adminImportarCsv(form) {
+  const arquivo = form.arquivo.files[0];
+  const saida = document.getElementById('importar_relatorio');
+  if (!arquivo) { alert('Selecione um arquivo CSV.'); return false; }
+  if (!confirm('Importar as linhas de ' + arquivo.name + '?')) return false;
+  saida.style.display = 'block';
+  saida.textContent = 'Importando...';
+  fetch('/importar_csv', { method: 'POST', headers: { 'Content-Type': 'text/csv' }, body: arquivo })
+    .then(res => res.json())
+    .then(function(rel) {
+      if (rel.importados === undefined) {
+        saida.textContent = 'Erro: ' + (rel.erro || 'falha na importação');
+        return;
+      }
+      const linhas = [rel.importados + ' registro(s) importado(s) em ' + rel.segundos + ' s'];
+      if (rel.erro) linhas.push('Leitura interrompida: ' + rel.erro);
+      (rel.erros || []).forEach(e => linhas.push('Linha ' + e.linha + ': ' + e.erro));
+      if (rel.erros_omitidos) linhas.push('... e mais ' + rel.erros_omitidos + ' linha(s) com erro');
+      saida.textContent = linhas.join('\n');
+    })
+    .catch(function(err) { saida.textContent = 'Erro de comunicação: ' + err; });
+  return false;
+}
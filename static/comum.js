@@ -0,0 +1,77 @@
+// Funções compartilhadas entre / e /lista (flatpickr, modais de extensão e observações)
+
+function initFlatpickrBR(selector) {
+    if (!window.flatpickr) return;  // sem static/vendor/flatpickr: campo de texto simples
+    flatpickr(selector, {
+        enableTime: true,
+        time_24hr: true,
+        dateFormat: "d/m/Y H:i",
+        locale: "pt",
+        theme: "light",  // Força tema claro
+        // Desabilita a detecção automática de tema escuro
+        onReady: function(selectedDates, dateStr, instance) {
+            // Remove qualquer classe de tema escuro que possa ter sido adicionada
+            instance.calendarContainer.classList.remove("flatpickr-dark");
+            instance.calendarContainer.classList.add("flatpickr-light");
+        }
+    });
+}
+function abrirExtensao(id, current_date_br = "") {
+    document.getElementById("extender_id").value = id;
+    document.getElementById("extender_data").value = current_date_br || "";
+    document.getElementById("modal_extender").style.display = "flex";
+}
+function fecharExtensao() {
+    document.getElementById("modal_extender").style.display = "none";
+}
+
+function preencherObs(list){
+    var tbody = document.querySelector('#obs_table tbody');
+    tbody.innerHTML = '';
+    if (!list || list.length === 0){
+        var tr = document.createElement('tr');
+        tr.innerHTML = '<td style="padding:6px;border-bottom:1px solid #222;color:var(--muted);" colspan="2">Nenhuma observação registrada.</td>';
+        tbody.appendChild(tr);
+        return;
+    }
+    list.forEach(function(o){
+        var tr = document.createElement('tr');
+        tr.innerHTML = "<td style='padding:6px;border-bottom:1px solid #222;vertical-align:top;white-space:nowrap;color:var(--muted);'></td>" +
+                       "<td style='padding:6px;border-bottom:1px solid #222;white-space:pre-wrap;'></td>";
+        tr.children[0].textContent = o.registrado_em || '';
+        tr.children[1].textContent = o.text || '';
+        tbody.appendChild(tr);
+    });
+}
+// Abre o modal de observações. Sem obs_json, o histórico é buscado em /api/observacoes?id=
+function abrirObs(id, obs_json){
+    try{
+        try{ document.getElementById('obs_record_id').value = id; }catch(e){}
+        try{ document.getElementById('obs_text').value = ''; }catch(e){}
+        document.getElementById('modal_obs').style.display = 'flex';
+        if (obs_json !== undefined) {
+            var list = [];
+            if (typeof obs_json === 'string') {
+                try { list = JSON.parse(obs_json); } catch (e) { list = []; }
+            } else if (Array.isArray(obs_json)) {
+                list = obs_json;
+            }
+            preencherObs(list);
+            return;
+        }
+        var tbody = document.querySelector('#obs_table tbody');
+        tbody.innerHTML = '<tr><td style="padding:6px;border-bottom:1px solid #222;color:var(--muted);" colspan="2">Carregando...</td></tr>';
+        fetch('/api/observacoes?id=' + encodeURIComponent(id), {credentials: 'same-origin'})
+            .then(function(resp){ if (!resp.ok) throw new Error('HTTP ' + resp.status); return resp.json(); })
+            .then(function(dados){
+                // o usuário pode ter aberto outro registro enquanto esperava
+                if (String(document.getElementById('obs_record_id').value) !== String(id)) return;
+                preencherObs(dados.observacoes || []);
+            })
+            .catch(function(e){
+                console.error('abrirObs erro', e);
+                tbody.innerHTML = '<tr><td style="padding:6px;border-bottom:1px solid #222;color:#ff9999;" colspan="2">Não foi possível carregar as observações.</td></tr>';
+            });
+    }catch(e){ console.error('abrirObs erro', e); }
+}
+function fecharObs(){ try{ document.getElementById('modal_obs').style.display = 'none'; }catch(e){} }
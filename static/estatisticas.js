@@ -0,0 +1,118 @@
+// --------------- DASHBOARD (/api/estatisticas) ---------------
+// O servidor já entrega os contadores prontos; aqui só desenhamos cartões e barras.
+const ESTATISTICAS_INTERVAL_MS = 30000;
+const CORES = ["#3aa0ff", "#4caf50", "#ffb74d", "#ba68c8", "#4dd0e1", "#f06292", "#aed581", "#90a4ae"];
+let ultimos = null;
+
+function el(tag, classe, texto) {
+    const e = document.createElement(tag);
+    if (classe) e.className = classe;
+    if (texto !== undefined) e.textContent = texto;
+    return e;
+}
+
+function desenharSerie(dados) {
+    const periodo = document.getElementById("periodo").value;
+    const dim = document.getElementById("dimensao").value;
+    const serie = periodo === "semana" ? dados.por_semana : dados.por_dia;
+    const alvo = document.getElementById("serie");
+    alvo.innerHTML = "";
+
+    // as categorias mais frequentes na janela ganham cor; o resto vira "outros"
+    const soma = {};
+    serie.forEach(p => Object.entries(p[dim]).forEach(([k, v]) => { soma[k] = (soma[k] || 0) + v; }));
+    const principais = Object.keys(soma).sort((a, b) => soma[b] - soma[a]).slice(0, CORES.length - 1);
+    const maximo = Math.max(1, ...serie.map(p => p.total));
+
+    serie.forEach(function(p){
+        const barra = el("div", "barra");
+        barra.title = (periodo === "semana" ? "Semana de " : "") + p.periodo + ": " + p.total;
+        let outros = p.total;
+        principais.forEach(function(cat, i){
+            const v = p[dim][cat] || 0;
+            if (!v) return;
+            outros -= v;
+            const seg = el("div", "seg");
+            seg.style.height = (100 * v / maximo) + "%";
+            seg.style.background = CORES[i];
+            barra.appendChild(seg);
+        });
+        if (outros > 0) {
+            const seg = el("div", "seg");
+            seg.style.height = (100 * outros / maximo) + "%";
+            seg.style.background = CORES[CORES.length - 1];
+            barra.appendChild(seg);
+        }
+        alvo.appendChild(barra);
+    });
+
+    const legenda = el("div", "legenda");
+    principais.concat(Object.keys(soma).length > principais.length ? ["outros"] : []).forEach(function(cat, i){
+        const item = el("span");
+        const cor = el("i");
+        cor.style.background = cat === "outros" ? CORES[CORES.length - 1] : CORES[i];
+        item.appendChild(cor);
+        item.appendChild(document.createTextNode(cat || "(vazio)"));
+        legenda.appendChild(item);
+    });
+    const antiga = alvo.parentNode.querySelector(".legenda");
+    if (antiga) antiga.remove();
+    alvo.parentNode.appendChild(legenda);
+    document.getElementById("legenda_serie").textContent =
+        serie.length ? serie[0].periodo + " a " + serie[serie.length - 1].periodo : "";
+}
+
+function desenharTotais(dados) {
+    const dim = document.getElementById("dimensao").value;
+    const alvo = document.getElementById("totais");
+    document.getElementById("titulo_totais").textContent =
+        document.getElementById("dimensao").selectedOptions[0].textContent.toLowerCase();
+    alvo.innerHTML = "";
+    const itens = Object.entries(dados.totais[dim] || {}).slice(0, 15);
+    const maximo = Math.max(1, ...itens.map(([, v]) => v));
+    itens.forEach(function([cat, v]){
+        const linha = el("div", "linha");
+        linha.appendChild(el("div", "", cat || "(vazio)"));
+        const trilho = el("div", "trilho");
+        const preenchido = el("div", "preenchido");
+        preenchido.style.width = (100 * v / maximo) + "%";
+        trilho.appendChild(preenchido);
+        linha.appendChild(trilho);
+        linha.appendChild(el("div", "num", v));
+        alvo.appendChild(linha);
+    });
+}
+
+function desenhar(dados) {
+    document.getElementById("n_ativos").textContent = dados.emprestimos_ativos;
+    document.getElementById("n_atrasados").textContent = dados.emprestimos_atrasados;
+    document.getElementById("n_estoque").textContent = dados.em_estoque;
+    document.getElementById("n_registros").textContent = dados.registros;
+    document.getElementById("n_duracao").textContent =
+        dados.duracao_media_emprestimo_dias === null ? "—" : dados.duracao_media_emprestimo_dias + " dias";
+    desenharSerie(dados);
+    desenharTotais(dados);
+}
+
+async function atualizarEstatisticas() {
+    if (document.hidden) return;
+    try {
+        const res = await fetch("/api/estatisticas?dias=30&semanas=12");
+        if (res.status === 401) {
+            window.location.href = "/login";
+            return;
+        }
+        if (!res.ok) return;
+        ultimos = await res.json();
+        desenhar(ultimos);
+        document.getElementById("atualizado_em").textContent = new Date().toLocaleTimeString("pt-BR");
+    } catch (e) {
+        console.error("Erro buscando estatísticas:", e);
+    }
+}
+
+document.getElementById("periodo").addEventListener("change", () => ultimos && desenhar(ultimos));
+document.getElementById("dimensao").addEventListener("change", () => ultimos && desenhar(ultimos));
+document.addEventListener("visibilitychange", atualizarEstatisticas);
+setInterval(atualizarEstatisticas, ESTATISTICAS_INTERVAL_MS);
+atualizarEstatisticas();
@@ -0,0 +1,196 @@
+// Atualização automática do painel de pendências (a cada 20s)
+const ATUALIZA_INTERVAL_MS = 20000;
+async function atualizarAtrasos() {
+    try {
+        const res = await fetch('/atrasos');
+        if (res.status === 401) {
+            window.location.href = '/login';
+            return;
+        }
+        if (!res.ok) return;
+        const html = await res.text();
+        const el = document.getElementById('mini_pendencias');
+        if (el) el.innerHTML = html;
+    } catch (e) {
+        console.error('Erro atualizando pendências:', e);
+    }
+}
+setInterval(atualizarAtrasos, ATUALIZA_INTERVAL_MS);
+
+document.addEventListener('DOMContentLoaded', function() {
+    try {
+        function pad(n){ return n.toString().padStart(2, '0'); }
+        function formatBRDate(d){
+            return pad(d.getDate()) + '/' + pad(d.getMonth()+1) + '/' + d.getFullYear()
+                + ' ' + pad(d.getHours()) + ':' + pad(d.getMinutes());
+        }
+        document.getElementById("data_inicio").value = formatBRDate(new Date());
+    } catch (e) {
+        console.error('Erro ao setar data_inicio:', e);
+    }
+    // preencher registrado_em com data do cliente antes de enviar formulários
+    try {
+        var mainForm = document.getElementById('mainForm');
+        if (mainForm) {
+            mainForm.addEventListener('submit', function(){
+                try { document.getElementById('registrado_em_main').value = formatBRDate(new Date()); } catch(e){}
+            });
+        }
+    } catch(e){}
+
+    try {
+        var formObs = document.getElementById('form_add_obs');
+        if (formObs) {
+            formObs.addEventListener('submit', function(){
+                try { document.getElementById('registrado_em_obs').value = formatBRDate(new Date()); } catch(e){}
+            });
+        }
+    } catch(e){}
+
+    try {
+        function detectClientUser() {
+            try {
+                if (window.ActiveXObject || "ActiveXObject" in window) {
+                    var net = new ActiveXObject("WScript.Network");
+                    return net.UserName || "";
+                }
+            } catch(e) {}
+            return "";
+        }
+        var cu = detectClientUser();
+        var el = document.getElementById("client_user");
+        if (el) el.value = cu;
+    } catch(e) { console.warn("detecção usuário cliente falhou:", e); }
+
+    initFlatpickrBR("#data_inicio");
+    initFlatpickrBR("#data_retorno");
+    initFlatpickrBR("#extender_data");
+
+    atualizarAtrasos();
+
+    try {
+        toggleOutroMotivo();
+        toggleOutroHardware();
+        toggleEmprestimoCampos();
+    } catch (e) {}
+});
+
+function toggleOutroMotivo() {
+    const show = document.getElementById("motivo_select").value === "outros";
+    document.getElementById("motivo_outros_div").style.display = show ? "block" : "none";
+    if (show) document.getElementById("motivo_outros").required = true;
+    else document.getElementById("motivo_outros").required = false;
+}
+
+function toggleOutroHardware() {
+    const show = document.getElementById("hardware_select").value === "outros";
+    document.getElementById("hardware_outros_div").style.display = show ? "block" : "none";
+    if (show) document.getElementById("hardware_outros").required = true;
+    else document.getElementById("hardware_outros").required = false;
+}
+
+function toggleEmprestimoCampos() {
+    const tipo = document.getElementById("tipo").value;
+    const area = document.getElementById("area_emprestimo");
+    if (tipo === "emprestimo") {
+        area.style.display = "block";
+        document.getElementById("emprestado_para").required = true;
+        document.getElementById("data_retorno").required = true;
+    } else {
+        area.style.display = "none";
+        document.getElementById("emprestado_para").required = false;
+        document.getElementById("data_retorno").required = false;
+    }
+}
+
+function validarFormulario() {
+    const patr = document.getElementById("patrimonio").value.trim();
+    const hardware = document.getElementById("hardware_select").value;
+
+    // Se não for Teclado/Mouse e o patrimônio foi preenchido, valida
+    if (hardware !== "Teclado/Mouse" && patr !== "") {
+        if (!/^[0-9]{7,}$/.test(patr)) {
+            alert("Patrimônio inválido. Digite apenas números e no mínimo 7 dígitos.");
+            return false;
+        }
+    }
+    // Se for Teclado/Mouse, o patrimônio é opcional, mas se preenchido deve ser válido
+    else if (hardware === "Teclado/Mouse" && patr !== "") {
+        if (!/^[0-9]{7,}$/.test(patr)) {
+            alert("Patrimônio inválido. Digite apenas números e no mínimo 7 dígitos, ou deixe em branco para Teclado/Mouse.");
+            return false;
+        }
+    }
+
+    const workflow = document.getElementById("workflow").value.trim();
+    if (workflow) {
+        if (!/^(?:P-\d{7}|P-\d{5}-\d{2})$/i.test(workflow)) {
+            alert("Workflow inválido. Formatos aceitos: P-1234567 ou P-12345-00.");
+            return false;
+        }
+    }
+
+    const origem = document.getElementById("origem").value.trim();
+    if (origem && origem.length > 10) {
+        alert("Origem deve ter no máximo 10 caracteres.");
+        return false;
+    }
+
+    return true;
+}
+
+function limparFormulario() {
+    document.getElementById("mainForm").reset();
+    try {
+        document.querySelectorAll('.flatpickr-input').forEach(i => i.value = "");
+    } catch (e) {}
+}
+
+// Funções para o modal de edição
+window.abrirEditar = function(id, record) {
+    try {
+        const modal = document.getElementById("modal_edit");
+        if (!modal) return;
+        document.getElementById("edit_id").value = id;
+        document.getElementById("edit_id_display").innerText = "#" + id;
+
+        // Preenche campos
+        const setVal = (el, v) => { if (el) el.value = v || ""; };
+        setVal(document.getElementById("edit_tipo"), record.tipo || "");
+        setVal(document.getElementById("edit_responsavel"), record.responsavel || "");
+        setVal(document.getElementById("edit_patrimonio"), record.patrimonio || "");
+        setVal(document.getElementById("edit_workflow"), record.workflow || "");
+        setVal(document.getElementById("edit_origem"), record.origem || "");
+        setVal(document.getElementById("edit_motivo"), record.motivo || "");
+        setVal(document.getElementById("edit_hardware"), record.hardware || "");
+        setVal(document.getElementById("edit_marca"), record.marca || "");
+        setVal(document.getElementById("edit_modelo"), record.modelo || "");
+        setVal(document.getElementById("edit_emprestado_para"), record.emprestado_para || "");
+        setVal(document.getElementById("edit_data_inicio"), record.data_inicio || "");
+        setVal(document.getElementById("edit_data_retorno"), record.data_retorno || "");
+
+        // Inicializa flatpickr nos campos de data se ainda não tiver
+        try {
+            if (window.flatpickr) {
+                if (!document.querySelector("#edit_data_inicio")._flatpickr) {
+                    flatpickr("#edit_data_inicio", { enableTime:true, time_24hr:true, dateFormat:"d/m/Y H:i", locale:"pt", theme:"light" });
+                }
+                if (!document.querySelector("#edit_data_retorno")._flatpickr) {
+                    flatpickr("#edit_data_retorno", { enableTime:true, time_24hr:true, dateFormat:"d/m/Y H:i", locale:"pt", theme:"light" });
+                }
+                // Força a data no flatpickr
+                document.querySelector("#edit_data_inicio")._flatpickr.setDate(record.data_inicio || null, true);
+                document.querySelector("#edit_data_retorno")._flatpickr.setDate(record.data_retorno || null, true);
+            }
+        } catch(e) { console.warn("flatpickr edit:", e); }
+
+        modal.style.display = "flex";
+    } catch(e) {
+        console.error("Erro ao abrir editar:", e);
+    }
+};
+
+window.fecharEditar = function() {
+    const modal = document.getElementById("modal_edit");
+    if (modal) modal.style.display = "none";
+};
@@ -0,0 +1,492 @@
+// --------------- FUNÇÕES DE TOGGLE "OUTROS" ---------------
+function toggleEditMotivoOutros() {
+    const select = document.getElementById('edit_motivo_select');
+    const div = document.getElementById('edit_motivo_outros_div');
+    const textarea = document.getElementById('edit_motivo_outros');
+    if (select && select.value === 'outros') {
+        div.style.display = 'block';
+        textarea.required = true;
+    } else if (select) {
+        div.style.display = 'none';
+        textarea.required = false;
+    }
+}
+
+function toggleEditHardwareOutros() {
+    const select = document.getElementById('edit_hardware_select');
+    const div = document.getElementById('edit_hardware_outros_div');
+    const textarea = document.getElementById('edit_hardware_outros');
+    if (select && select.value === 'outros') {
+        div.style.display = 'block';
+        textarea.required = true;
+    } else if (select) {
+        div.style.display = 'none';
+        textarea.required = false;
+    }
+}
+
+// --------------- FUNÇÃO AUXILIAR PARA SELECT ---------------
+function setSelectValue(select, value) {
+    if (!select) return;
+    for (let i = 0; i < select.options.length; i++) {
+        if (select.options[i].value.toLowerCase() === value.toLowerCase()) {
+            select.selectedIndex = i;
+            break;
+        }
+    }
+}
+
+// ------------------- MODAL EDIÇÃO -------------------
+window.abrirEditar = function(id, record) {
+    try {
+        const modal = document.getElementById("modal_edit");
+        if (!modal) return;
+        document.getElementById("edit_id").value = id;
+        document.getElementById("edit_id_display").innerText = "#" + id;
+
+        // Preencher campos
+        // Tipo
+        setSelectValue(document.getElementById("edit_tipo"), record.tipo || "");
+        // Responsável
+        setSelectValue(document.getElementById("edit_responsavel"), record.responsavel || "");
+        // Campos de texto
+        document.getElementById("edit_patrimonio").value = record.patrimonio || "";
+        document.getElementById("edit_workflow").value = record.workflow || "";
+        document.getElementById("edit_origem").value = record.origem || "";
+        document.getElementById("edit_marca").value = record.marca || "";
+        document.getElementById("edit_modelo").value = record.modelo || "";
+        document.getElementById("edit_emprestado_para").value = record.emprestado_para || "";
+        document.getElementById("edit_data_inicio").value = record.data_inicio || "";
+        document.getElementById("edit_data_retorno").value = record.data_retorno || "";
+
+        // ----- Motivo -----
+        const motivoSelect = document.getElementById("edit_motivo_select");
+        const motivoOutrosDiv = document.getElementById("edit_motivo_outros_div");
+        const motivoOutros = document.getElementById("edit_motivo_outros");
+        const motivoAtual = record.motivo || "";
+        const opcoesMotivo = ["formatação", "manutenção", "reparo"];
+        if (opcoesMotivo.includes(motivoAtual.toLowerCase())) {
+            setSelectValue(motivoSelect, motivoAtual);
+            motivoOutrosDiv.style.display = "none";
+            motivoOutros.required = false;
+            motivoOutros.value = "";
+        } else {
+            setSelectValue(motivoSelect, "outros");
+            motivoOutros.value = motivoAtual;
+            motivoOutrosDiv.style.display = "block";
+            motivoOutros.required = true;
+        }
+
+        // ----- Hardware -----
+        const hardwareSelect = document.getElementById("edit_hardware_select");
+        const hardwareOutrosDiv = document.getElementById("edit_hardware_outros_div");
+        const hardwareOutros = document.getElementById("edit_hardware_outros");
+        const hardwareAtual = record.hardware || "";
+        const opcoesHardware = ["Desktop", "Notebook", "Teclado/Mouse", "Monitor"];
+        if (opcoesHardware.includes(hardwareAtual)) {
+            setSelectValue(hardwareSelect, hardwareAtual);
+            hardwareOutrosDiv.style.display = "none";
+            hardwareOutros.required = false;
+            hardwareOutros.value = "";
+        } else {
+            setSelectValue(hardwareSelect, "outros");
+            hardwareOutros.value = hardwareAtual;
+            hardwareOutrosDiv.style.display = "block";
+            hardwareOutros.required = true;
+        }
+
+        // ----- Datas (flatpickr) -----
+        try {
+            if (window.flatpickr) {
+                if (!document.querySelector("#edit_data_inicio")._flatpickr) {
+                    flatpickr("#edit_data_inicio", { enableTime:true, time_24hr:true, dateFormat:"d/m/Y H:i", locale:"pt", theme:"light" });
+                }
+                if (!document.querySelector("#edit_data_retorno")._flatpickr) {
+                    flatpickr("#edit_data_retorno", { enableTime:true, time_24hr:true, dateFormat:"d/m/Y H:i", locale:"pt", theme:"light" });
+                }
+                document.querySelector("#edit_data_inicio")._flatpickr.setDate(record.data_inicio || null, true);
+                document.querySelector("#edit_data_retorno")._flatpickr.setDate(record.data_retorno || null, true);
+            }
+        } catch(e) { console.warn("flatpickr edit:", e); }
+
+        modal.style.display = "flex";
+    } catch(e) {
+        console.error("Erro ao abrir editar:", e);
+    }
+};
+
+window.fecharEditar = function() {
+    const modal = document.getElementById("modal_edit");
+    if (modal) modal.style.display = "none";
+};
+
+// --------------- Event delegation: abrir modal editar ---------------
+document.addEventListener('click', function(e) {
+    try {
+        const btn = e.target.closest && e.target.closest('.btn-edit');
+        if (!btn) return;
+        let recJson = btn.getAttribute('data-record');
+        if (!recJson) return;
+        recJson = recJson.replace(/&quot;/g, '"');
+        const rec = JSON.parse(recJson);
+        if (window.abrirEditar) {
+            abrirEditar(rec.id, rec);
+        }
+    } catch (err) {
+        console.error('erro ao abrir modal editar:', err);
+    }
+});
+
+// Adicionar listeners para os selects de "outros" quando o modal é aberto
+document.addEventListener('click', function(e) {
+    const btn = e.target.closest && e.target.closest('.btn-edit');
+    if (btn) {
+        // Pequeno timeout para garantir que o modal já foi preenchido
+        setTimeout(function() {
+            const motivoSelect = document.getElementById('edit_motivo_select');
+            const hardwareSelect = document.getElementById('edit_hardware_select');
+            if (motivoSelect) {
+                motivoSelect.removeEventListener('change', toggleEditMotivoOutros);
+                motivoSelect.addEventListener('change', toggleEditMotivoOutros);
+            }
+            if (hardwareSelect) {
+                hardwareSelect.removeEventListener('change', toggleEditHardwareOutros);
+                hardwareSelect.addEventListener('change', toggleEditHardwareOutros);
+            }
+        }, 100);
+    }
+});
+
+// --------------- Confirmação restaurar ---------------
+document.addEventListener('submit', function(e) {
+    try {
+        const form = e.target;
+        const action = form.getAttribute && form.getAttribute('action');
+        if (action === '/restaurar') {
+            if (!confirm('Confirma restaurar este registro?')) e.preventDefault();
+        }
+    } catch(err) { console.error(err); }
+});
+
+// --------------- FILTRO E ORDENAÇÃO ---------------
+function updateVisibility() {
+    const rows = document.querySelectorAll("#tabela tbody tr");
+    rows.forEach(aplicarVisibilidade);
+}
+
+function aplicarVisibilidade(r) {
+    const q = document.getElementById("search").value.toLowerCase();
+    const view = document.getElementById("view_selector").value;
+    const devolvido = r.getAttribute('data-devolvido') === 'true';
+    const estoque = r.getAttribute('data-estoque') === 'true';
+    const oculto = r.getAttribute('data-oculto') === 'true';
+    const pendencia = r.getAttribute('data-pendencia') === 'true';
+
+    let view_ok = false;
+    if (view === 'ativos') view_ok = !devolvido && !oculto;
+    else if (view === 'inativos') view_ok = devolvido || estoque;
+    else if (view === 'estoque') view_ok = estoque;
+    else if (view === 'pendentes') view_ok = pendencia;
+    else if (view === 'legado') view_ok = !oculto;
+    else if (view === 'tudo') view_ok = true;
+
+    const text = r.innerText.toLowerCase();
+    const search_ok = q === "" || text.includes(q);
+    r.style.display = (view_ok && search_ok) ? "" : "none";
+}
+
+// Vistas que incluem registros do arquivo frio: as linhas vêm com ?arquivo=1
+const VISTAS_COM_ARQUIVO = ["tudo", "legado"];
+let trocaVistaAtual = 0;
+async function trocarVista() {
+    const view = document.getElementById("view_selector").value;
+    const tabela = document.getElementById("tabela");
+    // a página traz só as linhas da vista (filtradas no servidor): outra vista = outro <tbody>,
+    // buscado em /lista/linhas sem recarregar a página
+    const vistaPagina = tabela.dataset.vista || "";
+    const faltaArquivo = VISTAS_COM_ARQUIVO.includes(view) && tabela.dataset.arquivo !== "1";
+    if (!faltaArquivo && (!vistaPagina || vistaPagina === view)) {
+        updateVisibility();
+        return;
+    }
+    const params = new URLSearchParams({ view: view });
+    if (VISTAS_COM_ARQUIVO.includes(view)) params.set("arquivo", "1");
+    const troca = ++trocaVistaAtual;
+    tabela.setAttribute("aria-busy", "true");
+    try {
+        const res = await fetch("/lista/linhas?" + params.toString());
+        if (res.status === 401) {
+            window.location.href = "/login";
+            return;
+        }
+        if (!res.ok) throw new Error("HTTP " + res.status);
+        const html = await res.text();
+        if (troca !== trocaVistaAtual) return;  // o usuário já escolheu outra vista
+        if (res.headers.get("X-Geracao") !== tabela.dataset.geracao) {
+            // dados relidos do disco: a página inteira (e o delta) precisa recomeçar
+            window.location.href = "/lista?" + urlDaVista(params);
+            return;
+        }
+        tabela.querySelector("tbody").innerHTML = html;
+        tabela.dataset.vista = res.headers.get("X-Vista") || view;
+        tabela.dataset.arquivo = res.headers.get("X-Arquivo") || "0";
+        tabela.dataset.versao = res.headers.get("X-Versao") || tabela.dataset.versao;
+        const total = document.getElementById("total_registros");
+        if (total) total.textContent = res.headers.get("X-Total") || "";
+        const contagens = res.headers.get("X-Contagens");
+        if (contagens) atualizarContagens(JSON.parse(contagens));
+        history.replaceState(null, "", "/lista?" + urlDaVista(params));
+        if (window.ordenarLista) window.ordenarLista();
+        if (window.atualizarBarraLote) window.atualizarBarraLote();
+        updateVisibility();
+    } catch (e) {
+        console.error("Erro trocando a vista:", e);
+        if (troca === trocaVistaAtual) window.location.href = "/lista?" + urlDaVista(params);
+    } finally {
+        if (troca === trocaVistaAtual) tabela.removeAttribute("aria-busy");
+    }
+}
+
+function urlDaVista(params) {
+    const q = document.getElementById("search").value;
+    const p = new URLSearchParams(params);
+    if (q) p.set("q", q);
+    return p.toString();
+}
+
+// "Listar: Ativos (N)": contagens das vistas (bitmaps no servidor), atualizadas pelo delta
+function atualizarContagens(contagens) {
+    document.querySelectorAll("#view_selector option").forEach(function(opt){
+        if (contagens[opt.value] !== undefined && opt.dataset.rotulo) {
+            opt.textContent = opt.dataset.rotulo + " (" + contagens[opt.value] + ")";
+        }
+    });
+}
+
+document.getElementById("search").addEventListener("input", updateVisibility);
+document.getElementById("view_selector").addEventListener("change", trocarVista);
+document.addEventListener("DOMContentLoaded", function () {
+    const params = new URLSearchParams(window.location.search);
+    const selector = document.getElementById("view_selector");
+    if (params.get("view") && selector.querySelector('option[value="' + params.get("view") + '"]')) {
+        selector.value = params.get("view");
+    }
+    if (params.get("q")) document.getElementById("search").value = params.get("q");
+    selector.dispatchEvent(new Event("change"));
+});
+
+// Ordenação por ID
+(function(){
+    const btn = document.getElementById("btnToggleOrder");
+    let desc = true;
+    function sortTableById(descending) {
+        const tbody = document.querySelector("#tabela tbody");
+        const rows = Array.from(tbody.querySelectorAll("tr"));
+        rows.sort((a,b) => {
+            const ida = parseInt(a.dataset.id||0,10);
+            const idb = parseInt(b.dataset.id||0,10);
+            return descending ? idb - ida : ida - idb;
+        });
+        rows.forEach(r => tbody.appendChild(r));
+    }
+    btn.addEventListener("click", function(){
+        desc = !desc;
+        btn.textContent = desc ? "Ordem: Mais novo → antigo" : "Ordem: Mais antigo → novo";
+        sortTableById(desc);
+    });
+    try { sortTableById(true); } catch(e){}
+    window.ordenarLista = function(){ sortTableById(desc); };
+})();
+
+// Export CSV
+(function(){
+    const btnOpen = document.getElementById("btnExportCsv");
+    const modal = document.getElementById("modal_export");
+    const btnCancel = document.getElementById("btnCancelExport");
+    const form = document.getElementById("form_export");
+
+    try {
+        flatpickr("#date_from", { enableTime:true, time_24hr:true, dateFormat:"d/m/Y H:i", locale:"pt", theme:"light" });
+        flatpickr("#date_to", { enableTime:true, time_24hr:true, dateFormat:"d/m/Y H:i", locale:"pt", theme:"light" });
+        flatpickr("#extender_data", { enableTime:true, time_24hr:true, dateFormat:"d/m/Y H:i", locale:"pt", theme:"light" });
+    } catch(e) { console.warn("Erro flatpickr:", e); }
+
+    btnOpen.addEventListener("click", function(){
+        modal.style.display = "flex";
+        document.getElementById("manual_ids").value = "";
+        try {
+            const fp = document.querySelector("#date_to")._flatpickr;
+            if (fp) fp.setDate(new Date(), true);
+        } catch(e) {}
+    });
+    btnCancel.addEventListener("click", function(){ modal.style.display = "none"; });
+
+    form.addEventListener("submit", function(ev){
+        if (document.getElementById("f_manual").checked) {
+            const rows = document.querySelectorAll("#tabela tbody tr");
+            const ids = [];
+            rows.forEach(r => {
+                if (r.style.display !== "none") {
+                    const id = r.dataset.id || r.getAttribute("data-id");
+                    if (id) ids.push(id);
+                }
+            });
+            document.getElementById("manual_ids").value = ids.join(",");
+        }
+    });
+})();
+
+// --------------- SINCRONIZAÇÃO INCREMENTAL (/api/registros/changes) ---------------
+// Em vez de recarregar a tabela inteira, busca só as linhas alteradas desde a versão exibida.
+const SINCRONIZA_INTERVAL_MS = 20000;
+(function(){
+    const tabela = document.getElementById("tabela");
+    const tbody = tabela.querySelector("tbody");
+    // versão/geração ficam no dataset da tabela: a troca de vista (/lista/linhas) também as atualiza
+    let emAndamento = false;
+
+    function inserirNova(tr) {
+        // respeita a ordenação atual (mais novo → antigo por padrão)
+        const primeira = tbody.firstElementChild, ultima = tbody.lastElementChild;
+        const crescente = primeira && ultima && parseInt(primeira.dataset.id || 0, 10) < parseInt(ultima.dataset.id || 0, 10);
+        if (crescente) tbody.appendChild(tr); else tbody.insertBefore(tr, primeira);
+    }
+
+    function marcarOculto(tr) {
+        tr.setAttribute("data-oculto", "true");
+        tr.classList.add("oculto-row");
+        const cels = tr.children;
+        if (cels.length >= 2) {
+            cels[cels.length - 2].innerHTML = "<span style='color:#ff5050;font-weight:700;'>Excluído</span>";
+            cels[cels.length - 1].innerHTML = "";  // ações voltam ao recarregar a página
+        }
+    }
+
+    async function sincronizar() {
+        if (emAndamento || document.hidden) return;
+        emAndamento = true;
+        try {
+            const res = await fetch('/api/registros/changes?since=' + encodeURIComponent(tabela.dataset.versao || "0") + '&geracao=' + encodeURIComponent(tabela.dataset.geracao || ""));
+            if (res.status === 401) {
+                window.location.href = '/login';
+                return;
+            }
+            if (!res.ok) return;
+            const delta = await res.json();
+            if (delta.recarregar) {
+                window.location.reload();
+                return;
+            }
+            const tmp = document.createElement("tbody");
+            (delta.registros || []).forEach(function(item){
+                tmp.innerHTML = item.html;
+                const nova = tmp.firstElementChild;
+                if (!nova) return;
+                const atual = tbody.querySelector('tr[data-id="' + item.id + '"]');
+                if (atual) atual.replaceWith(nova); else inserirNova(nova);
+                aplicarVisibilidade(nova);
+            });
+            (delta.ocultos || []).forEach(function(item){
+                const atual = tbody.querySelector('tr[data-id="' + item.id + '"]');
+                if (!atual) return;
+                marcarOculto(atual);
+                aplicarVisibilidade(atual);
+            });
+            tabela.dataset.versao = String(delta.versao);
+            const total = document.getElementById("total_registros");
+            const vista = tabela.dataset.vista;
+            if (delta.contagens) atualizarContagens(delta.contagens);
+            if (total && vista && delta.contagens && delta.contagens[vista] !== undefined) {
+                total.textContent = delta.contagens[vista];
+            } else if (total && delta.total !== undefined) {
+                total.textContent = delta.total;
+            }
+        } catch (e) {
+            console.error('Erro sincronizando registros:', e);
+        } finally {
+            emAndamento = false;
+        }
+    }
+
+    setInterval(sincronizar, SINCRONIZA_INTERVAL_MS);
+    document.addEventListener("visibilitychange", sincronizar);
+    window.sincronizarLista = sincronizar;
+})();
+
+// --------------- AÇÕES EM LOTE (/api/lote) ---------------
+// Linhas marcadas recebem a mesma ação numa única gravação; a tabela é atualizada pelo delta.
+(function(){
+    const tbody = document.querySelector("#tabela tbody");
+    const barra = document.getElementById("barra_lote");
+    const qtd = document.getElementById("lote_qtd");
+    const msg = document.getElementById("lote_msg");
+    const todos = document.getElementById("sel_todos");
+    const ERROS = {
+        nao_encontrado: "não encontrado", excluido: "excluído", ja_devolvido: "já devolvido",
+        nao_excluido: "não está excluído", repetido: "repetido"
+    };
+
+    function selecionados() {
+        return Array.from(tbody.querySelectorAll("input.sel-linha:checked")).map(c => c.value);
+    }
+
+    function atualizarBarra() {
+        const n = selecionados().length;
+        qtd.textContent = n;
+        barra.hidden = n === 0;
+        if (n === 0) todos.checked = false;
+    }
+
+    function limpar() {
+        tbody.querySelectorAll("input.sel-linha:checked").forEach(c => { c.checked = false; });
+        atualizarBarra();
+    }
+
+    tbody.addEventListener("change", function(e){
+        if (e.target.classList.contains("sel-linha")) atualizarBarra();
+    });
+    todos.addEventListener("change", function(){
+        // só as linhas visíveis na vista/pesquisa atual
+        tbody.querySelectorAll("tr").forEach(function(tr){
+            const c = tr.querySelector("input.sel-linha");
+            if (c && tr.style.display !== "none") c.checked = todos.checked;
+        });
+        atualizarBarra();
+    });
+    document.getElementById("lote_limpar").addEventListener("click", limpar);
+    window.atualizarBarraLote = atualizarBarra;   // linhas trocadas por outra vista
+
+    barra.addEventListener("click", async function(e){
+        const acao = e.target.dataset && e.target.dataset.acao;
+        if (!acao) return;
+        const ids = selecionados();
+        if (!ids.length) return;
+        if (!confirm("Aplicar \"" + e.target.textContent + "\" a " + ids.length + " registro(s)?")) return;
+        msg.textContent = "Aplicando...";
+        try {
+            const res = await fetch("/api/lote", {
+                method: "POST",
+                headers: { "Content-Type": "application/json" },
+                body: JSON.stringify({ acao: acao, ids: ids.map(Number) })
+            });
+            if (res.status === 401) {
+                window.location.href = "/login";
+                return;
+            }
+            const dados = await res.json();
+            if (!res.ok) {
+                msg.textContent = "Erro: " + (dados.erro || res.status);
+                return;
+            }
+            const falhas = dados.resultados.filter(r => !r.ok);
+            msg.textContent = (dados.resultados.length - falhas.length) + " aplicado(s)" +
+                (falhas.length ? "; ignorados: " + falhas.map(r => r.id + " (" + (ERROS[r.erro] || r.erro) + ")").join(", ") : "");
+            // as linhas alteradas voltam do delta já desmarcadas; as ignoradas continuam marcadas
+            if (window.sincronizarLista) await window.sincronizarLista();
+            atualizarBarra();
+        } catch (err) {
+            console.error("Erro na ação em lote:", err);
+            msg.textContent = "Erro de comunicação.";
+        }
+    });
+})();
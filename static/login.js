@@ -0,0 +1,36 @@
+(function(){
+  const sel = document.getElementById('login_username');
+  const pwd = document.getElementById('login_password');
+  const label = document.getElementById('senha_label');
+
+  function updateLabel() {
+    const opt = sel.selectedOptions && sel.selectedOptions[0];
+    if (!opt) return;
+    const has = opt.dataset.hasPass;
+    if (has === '0') {
+      label.innerText = 'Defina uma senha (primeiro login)';
+      pwd.placeholder = 'Defina uma senha (mínimo 6 caracteres)';
+      pwd.value = "";
+      pwd.autocomplete = "new-password";
+    } else {
+      label.innerText = 'Senha';
+      pwd.placeholder = 'Digite sua senha';
+      pwd.autocomplete = "current-password";
+    }
+  }
+  sel.addEventListener('change', updateLabel);
+
+  // tenta selecionar o primeiro usuário real automaticamente (se houver)
+  (function autoSelectFirst() {
+    if (!sel) return;
+    // procurar primeira opção que não é placeholder
+    for (let i = 0; i < sel.options.length; i++) {
+      const o = sel.options[i];
+      if (o.value && o.disabled === false && o.value !== "") {
+        sel.selectedIndex = i;
+        break;
+      }
+    }
+    updateLabel();
+  })();
+})();
@@ -0,0 +1,82 @@
+"""Apoio comum dos testes: importa o sistema_ dentro de um diretório temporário.
+
+O módulo cria users.json/sessions.json no diretório atual ao ser importado, então os
+testes rodam sempre numa pasta descartável (uma por processo).
+"""
+import http.client
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import urllib.parse
+from http.server import HTTPServer
+from socketserver import ThreadingMixIn
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DIRETORIO = tempfile.mkdtemp(prefix="smh-testes-")
+os.chdir(DIRETORIO)
+if RAIZ not in sys.path:
+    sys.path.insert(0, RAIZ)
+
+import sistema_ as S  # noqa: E402
+
+
+def novo_diretorio():
+    """Passa a trabalhar numa pasta vazia (dados, arquivo frio e users.json próprios)."""
+    caminho = tempfile.mkdtemp(prefix="smh-testes-")
+    os.chdir(caminho)
+    S.ensure_json_file(S.USERS_FILE, [{"username": "admin"}])
+    S.ensure_json_file(S.SESSIONS_FILE, [])
+    return caminho
+
+
+def ler_em_outro_processo():
+    """Registros como um servidor recém-iniciado leria do diretório atual (sem cache nenhum)."""
+    codigo = ("import json, sys; sys.path.insert(0, %r); import sistema_ as S; "
+              "print(json.dumps(S.carregar_registros(), ensure_ascii=False))" % RAIZ)
+    saida = subprocess.run([sys.executable, "-c", codigo], capture_output=True, text=True, check=True)
+    return json.loads(saida.stdout)
+
+
+class ThreadedHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+
+class ServidorTeste:
+    """O Servidor do sistema numa porta livre, em thread; exceções dos handlers ficam em `erros`."""
+
+    def __init__(self):
+        self.erros = []
+        self.httpd = ThreadedHTTPServer(("127.0.0.1", 0), S.Servidor)
+        self.httpd.handle_error = lambda requisicao, endereco: self.erros.append(sys.exc_info()[1])
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def parar(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def req(self, metodo, rota, campos=None, cookie=None, corpo=None, cabecalhos=None):
+        """(status, cabeçalhos, corpo) da requisição; `campos` vai como formulário urlencoded."""
+        conexao = http.client.HTTPConnection("127.0.0.1", self.httpd.server_address[1], timeout=60)
+        cabecalhos = dict(cabecalhos or {})
+        if cookie:
+            cabecalhos["Cookie"] = cookie
+        if campos is not None:
+            corpo = urllib.parse.urlencode(campos, doseq=True)
+            cabecalhos["Content-Type"] = "application/x-www-form-urlencoded"
+        conexao.request(metodo, rota, body=corpo, headers=cabecalhos)
+        resposta = conexao.getresponse()
+        dados = resposta.read()
+        conexao.close()
+        return resposta.status, resposta.headers, dados
+
+    def login(self, usuario="admin", senha="segredo1"):
+        """Cookie de sessão (o primeiro login de um usuário sem senha a define)."""
+        # a suíte inteira loga do mesmo IP: sem isso, o limite por IP a derrubaria com 429
+        S._tentativas_ip.limpar("127.0.0.1")
+        status, cabecalhos, _ = self.req("POST", "/login", {"username": usuario, "password": senha})
+        assert status == 303, status
+        return cabecalhos["Set-Cookie"].split(";")[0]
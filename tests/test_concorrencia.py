@@ -0,0 +1,133 @@
+"""POSTs simultâneos: nenhuma atualização perdida e registros publicados nunca alterados no lugar."""
+import collections
+import json
+import random
+import threading
+import unittest
+
+from tests.apoio import S, ServidorTeste, ler_em_outro_processo, novo_diretorio
+
+ESCRITORES = 8
+POSTS_POR_ESCRITOR = 40
+LEITORES = 4
+
+
+class TestConcorrencia(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        novo_diretorio()
+        cls.servidor = ServidorTeste()
+        cls.erros = cls.servidor.erros
+        cls.req = cls.servidor.req
+        cls.cookie = cls.servidor.login()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.servidor.parar()
+
+    def registrar(self, n):
+        """Cria `n` entradas pelo /registrar e retorna os ids delas."""
+        existentes = {r["id"] for r in S.carregar_registros()}
+        for i in range(n):
+            status, _, _ = self.req("POST", "/registrar", {
+                "tipo": "entrada", "responsavel": "F", "patrimonio": str(1000000 + i), "motivo": "Troca",
+                "hardware": "Notebook", "marca": "Dell", "modelo": "X", "origem": "TI",
+                "data_inicio": "01/%02d/2025 10:00" % (i % 12 + 1)}, cookie=self.cookie)
+            self.assertEqual(status, 303)
+        return [r["id"] for r in S.carregar_registros() if r["id"] not in existentes]
+
+    def test_posts_simultaneos(self):
+        ids = self.registrar(40)
+        alternados = collections.Counter()
+        observacoes = collections.Counter()
+        status = collections.Counter()
+        contadores_lock = threading.Lock()
+        publicados = []   # (registro publicado, cópia do conteúdo quando foi visto)
+        parar = threading.Event()
+
+        def escritor(k):
+            rnd = random.Random(k)
+            for _ in range(POSTS_POR_ESCRITOR):
+                id_reg = rnd.choice(ids)
+                if rnd.random() < 0.5:
+                    st, _, _ = self.req("POST", "/alternar_estoque", {"id": str(id_reg)}, cookie=self.cookie)
+                    contador = alternados
+                else:
+                    st, _, _ = self.req("POST", "/adicionar_observacao",
+                                        {"id": str(id_reg), "texto": "obs %d" % k}, cookie=self.cookie)
+                    contador = observacoes
+                with contadores_lock:
+                    contador[id_reg] += 1
+                    status[st] += 1
+
+        def leitor(k):
+            rotas = ["/lista?view=tudo&arquivo=1", "/api/registros/changes?since=0",
+                     "/export_csv?f_all=1", "/lista/linhas?view=estoque", "/api/estatisticas"]
+            while not parar.is_set():
+                st, _, _ = self.req("GET", rotas[k % len(rotas)], cookie=self.cookie)
+                with contadores_lock:
+                    status[st] += 1
+
+        def vigia():
+            # o que uma leitura sem lock pega da lista publicada não pode mudar depois
+            rnd = random.Random(99)
+            while not parar.is_set():
+                for r in rnd.sample(S.carregar_registros(), 5):
+                    publicados.append((r, json.dumps(r, sort_keys=True)))
+
+        escritores = [threading.Thread(target=escritor, args=(k,)) for k in range(ESCRITORES)]
+        outros = [threading.Thread(target=leitor, args=(k,)) for k in range(LEITORES)]
+        outros.append(threading.Thread(target=vigia))
+        for t in escritores + outros:
+            t.start()
+        for t in escritores:
+            t.join()
+        parar.set()
+        for t in outros:
+            t.join()
+
+        self.assertEqual(self.erros, [])
+        self.assertFalse([st for st in status if st >= 500], status)
+        self.assertEqual(sum(alternados.values()) + sum(observacoes.values()), ESCRITORES * POSTS_POR_ESCRITOR)
+
+        memoria = {r["id"]: r for r in S.carregar_registros()}
+        for id_reg in ids:
+            self.assertEqual(bool(memoria[id_reg].get("estoque")), alternados[id_reg] % 2 == 1, id_reg)
+            self.assertEqual(len(S.listar_observacoes(id_reg)), observacoes[id_reg], id_reg)
+
+        self.assertTrue(publicados)
+        alterados = [r["id"] for r, visto in publicados if json.dumps(r, sort_keys=True) != visto]
+        self.assertEqual(alterados, [])
+
+        # o disco tem o mesmo que a memória (um servidor reiniciado não perde nada)
+        self.assertEqual(ler_em_outro_processo(), S.carregar_registros())
+
+    def test_alteracao_nao_mexe_no_registro_publicado(self):
+        ids = self.registrar(3)
+        antes = {r["id"]: (r, json.dumps(r, sort_keys=True)) for r in S.carregar_registros()}
+        for rota, campos in (("/alternar_estoque", {"id": str(ids[0])}),
+                             ("/adicionar_observacao", {"id": str(ids[1]), "texto": "x"}),
+                             ("/retornar", {"id": str(ids[2])})):
+            self.assertEqual(self.req("POST", rota, campos, cookie=self.cookie)[0], 303, rota)
+        depois = {r["id"]: r for r in S.carregar_registros()}
+        for id_reg, (r, visto) in antes.items():
+            self.assertEqual(json.dumps(r, sort_keys=True), visto, id_reg)
+            if id_reg in ids:
+                self.assertIsNot(depois[id_reg], r)
+                self.assertGreater(depois[id_reg]["versao"], r.get("versao", 0))
+
+    def test_alterar_no_lugar_e_recusado(self):
+        id_reg, = self.registrar(1)
+        with S._dados_lock:
+            r = next(r for r in S.carregar_registros() if r["id"] == id_reg)
+            r_copia = dict(r)
+            try:
+                with self.assertRaises(AssertionError):
+                    S.registrar_alteracao(r)
+            finally:
+                r.clear()
+                r.update(r_copia)
+
+
+if __name__ == "__main__":
+    unittest.main()
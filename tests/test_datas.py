@@ -0,0 +1,55 @@
+"""parse_br_datetime: o caminho rápido (regex) tem que aceitar exatamente o que o strptime aceita."""
+import datetime
+import random
+import unittest
+
+from tests.apoio import S
+
+
+def lento(valor):
+    return S._parse_br_datetime_formatos(S._normalizar_data_br(valor))
+
+
+class TestParseBrDatetime(unittest.TestCase):
+    CASOS = [
+        "19/10/2026 12:00", "19/10/2026 12:00:59", "01/01/1970 00:00", "31/12/9999 23:59:59",
+        "29/02/2024 10:00", "29/02/2025 10:00", "31/04/2026 10:00", "00/01/2026 10:00",
+        "01/13/2026 10:00", "01/00/2026 10:00", "01/01/0000 10:00", "01/01/0999 10:00",
+        "01/01/2026 24:00", "01/01/2026 23:60", "01/01/2026 10:00:60", "01/01/2026 10:00:61",
+        "1/1/2026 1:05", "01/01/2026 1:05", "01/01/2026 10:5", "01/01/2026 10:00:5",
+        "  19/10/2026 12:00  ", "19/10/2026  12:00", "19/10/2026\xa012:00", "‎19/10/2026 12:00‏",
+        "19/10/2026T12:00", "2026-10-19T12:00:00", "2026-10-19 12:00", "19/10/2026",
+        "19/10/2026 12:00\n", "19/10/2026 12:00\nx", "19/10/2026 12:00:00.5", "19/10/2026 12:00 ",
+        "١٩/١٠/٢٠٢٦ ١٢:٠٠", "19/10/2026 ١٢:00", "１９/10/2026 12:00", "19-10-2026 12:00",
+        "19/10/26 12:00", "19/10/2026 12h00", "x", "", "  ",
+    ]
+
+    def test_casos_limite(self):
+        for valor in self.CASOS:
+            with self.subTest(valor=valor):
+                esperado = lento(valor) if valor else None
+                self.assertEqual(S.parse_br_datetime(valor), esperado)
+
+    def test_aleatorio(self):
+        rnd = random.Random(44)
+        digitos = "0123456789"
+        for _ in range(20000):
+            partes = ["".join(rnd.choice(digitos) for _ in range(rnd.choice((1, 2, 2, 2, 3)))) for _ in range(2)]
+            ano = "".join(rnd.choice(digitos) for _ in range(rnd.choice((2, 4, 4, 4, 5))))
+            hora = ["".join(rnd.choice(digitos) for _ in range(rnd.choice((1, 2, 2, 2)))) for _ in range(3)]
+            valor = "%s/%s/%s %s" % (partes[0], partes[1], ano, ":".join(hora[:rnd.choice((2, 3))]))
+            with self.subTest(valor=valor):
+                self.assertEqual(S.parse_br_datetime(valor), lento(valor))
+
+    def test_datas_validas_viram_datetime(self):
+        rnd = random.Random(7)
+        base = datetime.datetime(2020, 1, 1)
+        for _ in range(2000):
+            dt = base + datetime.timedelta(seconds=rnd.randrange(10 * 365 * 86400))
+            for fmt in ("%d/%m/%Y %H:%M", "%d/%m/%Y %H:%M:%S"):
+                valor = dt.strftime(fmt)
+                self.assertEqual(S.parse_br_datetime(valor), datetime.datetime.strptime(valor, fmt))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,187 @@
+"""Filtros do /export_csv: mesmo resultado (e ordem) que a implementação de antes da tabela colunar."""
+import datetime
+import json
+import random
+import unittest
+
+from tests.apoio import S, novo_diretorio
+
+
+# ---- referência: filtros/seleção como eram antes das máscaras sobre a tabela colunar ----
+def _meses_export_antigo(qs):
+    if 'f_all' in qs or 'f_data' not in qs:
+        return None
+    dt_from = S.parse_br_datetime(qs.get('date_from', [''])[0].strip())
+    dt_to = S.parse_br_datetime(qs.get('date_to', [''])[0].strip())
+    if not dt_from and not dt_to:
+        return None
+    de = dt_from.strftime("%Y-%m") if dt_from else ""
+    ate = dt_to.strftime("%Y-%m") if dt_to else "9999-99"
+    return {m for m in S.meses_particoes() if m != "sem_data" and de <= m <= ate}
+
+
+def _filtrar_antigo(registros, qs):
+    def has(key):
+        return key in qs and qs.get(key)
+
+    filtered = list(registros)
+    if has('f_all'):
+        return filtered
+    if has('f_manual') and qs.get('manual_ids'):
+        try:
+            ids = [int(x) for x in qs.get('manual_ids', [''])[0].split(',') if x.strip() != '']
+        except ValueError:
+            ids = []
+        filtered = [r for r in filtered if (r.get('id') is not None and int(r.get('id')) in ids)]
+    if has('f_tipo') and qs.get('tipo_value'):
+        tipo_v = qs.get('tipo_value', [''])[0].strip()
+        if tipo_v:
+            filtered = [r for r in filtered if str(r.get('tipo', '')) == tipo_v]
+    for campo in ("responsavel", "motivo", "hardware"):
+        if has('f_' + campo) and qs.get(campo + '_value'):
+            v = qs.get(campo + '_value', [''])[0].strip().lower()
+            if v:
+                filtered = [r for r in filtered if str(r.get(campo, '')).strip().lower() == v]
+    for campo in ("emprestado_para", "origem", "patrimonio", "workflow", "marca", "modelo"):
+        if has('f_' + campo) and qs.get(campo + '_value'):
+            v = qs.get(campo + '_value', [''])[0].strip().lower()
+            if v:
+                filtered = [r for r in filtered if v in str(r.get(campo, '')).lower()]
+    if has('f_data'):
+        from_s = qs.get('date_from', [''])[0].strip()
+        to_s = qs.get('date_to', [''])[0].strip()
+        dt_from = S.parse_br_datetime(from_s) if from_s else None
+        dt_to = S.parse_br_datetime(to_s) if to_s else None
+        if dt_from or dt_to:
+            def in_range(r):
+                di = S.parse_br_datetime(r.get('data_inicio', ''))
+                if not di:
+                    return False
+                if dt_from and di < dt_from:
+                    return False
+                if dt_to and di > dt_to:
+                    return False
+                return True
+            filtered = [r for r in filtered if in_range(r)]
+    return filtered
+
+
+def referencia(qs):
+    meses = _meses_export_antigo(qs)
+    registros = S.carregar_registros() if meses is None else S.carregar_particoes(meses)
+    return _filtrar_antigo(S.registros_com_arquivo(registros, S.anos_export(qs)), qs)
+
+
+# ---- dados ----
+TIPOS = ["emprestimo", "entrada", "saida"]
+NOMES = ["Ana", "ana ", "Bruno", "Carla", None, ""]
+HARDWARE = ["Notebook", "notebook", "Monitor", "Mouse", None]
+MOTIVOS = ["Manutenção", "Troca", "outros", None]
+ORIGENS = ["RH", "TI", "Financeiro", "None", None, ""]
+
+
+def _data(rnd):
+    dt = datetime.datetime(2022, 1, 1) + datetime.timedelta(minutes=rnd.randrange(5 * 365 * 1440))
+    forma = rnd.random()
+    if forma < 0.75:
+        return dt.strftime("%d/%m/%Y %H:%M")
+    if forma < 0.85:
+        return dt.strftime("%d/%m/%Y %H:%M:%S")
+    if forma < 0.9:
+        return dt.strftime("%d/%m/%Y")
+    if forma < 0.95:
+        return dt.isoformat()
+    return rnd.choice(["", "31/02/2024 10:00", "x", None])
+
+
+def gerar_registros(rnd, n):
+    registros = []
+    for i in range(1, n + 1):
+        r = {"id": i, "tipo": rnd.choice(TIPOS), "patrimonio": str(1000000 + rnd.randrange(500)),
+             "workflow": rnd.choice(["", "W1", "W22", "wf-%d" % i]), "modelo": rnd.choice(["X1", "Y 2", ""]),
+             "marca": rnd.choice(["Dell", "HP", "dell ", None]), "data_inicio": _data(rnd),
+             "devolvido": rnd.random() < 0.5, "estoque": rnd.random() < 0.1, "oculto": rnd.random() < 0.05}
+        for campo, valores in (("responsavel", NOMES), ("hardware", HARDWARE), ("motivo", MOTIVOS),
+                               ("origem", ORIGENS)):
+            if rnd.random() < 0.95:
+                r[campo] = rnd.choice(valores)
+        if r["tipo"] == "emprestimo":
+            r["emprestado_para"] = rnd.choice(["Fulano", "Setor X", ""])
+            r["data_retorno"] = _data(rnd)
+        registros.append(r)
+    return registros
+
+
+def gerar_qs(rnd):
+    qs = {}
+    if rnd.random() < 0.05:
+        qs["f_all"] = ["1"]
+    if rnd.random() < 0.1:
+        qs["f_manual"] = ["1"]
+        qs["manual_ids"] = [",".join(str(rnd.randrange(1, 1300)) for _ in range(rnd.randrange(1, 30)))
+                            if rnd.random() < 0.9 else "1,a"]
+    escolhas = {"tipo": TIPOS + ["Emprestimo"], "responsavel": ["ana", "BRUNO", "none", "Carla "],
+                "hardware": ["notebook", "Monitor", "None"], "motivo": ["troca", "OUTROS", "none"],
+                "origem": ["r", "ti", "no", "one", "Fin"], "marca": ["dell", "h", "none"],
+                "patrimonio": ["1000", "10001", "42"], "workflow": ["w", "W2", "wf-1"],
+                "modelo": ["x", " 2"], "emprestado_para": ["set", "fulano", "o"]}
+    for campo, valores in escolhas.items():
+        if rnd.random() < 0.2:
+            qs["f_" + campo] = ["1"]
+            qs[campo + "_value"] = [rnd.choice(valores)]
+    if rnd.random() < 0.5:
+        qs["f_data"] = ["1"]
+        inicio = datetime.datetime(2022, 1, 1) + datetime.timedelta(days=rnd.randrange(5 * 365))
+        fim = inicio + datetime.timedelta(days=rnd.randrange(1, 400), minutes=rnd.randrange(1440))
+        if rnd.random() < 0.8:
+            qs["date_from"] = [inicio.strftime("%d/%m/%Y %H:%M")]
+        if rnd.random() < 0.8:
+            qs["date_to"] = [fim.strftime(rnd.choice(["%d/%m/%Y %H:%M", "%d/%m/%Y"]))]
+    return qs
+
+
+class TestParidadeExport(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        novo_diretorio()
+        rnd = random.Random(49)
+        with open(S.ARQUIVO, "w", encoding="utf-8") as f:
+            json.dump(gerar_registros(rnd, 1200), f)
+        S.carregar_registros()
+        # parte dos encerrados antigos vai para o arquivo frio
+        S.arquivar_registros(365)
+        assert S.anos_arquivados(), "nenhum registro foi arquivado"
+        # e alguns voltam depois da tabela montada (linhas fora da ordem de id na tabela)
+        S.tabela_registros()
+        arquivados = [r["id"] for r in S.carregar_arquivo()]
+        S.desarquivar_registros(random.Random(3).sample(arquivados, 20))
+
+    def test_mesma_selecao_e_ordem(self):
+        rnd = random.Random(7)
+        for _ in range(600):
+            qs = gerar_qs(rnd)
+            with self.subTest(qs=qs):
+                esperado = [r["id"] for r in referencia(qs)]
+                self.assertEqual([r["id"] for r in S.filtrar_export(qs)], esperado)
+
+    def test_mesmo_csv(self):
+        rnd = random.Random(11)
+        for _ in range(50):
+            qs = gerar_qs(rnd)
+            with self.subTest(qs=qs):
+                self.assertEqual(S.gerar_csv_registros(S.filtrar_export(qs)),
+                                 S.gerar_csv_registros(referencia(qs)))
+
+
+class TestParidadeExportSemNumpy(TestParidadeExport):
+    """As máscaras sem NumPy (inteiros/bytes) têm que dar o mesmo resultado."""
+
+    def setUp(self):
+        self._numpy, S.numpy = S.numpy, None
+
+    def tearDown(self):
+        S.numpy = self._numpy
+
+
+if __name__ == "__main__":
+    unittest.main()
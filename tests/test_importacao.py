@@ -0,0 +1,168 @@
+"""POST /importar_csv: mesmas regras do /registrar, ids em bloco, gravação por lotes e relatório de erros."""
+import csv
+import io
+import json
+import unittest
+from unittest import mock
+
+from tests.apoio import S, ServidorTeste, ler_em_outro_processo, novo_diretorio
+
+VALIDA = {"tipo": "entrada", "responsavel": "Ana", "patrimonio": "1234567", "motivo": "Troca",
+          "hardware": "Notebook", "marca": "Dell", "modelo": "X", "origem": "TI", "workflow": "W1",
+          "data_inicio": "05/03/2025 10:00"}
+
+# (alterações sobre VALIDA, válida?) — as mesmas linhas vão pelo /registrar e pelo CSV
+LINHAS = [
+    ({}, True),
+    ({"tipo": ""}, False),
+    ({"responsavel": "  "}, False),
+    ({"motivo": ""}, False),
+    ({"motivo": "outros", "motivo_outros": "Garantia"}, True),
+    ({"motivo": "outros"}, False),
+    ({"hardware": ""}, False),
+    ({"hardware": "outros", "hardware_outros": "Scanner"}, True),
+    ({"hardware": "outros"}, False),
+    ({"patrimonio": ""}, False),
+    ({"patrimonio": "", "hardware": "Teclado/Mouse"}, True),
+    ({"patrimonio": "123456"}, False),
+    ({"patrimonio": "12345a7"}, False),
+    ({"observacao": "x" * 200, "registrado_em": "06/03/2025 09:00"}, True),
+    ({"observacao": "x" * 201}, False),
+    ({"tipo": "emprestimo", "emprestado_para": "Bruno", "data_retorno": "10/03/2025 10:00"}, True),
+    ({"data_inicio": "5/3/2025"}, True),
+]
+
+IGNORADOS = ("id", "versao", "oculto_meta")
+
+
+def csv_de(linhas, delimitador=","):
+    campos = sorted({k for linha in linhas for k in linha})
+    saida = io.StringIO()
+    escritor = csv.DictWriter(saida, campos, delimiter=delimitador, lineterminator="\r\n")
+    escritor.writeheader()
+    escritor.writerows(linhas)
+    return saida.getvalue().encode("utf-8")
+
+
+def sem_ids(registro):
+    return {k: v for k, v in registro.items() if k not in IGNORADOS}
+
+
+class TestImportacao(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.servidor = ServidorTeste()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.servidor.parar()
+
+    def setUp(self):
+        novo_diretorio()
+        self.servidor.erros.clear()
+        self.cookie = self.servidor.login()
+
+    def tearDown(self):
+        self.assertEqual(self.servidor.erros, [])
+
+    def importar(self, corpo, cookie=None):
+        status, _, dados = self.servidor.req("POST", "/importar_csv", corpo=corpo, cookie=cookie or self.cookie,
+                                             cabecalhos={"Content-Type": "text/csv"})
+        return status, json.loads(dados)
+
+    def test_mesmas_regras_do_registrar(self):
+        linhas = [dict(VALIDA, **mudanca) for mudanca, _ in LINHAS]
+        mensagens = {}
+        for i, linha in enumerate(linhas):
+            status, _, dados = self.servidor.req("POST", "/registrar", linha, cookie=self.cookie)
+            self.assertEqual(status == 303, LINHAS[i][1], linha)
+            if status != 303:
+                self.assertEqual(status, 400)
+                mensagens[i] = dados.decode("utf-8")
+        registrados = [sem_ids(r) for r in S.carregar_registros()]
+
+        novo_diretorio()
+        cookie = self.servidor.login()
+        status, relatorio = self.importar(csv_de(linhas), cookie=cookie)
+        self.assertEqual(status, 200)
+        self.assertEqual(relatorio["importados"], sum(valida for _, valida in LINHAS))
+        # linha do arquivo = posição + 2 (a 1 é o cabeçalho); a mensagem é a mesma do formulário
+        self.assertEqual([e["linha"] - 2 for e in relatorio["erros"]], sorted(mensagens))
+        for erro in relatorio["erros"]:
+            self.assertIn("<p>%s</p>" % erro["erro"], mensagens[erro["linha"] - 2])
+        importados = S.carregar_registros()
+        self.assertEqual([sem_ids(r) for r in importados], registrados)
+        self.assertTrue(all(r["oculto_meta"]["registrado_por"] == "admin" for r in importados))
+        obs = next(r for r in importados if r.get("observacao"))
+        self.assertEqual(S.listar_observacoes(obs["id"]), [{"text": "x" * 200, "registrado_em": "06/03/2025 09:00"}])
+
+    def test_ids_em_bloco_e_lotes(self):
+        linhas = [dict(VALIDA, patrimonio=str(2000000 + i), observacao="obs %d" % i,
+                       registrado_em="06/03/2025 09:00") for i in range(7)]
+        linhas.insert(4, dict(VALIDA, tipo=""))
+        status, _, _ = self.servidor.req("POST", "/registrar", VALIDA, cookie=self.cookie)   # id 1 já existe
+        self.assertEqual(status, 303)
+        with mock.patch.object(S, "IMPORTACAO_LOTE", 3), \
+                mock.patch.object(S, "_gravar_particoes", wraps=S._gravar_particoes) as gravar, \
+                mock.patch.object(S._log_observacoes, "anexar_varios", wraps=S._log_observacoes.anexar_varios) as anexar:
+            status, relatorio = self.importar(csv_de(linhas))
+        self.assertEqual(status, 200)
+        self.assertEqual((relatorio["importados"], relatorio["lotes"]), (7, 3))
+        self.assertEqual(relatorio["ids"], [[2, 4], [5, 7], [8, 8]])
+        self.assertEqual(relatorio["erros"], [{"linha": 6, "erro": "Campo 'Tipo' é obrigatório."}])
+        self.assertEqual(gravar.call_count, 3)    # uma gravação das partições por lote
+        self.assertEqual([len(c.args[0]) for c in anexar.call_args_list], [3, 3, 1])
+        registros = ler_em_outro_processo()
+        self.assertEqual([r["patrimonio"] for r in registros[1:]], [l["patrimonio"] for l in linhas if l["tipo"]])
+        self.assertEqual([r["id"] for r in registros], list(range(1, 9)))
+
+    def test_relatorio_limitado(self):
+        linhas = [dict(VALIDA, patrimonio="12") for _ in range(5)] + [VALIDA]
+        with mock.patch.object(S, "IMPORTACAO_MAX_ERROS", 2):
+            status, relatorio = self.importar(csv_de(linhas))
+        self.assertEqual(status, 200)
+        self.assertEqual(relatorio["importados"], 1)
+        self.assertEqual([e["linha"] for e in relatorio["erros"]], [2, 3])
+        self.assertEqual(relatorio["erros_omitidos"], 3)
+
+    def test_ponto_e_virgula_bom_e_colunas_extras(self):
+        linhas = [dict(VALIDA, id="77", status="Pendente", devolvido="Sim", estoque="não"), VALIDA]
+        corpo = b"\xef\xbb\xbf" + csv_de(linhas, ";").replace(b"data_inicio", b"Data_Inicio ")
+        status, relatorio = self.importar(corpo)
+        self.assertEqual((status, relatorio["importados"], relatorio["erros"]), (200, 2, []))
+        primeiro, segundo = S.carregar_registros()
+        self.assertEqual((primeiro["id"], primeiro["devolvido"], primeiro["estoque"]), (1, True, False))
+        self.assertEqual(primeiro["data_inicio"], "05/03/2025 10:00")
+        self.assertNotIn("status", primeiro)
+        self.assertFalse(segundo["devolvido"])
+
+    def test_arquivo_quebrado_no_meio(self):
+        linhas = [dict(VALIDA, patrimonio=str(3000000 + i)) for i in range(600)]
+        corpo = csv_de(linhas) + b"entrada,\xff\xfe quebrado\r\n" + csv_de([VALIDA]).split(b"\r\n", 1)[1]
+        with mock.patch.object(S, "IMPORTACAO_LOTE", 100):
+            status, relatorio = self.importar(corpo)
+        self.assertEqual(status, 200)
+        self.assertIn("erro", relatorio)
+        # o que veio antes do defeito foi gravado; o relatório conta exatamente o que está no disco
+        self.assertGreater(relatorio["importados"], 0)
+        self.assertEqual(len(ler_em_outro_processo()), relatorio["importados"])
+
+    def test_recusas(self):
+        self.assertEqual(self.servidor.req("POST", "/importar_csv", corpo=csv_de([VALIDA]))[0], 401)
+        S.save_users(S.load_users() + [{"username": "bruno"}])
+        self.assertEqual(self.importar(csv_de([VALIDA]), cookie=self.servidor.login("bruno", "senha123"))[0], 403)
+        status, resposta = self.importar(b"responsavel,motivo\r\nAna,Troca\r\n")
+        self.assertEqual(status, 400)
+        self.assertIn("tipo", resposta["erro"])
+        self.assertEqual(S.carregar_registros(), [])
+
+    def test_corpo_lido_so_ate_o_content_length(self):
+        fonte = io.BytesIO(csv_de([VALIDA]) + b"lixo que pertence a outra requisicao")
+        tamanho = len(csv_de([VALIDA]))
+        relatorio = S.importar_csv(io.BufferedReader(S.CorpoLimitado(fonte, tamanho), 16), "admin")
+        self.assertEqual((relatorio["importados"], relatorio["erros"]), (1, []))
+        self.assertEqual(fonte.tell(), tamanho)
+
+
+if __name__ == "__main__":
+    unittest.main()
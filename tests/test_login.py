@@ -0,0 +1,148 @@
+"""Login: PBKDF2 no pool dedicado, 503 com o pool lotado, limites por IP/usuário e primeiro login."""
+import threading
+import unittest
+from unittest import mock
+
+from tests.apoio import S, ServidorTeste, novo_diretorio
+
+
+class TestLogin(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.servidor = ServidorTeste()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.servidor.parar()
+
+    def setUp(self):
+        novo_diretorio()
+        self.servidor.erros.clear()
+        # limitadores novos a cada teste (os de verdade guardam o histórico do processo inteiro)
+        for nome in ("_tentativas_ip", "_falhas_usuario"):
+            patcher = mock.patch.object(S, nome, S.LimitadorTentativas())
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.assertEqual(self.login("admin", "segredo1")[0], 303)
+
+    def tearDown(self):
+        self.assertEqual(self.servidor.erros, [])
+
+    def login(self, usuario, senha):
+        return self.servidor.req("POST", "/login", {"username": usuario, "password": senha})
+
+    def test_pbkdf2_roda_no_pool(self):
+        threads = []
+        verify_password = S.verify_password
+
+        def verificar(*args):
+            threads.append(threading.current_thread().name)
+            return verify_password(*args)
+
+        with mock.patch.object(S, "verify_password", verificar):
+            self.assertEqual(self.login("admin", "segredo1")[0], 303)
+            self.assertEqual(self.login("admin", "errada99")[0], 400)
+        self.assertEqual(len(threads), 2)
+        self.assertTrue(all(nome.startswith("senha") for nome in threads), threads)
+
+    def test_pool_lotado_responde_503(self):
+        vagas = S.SENHA_WORKERS + S.SENHA_FILA_MAX
+        for _ in range(vagas):
+            self.assertTrue(S._senhas_vagas.acquire(blocking=False))
+        try:
+            with mock.patch.object(S, "verify_password") as verify_password:
+                status, cabecalhos, _ = self.login("admin", "segredo1")
+            self.assertEqual(status, 503)
+            self.assertEqual(cabecalhos["Retry-After"], "1")
+            self.assertNotIn("Set-Cookie", cabecalhos)
+            verify_password.assert_not_called()   # recusado sem gastar CPU com o hash
+        finally:
+            for _ in range(vagas):
+                S._senhas_vagas.release()
+        self.assertEqual(self.login("admin", "segredo1")[0], 303)
+
+    def test_fila_cheia_e_vagas_devolvidas(self):
+        liberar = threading.Event()
+        entrou = threading.Semaphore(0)
+
+        def lento():
+            entrou.release()
+            liberar.wait(10)
+            return True
+
+        with mock.patch.object(S, "_senhas_vagas", threading.BoundedSemaphore(2)):
+            resultados = []
+            threads = [threading.Thread(target=lambda: resultados.append(S.executar_hash(lento)))
+                       for _ in range(2)]
+            for t in threads:
+                t.start()
+            for _ in threads:
+                self.assertTrue(entrou.acquire(timeout=10))
+            with self.assertRaises(S.FilaSenhasCheia):
+                S.executar_hash(lento)
+            liberar.set()
+            for t in threads:
+                t.join()
+            self.assertEqual(resultados, [True, True])
+            self.assertTrue(S.executar_hash(lambda: True))
+
+    def test_limite_de_falhas_por_usuario(self):
+        with mock.patch.object(S, "LOGIN_FALHAS_POR_USUARIO", (3, 300)):
+            for _ in range(3):
+                self.assertEqual(self.login("Admin", "errada99")[0], 400)
+            with mock.patch.object(S, "verify_password") as verify_password:
+                status, cabecalhos, _ = self.login("admin", "segredo1")
+            self.assertEqual(status, 429)
+            self.assertGreater(int(cabecalhos["Retry-After"]), 0)
+            verify_password.assert_not_called()
+            # o bloqueio é do usuário, não do IP
+            S.save_users(S.load_users() + [{"username": "bruno"}])
+            self.assertEqual(self.login("bruno", "senha123")[0], 303)
+
+    def test_login_certo_zera_as_falhas(self):
+        with mock.patch.object(S, "LOGIN_FALHAS_POR_USUARIO", (3, 300)):
+            for _ in range(2):
+                self.assertEqual(self.login("admin", "errada99")[0], 400)
+            self.assertEqual(self.login("admin", "segredo1")[0], 303)
+            for _ in range(2):
+                self.assertEqual(self.login("admin", "errada99")[0], 400)
+            self.assertEqual(self.login("admin", "segredo1")[0], 303)
+
+    def test_limite_de_tentativas_por_ip(self):
+        with mock.patch.object(S, "LOGIN_TENTATIVAS_POR_IP", (4, 60)):
+            # o login do setUp é a primeira das 4; conta tentativa certa, errada e de inexistente
+            for usuario in ("ninguem", "admin", "outro"):
+                self.assertIn(self.login(usuario, "segredo1")[0], (303, 400))
+            status, cabecalhos, _ = self.login("admin", "segredo1")
+            self.assertEqual(status, 429)
+            self.assertIn("Retry-After", cabecalhos)
+
+    def test_primeiros_logins_simultaneos(self):
+        S.save_users(S.load_users() + [{"username": "carla"}])
+        juntos = threading.Barrier(2, timeout=10)
+        hash_password = S.hash_password
+
+        def hash_ao_mesmo_tempo(senha):
+            juntos.wait()   # os dois já viram o usuário sem senha antes de qualquer um gravar
+            return hash_password(senha)
+
+        respostas = {}
+        with mock.patch.object(S, "hash_password", hash_ao_mesmo_tempo):
+            threads = [threading.Thread(target=lambda s=senha: respostas.__setitem__(s, self.login("carla", s)))
+                       for senha in ("primeira1", "segunda2")]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        aceitas = [senha for senha, (status, _, _) in respostas.items() if status == 303]
+        self.assertEqual(len(aceitas), 1, {s: r[0] for s, r in respostas.items()})
+        recusada, = set(respostas) - set(aceitas)
+        self.assertEqual(respostas[recusada][0], 400)
+        self.assertNotIn("Set-Cookie", respostas[recusada][1])
+        # vale a senha de quem gravou primeiro; a outra agora é só uma senha errada
+        self.assertEqual(self.login("carla", aceitas[0])[0], 303)
+        self.assertEqual(self.login("carla", recusada)[0], 400)
+
+
+if __name__ == "__main__":
+    unittest.main()
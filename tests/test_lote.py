@@ -0,0 +1,118 @@
+"""POST /api/lote: um resultado por id, uma única gravação das partições e nada gravado se falhar."""
+import json
+import unittest
+from unittest import mock
+
+from tests.apoio import S, ServidorTeste, ler_em_outro_processo, novo_diretorio
+
+REGISTROS = [
+    {"id": 1, "tipo": "emprestimo", "responsavel": "Ana", "patrimonio": "1000001",
+     "data_inicio": "05/03/2025 10:00", "data_retorno": "10/03/2025 10:00", "devolvido": False},
+    {"id": 2, "tipo": "entrada", "responsavel": "Bruno", "patrimonio": "1000002", "motivo": "Troca",
+     "data_inicio": "07/04/2025 08:00"},
+    {"id": 3, "tipo": "saida", "responsavel": "Carla", "patrimonio": "1000003",
+     "data_inicio": "08/05/2025 08:00", "oculto": True},
+    {"id": 4, "tipo": "emprestimo", "responsavel": "Davi", "patrimonio": "1000004",
+     "data_inicio": "09/05/2025 08:00", "data_retorno": "10/05/2025 08:00", "devolvido": True},
+    {"id": 5, "tipo": "entrada", "responsavel": "Eva", "patrimonio": "1000005",
+     "data_inicio": "10/06/2025 08:00", "estoque": True},
+]
+
+
+class TestLote(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.servidor = ServidorTeste()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.servidor.parar()
+
+    def setUp(self):
+        novo_diretorio()
+        with open(S.ARQUIVO, "w", encoding="utf-8") as f:
+            json.dump(REGISTROS, f)
+        S.carregar_registros()
+        self.servidor.erros.clear()
+        self.cookie = self.servidor.login()
+
+    def tearDown(self):
+        self.assertEqual(self.servidor.erros, [])
+
+    def lote(self, acao, ids, cookie=None):
+        corpo = json.dumps({"acao": acao, "ids": ids})
+        status, _, dados = self.servidor.req("POST", "/api/lote", corpo=corpo, cookie=cookie or self.cookie,
+                                             cabecalhos={"Content-Type": "application/json"})
+        return status, json.loads(dados)
+
+    def por_id(self):
+        return {r["id"]: r for r in S.carregar_registros()}
+
+    def test_resultado_por_id_e_um_commit(self):
+        with mock.patch.object(S, "_gravar_particoes", wraps=S._gravar_particoes) as gravar:
+            status, resposta = self.lote("retornar", [1, 2, 3, 4, 99, 1])
+        self.assertEqual(status, 200)
+        self.assertEqual(gravar.call_count, 1)   # um manifesto novo para o lote inteiro
+        resultados = resposta["resultados"]
+        self.assertEqual([r["id"] for r in resultados], [1, 2, 3, 4, 99, 1])
+        self.assertEqual([r["ok"] for r in resultados], [True, True, False, False, False, False])
+        self.assertEqual([r.get("erro") for r in resultados[2:]], ["excluido", "ja_devolvido", "nao_encontrado", "repetido"])
+        self.assertNotIn("novo_id", resultados[0])   # empréstimo só vira devolvido
+        self.assertEqual(resultados[1]["novo_id"], 6)  # entrada gera a saída de retorno
+        self.assertEqual(resposta["versao"], S.versao_dados())
+
+        registros = self.por_id()
+        self.assertTrue(registros[1]["devolvido"])
+        self.assertEqual(registros[1]["versao"], resultados[0]["versao"])
+        self.assertEqual((registros[6]["tipo"], registros[6]["retorno_de"]), ("saida", 2))
+        self.assertEqual(registros[2]["status_extra"], "Devolvido (ID: 6)")
+        self.assertEqual(ler_em_outro_processo(), S.carregar_registros())
+
+    def test_formulario(self):
+        status, _, dados = self.servidor.req("POST", "/api/lote", {"acao": "alternar_estoque", "ids": "1,5"},
+                                             cookie=self.cookie)
+        self.assertEqual(status, 200)
+        self.assertTrue(all(r["ok"] for r in json.loads(dados)["resultados"]))
+        registros = self.por_id()
+        self.assertEqual((registros[1].get("estoque"), registros[5].get("estoque")), (True, False))
+
+    def test_falha_na_gravacao_nao_grava_nada(self):
+        antes = ler_em_outro_processo()
+        with mock.patch.object(S, "_gravar_particoes", side_effect=OSError("disco cheio")):
+            status, resposta = self.lote("ocultar", [1, 2, 4, 5])
+        self.assertEqual(status, 500)
+        self.assertIn("erro", resposta)
+        self.assertEqual(ler_em_outro_processo(), antes)
+        # a memória é relida do disco: nenhuma das alterações ficou valendo
+        self.assertEqual(S.carregar_registros(), antes)
+
+    def test_traz_do_arquivo_frio(self):
+        self.assertEqual(S.arquivar_registros(idade_dias=1), {"2025": 2})   # 3 (excluído) e 4 (devolvido)
+        self.assertNotIn(4, self.por_id())
+        status, resposta = self.lote("ocultar", [4, 1])
+        self.assertEqual(status, 200)
+        self.assertTrue(all(r["ok"] for r in resposta["resultados"]))
+        self.assertTrue(self.por_id()[4]["oculto"])
+        self.assertIsNone(S.buscar_arquivado(4))
+        self.assertIsNotNone(S.buscar_arquivado(3))
+        self.assertEqual(ler_em_outro_processo(), S.carregar_registros())
+
+    def test_recusas(self):
+        status, _, _ = self.servidor.req("POST", "/api/lote", {"acao": "ocultar", "ids": "1"})
+        self.assertEqual(status, 401)
+        self.assertEqual(self.lote("apagar", [1])[0], 400)
+        self.assertEqual(self.lote("ocultar", [])[0], 400)
+        self.assertEqual(self.lote("ocultar", ["x"])[0], 400)
+        with mock.patch.object(S, "LOTE_MAX_IDS", 3):
+            self.assertEqual(self.lote("ocultar", [1, 2, 4, 5])[0], 413)
+        S.save_users(S.load_users() + [{"username": "bruno"}])
+        cookie = self.servidor.login("bruno", "senha123")
+        self.assertEqual(self.lote("restaurar", [3], cookie=cookie)[0], 403)
+        status, resposta = self.lote("restaurar", [3, 1])
+        self.assertEqual(status, 200)
+        self.assertEqual([r.get("erro") for r in resposta["resultados"]], [None, "nao_excluido"])
+        self.assertFalse(self.por_id()[3]["oculto"])
+
+
+if __name__ == "__main__":
+    unittest.main()
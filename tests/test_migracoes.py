@@ -0,0 +1,131 @@
+"""Migrações de inicialização (observações e edições embutidas) interrompidas e repetidas."""
+import json
+import unittest
+from unittest import mock
+
+from tests.apoio import S, ler_em_outro_processo, novo_diretorio
+
+OBSERVACOES = [
+    {"text": "chegou sem fonte", "registrado_em": "05/03/2025 10:00"},
+    {"text": "fonte entregue", "registered_at": "06/03/2025 09:30"},
+    {"text": "fonte entregue", "registered_at": "06/03/2025 09:30"},   # repetida de verdade
+]
+
+REGISTROS = [
+    {"id": 1, "tipo": "entrada", "responsavel": "Ana", "data_inicio": "05/03/2025 10:00",
+     "observacoes": OBSERVACOES},
+    {"id": 2, "tipo": "saida", "responsavel": "Bruno", "data_inicio": "07/04/2025 08:00",
+     "observacoes": [{"text": "ok", "registrado_em": "07/04/2025 08:05"}]},
+    {"id": 3, "tipo": "saida", "responsavel": "Carla", "data_inicio": "08/04/2025 08:00"},
+]
+
+
+def falha_ao_gravar():
+    """As partições não chegam ao disco (como uma queda antes do manifesto novo)."""
+    return mock.patch.object(S, "_gravar_particoes", side_effect=OSError("disco cheio"))
+
+
+class TestMigrarObservacoes(unittest.TestCase):
+    def setUp(self):
+        novo_diretorio()
+        with open(S.ARQUIVO, "w", encoding="utf-8") as f:
+            json.dump(REGISTROS, f)
+        S.carregar_registros()
+
+    def conferir_migrado(self):
+        self.assertEqual(S.listar_observacoes(1), [
+            {"text": "chegou sem fonte", "registrado_em": "05/03/2025 10:00"},
+            {"text": "fonte entregue", "registrado_em": "06/03/2025 09:30"},
+            {"text": "fonte entregue", "registrado_em": "06/03/2025 09:30"},
+        ])
+        self.assertEqual(S.listar_observacoes(2), [{"text": "ok", "registrado_em": "07/04/2025 08:05"}])
+        disco = {r["id"]: r for r in ler_em_outro_processo()}
+        self.assertFalse(any("observacoes" in r for r in disco.values()))
+        self.assertEqual(disco[1]["ultima_observacao_em"], "06/03/2025 09:30")
+        self.assertEqual(S.observacoes_do_registro(disco[1]), S.listar_observacoes(1))
+
+    def test_migracao(self):
+        self.assertEqual(S.migrar_observacoes(), 2)
+        self.conferir_migrado()
+        self.assertEqual(S.migrar_observacoes(), 0)
+        self.conferir_migrado()
+
+    def test_gravacao_falha_e_migracao_repete(self):
+        with falha_ao_gravar(), self.assertRaises(OSError):
+            S.migrar_observacoes()
+        # o log já tem as observações, mas as partições ainda trazem as listas embutidas
+        self.assertEqual(len(S.listar_observacoes(1)), 3)
+        self.assertIn("observacoes", S.carregar_registros()[0])
+        self.assertEqual(S.migrar_observacoes(), 2)
+        self.conferir_migrado()
+
+    def test_log_interrompido_no_meio(self):
+        S.anexar_observacao(1, "chegou sem fonte", "05/03/2025 10:00")
+        self.assertEqual(S.migrar_observacoes(), 2)
+        self.conferir_migrado()
+
+    def test_uma_escrita_no_log(self):
+        with mock.patch.object(S._log_observacoes, "anexar_varios",
+                               wraps=S._log_observacoes.anexar_varios) as anexar:
+            S.migrar_observacoes()
+        self.assertEqual(anexar.call_count, 1)
+        self.assertEqual(len(anexar.call_args.args[0]), 4)
+
+
+EDICOES = [
+    {"responsavel": "Ana", "motivo": "Troca", "registrado_em_snapshot": "05/03/2025 11:00", "edited_by": "admin"},
+    {"responsavel": "Ana B.", "registrado_em_snapshot": "06/03/2025 12:00", "edited_by": "bruno"},
+]
+
+REGISTROS_EDITADOS = [
+    {"id": 1, "tipo": "entrada", "responsavel": "Ana C.", "data_inicio": "05/03/2025 10:00",
+     "oculto_meta": {"registrado_por": "admin", "edicoes": EDICOES}},
+    {"id": 2, "tipo": "saida", "responsavel": "Bruno", "data_inicio": "07/04/2025 08:00",
+     "oculto_meta": {"edicoes": [dict(EDICOES[0], registrado_em_snapshot="07/04/2025 09:00")]}},
+    {"id": 3, "tipo": "saida", "responsavel": "Carla", "data_inicio": "08/04/2025 08:00", "oculto_meta": {}},
+]
+
+
+class TestMigrarEdicoes(unittest.TestCase):
+    def setUp(self):
+        novo_diretorio()
+        with open(S.ARQUIVO, "w", encoding="utf-8") as f:
+            json.dump(REGISTROS_EDITADOS, f)
+        S.carregar_registros()
+
+    def conferir_migrado(self):
+        self.assertEqual(S.consultar_auditoria(id_reg=1), [
+            {"id": 1, "registrado_em": "05/03/2025 11:00", "usuario": "admin",
+             "anterior": {"responsavel": "Ana", "motivo": "Troca"}},
+            {"id": 1, "registrado_em": "06/03/2025 12:00", "usuario": "bruno",
+             "anterior": {"responsavel": "Ana B."}},
+        ])
+        self.assertEqual(len(S.consultar_auditoria(id_reg=2)), 1)
+        self.assertEqual(len(S.consultar_auditoria()), 3)
+        disco = {r["id"]: r for r in ler_em_outro_processo()}
+        self.assertFalse(any("edicoes" in r["oculto_meta"] for r in disco.values()))
+        self.assertEqual(disco[1]["oculto_meta"], {"registrado_por": "admin", "editado_em": "06/03/2025 12:00"})
+
+    def test_migracao(self):
+        self.assertEqual(S.migrar_edicoes(), 2)
+        self.conferir_migrado()
+        self.assertEqual(S.migrar_edicoes(), 0)
+        self.conferir_migrado()
+
+    def test_gravacao_falha_e_migracao_repete(self):
+        with falha_ao_gravar(), self.assertRaises(OSError):
+            S.migrar_edicoes()
+        self.assertEqual(len(S.consultar_auditoria()), 3)
+        self.assertIn("edicoes", S.carregar_registros()[0]["oculto_meta"])
+        self.assertEqual(S.migrar_edicoes(), 2)
+        self.conferir_migrado()
+
+    def test_uma_escrita_no_log(self):
+        with mock.patch.object(S._log_auditoria, "anexar_varios", wraps=S._log_auditoria.anexar_varios) as anexar:
+            S.migrar_edicoes()
+        self.assertEqual(anexar.call_count, 1)
+        self.assertEqual(len(anexar.call_args.args[0]), 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
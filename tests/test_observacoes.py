@@ -0,0 +1,61 @@
+"""GET /api/observacoes: histórico de um registro quente, arquivado ou inexistente."""
+import json
+import unittest
+
+from tests.apoio import S, ServidorTeste, novo_diretorio
+
+REGISTROS = [
+    {"id": 1, "tipo": "entrada", "responsavel": "Ana", "data_inicio": "05/03/2025 10:00"},
+    {"id": 2, "tipo": "emprestimo", "responsavel": "Bruno", "data_inicio": "07/04/2024 08:00",
+     "data_retorno": "10/04/2024 08:00", "devolvido": True},
+    {"id": 3, "tipo": "saida", "responsavel": "Carla", "data_inicio": "08/05/2025 08:00"},
+]
+
+
+class TestApiObservacoes(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.servidor = ServidorTeste()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.servidor.parar()
+
+    def setUp(self):
+        novo_diretorio()
+        with open(S.ARQUIVO, "w", encoding="utf-8") as f:
+            json.dump(REGISTROS, f)
+        S.carregar_registros()
+        self.servidor.erros.clear()
+        self.cookie = self.servidor.login()
+
+    def tearDown(self):
+        self.assertEqual(self.servidor.erros, [])
+
+    def observacoes(self, id_reg):
+        status, _, dados = self.servidor.req("GET", "/api/observacoes?id=%s" % id_reg, cookie=self.cookie)
+        return status, json.loads(dados)
+
+    def test_registro_quente(self):
+        S.anexar_observacao(3, "sem fonte", "08/05/2025 09:00")
+        S.anexar_observacao(1, "ok", "05/03/2025 11:00")
+        self.assertEqual(self.observacoes(3), (200, {"id": 3, "observacoes": [
+            {"text": "sem fonte", "registrado_em": "08/05/2025 09:00"}]}))
+        self.assertEqual(self.observacoes(1)[1]["observacoes"], [{"text": "ok", "registrado_em": "05/03/2025 11:00"}])
+
+    def test_registro_arquivado_e_inexistente(self):
+        S.anexar_observacao(2, "devolvido sem cabo", "10/04/2024 08:30")
+        self.assertEqual(S.arquivar_registros(idade_dias=1), {"2024": 1})
+        self.assertEqual(self.observacoes(2)[1]["observacoes"],
+                         [{"text": "devolvido sem cabo", "registrado_em": "10/04/2024 08:30"}])
+        self.assertEqual(self.observacoes(99), (200, {"id": 99, "observacoes": []}))
+
+    def test_recusas(self):
+        self.assertEqual(self.observacoes("x")[0], 400)
+        self.assertEqual(self.observacoes("")[0], 400)
+        status, _, _ = self.servidor.req("GET", "/api/observacoes?id=1")
+        self.assertEqual(status, 401)
+
+
+if __name__ == "__main__":
+    unittest.main()
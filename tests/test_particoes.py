@@ -0,0 +1,204 @@
+"""Formato em disco das partições mensais e do manifesto (dados/manifesto.json)."""
+import json
+import os
+import random
+import re
+import unittest
+from unittest import mock
+
+from tests.apoio import S, ler_em_outro_processo, novo_diretorio
+
+CHAVES_MANIFESTO = {"atualizado_em", "formato", "particoes"}
+CHAVES_PARTICAO = {"arquivo", "formato", "id_max", "id_min", "registros", "versao_max"}
+RE_ARQUIVO = re.compile(r"(\d{4}-\d{2}|sem_data)\.[0-9a-f]{6}\.(json|bin)")
+
+REGISTROS = [
+    {"id": 1, "tipo": "entrada", "responsavel": "Ana", "data_inicio": "05/03/2025 10:00", "devolvido": False},
+    {"id": 2, "tipo": "saida", "responsavel": "Bruno", "data_inicio": "28/03/2025 23:59:59", "origem": "Açúcar"},
+    {"id": 3, "tipo": "emprestimo", "responsavel": "Carla", "data_inicio": "07/04/2025 08:00",
+     "data_retorno": "08/04/2025 08:00", "devolvido": True, "status_extra": "Devolvido",
+     "oculto_meta": {"registrado_por": "ana", "registrado_em": "07/04/2025 08:00"}},
+    {"id": 4, "tipo": "saida", "responsavel": None, "data_inicio": ""},
+    {"id": 5, "tipo": "entrada", "responsavel": "Davi", "data_inicio": "2025-04-09T10:00:00", "marca": "x\ny"},
+]
+
+
+def sem_versao(registros):
+    return [{k: v for k, v in r.items() if k != "versao"} for r in registros]
+
+
+class TestParticoes(unittest.TestCase):
+    def setUp(self):
+        novo_diretorio()
+        self._formato = S.FORMATO_DADOS
+        with open(S.ARQUIVO, "w", encoding="utf-8") as f:
+            json.dump(REGISTROS, f)
+        S.carregar_registros()
+
+    def tearDown(self):
+        S.FORMATO_DADOS = self._formato
+
+    def manifesto(self):
+        with open(os.path.join(S.DADOS_DIR, "manifesto.json"), encoding="utf-8") as f:
+            return json.load(f)
+
+    def conferir_manifesto(self):
+        manifesto = self.manifesto()
+        self.assertEqual(set(manifesto), CHAVES_MANIFESTO)
+        self.assertEqual(manifesto["formato"], 1)
+        arquivos = set()
+        for mes, info in manifesto["particoes"].items():
+            self.assertEqual(set(info), CHAVES_PARTICAO, mes)
+            self.assertRegex(info["arquivo"], RE_ARQUIVO)
+            self.assertTrue(info["arquivo"].startswith(mes + "."))
+            self.assertEqual(info["arquivo"].endswith(".bin"), info["formato"] == "binario")
+            registros = S.ler_registros(os.path.join(S.DADOS_DIR, info["arquivo"]))
+            ids = [r["id"] for r in registros]
+            self.assertEqual(info["registros"], len(registros))
+            self.assertEqual((info["id_min"], info["id_max"]), (min(ids), max(ids)))
+            self.assertEqual(info["versao_max"], max(r.get("versao", 0) for r in registros))
+            self.assertTrue(all(S._mes_particao(r) == mes for r in registros), mes)
+            arquivos.add(info["arquivo"])
+        # nada além das partições do manifesto (arquivos substituídos já foram apagados)
+        self.assertEqual(set(os.listdir(S.DADOS_DIR)) - {"manifesto.json"}, arquivos)
+        return manifesto
+
+    def conferir_memoria(self):
+        """As partições em memória (mantidas aos poucos) são exatamente a lista agrupada por mês."""
+        self.assertEqual(S._particoes_sujas, set())
+        registros = S.carregar_registros()
+        for mes, particao in S._particoes.items():
+            lista = particao["registros"]
+            self.assertTrue(lista, mes)
+            self.assertEqual([r["id"] for r in lista], sorted(r["id"] for r in lista), mes)
+            self.assertTrue(all(S._mes_particao(r) == mes for r in lista), mes)
+        nas_particoes = sorted((r for p in S._particoes.values() for r in p["registros"]), key=S._id_ordem)
+        self.assertEqual(len(nas_particoes), len(registros))
+        self.assertTrue(all(a is b for a, b in zip(nas_particoes, registros)))
+        self.assertEqual(set(S._particoes), set(self.manifesto()["particoes"]))
+
+    def test_migracao_e_layout(self):
+        manifesto = self.conferir_manifesto()
+        self.assertEqual(sorted(manifesto["particoes"]), ["2025-03", "2025-04", "sem_data"])
+        self.assertTrue(os.path.exists(S.ARQUIVO + ".migrado"))
+        with open(os.path.join(S.DADOS_DIR, manifesto["particoes"]["2025-03"]["arquivo"]), encoding="utf-8") as f:
+            texto = f.read()
+        # "json": uma lista com um registro por linha, indentada com 4 espaços
+        linhas = texto.split("\n")
+        self.assertEqual(linhas[0], "[")
+        self.assertEqual(linhas[-1], "]")
+        self.assertEqual([json.loads(l.strip().rstrip(",")) for l in linhas[1:-1]], REGISTROS[:2])
+        self.assertTrue(all(l.startswith("    {") for l in linhas[1:-1]))
+        self.assertEqual(sem_versao(ler_em_outro_processo()), REGISTROS)
+
+    def test_particao_indentada_antiga_continua_legivel(self):
+        info = self.manifesto()["particoes"]["2025-04"]
+        caminho = os.path.join(S.DADOS_DIR, info["arquivo"])
+        with open(caminho, "w", encoding="utf-8") as f:
+            json.dump(REGISTROS[2:3] + REGISTROS[4:], f, ensure_ascii=False, indent=4)
+        self.assertEqual(sem_versao(S.ler_registros(caminho)), REGISTROS[2:3] + REGISTROS[4:])
+        self.assertEqual(sem_versao(ler_em_outro_processo()), REGISTROS)
+
+    def test_alteracao_regrava_so_o_mes(self):
+        antes = self.manifesto()["particoes"]
+        with S._dados_lock:
+            r = S.copia_para_alterar(S.carregar_registros()[0])
+            r["responsavel"] = "Eva"
+            versao = S.registrar_alteracao(r)
+            S.salvar_registros(S.carregar_registros())
+        depois = self.conferir_manifesto()["particoes"]
+        self.assertNotEqual(depois["2025-03"]["arquivo"], antes["2025-03"]["arquivo"])
+        self.assertEqual(depois["2025-03"]["versao_max"], versao)
+        for mes in ("2025-04", "sem_data"):
+            self.assertEqual(depois[mes], antes[mes])
+        lidos = ler_em_outro_processo()
+        self.assertEqual(lidos, S.carregar_registros())
+        self.assertEqual(lidos[0]["responsavel"], "Eva")
+
+    def test_troca_de_mes_move_o_registro(self):
+        with S._dados_lock:
+            r = S.copia_para_alterar(S.carregar_registros()[1])
+            r["data_inicio"] = "01/05/2025 09:00"
+            S.registrar_alteracao(r)
+            S.salvar_registros(S.carregar_registros())
+        particoes = self.conferir_manifesto()["particoes"]
+        self.assertEqual(particoes["2025-03"]["registros"], 1)
+        self.assertEqual((particoes["2025-05"]["id_min"], particoes["2025-05"]["id_max"]), (2, 2))
+        self.assertEqual(ler_em_outro_processo(), S.carregar_registros())
+
+    def test_formatos(self):
+        for formato in ("compacto", "binario", "json"):
+            with self.subTest(formato=formato):
+                S.FORMATO_DADOS = formato
+                with S._dados_lock:
+                    registros = S.carregar_registros()
+                    for r in registros:
+                        S.registrar_alteracao(S.copia_para_alterar(r))
+                    S.salvar_registros(S.carregar_registros())
+                particoes = self.conferir_manifesto()["particoes"]
+                self.assertEqual({info["formato"] for info in particoes.values()}, {formato})
+                for info in particoes.values():
+                    with open(os.path.join(S.DADOS_DIR, info["arquivo"]), "rb") as f:
+                        inicio = f.read(len(S._BINARIO_MAGICO))
+                    self.assertEqual(inicio == S._BINARIO_MAGICO, formato == "binario")
+                self.assertEqual(ler_em_outro_processo(), S.carregar_registros())
+                self.assertEqual(sem_versao(S.carregar_registros()), REGISTROS)
+
+
+    def test_salvar_nao_percorre_todos_os_registros(self):
+        registros = [{"id": i, "tipo": "entrada", "responsavel": "Ana",
+                      "data_inicio": "%02d/%02d/2024 10:00" % (i % 28 + 1, i % 12 + 1)} for i in range(1, 3001)]
+        novo_diretorio()
+        with open(S.ARQUIVO, "w", encoding="utf-8") as f:
+            json.dump(registros, f)
+        S.carregar_registros()
+        with mock.patch.object(S, "_mes_particao", wraps=S._mes_particao) as mes_particao, \
+                mock.patch.object(S, "_gravar_particoes", wraps=S._gravar_particoes) as gravar:
+            with S._dados_lock:
+                r = S.copia_para_alterar(S.carregar_registros()[10])
+                r["data_inicio"] = "01/01/2025 10:00"
+                S.registrar_alteracao(r)
+                novo = {"id": 3001, "tipo": "saida", "responsavel": "Bruno", "data_inicio": "02/01/2025 10:00"}
+                S.registrar_alteracao(novo)
+                S.carregar_registros().append(novo)
+                S.salvar_registros(S.carregar_registros())
+        self.assertLess(mes_particao.call_count, 10)
+        self.assertEqual(sorted(gravar.call_args.args[2]), ["2024-12", "2025-01"])   # id 11: 12/12/2024
+        self.assertEqual(self.manifesto()["particoes"]["2025-01"]["registros"], 2)
+        self.conferir_memoria()
+        self.assertEqual(ler_em_outro_processo(), S.carregar_registros())
+
+    def test_particoes_em_memoria_seguem_as_alteracoes(self):
+        rnd = random.Random(7)
+        meses = ["%02d/%02d/2025 10:00" % (d, m) for m in range(1, 7) for d in (1, 15)] + ["", "31/02/2025"]
+        for passo in range(120):
+            with S._dados_lock:
+                registros = S.carregar_registros()
+                operacao = rnd.choice(["editar", "mudar_mes", "criar", "criar", "devolver"])
+                if operacao == "criar" or not registros:
+                    novo = {"id": S.proximo_id(registros), "tipo": "entrada", "responsavel": "Ana",
+                            "data_inicio": rnd.choice(meses)}
+                    S.registrar_alteracao(novo)
+                    registros.append(novo)
+                else:
+                    r = S.copia_para_alterar(rnd.choice(registros))
+                    if operacao == "editar":
+                        r["responsavel"] = "R%d" % passo
+                    elif operacao == "mudar_mes":
+                        r["data_inicio"] = rnd.choice(meses)
+                    else:
+                        r["devolvido"] = True
+                    S.registrar_alteracao(r)
+                S.salvar_registros(registros)
+            if passo % 30 == 29:
+                S.arquivar_registros(idade_dias=0)
+            if passo % 40 == 39 and S.anos_arquivados():
+                arquivados = S.carregar_arquivo()
+                S.desarquivar_registros([r["id"] for r in rnd.sample(arquivados, min(3, len(arquivados)))])
+            self.conferir_memoria()
+        self.assertTrue(S.anos_arquivados())
+        self.conferir_manifesto()
+        self.assertEqual(ler_em_outro_processo(), S.carregar_registros())
+
+if __name__ == "__main__":
+    unittest.main()
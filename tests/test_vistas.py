@@ -0,0 +1,82 @@
+"""Contagens do seletor de vistas do /lista: o cache acompanha alterações, prazos e o arquivo frio."""
+import datetime
+import json
+import random
+import unittest
+
+from tests.apoio import S, novo_diretorio
+
+
+def contagens_recalculadas():
+    registros = S.carregar_registros()
+    atrasos, pendencias = S.calcular_ids_atraso_pendencia(registros)
+    pendentes = {int(x) for x in atrasos | pendencias}
+    arquivados = S.carregar_arquivo()
+    contagens = {}
+    for vista in S.VISTAS_LISTA:
+        n = sum(1 for r in registros if S.registro_na_vista(r, vista, r["id"] in pendentes))
+        if vista in ("tudo", "legado"):
+            n += sum(1 for r in arquivados if S.registro_na_vista(r, vista))
+        contagens[vista] = n
+    return contagens
+
+
+class TestContagensVistas(unittest.TestCase):
+    def setUp(self):
+        novo_diretorio()
+        self.agora = datetime.datetime(2026, 10, 19, 12, 0)
+        self._relogio = S.sp_now_naive
+        S.sp_now_naive = lambda: self.agora
+        rnd = random.Random(50)
+        registros = []
+        for i in range(1, 401):
+            inicio = self.agora - datetime.timedelta(days=rnd.randrange(900))
+            r = {"id": i, "tipo": rnd.choice(["emprestimo", "entrada", "saida"]), "responsavel": "F",
+                 "patrimonio": str(1000000 + i), "motivo": "Troca", "data_inicio": inicio.strftime("%d/%m/%Y %H:%M"),
+                 "devolvido": rnd.random() < 0.4, "estoque": rnd.random() < 0.2, "oculto": rnd.random() < 0.1}
+            if r["tipo"] == "emprestimo":
+                retorno = self.agora + datetime.timedelta(minutes=rnd.randrange(-600, 600))
+                r["data_retorno"] = retorno.strftime("%d/%m/%Y %H:%M")
+            registros.append(r)
+        with open(S.ARQUIVO, "w", encoding="utf-8") as f:
+            json.dump(registros, f)
+
+    def tearDown(self):
+        S.sp_now_naive = self._relogio
+
+    def test_cache_segue_os_dados(self):
+        self.assertEqual(S.contagens_vistas(), contagens_recalculadas())
+        self.assertEqual(S.contagens_vistas(), contagens_recalculadas())   # do cache
+
+        with S._dados_lock:
+            registros = S.carregar_registros()
+            for r in registros[:30]:
+                novo = S.copia_para_alterar(r)
+                novo["devolvido"] = not novo.get("devolvido")
+                S.registrar_alteracao(novo)
+            S.salvar_registros(S.carregar_registros())
+        self.assertEqual(S.contagens_vistas(), contagens_recalculadas())
+
+        # prazos que vencem pelo relógio mudam a vista "pendentes" sem alterar registros
+        S.prazos_atuais()
+        antes = S.contagens_vistas()
+        self.agora += datetime.timedelta(hours=6)
+        S.vencer_prazos()
+        depois = S.contagens_vistas()
+        self.assertEqual(depois, contagens_recalculadas())
+        self.assertGreater(depois["pendentes"], antes["pendentes"])
+
+        # arquivar e desarquivar mexem no índice do arquivo frio
+        self.assertTrue(S.arquivar_registros(365))
+        self.assertEqual(S.contagens_vistas(), contagens_recalculadas())
+        S.desarquivar_registros([r["id"] for r in S.carregar_arquivo()][:5])
+        self.assertEqual(S.contagens_vistas(), contagens_recalculadas())
+
+    def test_devolve_copia(self):
+        contagens = S.contagens_vistas()
+        contagens["ativos"] = -1
+        self.assertNotEqual(S.contagens_vistas()["ativos"], -1)
+
+
+if __name__ == "__main__":
+    unittest.main()